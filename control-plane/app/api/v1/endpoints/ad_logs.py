@@ -1,16 +1,65 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import JSONResponse
+from app.core.config import settings
 from app.services import db_service
+from app.services.time_params import parse_time_param, to_storage_time, validate_timezone
 
 router = APIRouter()
 
 
+# count=auto 时，估计值不超过该阈值才做精确 COUNT(1)。
+EXACT_COUNT_THRESHOLD = 10000
+
+
 @router.get("/", response_model=dict)
-def list_ad_logs(offset: int = 0, limit: int = 50, device_id: str = None, ad_file_name: str = None, q: str = None):
+def list_ad_logs(
+    offset: int = 0,
+    limit: int = 50,
+    device_id: str = None,
+    ad_file_name: str = None,
+    q: str = None,
+    from_ts: str = None,
+    to_ts: str = None,
+    tz: str = settings.ad_log_timezone,
+    cursor: str = None,
+    count: str = Query('auto', pattern='^(auto|exact|estimated|none)$'),
+):
+    """
+    List play logs, newest first.
+
+    - ``from_ts`` / ``to_ts``: start_time window (ISO 8601 or Unix s/ms; naive
+      values are read in ``tz``). Bounded windows only touch the matching
+      ad_logs partitions.
+    - ``cursor``: keyset pagination; pass the previous response's ``next_cursor``
+      (offset is ignored). ``next_cursor`` is null on the last page.
+    - ``count``: exact | estimated (planner estimate) | none | auto (exact for
+      small results, estimated otherwise); ``total_estimated`` tells which one was used.
+    """
     try:
-        items = db_service.list_ad_logs(limit=limit, offset=offset, device_id=device_id, ad_file_name=ad_file_name, q=q)
-        total = db_service.count_ad_logs(device_id=device_id, ad_file_name=ad_file_name, q=q)
-        return {"total": total, "items": items}
+        validate_timezone(tz)
+        window = dict(
+            from_ts=to_storage_time(parse_time_param(from_ts), tz),
+            to_ts=to_storage_time(parse_time_param(to_ts), tz),
+        )
+        filters = dict(device_id=device_id, ad_file_name=ad_file_name, q=q, **window)
+        rows = db_service.list_ad_logs(limit=limit + 1, offset=offset, cursor=cursor, **filters)
+        items = rows[:limit]
+        next_cursor = db_service.encode_ad_log_cursor(items[-1]) if len(rows) > limit and items else None
+
+        total = None
+        estimated = False
+        if count in ('auto', 'estimated'):
+            total = db_service.count_ad_logs(estimate=True, **filters)
+            estimated = True
+            if count == 'auto' and total <= EXACT_COUNT_THRESHOLD:
+                total, estimated = None, False
+        if count == 'exact' or (count == 'auto' and total is None):
+            total = db_service.count_ad_logs(**filters)
+        return {"total": total, "total_estimated": estimated, "next_cursor": next_cursor, "items": items}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import logging
         logging.exception('failed to list ad_logs')
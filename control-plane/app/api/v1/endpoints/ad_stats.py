@@ -1,16 +1,20 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from datetime import datetime
+from typing import Optional
 try:
     from zoneinfo import ZoneInfo
 except Exception:
     ZoneInfo = None
+from app.core.config import settings
 from app.services import db_service
+from app.services.time_params import parse_time_param, to_storage_time, validate_timezone
 
 router = APIRouter()
 
 
-def _today_range_local(tz_name: str = 'Asia/Shanghai'):
-    """Return (start, now) for today's range in given timezone (default Asia/Shanghai)."""
+def _today_range_local(tz_name: Optional[str] = None):
+    """Return (start, now) for today's range in given timezone (default ``settings.ad_log_timezone``)."""
+    tz_name = tz_name or settings.ad_log_timezone
     if ZoneInfo is not None:
         tz = ZoneInfo(tz_name)
         now = datetime.now(tz)
@@ -21,43 +25,71 @@ def _today_range_local(tz_name: str = 'Asia/Shanghai'):
     return start, now
 
 
+def _summary(dimension, from_ts, to_ts, tz, sort, order, limit, offset):
+    """
+    Return (rows, total) for one stats dimension.
+
+    - 显式传入时间窗口：直接在 Postgres 中按窗口聚合 ad_logs（任意起止时间）；
+    - 未传窗口：统计“今天”（tz 时区）。tz 与 ad_logs 存储时区一致时读日级
+      rollup，否则按窗口聚合；今天无数据时回退到全部历史（保留原有容错行为）。
+    """
+    validate_timezone(tz)
+    page = dict(sort=sort, order=order, limit=limit, offset=offset)
+
+    if from_ts is not None or to_ts is not None:
+        window = (to_storage_time(parse_time_param(from_ts), tz), to_storage_time(parse_time_param(to_ts), tz))
+        return db_service.aggregate_ad_logs(dimension, from_ts=window[0], to_ts=window[1], **page)
+
+    start, now = _today_range_local(tz)
+    start, now = to_storage_time(start, tz), to_storage_time(now, tz)
+    if tz == settings.ad_log_timezone:
+        try:
+            rows, total = db_service.summarize_play_rollups(dimension, day_from=start.date(), day_to=now.date(), **page)
+            if not total:
+                rows, total = db_service.summarize_play_rollups(dimension, **page)
+            return rows, total
+        except ValueError:
+            raise
+        except Exception:
+            import logging
+            logging.exception('play rollups unavailable, aggregating ad_logs in SQL')
+
+    rows, total = db_service.aggregate_ad_logs(dimension, from_ts=start, to_ts=None, **page)
+    if not total:
+        rows, total = db_service.aggregate_ad_logs(dimension, **page)
+    return rows, total
+
+
 @router.get("/devices")
-def devices_summary():
-    """Return today's play stats aggregated by device."""
-    start, now = _today_range_local()
+def devices_summary(
+    from_ts: Optional[str] = None,
+    to_ts: Optional[str] = None,
+    tz: str = settings.ad_log_timezone,
+    sort: str = 'plays',
+    order: str = 'desc',
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Return play stats aggregated by device (today by default, or ``[from_ts, to_ts)`` in ``tz``).
+
+    sort: plays | valid_plays | avg_completion_rate | device_id; order: asc | desc.
+    """
     try:
-        rows = db_service.list_ad_logs(limit=10000, offset=0, from_ts=start, to_ts=now)
-        # 如果按今天过滤得到空结果，但表中有数据，则回退到不按时间过滤（提高容错性）
-        if (not rows) and db_service.count_ad_logs() > 0:
-            rows = db_service.list_ad_logs(limit=10000, offset=0)
-        # aggregate by device_id
-        groups = {}
-        for r in rows:
-            dev = r.get('device_id') or 'unknown'
-            grp = groups.setdefault(dev, {'device_id': dev, 'plays': 0, 'sum_rate': 0.0, 'count_rate': 0, 'items': []})
-            grp['plays'] += 1
-            rate = r.get('completion_rate')
-            # Exclude invalid logs (is_valid == False) from average calculation
-            if rate is not None and r.get('is_valid') is not False:
-                grp['sum_rate'] += float(rate)
-                grp['count_rate'] += 1
-            grp['items'].append({
-                'log_id': r.get('log_id'),
-                'ad_file_name': r.get('ad_file_name'),
-                'duration_ms': r.get('duration_ms'),
-                'completion_rate': r.get('completion_rate'),
-                'play_result': r.get('play_result'),
-                'billing_status': r.get('billing_status'),
-                'audit_result': r.get('audit_result'),
-            })
-
-        results = []
-        for dev, v in groups.items():
-            avg = (v['sum_rate'] / v['count_rate']) if v['count_rate']>0 else None
-            results.append({'device_id': dev, 'plays': v['plays'], 'avg_completion_rate': round(avg,4) if avg is not None else None})
-        # sort by plays desc
-        results.sort(key=lambda x: x['plays'], reverse=True)
-        return {'total': len(results), 'items': results}
+        rows, total = _summary('device', from_ts, to_ts, tz, sort, order, limit, offset)
+        results = [
+            {
+                'device_id': r.get('device_id') or 'unknown',
+                'plays': int(r.get('plays') or 0),
+                'avg_completion_rate': r.get('avg_completion_rate'),
+            }
+            for r in rows
+        ]
+        return {'total': total, 'items': results}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import logging
         logging.exception('failed to compute devices summary')
@@ -94,57 +126,37 @@ def device_detail(device_id: str):
 
 
 @router.get("/ads")
-def ads_summary():
-    """Return today's play stats aggregated by ad file name."""
-    start, now = _today_range_local()
+def ads_summary(
+    from_ts: Optional[str] = None,
+    to_ts: Optional[str] = None,
+    tz: str = settings.ad_log_timezone,
+    sort: str = 'plays',
+    order: str = 'desc',
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Return play stats aggregated by ad file name (today by default, or ``[from_ts, to_ts)`` in ``tz``).
+
+    plays counts logs not marked invalid. sort: plays | total_plays | avg_completion_rate | ad_file_name.
+    """
     try:
-        rows = db_service.list_ad_logs(limit=100000, offset=0, from_ts=start, to_ts=now)
-        if (not rows) and db_service.count_ad_logs() > 0:
-            rows = db_service.list_ad_logs(limit=100000, offset=0)
-        groups = {}
-        for r in rows:
-            ad = r.get('ad_file_name') or 'unknown'
-            grp = groups.setdefault(ad, {
-                'ad_file_name': ad,
-                'plays': 0,
-                'sum_rate': 0.0,
-                'count_rate': 0,
-                'items': [],
-                'advertiser': None
-            })
-            # Count plays excluding logs explicitly marked invalid (is_valid == False)
-            if r.get('is_valid') is not False:
-                # prefer the first non-empty advertiser we see for this ad
-                if not grp.get('advertiser'):
-                    grp['advertiser'] = r.get('advertiser')
-                grp['plays'] += 1
-            rate = r.get('completion_rate')
-            # Exclude logs with duration_ms == 0 (not started) and is_valid == False from average
-            if rate is not None and (r.get('duration_ms') or 0) > 0 and r.get('is_valid') is not False:
-                grp['sum_rate'] += float(rate)
-                grp['count_rate'] += 1
-            grp['items'].append({
+        rows, total = _summary('ad', from_ts, to_ts, tz, sort, order, limit, offset)
+        results = [
+            {
+                'ad_file_name': r.get('ad_file_name') or 'unknown',
+                # plays 只统计 is_valid != false 的播放
+                'plays': int(r.get('valid_plays') or 0),
+                'avg_completion_rate': r.get('avg_completion_rate'),
                 'advertiser': r.get('advertiser'),
-                'log_id': r.get('log_id'),
-                'device_id': r.get('device_id'),
-                'duration_ms': r.get('duration_ms'),
-                'completion_rate': r.get('completion_rate'),
-                'play_result': r.get('play_result'),
-                'billing_status': r.get('billing_status'),
-                'audit_result': r.get('audit_result'),
-            })
-
-        results = []
-        for ad, v in groups.items():
-            avg = (v['sum_rate'] / v['count_rate']) if v['count_rate'] > 0 else None
-            results.append({
-                'ad_file_name': ad,
-                'plays': v['plays'],
-                'avg_completion_rate': round(avg,4) if avg is not None else None,
-                'advertiser': v.get('advertiser')
-            })
-        results.sort(key=lambda x: x['plays'], reverse=True)
-        return {'total': len(results), 'items': results}
+            }
+            for r in rows
+        ]
+        return {'total': total, 'items': results}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import logging
         logging.exception('failed to compute ads summary')
@@ -15,6 +15,9 @@ from app.schemas.campaigns import (
     CampaignVersionListResponse,
 )
 from app.services import db_service
+from app.services.bundle_cache import get_bundle_cache
+from app.services.campaign_bindings import get_campaign_device_index
+from app.services.device_groups import count_targets, get_device_group_registry, parse_selector, selector_key, split_targets
 
 router = APIRouter()
 
@@ -129,6 +132,10 @@ def _normalize_target_devices(raw_devices: Any) -> List[str]:
         if not isinstance(did, str):
             continue
         v = did.strip()
+        # 设备组选择器统一成规范写法（小写前缀），与绑定表 / 设备所属组键一致。
+        selector = parse_selector(v)
+        if selector is not None:
+            v = selector_key(*selector)
         if not v or v in seen:
             continue
         seen.add(v)
@@ -311,14 +318,26 @@ def _validate_publish_inputs(schedule_json: Dict[str, Any], target_devices: List
         return {"ok": False, "errors": errors, "warnings": warnings}
 
     # DB-backed existence checks (best-effort; no hard fail on DB outage).
+    device_ids, group_keys = split_targets(target_devices)
     try:
-        existing_devices = set(db_service.get_existing_device_ids(target_devices))
-        missing_devices = [d for d in target_devices if d not in existing_devices]
-        if missing_devices:
-            errors.append(f"unknown devices: {missing_devices}")
+        if device_ids:
+            existing_devices = set(db_service.get_existing_device_ids(device_ids))
+            missing_devices = [d for d in device_ids if d not in existing_devices]
+            if missing_devices:
+                errors.append(f"unknown devices: {missing_devices}")
     except Exception:
         warnings.append("device existence check skipped (db unavailable)")
 
+    # 设备组只校验非空，不展开成 device_id 列表。
+    if group_keys:
+        registry = get_device_group_registry()
+        try:
+            empty_groups = [k for k in group_keys if not len(registry.resolve(k))]
+            if empty_groups:
+                errors.append(f"empty device groups: {empty_groups}")
+        except Exception:
+            warnings.append("device group check skipped (db unavailable)")
+
     try:
         ad_ids = [str(i.get("id")) for i in playlist if isinstance(i, dict) and i.get("id")]
         if ad_ids:
@@ -383,7 +402,7 @@ def _publish_campaign_pull_mode(
         "published": True,
         "delivery_mode": "pull",
         "updated": updated,
-        "device_count": len(target_devices),
+        "device_count": count_targets(target_devices),
         "material_count": len([item for item in schedule_json.get("playlist") or [] if isinstance(item, dict)]),
     }
     if idempotent:
@@ -395,6 +414,18 @@ def _publish_campaign_pull_mode(
     return response
 
 
+def _on_campaign_changed(campaign_id: str) -> None:
+    # 活动的发布 / 回滚 / 删除 / 策略变更：更新设备 -> 活动反向索引（内存兜底
+    # 模式的网关查询依赖它），并让网关缓存的 bundle 失效、设备重新解析。
+    campaign = _CAMPAIGN_STORE.get(campaign_id) if _fallback_enabled() else None
+    index = get_campaign_device_index()
+    if campaign is None:
+        index.unbind(campaign_id)
+    else:
+        index.bind(campaign, _normalize_target_devices(campaign.get("target_device_groups") or []))
+    get_bundle_cache().invalidate_campaign(campaign_id)
+
+
 def _mark_campaign_published(campaign_id: str, campaign: Dict[str, Any]) -> int:
     campaign["status"] = "published"
     campaign["updated_at"] = datetime.utcnow().isoformat() + "Z"
@@ -407,6 +438,8 @@ def _mark_campaign_published(campaign_id: str, campaign: Dict[str, Any]) -> int:
         if not _fallback_enabled():
             raise HTTPException(status_code=503, detail="database unavailable")
         return 0
+    finally:
+        _on_campaign_changed(campaign_id)
 
 
 @router.post("/strategy", response_model=CampaignStrategyResponse)
@@ -495,7 +528,7 @@ def create_campaign_strategy(payload: CampaignStrategyRequest):
         "creator_id": creator_id,
         "status": "draft",
         "schedule_json": schedule_config.model_dump(),
-        "target_device_groups": payload.devices_list,
+        "target_device_groups": _normalize_target_devices(payload.devices_list),
         "start_at": payload.time_rules.get("start_at"),
         "end_at": payload.time_rules.get("end_at"),
         "version": version,
@@ -627,7 +660,7 @@ def update_campaign_strategy(campaign_id: str, payload: CampaignStrategyRequest)
         "creator_id": modifier_id or campaign.get("creator_id"),
         "status": "draft",
         "schedule_json": schedule_config.model_dump(),
-        "target_device_groups": payload.devices_list,
+        "target_device_groups": _normalize_target_devices(payload.devices_list),
         "start_at": payload.time_rules.get("start_at") or campaign.get("start_at"),
         "end_at": payload.time_rules.get("end_at") or campaign.get("end_at"),
         "version": version,
@@ -646,6 +679,7 @@ def update_campaign_strategy(campaign_id: str, payload: CampaignStrategyRequest)
 
     if _fallback_enabled():
         _CAMPAIGN_STORE[campaign_id] = updated_row
+    _on_campaign_changed(campaign_id)
     _save_campaign_version(campaign_id, version, schedule_config.model_dump())
 
     return CampaignStrategyResponse(
@@ -735,6 +769,7 @@ def delete_campaign(campaign_id: str):
     if _fallback_enabled():
         removed_mem = _CAMPAIGN_STORE.pop(campaign_id, None) is not None
         _CAMPAIGN_VERSION_STORE.pop(campaign_id, None)
+    _on_campaign_changed(campaign_id)
 
     if deleted < 1 and not removed_mem and db_error and not _fallback_enabled():
         raise HTTPException(status_code=503, detail="database unavailable")
@@ -942,6 +977,7 @@ def rollback_campaign(campaign_id: str, body: CampaignRollbackRequest):
         db_service.insert_campaign(campaign)
     except Exception:
         pass
+    _on_campaign_changed(campaign_id)
 
     if not body.publish_now:
         return {
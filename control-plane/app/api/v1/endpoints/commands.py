@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Body, HTTPException
-from typing import Dict, Any
+from fastapi import APIRouter, BackgroundTasks, Body, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Any, List
 import time
 import uuid
 
 # 导入你之前调通的截图服务
-from app.services.device_snapshot_service import request_device_snapshot, send_remote_command
+from app.services.device_snapshot_service import request_device_snapshot
 from app.services import db_service
+from app.core.config import settings
+from app.services.command_jobs import get_command_job_runner
+from app.services.gateway_client import get_gateway_client
+from app.services.device_groups import get_device_group_registry, parse_selector, selector_key, split_targets
 
 router = APIRouter()
 
@@ -111,13 +116,13 @@ async def send_command(payload: Dict[str, Any] = Body(...)):
                 data = payload.get('params', {}) if isinstance(payload, dict) else {}
                 if action == "reboot":
                     # 将前端的 reboot 动作映射为网关/设备端的 REBOOT 命令
-                    send_remote_command(device_id, "REBOOT", data, cmd_id)
+                    await get_gateway_client().asend_command(device_id, "REBOOT", data, cmd_id)
                     print(f"[commands] 重启data:{data}")
                     record["status"] = "sent"
                     record["result"] = "reboot_sent"
                 else:
                     # 其他动作将 params 一并传输，设备端可从 data 字段读取
-                    send_remote_command(device_id, action.upper(), data, cmd_id)
+                    await get_gateway_client().asend_command(device_id, action.upper(), data, cmd_id)
                     record["status"] = "sent"
                     record["result"] = f"{action}_sent"
 
@@ -167,6 +172,78 @@ async def send_command(payload: Dict[str, Any] = Body(...)):
         record["status"] = "failed"
         mock_command_db.append(record)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _bulk_targets(payload: Dict[str, Any]) -> List[str]:
+    # target_device_ids：设备列表；group：设备组选择器（或其列表），
+    # 不带前缀的组名按 group:<名称> 处理。
+    targets = payload.get("target_device_ids") or []
+    if isinstance(targets, str):
+        targets = [targets]
+    targets = [str(t).strip() for t in targets if str(t).strip()]
+    groups = payload.get("group") or []
+    for group in [groups] if isinstance(groups, str) else groups:
+        group = str(group).strip()
+        if group:
+            targets.append(group if parse_selector(group) else selector_key("group", group))
+    return targets
+
+
+@router.post("/bulk")
+async def send_bulk_command(request: Request, background_tasks: BackgroundTasks, payload: Dict[str, Any] = Body(...)):
+    """
+    批量下发指令：一组设备或设备组，后台并发下发，返回可轮询的 job_id。
+    """
+    action = payload.get("action")
+    if not action or not isinstance(action, str):
+        raise HTTPException(status_code=400, detail="missing action")
+    if action == "capture":
+        # 截图需要逐台等待设备回调，仍走单设备接口。
+        raise HTTPException(status_code=400, detail="capture is not supported in bulk commands")
+    targets = _bulk_targets(payload)
+    if not targets:
+        raise HTTPException(status_code=400, detail="missing target_device_ids or group")
+
+    plain_ids, group_keys = split_targets(targets)
+    device_ids = list(dict.fromkeys(plain_ids))
+    registry = get_device_group_registry()
+    for key in group_keys:
+        try:
+            members = await run_in_threadpool(registry.resolve, key)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"device group lookup failed for {key}: {e}")
+        seen = set(device_ids)
+        device_ids.extend(d for d in members if d not in seen)
+    if not device_ids:
+        raise HTTPException(status_code=400, detail="no devices matched the targets")
+    if len(device_ids) > settings.command_bulk_max_devices:
+        raise HTTPException(
+            status_code=400,
+            detail=f"too many devices ({len(device_ids)} > {settings.command_bulk_max_devices})",
+        )
+
+    runner = get_command_job_runner()
+    job = runner.create(action, payload.get("params", {}), device_ids, targets)
+    # 响应先返回，下发在后台进行；DB 不可用时记录落到内存 mock。
+    background_tasks.add_task(runner.run, job, mock_command_db)
+    print(f"📡 [Commands] 批量指令: {action} -> {len(device_ids)} devices, job={job.job_id}")
+    return {
+        "status": "accepted",
+        "job_id": job.job_id,
+        "total": len(device_ids),
+        "job_url": str(request.url_for("get_command_job", job_id=job.job_id)),
+    }
+
+
+@router.get("/jobs/{job_id}", name="get_command_job")
+async def get_command_job(job_id: str, include_results: bool = False):
+    """批量指令进度：sent / failed / pending 计数与失败设备列表。"""
+    job = get_command_job_runner().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job.summary(include_results=include_results)
+
+
 @router.post("/callback")
 async def command_callback(body: Dict[str, Any] = Body(...)):
     """网关回调 control-plane，告知某条指令的执行结果
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from app.services import db_service
+from app.services.gateway_client import get_gateway_client
 from app.services.material_service import update_material_status
 
 router = APIRouter()
@@ -8,17 +9,27 @@ router = APIRouter()
 @router.get("/db/ping")
 def db_ping():
     try:
-        conn = db_service.get_conn()
-        cur = conn.cursor()
-        cur.execute('SELECT 1')
-        cur.fetchone()
-        cur.execute('SELECT count(1) FROM devices')
-        cnt = cur.fetchone()[0]
-        conn.close()
+        with db_service.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchone()
+            cur.execute('SELECT count(1) FROM devices')
+            cnt = cur.fetchone()[0]
         return {"ok": True, "devices_count": cnt}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/db/pool")
+def db_pool_stats():
+    """连接池状态（in_use / idle / 等待时间），用于压测时调整 PG_POOL_* 参数。"""
+    return db_service.pool_stats()
+
+@router.get("/gateway")
+def gateway_client_stats():
+    """网关客户端状态：熔断状态、按命令类型的延迟直方图和结果计数。"""
+    return get_gateway_client().stats()
+
 @router.post("/materials/{material_id}/status/{status}")
 def _dbg_update_status(material_id: str, status: str):
     try:
@@ -2,6 +2,9 @@ from fastapi import APIRouter, HTTPException
 from app.schemas.device import DeviceRegisterRequest, DeviceRegisterResponse
 import uuid
 from app.services import db_service
+from app.services.bundle_cache import get_bundle_cache
+from app.services.device_cache import get_known_device_cache
+from app.services.device_groups import get_device_group_registry
 import redis
 from app.core.config import settings
 import json
@@ -75,14 +78,20 @@ def register_device(payload: DeviceRegisterRequest):
         pass
 
     # 写入数据库（Best-effort: upsert）
+    meta = payload.dict(exclude_unset=True)
+    meta['device_id'] = device_id
+    if 'tags' in meta and isinstance(meta['tags'], str):
+        meta['tags'] = [t.strip() for t in meta['tags'].split(',') if t.strip()] if meta['tags'] else None
     try:
-        meta = payload.dict(exclude_unset=True)
-        meta['device_id'] = device_id
-        if 'tags' in meta and isinstance(meta['tags'], str):
-            meta['tags'] = [t.strip() for t in meta['tags'].split(',') if t.strip()] if meta['tags'] else None
         db_service.insert_device(**meta)
     except Exception:
         pass
+    # 让 Kafka 消费者的已知设备缓存在下一条日志到达时重新确认该设备。
+    get_known_device_cache().invalidate(device_id)
+    # 已解析的设备组按新属性增量加入 / 移出该设备；所属组变了，网关缓存的
+    # 设备 -> 活动映射也要重新解析。
+    get_device_group_registry().observe_device(device_id, meta)
+    get_bundle_cache().forget_device(device_id)
 
     return DeviceRegisterResponse(
         device_id=device_id,
@@ -1,16 +1,19 @@
+import hashlib
+import json
 from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from typing import Any, Dict, List, Literal, Optional
 
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request, Response
 
 from app.api.v1.endpoints import campaigns as campaigns_ep
 from app.services import db_service
-from app.services.material_service import (
-    get_material as get_local_material,
-    get_material_file_path,
-    list_materials as list_local_materials,
-)
+from app.services.bundle_cache import bundle_key, get_bundle_cache
+from app.services.campaign_bindings import get_campaign_device_index
+from app.services.device_groups import get_device_group_registry
+from app.services.material_catalog import get_material_catalog
+from app.services.material_downloads import etag_matches, material_file_response
+from app.services.material_service import get_material_file_path
 
 router = APIRouter()
 
@@ -20,27 +23,28 @@ def _utcnow_iso() -> str:
 
 
 def _pick_latest_published_campaign_from_memory(device_id: str) -> Optional[dict]:
-    candidates = []
-    for row in campaigns_ep._CAMPAIGN_STORE.values():
-        if row.get("status") != "published":
-            continue
-        target_devices = campaigns_ep._normalize_target_devices(row.get("target_device_groups") or [])
-        if device_id in target_devices:
-            candidates.append(row)
-    if not candidates:
+    # 反向索引由活动发布 / 回滚 / 删除增量维护，不再扫描整个 _CAMPAIGN_STORE。
+    # 按设备组绑定的活动只对已绑定的组做成员判断（有序集合二分查找）。
+    index = get_campaign_device_index()
+    groups = index.group_targets()
+    group_keys = get_device_group_registry().memberships(device_id, groups) if groups else ()
+    campaign_id = index.latest(device_id, group_keys)
+    if campaign_id is None:
+        return None
+    row = campaigns_ep._CAMPAIGN_STORE.get(campaign_id)
+    if not row or row.get("status") != "published":
         return None
-    candidates.sort(
-        key=lambda x: (
-            str(x.get("updated_at") or ""),
-            str(x.get("created_at") or ""),
-            str(x.get("campaign_id") or ""),
-        ),
-        reverse=True,
-    )
-    return candidates[0]
+    return row
 
 
 def _get_published_campaign_for_device(device_id: str) -> dict:
+    # 设备 -> 已发布活动的映射由 bundle cache 缓存，活动发布 / 回滚 / 删除时失效。
+    cache = get_bundle_cache()
+    cached = cache.get_device_campaign(device_id)
+    if cached is not None:
+        return cached
+    generation = cache.generation
+
     db_error = False
     try:
         campaign = db_service.get_latest_published_campaign_for_device(device_id)
@@ -55,6 +59,7 @@ def _get_published_campaign_for_device(device_id: str) -> dict:
         raise HTTPException(status_code=503, detail="database unavailable")
     if not campaign:
         raise HTTPException(status_code=404, detail="published schedule not found for device")
+    cache.put_device_campaign(device_id, campaign, generation)
     return campaign
 
 
@@ -80,37 +85,11 @@ def _normalize_material_row(raw: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def _list_material_rows_from_any_source() -> List[Dict[str, Any]]:
-    try:
-        rows = db_service.list_materials(limit=10000, offset=0)
-        return [_normalize_material_row(r) for r in rows]
-    except Exception:
-        pass
-
-    rows = list_local_materials(offset=0, limit=10000)
-    return [_normalize_material_row(r) for r in rows]
-
-
 def _pick_material_for_identifier(identifier: str) -> Optional[Dict[str, Any]]:
-    if not isinstance(identifier, str) or not identifier.strip():
-        return None
-    key = identifier.strip()
-
-    try:
-        row = db_service.get_material(key)
-    except Exception:
-        row = None
-    if row:
-        return _normalize_material_row(row)
-
-    local_row = get_local_material(key)
-    if local_row:
-        return _normalize_material_row(local_row)
-
-    for row in _list_material_rows_from_any_source():
-        if row.get("ad_id") == key or row.get("material_id") == key or row.get("file_name") == key:
-            return row
-    return None
+    # 素材目录按 material_id / ad_id / 文件名建了哈希索引（DB + 本地索引），
+    # 未命中时才批量回查 DB，不再逐条全表扫描。
+    row = get_material_catalog().lookup(identifier)
+    return _normalize_material_row(row) if row else None
 
 
 def _pick_material_for_ad_id(ad_id: str) -> Optional[Dict[str, Any]]:
@@ -188,15 +167,16 @@ def _build_device_schedule_bundle(request: Request, device_id: str, campaign: Di
         raise HTTPException(status_code=400, detail="invalid schedule_json")
 
     edge_schedule = campaigns_ep._build_edge_schedule(schedule_json)
-    playlist = schedule_json.get("playlist") or []
+    playlist = [item for item in schedule_json.get("playlist") or [] if isinstance(item, dict)]
+    # 整个播放列表的素材一次解析：目录命中是字典查找，未命中的合并成一次批量查询。
+    materials = get_material_catalog().lookup_many(item.get("id") for item in playlist)
     assets = []
     for item in playlist:
-        if not isinstance(item, dict):
-            continue
         ad_id = item.get("id")
         if not isinstance(ad_id, str) or not ad_id:
             continue
-        material_row = _pick_material_for_ad_id(ad_id)
+        material_row = materials.get(ad_id.strip())
+        material_row = _normalize_material_row(material_row) if material_row else None
         assets.append(_build_asset_item(request, item, material_row, schedule_json))
 
     return {
@@ -212,10 +192,128 @@ def _build_device_schedule_bundle(request: Request, device_id: str, campaign: Di
     }
 
 
+def _bundle_material_identifiers(bundle: Dict[str, Any]) -> List[str]:
+    # bundle 依赖的素材标识：素材按其中任一标识变化时都需要重新编译。
+    identifiers = []
+    for asset in bundle.get("assets") or []:
+        identifiers.extend([asset.get("id"), asset.get("material_id"), asset.get("filename")])
+    return [i for i in identifiers if isinstance(i, str) and i]
+
+
+def _json_body(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _content_etag(payload: Any) -> str:
+    # 强 ETag：规范化 JSON（键排序）的内容哈希，同一份编译结果在任何进程里都相同。
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _http_date(value: Any) -> str:
+    # campaign.updated_at 可能是 datetime 或 ISO 字符串；无法解析时用编译时间。
+    dt_value = value
+    if isinstance(value, str) and value:
+        try:
+            dt_value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            dt_value = None
+    if not isinstance(dt_value, datetime):
+        dt_value = datetime.now(timezone.utc)
+    if dt_value.tzinfo is None:
+        dt_value = dt_value.replace(tzinfo=timezone.utc)
+    return format_datetime(dt_value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _compile_device_schedule(request: Request, device_id: str, campaign: Dict[str, Any]) -> Dict[str, Any]:
+    bundle = _build_device_schedule_bundle(request, device_id, campaign)
+    # generated_at 每次编译都变，不参与 bundle 的 ETag。
+    variants = {
+        "bundle": (bundle, {k: v for k, v in bundle.items() if k != "generated_at"}),
+        "schedule-config": (bundle["schedule"], bundle["schedule"]),
+        "edge-schedule": (bundle["edge_schedule"], bundle["edge_schedule"]),
+    }
+    return {
+        "bundle": bundle,
+        "version": bundle.get("version"),
+        "last_modified": _http_date(campaign.get("updated_at")),
+        "variants": {
+            name: {"etag": _content_etag(hashed), "body": _json_body(payload)}
+            for name, (payload, hashed) in variants.items()
+        },
+    }
+
+
+def _get_compiled_schedule(request: Request, device_id: str, campaign: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compiled bundle for (campaign, version, device) plus per-format ETags and
+    pre-serialized bodies, served from the bundle cache when possible.
+    """
+    cache = get_bundle_cache()
+    key = bundle_key(campaign.get("campaign_id"), campaign.get("version"), device_id, str(request.base_url))
+    compiled = cache.get(key)
+    if compiled is None:
+        generation = cache.generation
+        compiled = _compile_device_schedule(request, device_id, campaign)
+        cache.put(key, compiled, _bundle_material_identifiers(compiled["bundle"]), generation)
+    return compiled
+
+
+def _get_device_schedule_bundle(request: Request, device_id: str, campaign: Dict[str, Any]) -> Dict[str, Any]:
+    return _get_compiled_schedule(request, device_id, campaign)["bundle"]
+
+
+def _not_modified(request: Request, etag: str, last_modified: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # 按 RFC 9110，同时携带时 If-None-Match 优先，忽略 If-Modified-Since。
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+def _conditional_schedule_response(
+    request: Request,
+    device_id: str,
+    campaign: Dict[str, Any],
+    variant: str,
+    since_version: Optional[str],
+) -> Response:
+    """
+    Serve one compiled schedule variant with ETag / Last-Modified validators.
+
+    ``since_version`` 与当前活动版本一致时直接 304，不编译、不序列化；
+    If-None-Match / If-Modified-Since 命中时 304 且不带 body。
+    """
+    version = campaign.get("version")
+    headers = {"Cache-Control": "no-cache"}
+    if since_version and version and since_version == str(version):
+        headers["X-Schedule-Version"] = str(version)
+        return Response(status_code=304, headers=headers)
+
+    compiled = _get_compiled_schedule(request, device_id, campaign)
+    entry = compiled["variants"][variant]
+    headers.update({"ETag": entry["etag"], "Last-Modified": compiled["last_modified"]})
+    if compiled.get("version") is not None:
+        headers["X-Schedule-Version"] = str(compiled["version"])
+    if since_version and compiled.get("version") is not None and since_version == str(compiled["version"]):
+        return Response(status_code=304, headers=headers)
+    if _not_modified(request, entry["etag"], compiled["last_modified"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
 @router.get("/devices/{device_id}/schedule")
 def get_device_schedule(
+    request: Request,
     device_id: str,
     format: Literal["schedule-config", "edge-schedule"] = "schedule-config",
+    since_version: Optional[str] = None,
 ):
     """
     Return the currently published schedule for one device.
@@ -223,35 +321,36 @@ def get_device_schedule(
     Default output is the README-style playlist JSON (`schedule-config`).
     `format=edge-schedule` is kept for compatibility with the existing
     terminal-side SyncSchedule shape.
+
+    Responses carry `ETag` / `Last-Modified`; a matching `If-None-Match`
+    (or `If-Modified-Since`) or `since_version` equal to the current
+    version returns 304 with no body.
     """
     campaign = _get_published_campaign_for_device(device_id)
-
-    schedule_json = campaigns_ep._normalize_schedule_json(campaign.get("schedule_json"))
-    if not schedule_json:
-        raise HTTPException(status_code=400, detail="invalid schedule_json")
-
-    if format == "edge-schedule":
-        return campaigns_ep._build_edge_schedule(schedule_json)
-    return schedule_json
+    # 两种格式都取自缓存的已编译 bundle，不再每次轮询重新规范化 / 生成。
+    return _conditional_schedule_response(request, device_id, campaign, format, since_version)
 
 
 @router.get("/devices/{device_id}/bundle")
-def get_device_schedule_bundle(request: Request, device_id: str):
+def get_device_schedule_bundle(request: Request, device_id: str, since_version: Optional[str] = None):
     """
     Return a device-level schedule bundle for gateway caching.
 
     The payload contains:
     - `schedule`: edge-consumable schedule JSON
     - `assets`: material metadata list used for prefetch/download
+
+    Supports the same conditional requests as `/schedule`; the bundle ETag
+    ignores `generated_at`.
     """
     campaign = _get_published_campaign_for_device(device_id)
-    return _build_device_schedule_bundle(request, device_id, campaign)
+    return _conditional_schedule_response(request, device_id, campaign, "bundle", since_version)
 
 
 @router.get("/devices/{device_id}/materials")
 def list_device_materials(request: Request, device_id: str):
     campaign = _get_published_campaign_for_device(device_id)
-    bundle = _build_device_schedule_bundle(request, device_id, campaign)
+    bundle = _get_device_schedule_bundle(request, device_id, campaign)
     return {
         "device_id": device_id,
         "campaign_id": bundle.get("campaign_id"),
@@ -300,17 +399,6 @@ def get_material_metadata(request: Request, material_id: str):
 
 
 @router.get("/materials/{material_id}/file", name="gateway_download_material_file")
-def download_material_file(material_id: str):
-    row = _pick_material_for_identifier(material_id)
-    if not row or not row.get("material_id"):
-        raise HTTPException(status_code=404, detail="material not found")
-
-    p = get_material_file_path(row["material_id"])
-    if not p:
-        raise HTTPException(status_code=404, detail="material file not found")
-
-    return FileResponse(
-        path=str(p),
-        filename=row.get("file_name") or p.name,
-        media_type="application/octet-stream",
-    )
+def download_material_file(request: Request, material_id: str):
+    # 支持 Range / If-Range 断点续传，ETag 为素材 MD5（见 material_downloads）。
+    return material_file_response(request, material_id, via_catalog=True, media_type="application/octet-stream")
@@ -1,17 +1,28 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, BackgroundTasks
-from app.schemas.material import MaterialUploadResponse
-from app.services.material_service import upsert_material, list_materials, get_material, get_material_file_path, delete_material
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, BackgroundTasks, Header, Request
+from app.schemas.material import (
+    MaterialUploadResponse,
+    MultipartUploadCompleteRequest,
+    MultipartUploadInitRequest,
+    MultipartUploadInitResponse,
+    MultipartUploadStatusResponse,
+)
+from app.services.material_service import upsert_material, list_materials, get_material, delete_material
 from app.schemas.material import MaterialListResponse, MaterialMeta
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 
-import hashlib
 import uuid
 from pathlib import Path
 from datetime import datetime, timezone
 from app.services import db_service
+from app.core.config import settings
+from app.services import material_multipart
+from app.services.blob_store import get_blob_store
+from app.services.material_upload import UploadLimitRoute, save_upload_stream
+from app.services.material_downloads import material_file_response
 
 
-router = APIRouter()
+router = APIRouter(route_class=UploadLimitRoute)
 
 # 素材文件先落到本地磁盘，再写入本地索引；如数据库可用，则补做一次
 # best-effort 持久化，保证开发环境和联调环境都能工作。
@@ -19,6 +30,117 @@ MATERIAL_DIR = Path("data/materials")
 MATERIAL_DIR.mkdir(parents=True,exist_ok=True)
 
 
+def _new_material_id() -> str:
+    # 优先生成可读的顺序 ID，便于 Swagger、文件目录和数据库排查。
+    # 如果推断失败，再回退到 UUID。
+    try:
+        from app.services.material_service import get_next_material_id
+        return get_next_material_id()
+    except Exception:
+        return f"mat_{uuid.uuid4().hex[:8]}"
+
+
+def _build_material_meta(
+    material_id: str,
+    resolved_filename: str,
+    *,
+    save_path=None,
+    size_bytes: int = 0,
+    md5: str = "",
+    sha256=None,
+    blob=None,
+    ad_id=None,
+    advertiser=None,
+    uploader_id=None,
+    tags=None,
+    oss_url=None,
+    type=None,
+    duration_sec=None,
+) -> dict:
+    created_at = datetime.now(timezone.utc).isoformat().replace("+00:00","Z")
+
+    # 写索引（最小字段）
+    # prefer explicit advertiser field, fall back to legacy ad_id
+    chosen_adv = advertiser or ad_id
+    meta = {
+        "material_id": material_id,
+        "advertiser": chosen_adv,
+        "ad_id": ad_id,
+        "file_name": resolved_filename,
+        "filename": resolved_filename,
+        "oss_url": oss_url,
+        "md5": md5,
+        "type": type,
+        "duration_sec": duration_sec,
+        "size_bytes": size_bytes,
+        "status": "uploaded",
+        "created_at": created_at,
+        "updated_at": created_at,
+        "uploader_id": uploader_id,
+        "tags": tags.split(',') if tags else [],
+        "extra": {
+            "path": str(save_path) if save_path else None,
+            "oss_url": oss_url,
+        }
+    }
+    if sha256:
+        meta["extra"]["sha256"] = sha256
+    if blob:
+        meta["extra"]["blob"] = blob["sha256"]
+        meta["extra"]["deduplicated"] = blob["deduplicated"]
+    return meta
+
+
+def _persist_material(meta: dict) -> None:
+    upsert_material(meta)
+    # 数据库持久化主要服务于查询和管理；素材文件管理本身仍以本地索引
+    # 为兜底，避免数据库短暂不可用时上传链路直接失败。
+    try:
+        db_service.insert_material({
+            "material_id": meta.get("material_id"),
+            "advertiser": meta.get("advertiser"),
+            "ad_id": meta.get("ad_id"),
+            "file_name": meta.get("file_name"),
+            "oss_url": meta.get("oss_url"),
+            "md5": meta.get("md5"),
+            "type": meta.get("type"),
+            "duration_sec": meta.get("duration_sec"),
+            "size_bytes": meta.get("size_bytes"),
+            "uploader_id": meta.get("uploader_id"),
+            "status": meta.get("status"),
+            "versions": meta.get("versions"),
+            "tags": meta.get("tags"),
+            "extra": meta.get("extra"),
+            "created_at": meta.get("created_at"),
+            "updated_at": meta.get("updated_at"),
+        })
+    except Exception:
+        # don't fail the upload if DB persist fails; keep local index
+        import logging
+        logging.exception('failed to persist material to DB (best-effort)')
+
+
+def _declared_sha256(value):
+    # 客户端预先声明的整体 SHA-256（十六进制），用于上传前按内容去重。
+    if not value:
+        return None
+    value = value.strip().lower()
+    if len(value) != 64 or any(c not in "0123456789abcdef" for c in value):
+        raise HTTPException(status_code=400, detail="invalid sha256")
+    return value
+
+
+def _persist_blob_material(meta: dict, blob) -> None:
+    # ingest() 已经给 blob 加了引用；本地记录写不进去时要还回去，否则这份引用
+    # 没有素材记录对应，blob 永远不会被回收。
+    try:
+        _persist_material(meta)
+    except Exception:
+        if blob is not None:
+            get_blob_store().release(blob["sha256"])
+        raise
+
+
 @router.post("/upload", response_model=MaterialUploadResponse)
 # 上传流程分三步：
 # 1) 二进制文件写入本地目录；
@@ -34,91 +156,66 @@ async def upload_material(
     type: str = Form(None),
     duration_sec: int = Form(None),
     file_name: str = Form(None),
+    sha256: str = Form(None),
 ):
     try:
         if file is None and not oss_url:
             raise HTTPException(status_code=400, detail="missing file or oss_url")
+        declared_sha256 = _declared_sha256(sha256)
 
-        content = b""
         size_bytes = 0
         md5 = ""
-        # 优先生成可读的顺序 ID，便于 Swagger、文件目录和数据库排查。
-        # 如果推断失败，再回退到 UUID。
-        try:
-            from app.services.material_service import get_next_material_id
-            material_id = get_next_material_id()
-        except Exception:
-            material_id = f"mat_{uuid.uuid4().hex[:8]}"
+        sha256 = None
+        blob = None
+        material_id = _new_material_id()
 
         save_path = None
         resolved_filename = file_name
         if file is not None:
-            content = await file.read()
-            size_bytes = len(content)
-            md5 = hashlib.md5(content).hexdigest()
-
             # 去掉用户上传文件名里可能携带的路径信息，只保留文件名本身。
             resolved_filename = resolved_filename or file.filename or f"{material_id}.bin"
             safe_name = Path(resolved_filename).name
             save_path = MATERIAL_DIR / f"{material_id}_{safe_name}"
-            save_path.write_bytes(content)
+            # 分块流式写入临时文件并增量计算哈希，完成后原子改名；内存占用与文件大小无关。
+            if settings.material_blob_store:
+                if declared_sha256:
+                    blob = await run_in_threadpool(get_blob_store().reference, declared_sha256, file.size)
+                if blob is not None:
+                    # 声明的 sha256 命中已有 blob：不再计算哈希、不再落盘（表单在进入接口前已接收完）。
+                    saved = {"size_bytes": blob["size_bytes"], "md5": blob["md5"], "sha256": declared_sha256}
+                else:
+                    incoming = get_blob_store().incoming_path()
+                    saved = await save_upload_stream(file, incoming, sha256=True)
+                    blob = await run_in_threadpool(
+                        get_blob_store().ingest, incoming, saved["sha256"], saved["md5"], saved["size_bytes"]
+                    )
+                save_path = blob["path"]
+            else:
+                saved = await save_upload_stream(file, save_path)
+            size_bytes = saved["size_bytes"]
+            md5 = saved["md5"]
+            sha256 = saved["sha256"]
         elif not resolved_filename:
             # URL-only 模式：尽量从链接推断文件名，保持管理界面可读性。
             resolved_filename = Path((oss_url or "").split("?", 1)[0]).name or f"{material_id}.bin"
         
-        created_at = datetime.now(timezone.utc).isoformat().replace("+00:00","Z")
-
-        # 写索引（最小字段）
-        # prefer explicit advertiser field, fall back to legacy ad_id
-        chosen_adv = advertiser or ad_id
-        meta = {
-            "material_id": material_id,
-            "advertiser": chosen_adv,
-            "ad_id": ad_id,
-            "file_name": resolved_filename,
-            "filename": resolved_filename,
-            "oss_url": oss_url,
-            "md5": md5,
-            "type": type,
-            "duration_sec": duration_sec,
-            "size_bytes": size_bytes,
-            "status": "uploaded",
-            "created_at": created_at,
-            "updated_at": created_at,
-            "uploader_id": uploader_id,
-            "tags": tags.split(',') if tags else [],
-            "extra": {
-                "path": str(save_path) if save_path else None,
-                "oss_url": oss_url,
-            }
-        }
-
-        upsert_material(meta)
-        # 数据库持久化主要服务于查询和管理；素材文件管理本身仍以本地索引
-        # 为兜底，避免数据库短暂不可用时上传链路直接失败。
-        try:
-            db_service.insert_material({
-                "material_id": meta.get("material_id"),
-                "advertiser": meta.get("advertiser"),
-                "ad_id": meta.get("ad_id"),
-                "file_name": meta.get("file_name"),
-                "oss_url": meta.get("oss_url"),
-                "md5": meta.get("md5"),
-                "type": meta.get("type"),
-                "duration_sec": meta.get("duration_sec"),
-                "size_bytes": meta.get("size_bytes"),
-                "uploader_id": meta.get("uploader_id"),
-                "status": meta.get("status"),
-                "versions": meta.get("versions"),
-                "tags": meta.get("tags"),
-                "extra": meta.get("extra"),
-                "created_at": meta.get("created_at"),
-                "updated_at": meta.get("updated_at"),
-            })
-        except Exception:
-            # don't fail the upload if DB persist fails; keep local index
-            import logging
-            logging.exception('failed to persist material to DB (best-effort)')
+        meta = _build_material_meta(
+            material_id,
+            resolved_filename,
+            save_path=save_path,
+            size_bytes=size_bytes,
+            md5=md5,
+            sha256=sha256,
+            blob=blob,
+            ad_id=ad_id,
+            advertiser=advertiser,
+            uploader_id=uploader_id,
+            tags=tags,
+            oss_url=oss_url,
+            type=type,
+            duration_sec=duration_sec,
+        )
+        _persist_blob_material(meta, blob)
 
         return MaterialUploadResponse(
             material_id=material_id,
@@ -129,11 +226,129 @@ async def upload_material(
                 "path": str(save_path) if save_path else None,
                 "size_bytes": size_bytes,
                 "oss_url": oss_url,
+                "deduplicated": bool(blob and blob["deduplicated"]),
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code = 500,detail =str(e))
 
+# 分片续传：init -> PUT 分片（可重传、乱序）-> 查询已收区间 -> complete。
+# 完成后与普通上传一样写本地索引并尽力同步到 Postgres。
+@router.post("/uploads", response_model=MultipartUploadInitResponse)
+def init_multipart_upload(body: MultipartUploadInitRequest):
+    declared_sha256 = _declared_sha256(body.sha256)
+    if settings.material_blob_store and declared_sha256:
+        # 同内容的 blob 已存在：直接引用并登记素材，客户端不用再传任何分片。
+        blob = get_blob_store().reference(declared_sha256, body.size_bytes, md5=body.md5)
+        if blob is not None:
+            return {
+                "size_bytes": body.size_bytes,
+                "deduplicated": True,
+                "material": _register_deduplicated_material(blob, body),
+            }
+    meta = body.model_dump(exclude={"size_bytes", "part_size", "md5", "sha256"})
+    session = material_multipart.init_upload(meta, body.size_bytes, part_size=body.part_size, md5=body.md5)
+    return {k: session[k] for k in ("upload_id", "size_bytes", "part_size", "total_parts")}
+
+
+def _register_deduplicated_material(blob: dict, body: MultipartUploadInitRequest) -> MaterialUploadResponse:
+    material_id = _new_material_id()
+    resolved_filename = body.file_name or f"{material_id}.bin"
+    meta = _build_material_meta(
+        material_id,
+        resolved_filename,
+        save_path=blob["path"],
+        size_bytes=blob["size_bytes"],
+        md5=blob["md5"],
+        sha256=blob["sha256"],
+        blob=blob,
+        ad_id=body.ad_id,
+        advertiser=body.advertiser,
+        uploader_id=body.uploader_id,
+        tags=body.tags,
+        type=body.type,
+        duration_sec=body.duration_sec,
+    )
+    _persist_blob_material(meta, blob)
+    return MaterialUploadResponse(
+        material_id=material_id,
+        filename=resolved_filename,
+        md5=blob["md5"],
+        status="uploaded",
+        extra={"path": str(blob["path"]), "size_bytes": blob["size_bytes"], "oss_url": None, "deduplicated": True},
+    )
+
+
+@router.put("/uploads/{upload_id}/parts/{part_number}")
+async def put_multipart_upload_part(
+    upload_id: str,
+    part_number: int,
+    request: Request,
+    content_md5: str = Header(None),
+):
+    # 分片 MD5 可通过标准 Content-MD5（base64）或十六进制摘要提供。
+    return await material_multipart.upload_part(upload_id, part_number, request.stream(), content_md5)
+
+
+@router.get("/uploads/{upload_id}", response_model=MultipartUploadStatusResponse)
+def get_multipart_upload_status(upload_id: str):
+    return material_multipart.upload_status(upload_id)
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=MaterialUploadResponse)
+def complete_multipart_upload(upload_id: str, body: MultipartUploadCompleteRequest = None):
+    session_meta = material_multipart.get_upload(upload_id)["meta"]
+    material_id = _new_material_id()
+    resolved_filename = session_meta.get("file_name") or f"{material_id}.bin"
+    save_path = MATERIAL_DIR / f"{material_id}_{Path(resolved_filename).name}"
+    parts = [p.model_dump() for p in body.parts] if body and body.parts else None
+    blob = None
+    if settings.material_blob_store:
+        incoming = get_blob_store().incoming_path()
+        saved = material_multipart.complete_upload(upload_id, incoming, parts=parts, sha256=True)
+        blob = get_blob_store().ingest(incoming, saved["sha256"], saved["md5"], saved["size_bytes"])
+        save_path = blob["path"]
+    else:
+        saved = material_multipart.complete_upload(upload_id, save_path, parts=parts)
+
+    meta = _build_material_meta(
+        material_id,
+        resolved_filename,
+        save_path=save_path,
+        size_bytes=saved["size_bytes"],
+        md5=saved["md5"],
+        sha256=saved["sha256"],
+        blob=blob,
+        ad_id=session_meta.get("ad_id"),
+        advertiser=session_meta.get("advertiser"),
+        uploader_id=session_meta.get("uploader_id"),
+        tags=session_meta.get("tags"),
+        type=session_meta.get("type"),
+        duration_sec=session_meta.get("duration_sec"),
+    )
+    _persist_blob_material(meta, blob)
+    return MaterialUploadResponse(
+        material_id=material_id,
+        filename=resolved_filename,
+        md5=saved["md5"],
+        status="uploaded",
+        extra={
+            "path": str(save_path),
+            "size_bytes": saved["size_bytes"],
+            "oss_url": None,
+            "deduplicated": bool(blob and blob["deduplicated"]),
+        },
+    )
+
+
+@router.delete("/uploads/{upload_id}")
+def abort_multipart_upload(upload_id: str):
+    material_multipart.abort_upload(upload_id)
+    return {"ok": True}
+
+
 @router.get("/", response_model=MaterialListResponse)
 def list_all_materials(offset: int = 0, limit: int = 50):
     # 尝试从 Postgres 读取 materials，失败时回退到本地索引
@@ -201,11 +416,11 @@ def delete_one_material(material_id: str):
         db_row = db_service.get_material(material_id)
         if db_row:
             # simple deletion; table must support PK material_id
-            conn = db_service.get_conn()
-            cur = conn.cursor()
-            cur.execute("DELETE FROM materials WHERE material_id = %s", [material_id])
-            conn.commit()
-            cur.close(); conn.close()
+            with db_service.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("DELETE FROM materials WHERE material_id = %s", [material_id])
+                conn.commit()
+                cur.close()
     except Exception:
         # ignore DB errors; fall back to local index
         pass
@@ -273,20 +488,6 @@ def get_one_material(material_id: str):
     return normalized
 
 @router.get("/{material_id}/file")
-def download_material_file(material_id: str):
-    item = get_material(material_id)
-    if not item:
-        raise HTTPException(status_code=404,detail="material not found")
-
-    p = get_material_file_path(material_id)
-    if not p:
-        raise HTTPException(status_code=404,detail="material file not found")
-        
-    # 下载时展示原始文件名(索引中已保存 filename)
-    download_name = item.get("filename") or p.name
-
-    return FileResponse(
-        path=str(p),
-        filename=download_name,
-        media_type="application/octet_stream",
-    )
+def download_material_file(request: Request, material_id: str):
+    # 下载时展示原始文件名(索引中已保存 filename)；支持 Range 断点续传。
+    return material_file_response(request, material_id, via_catalog=False, media_type="application/octet_stream")
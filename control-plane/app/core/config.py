@@ -5,6 +5,20 @@ import os
 class Settings(BaseSettings):
     # Gateways
     gateway_url: str = os.getenv("GATEWAY_URL", "http://127.0.0.1:8080")
+    # Pooled async client for gateway commands (app/services/gateway_client.py)
+    gateway_timeout_sec: float = float(os.getenv("GATEWAY_TIMEOUT_SEC", "5"))
+    gateway_max_connections: int = int(os.getenv("GATEWAY_MAX_CONNECTIONS", "100"))
+    gateway_max_keepalive: int = int(os.getenv("GATEWAY_MAX_KEEPALIVE", "20"))
+    # HTTP/2 needs the h2 package (pip install "httpx[http2]"); negotiated over https only.
+    gateway_http2: bool = os.getenv("GATEWAY_HTTP2", "false").strip().lower() in {
+        "1",
+        "true",
+        "yes",
+        "on",
+    }
+    # Circuit breaker: open after this many consecutive network errors / 5xx, retry after N seconds.
+    gateway_breaker_failures: int = int(os.getenv("GATEWAY_BREAKER_FAILURES", "5"))
+    gateway_breaker_reset_sec: float = float(os.getenv("GATEWAY_BREAKER_RESET_SEC", "30"))
 
     # Redis configuration
     redis_host: str = os.getenv("REDIS_HOST", "10.12.58.42")
@@ -19,9 +33,103 @@ class Settings(BaseSettings):
     pg_password: str = "123456"
     pg_db: str = "elevator_ad"
 
+    # Postgres connection pool (shared by API handlers and the Kafka consumer)
+    pg_pool_min_size: int = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+    pg_pool_max_size: int = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+    # Seconds a caller waits for a free connection before failing.
+    pg_pool_timeout: float = float(os.getenv("PG_POOL_TIMEOUT", "10"))
+    # Connections idle longer than this are probed with SELECT 1 on checkout.
+    pg_pool_health_check_idle_sec: float = float(os.getenv("PG_POOL_HEALTH_CHECK_IDLE_SEC", "30"))
+
+    # Known-device cache used by the play-log consumer for the ad_logs FK check
+    device_cache_max_size: int = int(os.getenv("DEVICE_CACHE_MAX_SIZE", "100000"))
+    device_cache_ttl_sec: float = float(os.getenv("DEVICE_CACHE_TTL_SEC", "3600"))
+
+    # Timezone of the naive ad_logs.start_time values reported by devices; /ad_stats
+    # converts request windows into this zone before querying.
+    ad_log_timezone: str = os.getenv("AD_LOG_TIMEZONE", "Asia/Shanghai")
+
+    # Native range partitioning of ad_logs on start_time (see app/services/ad_log_partitions.py).
+    # "day" or "month"; only used when ad_logs is (or is being migrated to) a partitioned table.
+    ad_log_partition_interval: str = os.getenv("AD_LOG_PARTITION_INTERVAL", "day")
+    # Number of future partitions kept ahead of today.
+    ad_log_partition_premake: int = int(os.getenv("AD_LOG_PARTITION_PREMAKE", "7"))
+    # Partitions whose whole range is older than this many days are dropped; 0 keeps everything.
+    ad_log_retention_days: int = int(os.getenv("AD_LOG_RETENTION_DAYS", "0"))
+    # Seconds between background maintenance runs in the API process; 0 disables the thread.
+    ad_log_partition_maintenance_sec: float = float(os.getenv("AD_LOG_PARTITION_MAINTENANCE_SEC", "3600"))
+
+    # Compiled gateway schedule bundles (app/services/bundle_cache.py)
+    bundle_cache_max_size: int = int(os.getenv("BUNDLE_CACHE_MAX_SIZE", "20000"))
+    # Upper bound on staleness if a cross-process invalidation is missed.
+    bundle_cache_ttl_sec: float = float(os.getenv("BUNDLE_CACHE_TTL_SEC", "300"))
+    # Share compiled bundles and invalidations between API processes through Redis.
+    bundle_cache_redis: bool = os.getenv("BUNDLE_CACHE_REDIS", "false").strip().lower() in {
+        "1",
+        "true",
+        "yes",
+        "on",
+    }
+
+    # Gateway material catalog (app/services/material_catalog.py); full reload interval
+    # that bounds staleness from writes made by other processes.
+    material_catalog_ttl_sec: float = float(os.getenv("MATERIAL_CATALOG_TTL_SEC", "300"))
+
+    # Local material catalog backend (app/services/material_store.py): "sqlite" or "json"
+    # (legacy data/materials/index.json). The SQLite store imports an existing index.json once.
+    material_store_backend: str = os.getenv("MATERIAL_STORE_BACKEND", "sqlite")
+
+    # Streaming material uploads (app/services/material_upload.py); 0 disables the size limit.
+    material_upload_max_bytes: int = int(os.getenv("MATERIAL_UPLOAD_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+    material_upload_chunk_bytes: int = int(os.getenv("MATERIAL_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+    # Also compute SHA-256 while streaming (stored in extra.sha256).
+    material_upload_sha256: bool = os.getenv("MATERIAL_UPLOAD_SHA256", "false").strip().lower() in {
+        "1",
+        "true",
+        "yes",
+        "on",
+    }
+
+    # Store uploaded files content-addressed under data/materials/blobs with reference
+    # counts (app/services/blob_store.py); identical uploads share one file.
+    material_blob_store: bool = os.getenv("MATERIAL_BLOB_STORE", "true").strip().lower() in {
+        "1",
+        "true",
+        "yes",
+        "on",
+    }
+
+    # Material downloads (app/services/material_downloads.py): resolved-path cache and the
+    # read size used when the server offers neither zero-copy nor pathsend.
+    material_download_cache_size: int = int(os.getenv("MATERIAL_DOWNLOAD_CACHE_SIZE", "4096"))
+    material_download_cache_ttl_sec: float = float(os.getenv("MATERIAL_DOWNLOAD_CACHE_TTL_SEC", "300"))
+    material_download_chunk_bytes: int = int(os.getenv("MATERIAL_DOWNLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+    # Resumable multipart uploads (app/services/material_multipart.py)
+    material_multipart_part_bytes: int = int(os.getenv("MATERIAL_MULTIPART_PART_BYTES", str(8 * 1024 * 1024)))
+    # Unfinished sessions idle longer than this are removed.
+    material_multipart_ttl_sec: float = float(os.getenv("MATERIAL_MULTIPART_TTL_SEC", "86400"))
+
+    # Device group selectors (group:/city:/building:/tag:) resolved from the devices table
+    device_group_cache_ttl_sec: float = float(os.getenv("DEVICE_GROUP_CACHE_TTL_SEC", "600"))
+    device_group_cache_max_groups: int = int(os.getenv("DEVICE_GROUP_CACHE_MAX_GROUPS", "1024"))
+
     # Snapshot handling
     snapshot_storage_dir: str = os.getenv("SNAPSHOT_STORAGE_DIR", "data/snapshots")
     snapshot_wait_timeout: int = int(os.getenv("SNAPSHOT_WAIT_TIMEOUT", "15"))
+    # Expiry granularity of pending snapshot requests (app/services/snapshot_waiters.py)
+    snapshot_waiter_tick_sec: float = float(os.getenv("SNAPSHOT_WAITER_TICK_SEC", "0.25"))
+    # Reuse a device's snapshot URL for this many seconds after it arrived (0 disables)
+    snapshot_result_cache_sec: float = float(os.getenv("SNAPSHOT_RESULT_CACHE_SEC", "10"))
+
+    # Bulk commands (POST /commands/bulk, app/services/command_jobs.py): concurrent sends to
+    # the gateway, retries with exponential backoff for network errors / 5xx, devices per
+    # job and how many finished jobs stay pollable.
+    command_bulk_concurrency: int = int(os.getenv("COMMAND_BULK_CONCURRENCY", "32"))
+    command_bulk_max_retries: int = int(os.getenv("COMMAND_BULK_MAX_RETRIES", "2"))
+    command_bulk_backoff_sec: float = float(os.getenv("COMMAND_BULK_BACKOFF_SEC", "0.5"))
+    command_bulk_max_devices: int = int(os.getenv("COMMAND_BULK_MAX_DEVICES", "5000"))
+    command_job_history: int = int(os.getenv("COMMAND_JOB_HISTORY", "200"))
 
     # Toggle memory fallback for campaign endpoints when DB is unavailable.
     enable_memory_fallback: bool = os.getenv("ENABLE_MEMORY_FALLBACK", "true").strip().lower() in {
@@ -0,0 +1,392 @@
+"""
+Process-wide Postgres connection pool.
+
+db_service 过去每次查询都会重新解析 .env 并新建一条 psycopg2 连接；
+这里统一维护一个线程安全的连接池，API 请求线程和 Kafka 消费线程共用。
+
+Usage::
+
+    from app.db.session import connection
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+
+The pool is created lazily on first use, and explicitly by the FastAPI
+lifespan (see ``app/main.py``) so that startup can warm ``min_size``
+connections and shutdown can close them.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import psycopg2
+from psycopg2 import extensions
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_ENV_LOADED = False
+_ENV_LOCK = threading.Lock()
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+def _load_env_file() -> None:
+    # 只在进程内解析一次 control-plane/.env，后续连接直接复用环境变量。
+    global _ENV_LOADED
+    if _ENV_LOADED:
+        return
+    with _ENV_LOCK:
+        if _ENV_LOADED:
+            return
+        try:
+            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+            env_path = os.path.join(base_dir, '.env')
+            if os.path.exists(env_path):
+                with open(env_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line or line.startswith('#') or '=' not in line:
+                            continue
+                        k, v = line.split('=', 1)
+                        k = k.strip(); v = v.strip().strip('"').strip("'")
+                        if k not in os.environ:
+                            os.environ[k] = v
+        except Exception:
+            logger.exception('failed to load .env')
+        _ENV_LOADED = True
+
+
+def get_dsn() -> str:
+    """Return the Postgres DSN from ``PG_DSN`` or the individual ``PG_*`` variables."""
+    _load_env_file()
+    dsn = os.getenv('PG_DSN')
+    if not dsn:
+        host = os.getenv('PG_HOST', 'localhost')
+        port = os.getenv('PG_PORT', '5432')
+        user = os.getenv('PG_USER', 'postgres')
+        password = os.getenv('PG_PASSWORD', '538890')
+        db = os.getenv('PG_DB', 'elevator_ad')
+        dsn = f"host={host} port={port} user={user} password={password} dbname={db}"
+    return dsn
+
+
+def connect(dsn: Optional[str] = None):
+    """Open a new dedicated (unpooled) connection."""
+    dsn = dsn or get_dsn()
+    try:
+        conn = psycopg2.connect(dsn)
+        try:
+            # ensure client uses UTF8; helps psycopg2 decode text columns correctly
+            conn.set_client_encoding('UTF8')
+        except Exception:
+            pass
+        return conn
+    except Exception:
+        logger.exception('failed to connect to Postgres with dsn: %s', dsn)
+        raise
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe psycopg2 connection pool.
+
+    - ``min_size`` connections are opened by :meth:`warmup`.
+    - At most ``max_size`` connections exist at a time; callers beyond that
+      wait up to ``timeout`` seconds and then get :class:`PoolTimeout`.
+    - Connections idle for longer than ``health_check_idle_sec`` are probed
+      with ``SELECT 1`` on checkout; broken ones are discarded and replaced.
+    - Returned connections are rolled back and reset to UTF8 so that one
+      caller's open transaction or encoding fallback never leaks to the next.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 10.0,
+        health_check_idle_sec: float = 30.0,
+    ):
+        if max_size < 1:
+            raise ValueError('max_size must be >= 1')
+        self.dsn = dsn
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_idle_sec = health_check_idle_sec
+
+        self._cond = threading.Condition()
+        # (conn, last_used_monotonic)
+        self._idle: deque = deque()
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+        self._connect_errors = 0
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def warmup(self) -> int:
+        """Open connections until ``min_size`` are available. Returns how many were opened."""
+        opened = 0
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return opened
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            opened += 1
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    # -- checkout / return ---------------------------------------------------
+
+    def getconn(self, timeout: Optional[float] = None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        while True:
+            conn = None
+            need_open = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError('connection pool is closed')
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self._in_use += 1
+                        need_open = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f'no Postgres connection available within {timeout}s '
+                            f'(max_size={self.max_size})'
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if need_open:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._connect_errors += 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                continue
+
+            self._record_checkout(time.monotonic() - started, waited)
+            return conn
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        if conn is None:
+            return
+        if not discard:
+            discard = not self._reset(conn)
+        if discard:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._in_use -= 1
+            if self._closed:
+                self._size -= 1
+                close_now = True
+            else:
+                self._idle.append((conn, time.monotonic()))
+                close_now = False
+            self._cond.notify()
+        if close_now:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """Check out a connection for the duration of the ``with`` block."""
+        conn = self.getconn(timeout=timeout)
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    # -- stats -------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': checkouts,
+                'waits': self._waits,
+                'wait_time_total_ms': round(self._wait_total * 1000.0, 3),
+                'wait_time_avg_ms': round(self._wait_total * 1000.0 / checkouts, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_max * 1000.0, 3),
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'connect_errors': self._connect_errors,
+                'closed': self._closed,
+            }
+
+    # -- internals ---------------------------------------------------------
+
+    def _open(self):
+        return connect(self.dsn)
+
+    def _record_checkout(self, wait: float, waited: bool) -> None:
+        with self._cond:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_total += wait
+            if wait > self._wait_max:
+                self._wait_max = wait
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if self.health_check_idle_sec is None or time.monotonic() - last_used < self.health_check_idle_sec:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            logger.warning('discarding unhealthy pooled Postgres connection', exc_info=True)
+            return False
+
+    def _reset(self, conn) -> bool:
+        # 归还前清理事务和编码（list_* 在 UnicodeDecodeError 时会切到 LATIN1）。
+        if conn.closed:
+            return False
+        try:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.encoding != 'UTF8':
+                conn.set_client_encoding('UTF8')
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn) -> None:
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._in_use -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_POOL: Optional[ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def init_pool(warmup: bool = True) -> ConnectionPool:
+    """Create the process-wide pool (idempotent) and optionally warm ``min_size`` connections."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ConnectionPool(
+                get_dsn(),
+                min_size=settings.pg_pool_min_size,
+                max_size=settings.pg_pool_max_size,
+                timeout=settings.pg_pool_timeout,
+                health_check_idle_sec=settings.pg_pool_health_check_idle_sec,
+            )
+        pool = _POOL
+    if warmup:
+        pool.warmup()
+    return pool
+
+
+def get_pool() -> ConnectionPool:
+    pool = _POOL
+    if pool is None:
+        pool = init_pool(warmup=False)
+    return pool
+
+
+def close_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.close()
+
+
+@contextmanager
+def connection(timeout: Optional[float] = None) -> Iterator[Any]:
+    """Check out a pooled connection; it is rolled back (if needed) and returned on exit."""
+    with get_pool().connection(timeout=timeout) as conn:
+        yield conn
+
+
+def pool_stats() -> Dict[str, Any]:
+    pool = _POOL
+    if pool is None:
+        return {'initialized': False}
+    return {'initialized': True, **pool.stats()}
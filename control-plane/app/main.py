@@ -5,6 +5,8 @@ import os # 【新增】
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.router import api_router
 from app.services.background_tasks import get_task_manager
+from app.services.gateway_client import get_gateway_client
+from app.db.session import init_pool, close_pool
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,6 +19,11 @@ async def lifespan(app: FastAPI):
     """
     # Startup
     logger.info("Starting control-plane application...")
+    # 预热 Postgres 连接池；数据库不可用时不阻塞启动，首次查询时会再次尝试建连。
+    try:
+        init_pool()
+    except Exception as e:
+        logger.warning(f"Failed to warm up Postgres connection pool: {e}")
     task_manager = get_task_manager()
     
     # Start Kafka consumer background task
@@ -26,12 +33,18 @@ async def lifespan(app: FastAPI):
         task_manager.start_kafka_consumer()
     except Exception as e:
         logger.warning(f"Failed to start Kafka consumer: {e}. App will continue without log ingestion.")
+
+    # ad_logs 分区表：预建未来分区、按保留期删除旧分区（未分区时线程自行退出）
+    task_manager.start_partition_maintenance()
     
     yield
     
     # Shutdown
     logger.info("Shutting down control-plane application...")
     task_manager.stop_kafka_consumer()
+    task_manager.stop_partition_maintenance()
+    await get_gateway_client().aclose()
+    close_pool()
     logger.info("Shutdown complete")
 
 
@@ -29,6 +29,55 @@ class MaterialUploadResponse(BaseModel):
     status: str = "uploaded"  # uploaded / transcoding / done / failed
     extra: Optional[Dict[str, Any]] = None
 
+class MultipartUploadInitRequest(BaseModel):
+    file_name: str
+    size_bytes: int
+    part_size: Optional[int] = None
+    # Optional whole-file MD5 (hex), verified on complete.
+    md5: Optional[str] = None
+    # Optional whole-file SHA-256 (hex); with the blob store enabled an already
+    # stored blob of the same size is referenced at once and no parts are sent.
+    sha256: Optional[str] = None
+    ad_id: Optional[str] = None
+    advertiser: Optional[str] = None
+    uploader_id: Optional[str] = None
+    tags: Optional[str] = None
+    type: Optional[str] = None
+    duration_sec: Optional[int] = None
+
+
+class MultipartUploadInitResponse(BaseModel):
+    # upload_id is None when the declared sha256 was deduplicated: the material
+    # already exists (see ``material``) and there is nothing to upload.
+    upload_id: Optional[str] = None
+    size_bytes: int
+    part_size: Optional[int] = None
+    total_parts: int = 0
+    deduplicated: bool = False
+    material: Optional[MaterialUploadResponse] = None
+
+
+class MultipartUploadPart(BaseModel):
+    part_number: int
+    size: Optional[int] = None
+    md5: Optional[str] = None
+
+
+class MultipartUploadStatusResponse(BaseModel):
+    upload_id: str
+    size_bytes: int
+    part_size: int
+    total_parts: int
+    received_bytes: int
+    received_ranges: List[List[int]]
+    parts: List[MultipartUploadPart]
+    missing_parts: List[int]
+
+
+class MultipartUploadCompleteRequest(BaseModel):
+    parts: Optional[List[MultipartUploadPart]] = None
+
+
 class MaterialListResponse(BaseModel):
     total: int
     items: List[MaterialMeta]
@@ -0,0 +1,323 @@
+"""
+Native range partitioning of ad_logs on start_time.
+
+ad_logs 原来是一张不分区的大表，统计、列表、计数查询都要扫全表，清理历史
+数据只能长时间 DELETE 并引发 vacuum 风暴。这里把它管理为按天或按月的
+Postgres 原生范围分区表：
+
+- 分区命名 ``ad_logs_pYYYYMMDD``（按天）/ ``ad_logs_pYYYYMM``（按月），
+  另有 ``ad_logs_default`` 兜底分区承接超出预建范围的日志；
+- 维护任务（API 后台线程或 ``maintain`` 命令）提前建好未来
+  ``AD_LOG_PARTITION_PREMAKE`` 个分区，并 DETACH + DROP 整个范围早于
+  ``AD_LOG_RETENTION_DAYS`` 的分区 —— 删除历史数据只是元数据操作；
+- 带 start_time 条件的查询（list_ad_logs / count_ad_logs / rollup 重算）
+  由规划器裁剪到相关分区。
+
+分区表的唯一约束必须包含分区键，主键变为 ``(log_id, start_time)``，
+start_time 不能为 NULL（写入路径用 created_at 或 Kafka 消息时间戳补齐，推导
+不出的记录进入死信队列，见 db_service.upsert_ad_logs_batch）。同一 log_id 的
+start_time 变化后重新投递会在新分区插入第二行，修正 start_time 需先删除旧行。rollup 表不受保留期影响，统计页仍能看到
+已删除分区的历史汇总。
+
+把现有表迁移为分区表（需停掉消费者，迁移后重启 API 与 ingest worker）::
+
+    python -m app.services.ad_log_partitions migrate
+    python -m app.services.ad_log_partitions maintain
+    python -m app.services.ad_log_partitions list
+"""
+
+import argparse
+import json
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'ad_logs'
+DEFAULT_PARTITION = 'ad_logs_default'
+LEGACY_TABLE = 'ad_logs_unpartitioned'
+INTERVALS = ('day', 'month')
+
+_NAME_RE = re.compile(r'^ad_logs_p(\d{4})(\d{2})(\d{2})?$')
+
+
+def _check_interval(interval: str) -> str:
+    interval = (interval or '').strip().lower()
+    if interval not in INTERVALS:
+        raise ValueError(f"unsupported partition interval: {interval!r} (expected day or month)")
+    return interval
+
+
+def partition_bounds(interval: str, day: date) -> Tuple[date, date]:
+    """Return the ``[start, end)`` range of the partition containing ``day``."""
+    interval = _check_interval(interval)
+    if isinstance(day, datetime):
+        day = day.date()
+    if interval == 'day':
+        return day, day + timedelta(days=1)
+    start = day.replace(day=1)
+    end = date(start.year + 1, 1, 1) if start.month == 12 else date(start.year, start.month + 1, 1)
+    return start, end
+
+
+def partition_name(interval: str, start: date) -> str:
+    if _check_interval(interval) == 'day':
+        return f"{PARENT_TABLE}_p{start:%Y%m%d}"
+    return f"{PARENT_TABLE}_p{start:%Y%m}"
+
+
+def parse_partition_name(name: str) -> Optional[Tuple[date, date]]:
+    """Inverse of :func:`partition_name`: ``[start, end)`` or None for foreign names."""
+    m = _NAME_RE.match(name or '')
+    if not m:
+        return None
+    year, month, day = int(m.group(1)), int(m.group(2)), m.group(3)
+    try:
+        if day is None:
+            return partition_bounds('month', date(year, month, 1))
+        return partition_bounds('day', date(year, month, int(day)))
+    except ValueError:
+        return None
+
+
+def planned_partitions(interval: str, today: date, premake: int, since: Optional[date] = None) -> List[Tuple[str, date, date]]:
+    """
+    Partitions that should exist: from ``since`` (default: today's partition)
+    up to ``premake`` partitions after today's. Returns ``[(name, start, end), ...]``.
+    """
+    start, end = partition_bounds(interval, since or today)
+    _, last_end = partition_bounds(interval, today)
+    for _ in range(max(0, int(premake))):
+        _, last_end = partition_bounds(interval, last_end)
+    planned = []
+    while start < last_end:
+        planned.append((partition_name(interval, start), start, end))
+        start, end = partition_bounds(interval, end)
+    return planned
+
+
+def expired_partitions(names: List[str], today: date, retention_days: int) -> List[str]:
+    """Partition names whose whole range ends on or before ``today - retention_days``."""
+    if not retention_days or retention_days <= 0:
+        return []
+    cutoff = today - timedelta(days=int(retention_days))
+    expired = []
+    for name in names:
+        bounds = parse_partition_name(name)
+        if bounds is not None and bounds[1] <= cutoff:
+            expired.append(name)
+    return sorted(expired)
+
+
+# -- database operations -----------------------------------------------------
+
+
+def is_partitioned(cur) -> bool:
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [PARENT_TABLE])
+    return bool(cur.fetchone()[0])
+
+
+def list_partitions(cur) -> List[Dict[str, Any]]:
+    """Attached partitions of ad_logs with their bound expressions and estimated rows."""
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), GREATEST(c.reltuples, 0)::bigint
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+        """,
+        [PARENT_TABLE],
+    )
+    return [{'name': name, 'bound': bound, 'estimated_rows': rows} for name, bound, rows in cur.fetchall()]
+
+
+def _create_partition(cur, name: str, start: date, end: date) -> bool:
+    # 单个分区失败（例如 default 分区里已有落在该范围的数据）不影响其余分区。
+    cur.execute("SAVEPOINT ad_log_partition")
+    try:
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time())],
+        )
+        cur.execute("RELEASE SAVEPOINT ad_log_partition")
+        return True
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT ad_log_partition")
+        logger.warning(f"Failed to create ad_logs partition {name} [{start}, {end}): {e}")
+        return False
+
+
+def ensure_partitions(cur, interval: str, today: date, premake: int, since: Optional[date] = None) -> List[str]:
+    """Create missing partitions (and the default partition); returns the names created."""
+    existing = {p['name'] for p in list_partitions(cur)}
+    created = []
+    for name, start, end in planned_partitions(interval, today, premake, since=since):
+        if name not in existing and _create_partition(cur, name, start, end):
+            created.append(name)
+    if DEFAULT_PARTITION not in existing:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT")
+        created.append(DEFAULT_PARTITION)
+    return created
+
+
+def drop_expired_partitions(cur, today: date, retention_days: int) -> List[str]:
+    """Detach and drop partitions past the retention window; returns the names dropped."""
+    names = [p['name'] for p in list_partitions(cur)]
+    dropped = []
+    for name in expired_partitions(names, today, retention_days):
+        cur.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+        cur.execute(f"DROP TABLE {name}")
+        dropped.append(name)
+    return dropped
+
+
+def maintain(today: Optional[date] = None, interval: Optional[str] = None, premake: Optional[int] = None,
+             retention_days: Optional[int] = None) -> Dict[str, Any]:
+    """
+    One maintenance pass: create upcoming partitions and drop expired ones.
+
+    ad_logs 未分区时什么都不做（返回 ``partitioned: False``）。
+    """
+    from app.services.db_service import connection
+
+    interval = _check_interval(interval or settings.ad_log_partition_interval)
+    premake = settings.ad_log_partition_premake if premake is None else premake
+    retention_days = settings.ad_log_retention_days if retention_days is None else retention_days
+    today = today or date.today()
+
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            if not is_partitioned(cur):
+                conn.rollback()
+                return {'partitioned': False, 'created': [], 'dropped': []}
+            # 多个 API 进程同时维护时只让一个执行；DDL 等锁不要无限阻塞写入。
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('ad_logs_partition_maintenance'))")
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return {'partitioned': True, 'skipped': True, 'created': [], 'dropped': []}
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            created = ensure_partitions(cur, interval, today, premake)
+            dropped = drop_expired_partitions(cur, today, retention_days)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    if created or dropped:
+        logger.info(f"ad_logs partitions: created={created} dropped={dropped}")
+    return {'partitioned': True, 'created': created, 'dropped': dropped}
+
+
+def _legacy_columns(cur) -> List[str]:
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        [LEGACY_TABLE],
+    )
+    return [r[0] for r in cur.fetchall()]
+
+
+def migrate(interval: Optional[str] = None, premake: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Convert an unpartitioned ad_logs into a partitioned one, in one transaction.
+
+    原表重命名为 ``ad_logs_unpartitioned`` 并保留，核对无误后由运维手动 DROP；
+    start_time 为 NULL 的旧日志按 created_at（否则按迁移时间）归入分区。
+    列表 / 搜索索引在父表上重建，会级联到所有分区（再执行一次
+    db/ad_logs_indexes.sql 去掉 CONCURRENTLY 即可补齐 trigram 索引）。
+    """
+    from app.services.db_service import get_conn
+
+    interval = _check_interval(interval or settings.ad_log_partition_interval)
+    premake = settings.ad_log_partition_premake if premake is None else premake
+
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        if is_partitioned(cur):
+            return {'migrated': False, 'reason': 'ad_logs is already partitioned'}
+        cur.execute(f"LOCK TABLE {PARENT_TABLE} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"ALTER TABLE {PARENT_TABLE} RENAME TO {LEGACY_TABLE}")
+        # 约束名随原表保留，新表的主键需要另起名字。
+        cur.execute(
+            f"CREATE TABLE {PARENT_TABLE} (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (start_time)"
+        )
+        cur.execute(f"ALTER TABLE {PARENT_TABLE} ALTER COLUMN start_time SET NOT NULL")
+        cur.execute(f"ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT ad_logs_part_pkey PRIMARY KEY (log_id, start_time)")
+        cur.execute(
+            f"ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT ad_logs_part_device_fkey "
+            f"FOREIGN KEY (device_id) REFERENCES devices (device_id)"
+        )
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_ad_logs_part_start_time_log_id "
+            f"ON {PARENT_TABLE} (start_time DESC, log_id DESC)"
+        )
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_ad_logs_part_device_start_time "
+            f"ON {PARENT_TABLE} (device_id, start_time DESC, log_id DESC)"
+        )
+
+        fill = (
+            "COALESCE(start_time, to_timestamp(CASE WHEN created_at > 1e12 THEN created_at / 1000.0 "
+            "ELSE created_at END)::timestamp, now()::timestamp)"
+        )
+        cur.execute(f"SELECT MIN({fill})::date FROM {LEGACY_TABLE}")
+        oldest = cur.fetchone()[0]
+        created = ensure_partitions(cur, interval, date.today(), premake, since=oldest)
+
+        columns = _legacy_columns(cur)
+        select = ", ".join(fill if c == 'start_time' else c for c in columns)
+        cur.execute(
+            f"INSERT INTO {PARENT_TABLE} ({', '.join(columns)}) SELECT {select} FROM {LEGACY_TABLE}"
+        )
+        copied = cur.rowcount
+        conn.commit()
+        cur.execute(f"ANALYZE {PARENT_TABLE}")
+        conn.commit()
+        return {'migrated': True, 'partitions': len(created), 'rows': copied, 'legacy_table': LEGACY_TABLE}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Manage ad_logs range partitions.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    mg = sub.add_parser('migrate', help="convert an unpartitioned ad_logs into a partitioned table")
+    mt = sub.add_parser('maintain', help="create upcoming partitions and drop expired ones")
+    for p in (mg, mt):
+        p.add_argument('--interval', choices=INTERVALS, default=None)
+        p.add_argument('--premake', type=int, default=None)
+    mt.add_argument('--retention-days', type=int, default=None)
+    sub.add_parser('list', help="list attached partitions")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'migrate':
+        result = migrate(interval=args.interval, premake=args.premake)
+    elif args.command == 'maintain':
+        result = maintain(interval=args.interval, premake=args.premake, retention_days=args.retention_days)
+    else:
+        from app.services.db_service import connection
+
+        with connection() as conn:
+            result = list_partitions(conn.cursor())
+    print(json.dumps(result, ensure_ascii=False, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,19 @@ ensuring they start with the application and gracefully shut down.
 """
 
 import logging
+import os
 import threading
 import time
 from typing import Optional
+from app.core.config import settings
+from app.services import ad_log_partitions
 from app.services.kafka_consumer import create_consumer, KafkaPlayLogConsumer
 
 logger = logging.getLogger(__name__)
 
 
 class BackgroundTaskManager:
-    """Manages background tasks like Kafka consumer."""
+    """Manages background tasks like Kafka consumer and ad_logs partition maintenance."""
     
     _instance: Optional['BackgroundTaskManager'] = None
     _lock = threading.Lock()
@@ -32,6 +35,8 @@ class BackgroundTaskManager:
         if not hasattr(self, '_initialized'):
             self.kafka_consumer: Optional[KafkaPlayLogConsumer] = None
             self.kafka_thread: Optional[threading.Thread] = None
+            self.partition_thread: Optional[threading.Thread] = None
+            self._partition_stop = threading.Event()
             self.running = False
             self._initialized = True
     
@@ -45,6 +50,11 @@ class BackgroundTaskManager:
         if self.running:
             logger.warning("Kafka consumer is already running")
             return False
+
+        # 使用独立的 ingest_runner 多进程消费时，API 进程不再加入 consumer group。
+        if os.getenv('PLAYLOG_INGEST_IN_API', 'true').strip().lower() not in {'1', 'true', 'yes', 'on'}:
+            logger.info("PLAYLOG_INGEST_IN_API is disabled; play logs are consumed by the standalone ingest runner")
+            return False
         
         try:
             logger.info("Starting Kafka consumer in background thread...")
@@ -92,6 +102,47 @@ class BackgroundTaskManager:
             self.running = False
             logger.info("Kafka consumer stopped")
     
+    def start_partition_maintenance(self) -> bool:
+        """
+        Periodically create upcoming ad_logs partitions and drop expired ones.
+
+        Returns:
+            True if the maintenance thread was started
+        """
+        interval = settings.ad_log_partition_maintenance_sec
+        if interval <= 0:
+            logger.info("ad_logs partition maintenance is disabled")
+            return False
+        if self.partition_thread and self.partition_thread.is_alive():
+            return False
+        self._partition_stop.clear()
+        self.partition_thread = threading.Thread(
+            target=self._run_partition_maintenance,
+            args=(interval,),
+            daemon=True,
+            name="AdLogPartitionMaintenance",
+        )
+        self.partition_thread.start()
+        return True
+
+    def _run_partition_maintenance(self, interval: float):
+        while True:
+            try:
+                if not ad_log_partitions.maintain().get('partitioned'):
+                    # 未分区时无需维护；迁移后重启 API 即会重新启用。
+                    logger.info("ad_logs is not partitioned; partition maintenance stopped")
+                    return
+            except Exception as e:
+                logger.warning(f"ad_logs partition maintenance failed: {e}")
+            if self._partition_stop.wait(interval):
+                return
+
+    def stop_partition_maintenance(self):
+        self._partition_stop.set()
+        if self.partition_thread:
+            self.partition_thread.join(timeout=5)
+            self.partition_thread = None
+
     def is_running(self) -> bool:
         """Check if background tasks are running."""
         return self.running
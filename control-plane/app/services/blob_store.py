@@ -0,0 +1,182 @@
+"""
+Content-addressed storage for material files.
+
+原来每次上传都保存为 ``{material_id}_{name}``，同一个创意换个广告主 / 活动
+再传一次就多一份完全相同的文件。这里按内容 SHA-256 存储：
+
+- 文件位于 ``data/materials/blobs/<sha[:2]>/<sha>``，同样的字节只存一份；
+- 上传时边写临时文件边计算哈希（见 material_upload），写完发现已存在同哈希
+  blob 就直接丢弃临时文件，只给已有 blob 增加一次引用——这种情况下重复内容
+  照样完整传输、落盘一次；
+- 客户端预先声明 sha256 且同哈希、同大小的 blob 已存在时，:meth:`reference`
+  直接加引用：分片上传在 init 时就完成，不必传任何分片；``/materials/upload``
+  的表单在进入接口前已被完整接收，只能省掉哈希计算和落盘。声明的哈希按原样
+  信任（只额外核对大小和可选的 md5），这是管理端接口，不是匿名上传入口；
+- 引用计数记在 ``blobs/refs.sqlite3``，每条引用该 blob 的素材记录计一次，
+  ``delete_material`` 释放引用，计数归零才删除文件；
+- 素材的 md5 不变（设备端按 md5 校验），相同字节的不同素材 md5 相同、
+  下载路径相同，设备端缓存可以跨素材命中。
+
+引用计数的增减与文件移动 / 删除在同一个 SQLite 写事务里完成（BEGIN
+IMMEDIATE），并发上传同一内容、上传与删除交错都不会丢引用或误删文件。
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+class BlobStore:
+    """SHA-256 keyed blob directory with SQLite reference counts."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.incoming_dir = self.root / "incoming"
+        self.incoming_dir.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                md5 TEXT,
+                size_bytes INTEGER,
+                refcount INTEGER NOT NULL,
+                created_at REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_md5 ON blobs(md5)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.root / "refs.sqlite3"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def incoming_path(self) -> Path:
+        """Temp destination for a streamed upload before :meth:`ingest`."""
+        return self.incoming_dir / uuid.uuid4().hex
+
+    def ingest(self, tmp_path: Path, sha256: str, md5: str, size_bytes: int) -> Dict[str, Any]:
+        """
+        Take ownership of ``tmp_path`` as blob ``sha256`` and add one reference.
+
+        Returns ``{"sha256", "path", "deduplicated"}``; when the blob already
+        existed the temp file is removed instead of stored a second time.
+        """
+        path = self.blob_path(sha256)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            deduplicated = row is not None and path.exists()
+            if deduplicated:
+                Path(tmp_path).unlink()
+            else:
+                # 记录存在但文件丢失（手工清理等）时用本次上传的内容补回。
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+            if row is None:
+                conn.execute(
+                    "INSERT INTO blobs (sha256, md5, size_bytes, refcount, created_at) VALUES (?, ?, ?, 1, ?)",
+                    (sha256, md5, size_bytes, time.time()),
+                )
+            else:
+                conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?", (sha256,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"sha256": sha256, "path": path, "deduplicated": deduplicated}
+
+    def reference(self, sha256: str, size_bytes: Optional[int] = None, md5: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Add one reference to an existing blob without any upload.
+
+        Returns the same shape as :meth:`ingest` (``deduplicated`` True, plus
+        ``md5`` / ``size_bytes``), or None when no matching blob is stored.
+        """
+        path = self.blob_path(sha256)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT md5, size_bytes FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if (
+                row is None
+                or not path.exists()
+                or (size_bytes is not None and row[1] != size_bytes)
+                or (md5 and (row[0] or "").lower() != md5.lower())
+            ):
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?", (sha256,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"sha256": sha256, "path": path, "deduplicated": True, "md5": row[0], "size_bytes": row[1]}
+
+    def release(self, sha256: str) -> int:
+        """Drop one reference; the file is unlinked when none remain. Returns the new count."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return 0
+            remaining = row[0] - 1
+            if remaining > 0:
+                conn.execute("UPDATE blobs SET refcount = ? WHERE sha256 = ?", (remaining, sha256))
+            else:
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                try:
+                    self.blob_path(sha256).unlink()
+                except FileNotFoundError:
+                    pass
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return max(remaining, 0)
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT sha256, md5, size_bytes, refcount FROM blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"sha256": row[0], "md5": row[1], "size_bytes": row[2], "refcount": row[3], "path": self.blob_path(row[0])}
+
+    def stats(self) -> Dict[str, Any]:
+        blobs, refs, size = self._conn().execute(
+            "SELECT COUNT(1), COALESCE(SUM(refcount), 0), COALESCE(SUM(size_bytes), 0) FROM blobs"
+        ).fetchone()
+        return {"blobs": blobs, "references": refs, "stored_bytes": size}
+
+
+_BLOB_STORE: Optional[BlobStore] = None
+_BLOB_STORE_LOCK = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Process-wide blob store under ``data/materials/blobs``."""
+    global _BLOB_STORE
+    if _BLOB_STORE is None:
+        with _BLOB_STORE_LOCK:
+            if _BLOB_STORE is None:
+                from app.services.material_service import MATERIAL_DIR
+
+                _BLOB_STORE = BlobStore(MATERIAL_DIR / "blobs")
+    return _BLOB_STORE
@@ -0,0 +1,308 @@
+"""
+Compiled device schedule bundle cache for the gateway endpoints.
+
+设备每分钟轮询 ``/gateway/devices/{device_id}/bundle``，原来每次都要：查询
+设备当前的已发布活动（JSONB 包含扫描）、重新规范化 schedule_json、生成
+edge schedule、逐条解析素材（最坏情况每条 list_materials(limit=10000)）。
+这里把编译结果缓存下来：
+
+- 设备 -> 已发布活动：按 device_id 缓存，任何活动发布 / 回滚 / 删除 /
+  策略更新都会整体清空（目标设备可能变化）；
+- bundle：按 ``(campaign_id, version, device_id, base_url)`` 缓存（下载链接
+  是绝对 URL，跟请求 host 有关），同时记录 bundle 引用了哪些素材标识，
+  素材上传 / 状态变化 / 删除时只失效相关条目；
+- 进程内有界 LRU + TTL，命中即一次字典查找；
+- 可选 Redis 二级缓存（``BUNDLE_CACHE_REDIS=true``）：多个 API 进程共享
+  已编译 bundle，失效时删除 Redis 键并通过 pub/sub 通知其它进程清理本地条目。
+  本地 TTL 兜底 pub/sub 消息丢失的情况。
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = 'bundle:'
+REDIS_CHANNEL = 'bundle_cache:invalidate'
+
+BundleKey = Tuple[str, str, str, str]
+
+
+def bundle_key(campaign_id: Any, version: Any, device_id: str, base_url: str = '') -> BundleKey:
+    return (str(campaign_id or ''), str(version or ''), str(device_id), str(base_url or ''))
+
+
+def _redis_key(key: BundleKey) -> str:
+    campaign_id, version, device_id, base_url = key
+    host = hashlib.sha1(base_url.encode('utf-8')).hexdigest()[:12]
+    return f"{REDIS_KEY_PREFIX}{campaign_id}:{version}:{device_id}:{host}"
+
+
+class BundleCache:
+    """Thread-safe bounded LRU of compiled bundles plus a device -> campaign map."""
+
+    def __init__(self, max_size: int = 10000, ttl_sec: float = 300.0, redis_client=None, redis_ttl_sec: Optional[float] = None):
+        self.max_size = max(1, int(max_size))
+        self.ttl_sec = ttl_sec
+        self.redis = redis_client
+        self.redis_ttl_sec = int(redis_ttl_sec if redis_ttl_sec is not None else ttl_sec) or None
+        self._bundles: "OrderedDict[BundleKey, Tuple[float, Dict[str, Any], frozenset]]" = OrderedDict()
+        self._by_campaign: Dict[str, Set[BundleKey]] = {}
+        self._by_material: Dict[str, Set[BundleKey]] = {}
+        self._devices: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._redis_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        # 每次失效 +1；编译前记下的 generation 与写入时不一致说明编译期间发生了
+        # 失效，结果可能已过期，不再写入缓存。
+        self.generation = 0
+
+    # -- device -> campaign ----------------------------------------------------
+
+    def get_device_campaign(self, device_id: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._devices.get(device_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._devices[device_id]
+                return None
+            self._devices.move_to_end(device_id)
+            return entry[1]
+
+    def put_device_campaign(self, device_id: str, campaign: Dict[str, Any], generation: Optional[int] = None) -> None:
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._devices[device_id] = (time.monotonic() + self.ttl_sec, campaign)
+            self._devices.move_to_end(device_id)
+            while len(self._devices) > self.max_size:
+                self._devices.popitem(last=False)
+
+    def forget_device(self, device_id: str) -> None:
+        """Drop the cached campaign of one device (e.g. it re-registered into other groups)."""
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+    # -- bundles ---------------------------------------------------------------
+
+    def _drop(self, key: BundleKey) -> None:
+        # 调用方持有 _lock
+        entry = self._bundles.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_campaign.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_campaign[key[0]]
+        for ident in entry[2]:
+            keys = self._by_material.get(ident)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_material[ident]
+
+    def _store(self, key: BundleKey, bundle: Dict[str, Any], materials: frozenset, generation: Optional[int] = None) -> bool:
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._drop(key)
+            self._bundles[key] = (time.monotonic() + self.ttl_sec, bundle, materials)
+            self._by_campaign.setdefault(key[0], set()).add(key)
+            for ident in materials:
+                self._by_material.setdefault(ident, set()).add(key)
+            while len(self._bundles) > self.max_size:
+                self._drop(next(iter(self._bundles)))
+                self._evictions += 1
+            return True
+
+    def get(self, key: BundleKey) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._bundles.get(key)
+            if entry is not None and entry[0] > now:
+                self._bundles.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(_redis_key(key))
+            except Exception as e:
+                logger.warning(f"Bundle cache Redis read failed: {e}")
+                raw = None
+            if raw:
+                try:
+                    payload = json.loads(raw)
+                    self._store(key, payload['bundle'], frozenset(payload.get('materials') or ()))
+                    with self._lock:
+                        self._redis_hits += 1
+                    return payload['bundle']
+                except Exception:
+                    pass
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: BundleKey, bundle: Dict[str, Any], materials: Iterable[str] = (), generation: Optional[int] = None) -> None:
+        """
+        Cache ``bundle``; ``materials`` are the identifiers it resolved (material_id / ad_id / file name).
+
+        ``generation`` is :attr:`generation` read before compiling; the bundle is
+        dropped if an invalidation happened in between.
+        """
+        materials = frozenset(m for m in materials if isinstance(m, str) and m)
+        if not self._store(key, bundle, materials, generation):
+            return
+        if self.redis is not None:
+            try:
+                self.redis.set(
+                    _redis_key(key),
+                    json.dumps({'bundle': bundle, 'materials': sorted(materials)}, ensure_ascii=False, default=str),
+                    ex=self.redis_ttl_sec,
+                )
+            except Exception as e:
+                logger.warning(f"Bundle cache Redis write failed: {e}")
+
+    # -- invalidation ----------------------------------------------------------
+
+    def _apply_invalidation(self, kind: str, value: Optional[Iterable[str]]) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self.generation += 1
+            if kind == 'campaign':
+                # 目标设备可能随发布 / 回滚变化，设备映射整体清空。
+                self._devices.clear()
+                for campaign_id in value or ():
+                    for key in list(self._by_campaign.get(campaign_id, ())):
+                        self._drop(key)
+            elif kind == 'material':
+                if value is None:
+                    for key in list(self._bundles):
+                        self._drop(key)
+                    return
+                for ident in value:
+                    for key in list(self._by_material.get(ident, ())):
+                        self._drop(key)
+            else:
+                self._bundles.clear()
+                self._by_campaign.clear()
+                self._by_material.clear()
+                self._devices.clear()
+
+    def _publish_invalidation(self, kind: str, value: Optional[Iterable[str]], patterns: Iterable[str]) -> None:
+        if self.redis is None:
+            return
+        try:
+            for pattern in patterns:
+                batch = []
+                for k in self.redis.scan_iter(match=pattern, count=500):
+                    batch.append(k)
+                    if len(batch) >= 500:
+                        self.redis.delete(*batch)
+                        batch = []
+                if batch:
+                    self.redis.delete(*batch)
+            self.redis.publish(REDIS_CHANNEL, json.dumps({'kind': kind, 'value': value}))
+        except Exception as e:
+            logger.warning(f"Bundle cache Redis invalidation failed: {e}")
+
+    def invalidate_campaign(self, campaign_id: str) -> None:
+        """Publish / rollback / delete / strategy update of one campaign."""
+        self._apply_invalidation('campaign', [campaign_id])
+        self._publish_invalidation('campaign', [campaign_id], [f"{REDIS_KEY_PREFIX}{campaign_id}:*"])
+
+    def invalidate_materials(self, identifiers: Optional[Iterable[str]] = None) -> None:
+        """Material upload / status change / delete; None drops every bundle."""
+        value = None if identifiers is None else sorted({i for i in identifiers if isinstance(i, str) and i})
+        self._apply_invalidation('material', value)
+        # Redis 中的 bundle 不维护素材反向索引，素材变化时整体清除（低频操作）。
+        self._publish_invalidation('material', value, [f"{REDIS_KEY_PREFIX}*"])
+
+    def clear(self) -> None:
+        self._apply_invalidation('all', None)
+
+    def handle_remote_invalidation(self, message: Any) -> None:
+        """Apply an invalidation published by another process."""
+        try:
+            payload = json.loads(message)
+            self._apply_invalidation(payload.get('kind') or 'all', payload.get('value'))
+        except Exception:
+            self._apply_invalidation('all', None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': len(self._bundles),
+                'devices': len(self._devices),
+                'max_size': self.max_size,
+                'ttl_sec': self.ttl_sec,
+                'redis': self.redis is not None,
+                'hits': self._hits,
+                'redis_hits': self._redis_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
+
+
+def _start_invalidation_listener(cache: BundleCache) -> None:
+    def _listen():
+        while True:
+            try:
+                pubsub = cache.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REDIS_CHANNEL)
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        cache.handle_remote_invalidation(message.get('data'))
+            except Exception as e:
+                logger.warning(f"Bundle cache invalidation listener error: {e}; resubscribing")
+                # 断线期间可能漏掉消息，清空本地条目。
+                cache.clear()
+                time.sleep(5)
+
+    threading.Thread(target=_listen, daemon=True, name="BundleCacheInvalidation").start()
+
+
+_BUNDLE_CACHE: Optional[BundleCache] = None
+_BUNDLE_CACHE_LOCK = threading.Lock()
+
+
+def get_bundle_cache() -> BundleCache:
+    """Process-wide bundle cache used by the gateway, campaign and material endpoints."""
+    global _BUNDLE_CACHE
+    if _BUNDLE_CACHE is None:
+        with _BUNDLE_CACHE_LOCK:
+            if _BUNDLE_CACHE is None:
+                redis_client = None
+                if settings.bundle_cache_redis:
+                    import redis
+
+                    redis_client = redis.Redis(
+                        host=settings.redis_host,
+                        port=settings.redis_port,
+                        db=settings.redis_db,
+                        password=settings.redis_password,
+                        decode_responses=True,
+                    )
+                _BUNDLE_CACHE = BundleCache(
+                    max_size=settings.bundle_cache_max_size,
+                    ttl_sec=settings.bundle_cache_ttl_sec,
+                    redis_client=redis_client,
+                )
+                if redis_client is not None:
+                    _start_invalidation_listener(_BUNDLE_CACHE)
+    return _BUNDLE_CACHE
@@ -0,0 +1,121 @@
+"""
+In-memory reverse index: device_id -> latest published campaign.
+
+网关按设备解析“当前已发布活动”时，内存兜底模式原来要线性扫描全部活动
+并逐个规范化目标设备列表。这里维护一个反向索引，由活动的发布 / 回滚 /
+删除 / 策略更新驱动增量更新，按设备查询是一次字典查找。
+
+数据库侧对应 ``campaign_device_bindings`` 表（见 db_service），两者的
+“最新”语义一致：同一设备被多个已发布活动覆盖时，取 updated_at 最新者
+（再按 created_at、campaign_id 排序）。
+
+目标里的设备组选择器（``group:`` / ``city:`` / ``building:`` / ``tag:``，见
+device_groups）按原样作为键索引，查询时由调用方提供设备所属的组键。
+"""
+
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.services.device_groups import parse_selector
+
+SortKey = Tuple[str, str, str]
+
+
+def campaign_sort_key(campaign: Dict[str, Any]) -> SortKey:
+    return (
+        str(campaign.get("updated_at") or ""),
+        str(campaign.get("created_at") or ""),
+        str(campaign.get("campaign_id") or ""),
+    )
+
+
+class CampaignDeviceIndex:
+    """Thread-safe device_id -> latest published campaign_id index."""
+
+    def __init__(self):
+        self._by_campaign: Dict[str, Tuple[SortKey, frozenset]] = {}
+        self._by_device: Dict[str, Dict[str, SortKey]] = {}
+        self._latest: Dict[str, str] = {}
+        self._groups: set = set()
+        self._lock = threading.Lock()
+
+    def _recompute(self, device_id: str) -> None:
+        # 调用方持有 _lock；一个设备通常只被少数几个活动覆盖。
+        bound = self._by_device.get(device_id)
+        if not bound:
+            self._by_device.pop(device_id, None)
+            self._latest.pop(device_id, None)
+            self._groups.discard(device_id)
+            return
+        self._latest[device_id] = max(bound.items(), key=lambda kv: kv[1])[0]
+        if parse_selector(device_id) is not None:
+            self._groups.add(device_id)
+
+    def _remove(self, campaign_id: str) -> set:
+        previous = self._by_campaign.pop(campaign_id, None)
+        if previous is None:
+            return set()
+        for device_id in previous[1]:
+            bound = self._by_device.get(device_id)
+            if bound is not None:
+                bound.pop(campaign_id, None)
+        return set(previous[1])
+
+    def bind(self, campaign: Dict[str, Any], device_ids: Iterable[str]) -> None:
+        """Index ``campaign`` for ``device_ids`` if it is published; otherwise drop it."""
+        campaign_id = campaign.get("campaign_id")
+        if not campaign_id:
+            return
+        with self._lock:
+            touched = self._remove(campaign_id)
+            if campaign.get("status") == "published":
+                key = campaign_sort_key(campaign)
+                devices = frozenset(d for d in device_ids if isinstance(d, str) and d)
+                self._by_campaign[campaign_id] = (key, devices)
+                for device_id in devices:
+                    self._by_device.setdefault(device_id, {})[campaign_id] = key
+                touched |= devices
+            for device_id in touched:
+                self._recompute(device_id)
+
+    def unbind(self, campaign_id: str) -> None:
+        with self._lock:
+            for device_id in self._remove(campaign_id):
+                self._recompute(device_id)
+
+    def latest(self, device_id: str, group_keys: Iterable[str] = ()) -> Optional[str]:
+        """Latest campaign bound to ``device_id`` directly or to one of its ``group_keys``."""
+        group_keys = list(group_keys)
+        if not group_keys:
+            return self._latest.get(device_id)
+        best = None
+        with self._lock:
+            for target in [device_id] + group_keys:
+                campaign_id = self._latest.get(target)
+                entry = self._by_campaign.get(campaign_id) if campaign_id else None
+                if entry is not None and (best is None or entry[0] > best[0]):
+                    best = (entry[0], campaign_id)
+        return best[1] if best else None
+
+    def group_targets(self) -> List[str]:
+        """Group selectors currently bound by at least one published campaign."""
+        with self._lock:
+            return sorted(self._groups)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_campaign.clear()
+            self._by_device.clear()
+            self._latest.clear()
+            self._groups.clear()
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+
+_INDEX = CampaignDeviceIndex()
+
+
+def get_campaign_device_index() -> CampaignDeviceIndex:
+    """Process-wide index kept in sync with the in-memory campaign store."""
+    return _INDEX
@@ -0,0 +1,224 @@
+"""
+Bulk command fan-out jobs.
+
+``POST /commands`` 一次只能给一台设备下发命令；整栋楼重启 / 调音量要从前端
+串行调几百次接口，每次再同步 ``requests.post`` 到网关。这里把一次批量下发
+做成一个作业：
+
+- 目标可以是设备列表，也可以是设备组选择器（group:/city:/building:/tag:，
+  见 device_groups），去重后展开成设备集合；
+- 先用一条多行 INSERT 把所有设备的 command_log 以 pending 写入（设备回调
+  按 cmd_id 更新时记录已存在），结束后再用一条 ``UPDATE ... FROM (VALUES ...)``
+  回写 sent / failed，已被回调推进的记录不覆盖；
+- 通过共享的异步网关客户端（连接池）下发，``asyncio.Semaphore`` 限制并发，
+  网络错误 / 网关 5xx 按指数退避（带抖动）重试，设备离线（404）等 4xx 不重试；
+- 作业进度保存在内存里，``GET /commands/jobs/{job_id}`` 轮询，只保留最近
+  ``max_jobs`` 个作业；作业最终状态为 done / cancelled（关闭时被取消）/ failed。
+"""
+
+import asyncio
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services import db_service
+from app.services.gateway_client import get_gateway_client
+
+# 前端动作名 -> 网关 / 设备端命令名；其余动作直接转大写。
+_COMMAND_NAMES = {"reboot": "REBOOT"}
+
+
+def gateway_command_name(action: str) -> str:
+    return _COMMAND_NAMES.get(action, action.upper())
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, OSError))
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        text = (error.response.text or "").strip()
+        return f"gateway {error.response.status_code}: {text}" if text else f"gateway {error.response.status_code}"
+    return str(error) or type(error).__name__
+
+
+class CommandJob:
+    """Progress of one bulk command; mutated only on the event loop running it."""
+
+    def __init__(self, action: str, params: Any, device_ids: List[str], targets: List[str]):
+        self.job_id = uuid.uuid4().hex
+        self.action = action
+        self.params = params
+        self.targets = targets
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.persisted = False
+        send_ts = int(self.created_at)
+        # device_id -> command_log 记录（与单条下发的记录字段一致）
+        self.records: Dict[str, Dict[str, Any]] = {
+            device_id: {
+                "cmd_id": str(uuid.uuid4()),
+                "device_id": device_id,
+                "action": action,
+                "params": params,
+                "status": "pending",
+                "result": None,
+                "send_ts": send_ts,
+                "attempts": 0,
+            }
+            for device_id in device_ids
+        }
+
+    def summary(self, include_results: bool = False) -> Dict[str, Any]:
+        counts = {"pending": 0, "sent": 0, "failed": 0}
+        for record in self.records.values():
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        body: Dict[str, Any] = {
+            "job_id": self.job_id,
+            "action": self.action,
+            "status": self.status,
+            "targets": self.targets,
+            "total": len(self.records),
+            "done": counts["sent"] + counts["failed"],
+            **counts,
+            "persisted": self.persisted,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "failures": [
+                {"device_id": r["device_id"], "cmd_id": r["cmd_id"], "error": r["result"]}
+                for r in self.records.values()
+                if r["status"] == "failed"
+            ],
+        }
+        if include_results:
+            body["results"] = [
+                {k: r[k] for k in ("device_id", "cmd_id", "status", "result", "attempts")}
+                for r in self.records.values()
+            ]
+        return body
+
+
+def _log_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in record.items() if k != "attempts"}
+
+
+class CommandJobRunner:
+    """Runs bulk jobs with bounded concurrency and keeps recent jobs for polling."""
+
+    def __init__(
+        self,
+        concurrency: int = 32,
+        max_retries: int = 2,
+        backoff_sec: float = 0.5,
+        max_backoff_sec: float = 8.0,
+        max_jobs: int = 200,
+        sender=None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.max_jobs = max_jobs
+        self.sender = sender
+        self._jobs: "OrderedDict[str, CommandJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, action: str, params: Any, device_ids: List[str], targets: List[str]) -> CommandJob:
+        job = CommandJob(action, params, device_ids, targets)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[CommandJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._jobs.clear()
+
+    async def _send_one(self, job: CommandJob, record: Dict[str, Any], limiter: asyncio.Semaphore) -> None:
+        send = self.sender or get_gateway_client().asend_command
+        command = gateway_command_name(job.action)
+        for attempt in range(self.max_retries + 1):
+            record["attempts"] = attempt + 1
+            async with limiter:
+                try:
+                    await send(record["device_id"], command, job.params, record["cmd_id"])
+                    record["status"] = "sent"
+                    record["result"] = f"{job.action}_sent"
+                    return
+                except Exception as e:
+                    if attempt >= self.max_retries or not _retryable(e):
+                        record["status"] = "failed"
+                        record["result"] = _describe(e)
+                        return
+            # 退避期间不占并发名额
+            delay = min(self.max_backoff_sec, self.backoff_sec * (2 ** attempt))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def run(self, job: CommandJob, fallback_log: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Insert pending logs, fan out, then write back final statuses in one statement."""
+        job.status = "running"
+        records = list(job.records.values())
+        try:
+            try:
+                await run_in_threadpool(db_service.insert_commands_batch, [_log_row(r) for r in records])
+                job.persisted = True
+            except Exception as e:
+                print(f"[commands.bulk] insert_commands_batch failed, fallback to mock: {e}")
+
+            limiter = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._send_one(job, r, limiter) for r in records))
+
+            if job.persisted:
+                try:
+                    await run_in_threadpool(
+                        db_service.update_command_statuses_batch,
+                        [(r["cmd_id"], r["status"], r["result"]) for r in records],
+                    )
+                except Exception as e:
+                    print(f"[commands.bulk] update_command_statuses_batch failed (ignored): {e}")
+            elif fallback_log is not None:
+                fallback_log.extend(_log_row(r) for r in records)
+            job.status = "done"
+        except asyncio.CancelledError:
+            # 进程退出时任务被取消：作业不能一直停在 running。
+            job.status = "cancelled"
+            raise
+        finally:
+            if job.status == "running":
+                job.status = "failed"
+            job.finished_at = time.time()
+
+
+_RUNNER: Optional[CommandJobRunner] = None
+_RUNNER_LOCK = threading.Lock()
+
+
+def get_command_job_runner() -> CommandJobRunner:
+    """Process-wide bulk command runner configured from settings."""
+    global _RUNNER
+    if _RUNNER is None:
+        with _RUNNER_LOCK:
+            if _RUNNER is None:
+                _RUNNER = CommandJobRunner(
+                    concurrency=settings.command_bulk_concurrency,
+                    max_retries=settings.command_bulk_max_retries,
+                    backoff_sec=settings.command_bulk_backoff_sec,
+                    max_jobs=settings.command_job_history,
+                )
+    return _RUNNER
@@ -1,57 +1,37 @@
-import os
+import base64
 import json
 import logging
-import psycopg2
-from psycopg2.extras import RealDictCursor, Json
+from collections import Counter
+from datetime import datetime
+from psycopg2.extras import RealDictCursor, Json, execute_values
+
+from app.db import session
+from app.services.playlog_codec import PlayLogRecord, parse_timestamp
 
 
 def get_conn():
-    # 统一在这里解析 .env 并建立数据库连接，避免各模块各自维护
-    # Postgres 连接参数，降低本地开发和联调时的环境成本。
-    # Try to load .env in control-plane directory if present (simple parser)
-    try:
-        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        env_path = os.path.join(base_dir, '.env')
-        if os.path.exists(env_path):
-            with open(env_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#') or '=' not in line:
-                        continue
-                    k, v = line.split('=', 1)
-                    k = k.strip(); v = v.strip().strip('"').strip("'")
-                    if k not in os.environ:
-                        os.environ[k] = v
-    except Exception:
-        logging.exception('failed to load .env')
-
-    # DSN from env or build from parts
-    dsn = os.getenv('PG_DSN')
-    if not dsn:
-        host = os.getenv('PG_HOST', 'localhost')
-        port = os.getenv('PG_PORT', '5432')
-        user = os.getenv('PG_USER', 'postgres')
-        password = os.getenv('PG_PASSWORD', '538890')
-        db = os.getenv('PG_DB', 'elevator_ad')
-        dsn = f"host={host} port={port} user={user} password={password} dbname={db}"
-    try:
-        conn = psycopg2.connect(dsn)
-        try:
-            # ensure client uses UTF8; helps psycopg2 decode text columns correctly
-            conn.set_client_encoding('UTF8')
-        except Exception:
-            pass
-        return conn
-    except Exception:
-        logging.exception('failed to connect to Postgres with dsn: %s', dsn)
-        raise
+    """
+    Open a dedicated (unpooled) Postgres connection; the caller must close it.
+
+    业务查询统一走 ``connection()`` 连接池；这里仅保留给需要独占连接的
+    脚本或长事务使用。
+    """
+    return session.connect()
+
+
+def connection(timeout=None):
+    """Context manager that checks out a pooled connection (see app.db.session)."""
+    return session.connection(timeout=timeout)
+
+
+def pool_stats():
+    return session.pool_stats()
 
 
 def list_devices(limit=100, offset=0, q=None):
     # devices 表承担设备管理主视图的持久化查询职责；这里尽量补齐
     # 默认字段，减轻接口层和前端的兼容负担。
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         # 使用 SELECT * 避免因数据库列不一致导致查询失败
         sql = "SELECT * FROM devices"
@@ -107,14 +87,11 @@ def list_devices(limit=100, offset=0, q=None):
             if 'status' not in r:
                 r['status'] = 'unknown'
         return rows
-    finally:
-        conn.close()
 
 
 def count_devices(q=None):
     # 与 list_devices 配套的分页总数查询，过滤条件保持一致。
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         sql = "SELECT COUNT(1) FROM devices"
         params = []
@@ -124,16 +101,13 @@ def count_devices(q=None):
             params.extend([like, like])
         cur.execute(sql, params)
         return cur.fetchone()[0]
-    finally:
-        conn.close()
 
 
 def count_devices_status():
     """
     返回按 status 分组的设备计数，返回 dict，例如: {'online': 10, 'offline': 5}
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         sql = "SELECT status, COUNT(1) FROM devices GROUP BY status"
         cur.execute(sql)
@@ -143,23 +117,51 @@ def count_devices_status():
             key = status if status is not None else 'unknown'
             result[key] = int(cnt)
         return result
-    finally:
-        conn.close()
 
 
 def list_materials(limit=100, offset=0):
     # materials 表是素材管理的持久化查询面；接口层会再映射成统一
     # 的 MaterialMeta 响应结构。
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         sql = "SELECT * FROM materials ORDER BY material_id LIMIT %s OFFSET %s"
         params = [limit, offset]
         cur.execute(sql, params)
         rows = cur.fetchall()
         return rows
-    finally:
-        conn.close()
+
+
+def list_all_materials():
+    """Every materials row, ordered by material_id (catalog warm-up)."""
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT * FROM materials ORDER BY material_id")
+        return cur.fetchall()
+
+
+def list_material_ids() -> list:
+    """All material_id values (id generation only needs the ids, not whole rows)."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT material_id FROM materials")
+        return [r[0] for r in cur.fetchall()]
+
+
+def get_materials_by_identifiers(identifiers: list) -> list:
+    """
+    Materials matching any identifier by material_id, ad_id or file_name, in one query.
+    """
+    if not identifiers:
+        return []
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        sql = """
+            SELECT * FROM materials
+            WHERE material_id = ANY(%s) OR ad_id = ANY(%s) OR file_name = ANY(%s)
+            ORDER BY material_id
+        """
+        cur.execute(sql, [identifiers, identifiers, identifiers])
+        return cur.fetchall()
 
 
 def insert_material(meta: dict):
@@ -169,8 +171,7 @@ def insert_material(meta: dict):
     这里采用“按现有列做兼容插入 + upsert”的策略，原因是联调阶段表结构
     可能还在演进，接口层不应该因为某个非核心字段缺失就整体失败。
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         # 动态探测表列，尽量兼容当前数据库里已有的表结构。
         cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'materials'")
@@ -214,21 +215,16 @@ def insert_material(meta: dict):
 
         cur.execute(sql, values)
         conn.commit()
-    finally:
-        conn.close()
 
 
 def get_material(material_id: str):
     # 素材详情读取。上层会决定优先采用 DB 结果还是本地索引兜底。
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         sql = "SELECT * FROM materials WHERE material_id = %s"
         cur.execute(sql, [material_id])
         row = cur.fetchone()
         return row
-    finally:
-        conn.close()
 
 
 def list_commands(limit=100, offset=0, q=None, device_id=None, action=None, from_ts=None, to_ts=None):
@@ -238,8 +234,7 @@ def list_commands(limit=100, offset=0, q=None, device_id=None, action=None, from
     将可能为毫秒的 `send_ts` 转换为秒以兼容前端。
     返回: list[dict]
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         sql = "SELECT * FROM command_logs"
         params = []
@@ -302,14 +297,11 @@ def list_commands(limit=100, offset=0, q=None, device_id=None, action=None, from
                 r['send_ts'] = r.get('send_ts')
 
         return rows
-    finally:
-        conn.close()
 
 
 def count_commands(q=None, device_id=None, action=None, from_ts=None, to_ts=None):
     """Return total count of records in command_logs matching optional filters."""
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         sql = "SELECT COUNT(1) FROM command_logs"
         params = []
@@ -337,44 +329,97 @@ def count_commands(q=None, device_id=None, action=None, from_ts=None, to_ts=None
             sql += " WHERE " + " AND ".join(where)
         cur.execute(sql, params)
         return int(cur.fetchone()[0])
-    finally:
-        conn.close()
 
 
-def list_ad_logs(limit=100, offset=0, device_id=None, ad_file_name=None, from_ts=None, to_ts=None, q=None):
+def _ad_log_filters(device_id=None, ad_file_name=None, from_ts=None, to_ts=None, q=None) -> tuple:
+    # list_ad_logs / count_ad_logs 共用的过滤条件。
+    # device_id 等值、ad_file_name / q 子串匹配分别由 (device_id, start_time)
+    # 复合索引和 pg_trgm GIN 索引支撑（见 db/ad_logs_indexes.sql）。
+    params = []
+    where = []
+    if device_id:
+        where.append("ad_logs.device_id = %s")
+        params.append(device_id)
+    if ad_file_name:
+        where.append("ad_logs.ad_file_name ILIKE %s")
+        params.append(f"%{ad_file_name}%")
+    if from_ts is not None and to_ts is not None:
+        where.append("(ad_logs.start_time BETWEEN %s AND %s)")
+        params.extend([from_ts, to_ts])
+    elif from_ts is not None:
+        where.append("(ad_logs.start_time >= %s)")
+        params.append(from_ts)
+    elif to_ts is not None:
+        where.append("(ad_logs.start_time <= %s)")
+        params.append(to_ts)
+    if q:
+        where.append("(ad_logs.log_id ILIKE %s OR ad_logs.device_id ILIKE %s OR ad_logs.ad_file_name ILIKE %s)")
+        like = f"%{q}%"
+        params.extend([like, like, like])
+    return where, params
+
+
+def encode_ad_log_cursor(row) -> str:
+    """Opaque keyset cursor pointing just past ``row`` in list_ad_logs order."""
+    start_time = row.get('start_time')
+    payload = {
+        't': start_time.isoformat() if isinstance(start_time, datetime) else start_time,
+        'id': row.get('log_id'),
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_ad_log_cursor(cursor: str) -> tuple:
+    """Return ``(start_time or None, log_id)``; raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        start_time = datetime.fromisoformat(payload['t']) if payload.get('t') else None
+        log_id = payload['id']
+        if not isinstance(log_id, str):
+            raise TypeError('log_id')
+        return start_time, log_id
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def list_ad_logs(limit=100, offset=0, device_id=None, ad_file_name=None, from_ts=None, to_ts=None, q=None, cursor=None):
     """
     列出 ad_logs 表内容，支持按 device_id、ad_file_name、时间范围和通用查询过滤。
+
+    排序固定为 start_time DESC NULLS LAST, log_id DESC（全序）。传入 ``cursor``
+    （encode_ad_log_cursor 生成）时走 keyset 分页并忽略 offset，深翻页不再扫描
+    并丢弃前面的行。
     返回 list[dict]
     """
-    conn = get_conn()
-    try:
+    if cursor:
+        after_time, after_id = decode_ad_log_cursor(cursor)
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        # 左连接 materials 表以获取素材记录中的 duration_sec（单位：秒）
-        sql = "SELECT ad_logs.*, m.duration_sec AS material_duration_sec, m.advertiser AS advertiser FROM ad_logs LEFT JOIN materials m ON m.file_name = ad_logs.ad_file_name"
-        params = []
-        where = []
-        if device_id:
-            where.append("device_id = %s")
-            params.append(device_id)
-        if ad_file_name:
-            where.append("ad_file_name ILIKE %s")
-            params.append(f"%{ad_file_name}%")
-        if from_ts is not None and to_ts is not None:
-            where.append("(start_time BETWEEN %s AND %s)")
-            params.extend([from_ts, to_ts])
-        elif from_ts is not None:
-            where.append("(start_time >= %s)")
-            params.append(from_ts)
-        elif to_ts is not None:
-            where.append("(start_time <= %s)")
-            params.append(to_ts)
-        if q:
-            where.append("(log_id ILIKE %s OR device_id ILIKE %s OR ad_file_name ILIKE %s)")
-            like = f"%{q}%"
-            params.extend([like, like, like])
+        # 按 file_name 取一条素材记录的 duration_sec（单位：秒）和广告主；LATERAL + LIMIT 1
+        # 保证同名素材不会把一条日志放大成多行（keyset 分页依赖行唯一）。
+        sql = (
+            "SELECT ad_logs.*, m.duration_sec AS material_duration_sec, m.advertiser AS advertiser FROM ad_logs "
+            "LEFT JOIN LATERAL (SELECT duration_sec, advertiser FROM materials "
+            "WHERE materials.file_name = ad_logs.ad_file_name LIMIT 1) m ON true"
+        )
+        where, params = _ad_log_filters(device_id, ad_file_name, from_ts, to_ts, q)
+        if cursor:
+            if after_time is not None:
+                # 冗余的 start_time <= %s 让分区表在规划阶段裁剪掉更新的分区（行比较本身不参与裁剪）。
+                where.append(
+                    "((ad_logs.start_time <= %s AND (ad_logs.start_time, ad_logs.log_id) < (%s, %s))"
+                    " OR ad_logs.start_time IS NULL)"
+                )
+                params.extend([after_time, after_time, after_id])
+            else:
+                where.append("(ad_logs.start_time IS NULL AND ad_logs.log_id < %s)")
+                params.append(after_id)
+            offset = 0
         if where:
             sql += " WHERE " + " AND ".join(where)
-        sql += " ORDER BY start_time DESC NULLS LAST, created_at DESC NULLS LAST LIMIT %s OFFSET %s"
+        sql += " ORDER BY ad_logs.start_time DESC NULLS LAST, ad_logs.log_id DESC LIMIT %s OFFSET %s"
         params.extend([limit, offset])
         try:
             cur.execute(sql, params)
@@ -440,48 +485,42 @@ def list_ad_logs(limit=100, offset=0, device_id=None, ad_file_name=None, from_ts
                 r['play_result'] = 'unknown'
 
         return rows
-    finally:
-        conn.close()
 
 
-def count_ad_logs(device_id=None, ad_file_name=None, from_ts=None, to_ts=None, q=None):
-    # ad_logs 列表页 / 统计页对应的总数查询。
-    conn = get_conn()
-    try:
+def count_ad_logs(device_id=None, ad_file_name=None, from_ts=None, to_ts=None, q=None, estimate=False):
+    """
+    ad_logs 列表页 / 统计页对应的总数查询。
+
+    ``estimate=True`` 时不做 COUNT(1)：无过滤条件读 pg_class.reltuples，
+    有过滤条件读查询计划的行数估计，代价与表大小无关。
+    """
+    with connection() as conn:
         cur = conn.cursor()
-        sql = "SELECT COUNT(1) FROM ad_logs"
-        params = []
-        where = []
-        if device_id:
-            where.append("device_id = %s")
-            params.append(device_id)
-        if ad_file_name:
-            where.append("ad_file_name ILIKE %s")
-            params.append(f"%{ad_file_name}%")
-        if from_ts is not None and to_ts is not None:
-            where.append("(start_time BETWEEN %s AND %s)")
-            params.extend([from_ts, to_ts])
-        elif from_ts is not None:
-            where.append("(start_time >= %s)")
-            params.append(from_ts)
-        elif to_ts is not None:
-            where.append("(start_time <= %s)")
-            params.append(to_ts)
-        if q:
-            where.append("(log_id ILIKE %s OR device_id ILIKE %s OR ad_file_name ILIKE %s)")
-            like = f"%{q}%"
-            params.extend([like, like, like])
-        if where:
-            sql += " WHERE " + " AND ".join(where)
-        cur.execute(sql, params)
+        where, params = _ad_log_filters(device_id, ad_file_name, from_ts, to_ts, q)
+        where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+        if estimate:
+            if not where:
+                # 分区表的父表 reltuples 为 0，汇总所有子分区。
+                cur.execute(
+                    """
+                    SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint
+                    FROM pg_class c
+                    WHERE c.oid = 'ad_logs'::regclass
+                       OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'ad_logs'::regclass)
+                    """
+                )
+                return int(cur.fetchone()[0])
+            cur.execute("EXPLAIN (FORMAT JSON) SELECT 1 FROM ad_logs" + where_sql, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        cur.execute("SELECT COUNT(1) FROM ad_logs" + where_sql, params)
         return int(cur.fetchone()[0])
-    finally:
-        conn.close()
 
 
 def get_ad_log(log_id: str):
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         # 左连接 materials 以获取素材 duration_sec
         sql = "SELECT ad_logs.*, m.duration_sec AS material_duration_sec FROM ad_logs LEFT JOIN materials m ON m.file_name = ad_logs.ad_file_name WHERE ad_logs.log_id = %s"
@@ -524,13 +563,10 @@ def get_ad_log(log_id: str):
             row['play_result'] = 'unknown'
 
         return row
-    finally:
-        conn.close()
 
 
 def list_campaigns(limit=100, offset=0):
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         ensure_campaign_tables(cur)
         sql = "SELECT * FROM campaigns ORDER BY campaign_id LIMIT %s OFFSET %s"
@@ -538,52 +574,55 @@ def list_campaigns(limit=100, offset=0):
         cur.execute(sql, params)
         rows = cur.fetchall()
         return rows
-    finally:
-        conn.close()
 
 
 def get_campaign(campaign_id: str):
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         ensure_campaign_tables(cur)
         sql = "SELECT * FROM campaigns WHERE campaign_id = %s"
         cur.execute(sql, [campaign_id])
         row = cur.fetchone()
         return row
-    finally:
-        conn.close()
 
 
 def get_latest_published_campaign_for_device(device_id: str):
     """
     Return the latest published campaign targeting the given device.
 
-    The current implementation derives device-level strategy from campaign
-    rows directly. A dedicated device-campaign binding table can replace this
-    lookup later without changing the API contract.
+    通过 campaign_device_bindings 按 device_id 主键前缀索引查找，不再对全部
+    已发布活动做 JSONB 包含扫描；绑定表由发布 / 回滚 / 删除同步维护。
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         ensure_campaign_tables(cur)
+        # 活动也可以按设备组（group:/city:/building:/tag:）绑定，绑定表里存的是
+        # 选择器本身；这里把设备自己的属性换算成所属组的键一起匹配。
+        targets = [device_id]
+        cur.execute("SELECT * FROM devices WHERE device_id = %s", [device_id])
+        device = cur.fetchone()
+        if device:
+            from app.services.device_groups import device_group_keys
+
+            for keys in device_group_keys(device).values():
+                targets.extend(keys)
         sql = """
-            SELECT *
-            FROM campaigns
-            WHERE status = 'published'
-              AND COALESCE(target_device_groups, '[]'::jsonb) @> %s::jsonb
-            ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST
+            SELECT c.*
+            FROM campaign_device_bindings b
+            JOIN campaigns c ON c.campaign_id = b.campaign_id
+            WHERE b.device_id = ANY(%s)
+              AND c.status = 'published'
+            ORDER BY c.updated_at DESC NULLS LAST, c.created_at DESC NULLS LAST, c.campaign_id DESC
             LIMIT 1
         """
-        cur.execute(sql, [json.dumps([device_id])])
-        return cur.fetchone()
-    finally:
-        conn.close()
+        cur.execute(sql, [targets])
+        row = cur.fetchone()
+        conn.commit()
+        return row
 
 
 def delete_campaign(campaign_id: str) -> int:
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         ensure_campaign_tables(cur)
 
@@ -600,33 +639,30 @@ def delete_campaign(campaign_id: str) -> int:
         if cur.fetchone()[0]:
             cur.execute("DELETE FROM campaign_retry_batches WHERE campaign_id = %s", [campaign_id])
 
+        cur.execute("DELETE FROM campaign_device_bindings WHERE campaign_id = %s", [campaign_id])
         cur.execute("DELETE FROM campaigns WHERE campaign_id = %s", [campaign_id])
         deleted = cur.rowcount
         conn.commit()
         return deleted
-    finally:
-        conn.close()
 
 
 def update_campaign_status(campaign_id: str, status: str):
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         ensure_campaign_tables(cur)
         sql = "UPDATE campaigns SET status = %s, updated_at = now() WHERE campaign_id = %s"
         cur.execute(sql, [status, campaign_id])
+        updated = cur.rowcount
+        sync_campaign_device_bindings(cur, campaign_id)
         conn.commit()
-        return cur.rowcount
-    finally:
-        conn.close()
+        return updated
 
 def insert_campaign(meta: dict):
     """
     Insert or update a campaign record into Postgres campaigns table.
     Compatible with partial schemas by introspecting existing columns.
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         ensure_campaign_tables(cur)
         cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'campaigns'")
@@ -662,9 +698,9 @@ def insert_campaign(meta: dict):
             sql = f"INSERT INTO campaigns ({col_list}) VALUES ({placeholders}) ON CONFLICT (campaign_id) DO NOTHING"
 
         cur.execute(sql, values)
+        # 回滚 / 策略更新会经由这里改变状态或目标设备，绑定随之同步。
+        sync_campaign_device_bindings(cur, meta.get('campaign_id'))
         conn.commit()
-    finally:
-        conn.close()
 
 
 def insert_device(**meta):
@@ -677,8 +713,7 @@ def insert_device(**meta):
     if 'device_id' not in meta:
         raise RuntimeError('device_id is required to insert_device')
 
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         # 动态探测列结构，尽量兼容当前数据库中的 devices 表定义。
         cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'devices'")
@@ -715,8 +750,6 @@ def insert_device(**meta):
 
         cur.execute(sql, values)
         conn.commit()
-    finally:
-        conn.close()
 
 
 def insert_command(meta: dict):
@@ -726,8 +759,7 @@ def insert_command(meta: dict):
     command_logs 是设备控制链路的审计表：谁给哪台设备发了什么命令、
     何时发、当前状态如何、回调结果是什么，都在这里追踪。
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         # 同样按实际表结构探测列，避免联调阶段因为列演进导致命令链路不可用。
         cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'command_logs'")
@@ -789,8 +821,78 @@ def insert_command(meta: dict):
                     return None
             # otherwise re-raise
             raise
-    finally:
-        conn.close()
+
+
+def _command_log_columns(cur) -> dict:
+    cur.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'command_logs'")
+    cols = {r[0]: r[1] for r in cur.fetchall()}
+    if not cols:
+        raise RuntimeError('command_logs table not found or has no columns')
+    return cols
+
+
+def insert_commands_batch(rows: list) -> int:
+    """
+    批量下发时一次写入多条 command_logs（一条多行 INSERT）。
+
+    列同样按实际表结构探测；rows 里的字段与 insert_command 的 meta 一致。
+    """
+    if not rows:
+        return 0
+    with connection() as conn:
+        cur = conn.cursor()
+        cols = _command_log_columns(cur)
+        use_cols = [c for c in ('cmd_id', 'device_id', 'action', 'params', 'status', 'result', 'send_ts') if c in cols]
+        if not use_cols:
+            raise RuntimeError('no compatible columns to insert into command_logs')
+        values = [
+            tuple(
+                (Json(r.get(c)) if r.get(c) is not None else None) if c in ('params', 'result') else r.get(c)
+                for c in use_cols
+            )
+            for r in rows
+        ]
+        include_created_now = 'created_at' in cols
+        col_list = ','.join(use_cols + (['created_at'] if include_created_now else []))
+        template = '(' + ','.join(['%s'] * len(use_cols) + (['NOW()'] if include_created_now else [])) + ')'
+        execute_values(cur, f"INSERT INTO command_logs ({col_list}) VALUES %s", values, template=template, page_size=len(values))
+        conn.commit()
+        return len(values)
+
+
+def update_command_statuses_batch(updates: list) -> int:
+    """
+    批量回写 [(cmd_id, status, result), ...]，一条 UPDATE ... FROM (VALUES ...)。
+
+    只更新仍是 pending 的记录：设备回调可能已经先把状态推进到 success/failed。
+    """
+    if not updates:
+        return 0
+    with connection() as conn:
+        cur = conn.cursor()
+        cols = _command_log_columns(cur)
+        if 'cmd_id' not in cols or 'status' not in cols:
+            return 0
+        sets = ['status = v.status']
+        if 'result' in cols:
+            result_type = 'jsonb' if cols['result'] == 'jsonb' else ('json' if cols['result'] == 'json' else 'text')
+            sets.append(f'result = v.result::{result_type}')
+        if 'updated_at' in cols:
+            sets.append('updated_at = NOW()')
+        values = [(cmd_id, status, Json(result) if result is not None else None) for cmd_id, status, result in updates]
+        execute_values(
+            cur,
+            f"""
+            UPDATE command_logs AS c SET {', '.join(sets)}
+            FROM (VALUES %s) AS v(cmd_id, status, result)
+            WHERE c.cmd_id = v.cmd_id AND c.status = 'pending'
+            """,
+            values,
+            template='(%s, %s, %s::text)',
+            page_size=len(values),
+        )
+        conn.commit()
+        return cur.rowcount
 
 
 def update_command_status(cmd_id: str = None, device_id: str = None, status: str = None, result = None):
@@ -802,8 +904,7 @@ def update_command_status(cmd_id: str = None, device_id: str = None, status: str
     """
     if not cmd_id and not device_id:
         return 0
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         # 优先按 cmd_id 精确更新，避免误更新同设备上的其他命令。
         if cmd_id:
@@ -846,8 +947,6 @@ def update_command_status(cmd_id: str = None, device_id: str = None, status: str
         cur.execute(sql, vals)
         conn.commit()
         return cur.rowcount
-    finally:
-        conn.close()
 
 
 def insert_campaign_publish_logs(
@@ -860,8 +959,7 @@ def insert_campaign_publish_logs(
     Persist per-device publish results for audit/retry.
     Returns number of inserted rows.
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         # Keep this self-contained so local environments do not need manual migration first.
         cur.execute(
@@ -904,16 +1002,13 @@ def insert_campaign_publish_logs(
             inserted += 1
         conn.commit()
         return inserted
-    finally:
-        conn.close()
 
 
 def get_latest_failed_campaign_devices(campaign_id: str) -> list:
     """
     Return failed device_ids from the latest publish batch for a campaign.
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -968,8 +1063,6 @@ def get_latest_failed_campaign_devices(campaign_id: str) -> list:
             [campaign_id, campaign_id],
         )
         return [r[0] for r in cur.fetchall()]
-    finally:
-        conn.close()
 
 
 def ensure_campaign_tables(cur) -> None:
@@ -996,14 +1089,82 @@ def ensure_campaign_tables(cur) -> None:
     )
     cur.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_status ON campaigns(status)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_updated_at ON campaigns(updated_at DESC)")
+    ensure_campaign_binding_table(cur)
+
+
+# 已发布活动的目标设备展开为 (device_id, campaign_id) 行；target_device_groups
+# 可能是 JSON 数组或单个字符串，空白 / 非字符串元素忽略（与 _normalize_target_devices 一致）。
+_CAMPAIGN_BINDINGS_SELECT_SQL = """
+    SELECT DISTINCT btrim(t.device_id), c.campaign_id, c.version, c.updated_at
+    FROM campaigns c
+    CROSS JOIN LATERAL (
+        SELECT e AS device_id
+        FROM jsonb_array_elements_text(
+            CASE jsonb_typeof(c.target_device_groups)
+                WHEN 'array' THEN (
+                    SELECT COALESCE(jsonb_agg(x), '[]'::jsonb)
+                    FROM jsonb_array_elements(c.target_device_groups) x
+                    WHERE jsonb_typeof(x) = 'string'
+                )
+                WHEN 'string' THEN jsonb_build_array(c.target_device_groups)
+                ELSE '[]'::jsonb
+            END
+        ) e
+    ) t
+    WHERE c.status = 'published' AND btrim(t.device_id) <> ''
+"""
+
+
+def ensure_campaign_binding_table(cur) -> None:
+    """
+    Create ``campaign_device_bindings`` (device_id -> published campaign) and
+    backfill it from published campaigns the first time it is created.
+    """
+    cur.execute("SELECT to_regclass('public.campaign_device_bindings') IS NULL AS missing")
+    row = cur.fetchone()
+    missing = row['missing'] if isinstance(row, dict) else row[0]
+    if not missing:
+        return
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS campaign_device_bindings (
+            device_id TEXT NOT NULL,
+            campaign_id TEXT NOT NULL,
+            version TEXT,
+            published_at TIMESTAMPTZ,
+            PRIMARY KEY (device_id, campaign_id)
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_campaign_device_bindings_campaign ON campaign_device_bindings(campaign_id)"
+    )
+    cur.execute(
+        "INSERT INTO campaign_device_bindings (device_id, campaign_id, version, published_at) "
+        + _CAMPAIGN_BINDINGS_SELECT_SQL
+        + " ON CONFLICT DO NOTHING"
+    )
+
+
+def sync_campaign_device_bindings(cur, campaign_id: str) -> None:
+    """Rebuild one campaign's bindings inside the caller's transaction (none unless it is published)."""
+    if not campaign_id:
+        return
+    ensure_campaign_binding_table(cur)
+    cur.execute("DELETE FROM campaign_device_bindings WHERE campaign_id = %s", [campaign_id])
+    cur.execute(
+        "INSERT INTO campaign_device_bindings (device_id, campaign_id, version, published_at) "
+        + _CAMPAIGN_BINDINGS_SELECT_SQL
+        + " AND c.campaign_id = %s ON CONFLICT DO NOTHING",
+        [campaign_id],
+    )
 
 
 def list_campaign_publish_logs(campaign_id: str, limit: int = 100, offset: int = 0) -> list:
     """
     List publish logs for a campaign, newest first.
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
             """
@@ -1024,8 +1185,6 @@ def list_campaign_publish_logs(campaign_id: str, limit: int = 100, offset: int =
             [campaign_id, limit, offset],
         )
         return cur.fetchall()
-    finally:
-        conn.close()
 
 
 def mark_campaign_retry_batch(campaign_id: str, source_batch_id: str) -> bool:
@@ -1035,8 +1194,7 @@ def mark_campaign_retry_batch(campaign_id: str, source_batch_id: str) -> bool:
     """
     if not source_batch_id:
         return True
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -1059,16 +1217,13 @@ def mark_campaign_retry_batch(campaign_id: str, source_batch_id: str) -> bool:
         )
         conn.commit()
         return cur.rowcount > 0
-    finally:
-        conn.close()
 
 
 def insert_campaign_version(campaign_id: str, version: str, schedule_json: dict) -> int:
     """
     Save a campaign version snapshot for history/rollback.
     """
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -1093,13 +1248,10 @@ def insert_campaign_version(campaign_id: str, version: str, schedule_json: dict)
         )
         conn.commit()
         return cur.rowcount
-    finally:
-        conn.close()
 
 
 def list_campaign_versions(campaign_id: str, limit: int = 50, offset: int = 0) -> list:
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
             """
@@ -1112,13 +1264,10 @@ def list_campaign_versions(campaign_id: str, limit: int = 50, offset: int = 0) -
             [campaign_id, limit, offset],
         )
         return cur.fetchall()
-    finally:
-        conn.close()
 
 
 def get_campaign_version(campaign_id: str, version: str):
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
             """
@@ -1130,8 +1279,6 @@ def get_campaign_version(campaign_id: str, version: str):
             [campaign_id, version],
         )
         return cur.fetchone()
-    finally:
-        conn.close()
 
 
 def get_existing_device_ids(device_ids: list) -> list:
@@ -1140,14 +1287,29 @@ def get_existing_device_ids(device_ids: list) -> list:
     """
     if not device_ids:
         return []
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         sql = "SELECT device_id FROM devices WHERE device_id = ANY(%s)"
         cur.execute(sql, [device_ids])
         return [r[0] for r in cur.fetchall()]
-    finally:
-        conn.close()
+
+
+def list_device_ids_in_group(column: str, value: str) -> list:
+    """
+    Sorted device_ids whose ``column`` (group_id / city / building) equals ``value``,
+    or whose ``tags`` contain it.
+    """
+    if column not in ('group_id', 'city', 'building', 'tags'):
+        raise ValueError(f"unsupported device group column: {column}")
+    with connection() as conn:
+        cur = conn.cursor()
+        if column == 'tags':
+            # tags 可能是 jsonb 或 text[]；to_jsonb 统一成 JSON 数组再做元素包含判断。
+            sql = "SELECT device_id FROM devices WHERE to_jsonb(tags) ? %s ORDER BY device_id"
+        else:
+            sql = f"SELECT device_id FROM devices WHERE {column} = %s ORDER BY device_id"
+        cur.execute(sql, [value])
+        return [r[0] for r in cur.fetchall()]
 
 
 def get_existing_material_ids(ids: list) -> list:
@@ -1157,8 +1319,7 @@ def get_existing_material_ids(ids: list) -> list:
     """
     if not ids:
         return []
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'materials'")
         cols = {r[0] for r in cur.fetchall()}
@@ -1170,8 +1331,6 @@ def get_existing_material_ids(ids: list) -> list:
             return []
         cur.execute(sql, [ids])
         return [r[0] for r in cur.fetchall()]
-    finally:
-        conn.close()
 
 
 def insert_or_update_ad_log(log_record: dict) -> bool:
@@ -1204,71 +1363,189 @@ def insert_or_update_ad_log(log_record: dict) -> bool:
         logging.warning(f"Missing required fields in ad_log: {log_record}")
         return False
     
-    conn = get_conn()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
-        
-        # UPSERT: insert new record or update existing one by log_id
-        sql = """
-        INSERT INTO ad_logs (
-            log_id, device_id, material_id, ad_file_name, start_time, end_time,
-            duration_ms, status_code, status_msg, device_ip, firmware_version,
-            created_at, expected_md5, actual_md5, is_valid, billing_status
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+        try:
+            partitioned = ad_logs_partitioned(cur)
+            if partitioned and log_record.get('start_time') is None:
+                log_record = {**log_record, 'start_time': _fallback_start_time(log_record)}
+
+            # UPSERT: insert new record or update existing one by log_id
+            # (by (log_id, start_time) once ad_logs is partitioned)
+            _write_ad_log_rows(cur, partitioned, [tuple(log_record.get(c) for c in AD_LOG_COLUMNS)])
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            logging.error(f"Failed to insert/update ad_log {log_record.get('log_id')}: {e}")
+            conn.rollback()
+            _forget_play_rollup_tables()
+            return False
+        finally:
+            cur.close()
+
+
+# ad_logs 写入列顺序；单条 UPSERT 与批量 UPSERT 共用，保证两条路径落库一致。
+AD_LOG_COLUMNS = (
+    'log_id', 'device_id', 'material_id', 'ad_file_name', 'start_time', 'end_time',
+    'duration_ms', 'status_code', 'status_msg', 'device_ip', 'firmware_version',
+    'created_at', 'expected_md5', 'actual_md5', 'is_valid', 'billing_status',
+)
+
+
+
+def _ad_log_upsert_sql(partitioned: bool, values: str = "%s") -> str:
+    # 分区表的唯一约束必须包含分区键，冲突目标随之变为 (log_id, start_time)；
+    # 同一条日志重复投递时 start_time 不变，仍落在同一行。修正已入库日志的
+    # start_time 不能靠重新投递：会在新分区插入第二行，需先删除旧行再写入。
+    key = ('log_id', 'start_time') if partitioned else ('log_id',)
+    return (
+        "INSERT INTO ad_logs (" + ", ".join(AD_LOG_COLUMNS) + f") VALUES {values} "
+        f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET "
+        + ", ".join(f"{c} = EXCLUDED.{c}" for c in AD_LOG_COLUMNS if c not in key)
+    )
+
+
+def _write_ad_log_rows(cur, partitioned: bool, rows: list, rollups: bool = True) -> None:
+    """
+    Upsert ``rows`` (tuples in AD_LOG_COLUMNS order) and apply their play rollup deltas.
+
+    先 ``ON CONFLICT DO NOTHING`` 插入全新的日志；冲突的（重复投递 / 更新）再用
+    ``SELECT ... FOR UPDATE`` 锁住并取出旧值，然后 UPSERT 覆盖。DO NOTHING 会等待
+    并发插入同一 log_id 的事务结束，FOR UPDATE 读到的总是最新提交的旧行，因此
+    “新值 - 旧值” 的增量在并发写入下也是准确的。
+    """
+    if not rollups:
+        execute_values(cur, _ad_log_upsert_sql(partitioned), rows, page_size=len(rows))
+        return
+    # 固定加锁顺序，降低多个 ingest worker 之间死锁的概率。
+    rows = sorted(rows, key=lambda r: r[0])
+    key = ('log_id', 'start_time') if partitioned else ('log_id',)
+    # 调用方已按 log_id 去重，RETURNING log_id 足以区分新插入的行。
+    inserted = {
+        r[0] for r in execute_values(
+            cur,
+            "INSERT INTO ad_logs (" + ", ".join(AD_LOG_COLUMNS) + ") VALUES %s "
+            f"ON CONFLICT ({', '.join(key)}) DO NOTHING RETURNING log_id",
+            rows, page_size=len(rows), fetch=True,
         )
-        ON CONFLICT (log_id) DO UPDATE SET
-            device_id = EXCLUDED.device_id,
-            material_id = EXCLUDED.material_id,
-            ad_file_name = EXCLUDED.ad_file_name,
-            start_time = EXCLUDED.start_time,
-            end_time = EXCLUDED.end_time,
-            duration_ms = EXCLUDED.duration_ms,
-            status_code = EXCLUDED.status_code,
-            status_msg = EXCLUDED.status_msg,
-            device_ip = EXCLUDED.device_ip,
-            firmware_version = EXCLUDED.firmware_version,
-            created_at = EXCLUDED.created_at,
-            expected_md5 = EXCLUDED.expected_md5,
-            actual_md5 = EXCLUDED.actual_md5,
-            is_valid = EXCLUDED.is_valid,
-            billing_status = EXCLUDED.billing_status;
-        """
-        
-        cur.execute(sql, (
-            log_record.get('log_id'),
-            log_record.get('device_id'),
-            log_record.get('material_id'),
-            log_record.get('ad_file_name'),
-            log_record.get('start_time'),
-            log_record.get('end_time'),
-            log_record.get('duration_ms'),
-            log_record.get('status_code'),
-            log_record.get('status_msg'),
-            log_record.get('device_ip'),
-            log_record.get('firmware_version'),
-            log_record.get('created_at'),
-            log_record.get('expected_md5'),
-            log_record.get('actual_md5'),
-            log_record.get('is_valid'),
-            log_record.get('billing_status')
-        ))
-        
-        conn.commit()
-        return True
-        
-    except Exception as e:
-        logging.error(f"Failed to insert/update ad_log {log_record.get('log_id')}: {e}")
+    }
+    existing = [r for r in rows if r[0] not in inserted]
+    previous = []
+    if existing:
+        previous = _lock_previous_rollup_rows(cur, [r[0] for r in existing], [r[4] for r in existing] if partitioned else None)
+        execute_values(cur, _ad_log_upsert_sql(partitioned), existing, page_size=len(existing))
+    apply_play_rollup_deltas(cur, play_rollup_deltas([_rollup_fields(r) for r in rows], previous))
+
+
+_AD_LOGS_PARTITIONED = None
+
+
+def ad_logs_partitioned(cur) -> bool:
+    """
+    Whether ad_logs is a natively partitioned table (cached per process).
+
+    迁移为分区表（python -m app.services.ad_log_partitions migrate）后需重启 API
+    与 ingest worker，使缓存的判断和 UPSERT 冲突目标一起更新。
+    """
+    global _AD_LOGS_PARTITIONED
+    if _AD_LOGS_PARTITIONED is None:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('ad_logs'))")
+        _AD_LOGS_PARTITIONED = bool(cur.fetchone()[0])
+    return _AD_LOGS_PARTITIONED
+
+
+def _fallback_start_time(record) -> datetime:
+    # 分区键不能为 NULL，且必须只由消息本身决定：重复投递时要算出同一个
+    # (log_id, start_time)，否则 UPSERT 会插入第二行。缺少 start_time 的日志按设备
+    # created_at 归入分区（消费者已用 Kafka 消息时间戳补齐两者都缺的情况）；
+    # 仍推导不出的拒绝写入，由消费者二分后隔离到死信队列。
+    start_time = parse_timestamp(record.get('created_at'))
+    if start_time is None:
+        raise ValueError(f"ad_log {record.get('log_id')} has no start_time or created_at to derive its partition key")
+    return start_time
+
+
+def upsert_ad_logs_batch(conn, log_records: list, ensure_devices: bool = True, commit: bool = True, device_ids: list = None, rollups: bool = True) -> int:
+    """
+    Upsert a whole batch of normalized ad_logs records in one transaction.
+
+    相比逐条 SELECT devices / INSERT devices / UPSERT / COMMIT，这里的语句数
+    与批次大小无关：
+    1) 一条集合式 INSERT 补齐缺失的 devices（满足 ad_logs.device_id 外键）；
+    2) 一条 execute_values 多行 INSERT 写入全部日志，已存在的 log_id 再经
+       一条 SELECT ... FOR UPDATE 和一条多行 UPSERT 覆盖（见 _write_ad_log_rows）；
+    3) 每张 rollup 表一条累加增量的 UPSERT。
+
+    同一批次内重复的 log_id 只保留最后一条（与逐条 UPSERT 的最终结果一致），
+    否则 ON CONFLICT DO UPDATE 会因“同一行被更新两次”而整体失败。
+
+    ad_logs 分区后按 (log_id, start_time) 去重：缺少 start_time 的记录用
+    created_at 补齐，两者都没有时整批抛 ValueError；要修改已入库日志的
+    start_time，需先 DELETE 旧行再写入。
+
+    Args:
+        conn: Open (pooled) psycopg2 connection
+        log_records: List of normalized records (PlayLogRecord or dicts keyed by AD_LOG_COLUMNS)
+        ensure_devices: Insert missing device_ids before the UPSERT
+        device_ids: Restrict that devices INSERT to these ids (e.g. the ones a
+            known-device cache has not confirmed); defaults to every device in the batch
+        commit: Commit on success; on error the transaction is rolled back and the error re-raised
+        rollups: Apply the batch's hourly/daily play rollup deltas in the same transaction
+
+    Returns:
+        Number of distinct log records written
+    """
+    deduped = {}
+    for record in log_records or []:
+        if not record or not record.get('log_id') or not record.get('device_id'):
+            continue
+        deduped[record['log_id']] = record
+    if not deduped:
+        return 0
+
+    cur = conn.cursor()
+    try:
+        partitioned = ad_logs_partitioned(cur)
+        if partitioned:
+            for log_id, r in deduped.items():
+                if r.get('start_time') is None:
+                    start_time = _fallback_start_time(r)
+                    deduped[log_id] = (
+                        r._replace(start_time=start_time) if isinstance(r, PlayLogRecord)
+                        else {**r, 'start_time': start_time}
+                    )
+        # PlayLogRecord 已按 AD_LOG_COLUMNS 顺序排列，可直接作为一行。
+        rows = [
+            r if isinstance(r, PlayLogRecord) else tuple(r.get(c) for c in AD_LOG_COLUMNS)
+            for r in deduped.values()
+        ]
+        if device_ids is None:
+            device_ids = sorted({r['device_id'] for r in deduped.values()})
+        if ensure_devices and device_ids:
+            cur.execute(
+                "INSERT INTO devices (device_id) SELECT unnest(%s::text[]) ON CONFLICT (device_id) DO NOTHING",
+                [device_ids],
+            )
+        _write_ad_log_rows(cur, partitioned, rows, rollups=rollups)
+        if commit:
+            conn.commit()
+        return len(rows)
+    except Exception:
         conn.rollback()
-        return False
+        _forget_play_rollup_tables()
+        raise
     finally:
         cur.close()
-        conn.close()
 
 
 def batch_insert_ad_logs(log_records: list) -> int:
     """
     Batch insert multiple ad_logs records efficiently.
+
+    优先走 upsert_ad_logs_batch 的单事务批量路径；若批量失败（例如某条记录
+    违反约束），回退为逐条 UPSERT，保证其余健康记录仍能落库。
     
     Args:
         log_records: List of log record dictionaries
@@ -1278,7 +1555,15 @@ def batch_insert_ad_logs(log_records: list) -> int:
     """
     if not log_records:
         return 0
-    
+
+    try:
+        with connection() as conn:
+            success_count = upsert_ad_logs_batch(conn, log_records)
+        logging.info(f"Batch insert: {success_count}/{len(log_records)} ad_logs records processed (bulk)")
+        return success_count
+    except Exception as e:
+        logging.warning(f"Bulk ad_logs upsert failed, falling back to per-row path: {e}")
+
     success_count = 0
     for record in log_records:
         if insert_or_update_ad_log(record):
@@ -1286,3 +1571,439 @@ def batch_insert_ad_logs(log_records: list) -> int:
     
     logging.info(f"Batch insert: {success_count}/{len(log_records)} ad_logs records processed")
     return success_count
+
+
+# ---------------------------------------------------------------------------
+# Play statistics rollups
+#
+# /ad_stats 统计页不再每次拉取上万行 ad_logs 在 Python 里分组，而是读取按小时 /
+# 按天预聚合的 rollup 表（按设备、按广告文件两个维度）。每次写入 ad_logs 时在
+# 同一事务里累加增量：新写入的行 +1，被 UPSERT 覆盖的旧行 -1（旧行由
+# ``SELECT ... FOR UPDATE`` 锁定读取），完全相同的重复投递增量为 0。
+#
+# 累加（``plays = t.plays + EXCLUDED.plays``）与其他 ingest worker 的并发写入
+# 可交换，不依赖快照能否看到对方未提交的行；开销只与批次大小有关。rollup 与
+# ad_logs 同一事务提交，出错（包括死锁）时整批回滚并由消费者重试，不会悄悄
+# 偏离 ad_logs。素材时长变更后，旧日志扣减的完播率按新时长计算，需要时用
+# ``rebuild_play_rollups`` 重建。
+#
+# 桶边界使用 ad_logs.start_time 的本地时间（设备上报时已去掉时区后缀）。
+# ---------------------------------------------------------------------------
+
+# key 列名 -> 表名前缀；ad 维度把 NULL ad_file_name 记为 ''。
+PLAY_ROLLUP_DIMENSIONS = {
+    'device': ('device_id', 'ad_play_rollup_device'),
+    'ad': ('ad_file_name', 'ad_play_rollup_ad'),
+}
+
+# 每个文件名对应的素材时长：同名素材有多条时取最近更新的一条。rollup 的增量 / 重建和
+# aggregate_ad_logs 共用这一个定义，同一批播放无论走哪条路径算出的完播率都一致。
+_MATERIAL_DURATION_SQL = """
+    SELECT DISTINCT ON (file_name) file_name, duration_sec
+    FROM materials
+    WHERE duration_sec > 0
+    ORDER BY file_name, updated_at DESC NULLS LAST
+"""
+# 单条日志的完播率：实际播放时长 / 素材时长，限制在 [0, 10]。
+_COMPLETION_RATE_SQL = "LEAST(GREATEST(l.duration_ms / (md.duration_sec * 1000.0), 0), 10)"
+# 计入平均完播率的日志：设备维度排除 is_valid = false；广告维度再排除 duration_ms = 0（未开始播放）。
+_COMPLETION_FILTER_SQL = {
+    'device': "l.is_valid IS DISTINCT FROM false AND l.duration_ms IS NOT NULL AND md.duration_sec > 0",
+    'ad': "l.is_valid IS DISTINCT FROM false AND l.duration_ms > 0 AND md.duration_sec > 0",
+}
+_ROLLUP_KEY_EXPR = {
+    'device': "l.device_id",
+    'ad': "COALESCE(l.ad_file_name, '')",
+}
+
+_PLAY_ROLLUPS_READY = False
+
+
+def ensure_play_rollup_tables(cur) -> None:
+    """Create the hourly / daily play rollup tables if they do not exist (see db/init_play_rollups.sql)."""
+    global _PLAY_ROLLUPS_READY
+    if _PLAY_ROLLUPS_READY:
+        return
+    for dim, (key, prefix) in PLAY_ROLLUP_DIMENSIONS.items():
+        extra = "material_id TEXT," if dim == 'ad' else ""
+        for grain, bucket in (('hourly', 'bucket_start TIMESTAMP'), ('daily', 'bucket_date DATE')):
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {prefix}_{grain} (
+                    {bucket} NOT NULL,
+                    {key} TEXT NOT NULL,
+                    {extra}
+                    plays BIGINT NOT NULL DEFAULT 0,
+                    valid_plays BIGINT NOT NULL DEFAULT 0,
+                    completion_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    completion_count BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY ({bucket.split()[0]}, {key})
+                )
+                """
+            )
+    _PLAY_ROLLUPS_READY = True
+
+
+def _forget_play_rollup_tables() -> None:
+    # 建表语句可能随写入事务一起回滚，下次写入时重新确认。
+    global _PLAY_ROLLUPS_READY
+    _PLAY_ROLLUPS_READY = False
+
+
+def _rollup_hourly_sql(dim: str, keys_sql: str) -> str:
+    key, prefix = PLAY_ROLLUP_DIMENSIONS[dim]
+    material_col = ", material_id" if dim == 'ad' else ""
+    material_val = ", MAX(l.material_id)" if dim == 'ad' else ""
+    material_set = ", material_id = EXCLUDED.material_id" if dim == 'ad' else ""
+    completion = _COMPLETION_FILTER_SQL[dim]
+    return f"""
+        WITH keys AS ({keys_sql})
+        INSERT INTO {prefix}_hourly
+            (bucket_start, {key}{material_col}, plays, valid_plays, completion_sum, completion_count, updated_at)
+        SELECT k.bucket_start, k.key{material_val},
+               COUNT(l.log_id),
+               COUNT(l.log_id) FILTER (WHERE l.is_valid IS DISTINCT FROM false),
+               COALESCE(SUM({_COMPLETION_RATE_SQL}) FILTER (WHERE {completion}), 0),
+               COUNT(l.log_id) FILTER (WHERE {completion}),
+               now()
+        FROM keys k
+        LEFT JOIN ad_logs l
+               ON {_ROLLUP_KEY_EXPR[dim]} = k.key
+              AND l.start_time >= k.bucket_start
+              AND l.start_time < k.bucket_start + interval '1 hour'
+        LEFT JOIN ({_MATERIAL_DURATION_SQL}) md ON md.file_name = l.ad_file_name
+        GROUP BY k.bucket_start, k.key
+        ON CONFLICT (bucket_start, {key}) DO UPDATE SET
+            plays = EXCLUDED.plays,
+            valid_plays = EXCLUDED.valid_plays,
+            completion_sum = EXCLUDED.completion_sum,
+            completion_count = EXCLUDED.completion_count{material_set},
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+def _rollup_daily_sql(dim: str, keys_sql: str) -> str:
+    key, prefix = PLAY_ROLLUP_DIMENSIONS[dim]
+    material_col = ", material_id" if dim == 'ad' else ""
+    material_val = ", MAX(h.material_id)" if dim == 'ad' else ""
+    material_set = ", material_id = EXCLUDED.material_id" if dim == 'ad' else ""
+    return f"""
+        WITH keys AS ({keys_sql})
+        INSERT INTO {prefix}_daily
+            (bucket_date, {key}{material_col}, plays, valid_plays, completion_sum, completion_count, updated_at)
+        SELECT k.bucket_date, k.key{material_val},
+               COALESCE(SUM(h.plays), 0),
+               COALESCE(SUM(h.valid_plays), 0),
+               COALESCE(SUM(h.completion_sum), 0),
+               COALESCE(SUM(h.completion_count), 0),
+               now()
+        FROM keys k
+        LEFT JOIN {prefix}_hourly h
+               ON h.{key} = k.key
+              AND h.bucket_start >= k.bucket_date
+              AND h.bucket_start < k.bucket_date + 1
+        GROUP BY k.bucket_date, k.key
+        ON CONFLICT (bucket_date, {key}) DO UPDATE SET
+            plays = EXCLUDED.plays,
+            valid_plays = EXCLUDED.valid_plays,
+            completion_sum = EXCLUDED.completion_sum,
+            completion_count = EXCLUDED.completion_count{material_set},
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+# 参与 rollup 计算的 ad_logs 列
+_ROLLUP_FIELDS = ('start_time', 'device_id', 'ad_file_name', 'material_id', 'is_valid', 'duration_ms')
+_ROLLUP_FIELD_INDEX = tuple(AD_LOG_COLUMNS.index(c) for c in _ROLLUP_FIELDS)
+
+
+def _rollup_fields(row) -> tuple:
+    return tuple(row[i] for i in _ROLLUP_FIELD_INDEX)
+
+
+def play_rollup_deltas(added: list, removed: list) -> list:
+    """
+    Net rollup contribution of a write: ``(weight, *_ROLLUP_FIELDS)`` per distinct row.
+
+    Args:
+        added: ``_ROLLUP_FIELDS`` tuples of the rows written
+        removed: ``_ROLLUP_FIELDS`` tuples of the rows they replaced
+
+    完全相同的新旧行相互抵消（重复投递不产生任何 rollup 写入）；没有 start_time
+    的行不进入任何桶。
+    """
+    weights = Counter(tuple(r) for r in added)
+    weights.subtract(tuple(r) for r in removed)
+    return [(n, *fields) for fields, n in weights.items() if n and fields[0] is not None]
+
+
+def _lock_previous_rollup_rows(cur, log_ids: list, start_times: list = None) -> list:
+    # UPSERT 覆盖前的旧行（行锁保持到事务结束），其 rollup 贡献需要扣除。
+    # 分区表上按 (log_id, start_time) 精确匹配，start_time = ANY 让查询只探测相关分区。
+    columns = ", ".join(_ROLLUP_FIELDS)
+    if start_times is None:
+        cur.execute(
+            f"SELECT {columns} FROM ad_logs WHERE log_id = ANY(%s) ORDER BY log_id FOR UPDATE",
+            [log_ids],
+        )
+    else:
+        cur.execute(
+            f"SELECT {columns} FROM ad_logs "
+            "WHERE start_time = ANY(%s::timestamp[]) "
+            "AND (log_id, start_time) IN (SELECT * FROM unnest(%s::text[], %s::timestamp[])) "
+            "ORDER BY log_id FOR UPDATE",
+            [sorted(set(start_times)), log_ids, start_times],
+        )
+    return [tuple(r) for r in cur.fetchall()]
+
+
+_ROLLUP_DELTA_SRC_SQL = (
+    "SELECT * FROM unnest(%(weights)s::int[], %(start_times)s::timestamp[], %(device_ids)s::text[], "
+    "%(ad_file_names)s::text[], %(material_ids)s::text[], %(is_valid)s::boolean[], %(duration_ms)s::bigint[]) "
+    "AS l(weight, start_time, device_id, ad_file_name, material_id, is_valid, duration_ms)"
+)
+_ROLLUP_BUCKETS = {
+    'hourly': ('bucket_start', "date_trunc('hour', l.start_time)"),
+    'daily': ('bucket_date', "l.start_time::date"),
+}
+
+
+def _rollup_delta_sql(dim: str, grain: str) -> str:
+    key, prefix = PLAY_ROLLUP_DIMENSIONS[dim]
+    bucket_col, bucket_expr = _ROLLUP_BUCKETS[grain]
+    material_col = ", material_id" if dim == 'ad' else ""
+    material_val = ", MAX(l.material_id) FILTER (WHERE l.weight > 0)" if dim == 'ad' else ""
+    material_set = ", material_id = COALESCE(EXCLUDED.material_id, t.material_id)" if dim == 'ad' else ""
+    completion = _COMPLETION_FILTER_SQL[dim]
+    # ORDER BY：各事务按相同顺序锁 rollup 行。
+    return f"""
+        INSERT INTO {prefix}_{grain} AS t
+            ({bucket_col}, {key}{material_col}, plays, valid_plays, completion_sum, completion_count, updated_at)
+        SELECT {bucket_expr}, {_ROLLUP_KEY_EXPR[dim]}{material_val},
+               SUM(l.weight),
+               COALESCE(SUM(l.weight) FILTER (WHERE l.is_valid IS DISTINCT FROM false), 0),
+               COALESCE(SUM(l.weight * {_COMPLETION_RATE_SQL}) FILTER (WHERE {completion}), 0),
+               COALESCE(SUM(l.weight) FILTER (WHERE {completion}), 0),
+               now()
+        FROM ({_ROLLUP_DELTA_SRC_SQL}) l
+        LEFT JOIN ({_MATERIAL_DURATION_SQL}) md ON md.file_name = l.ad_file_name
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT ({bucket_col}, {key}) DO UPDATE SET
+            plays = t.plays + EXCLUDED.plays,
+            valid_plays = t.valid_plays + EXCLUDED.valid_plays,
+            completion_sum = t.completion_sum + EXCLUDED.completion_sum,
+            completion_count = t.completion_count + EXCLUDED.completion_count{material_set},
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+def apply_play_rollup_deltas(cur, deltas: list) -> None:
+    """
+    Add ``deltas`` (from :func:`play_rollup_deltas`) to the hourly and daily rollups.
+
+    Args:
+        cur: Cursor inside the transaction that wrote ad_logs; errors propagate so
+            the caller rolls back the ad_logs write together with the rollups
+        deltas: ``(weight, start_time, device_id, ad_file_name, material_id, is_valid, duration_ms)``
+    """
+    if not deltas:
+        return
+    ensure_play_rollup_tables(cur)
+    columns = list(zip(*deltas))
+    params = dict(zip(
+        ('weights', 'start_times', 'device_ids', 'ad_file_names', 'material_ids', 'is_valid', 'duration_ms'),
+        (list(c) for c in columns),
+    ))
+    for dim in PLAY_ROLLUP_DIMENSIONS:
+        for grain in _ROLLUP_BUCKETS:
+            cur.execute(_rollup_delta_sql(dim, grain), params)
+
+
+def rebuild_play_rollups(since=None) -> None:
+    """
+    Rebuild rollups from ad_logs (initial backfill or repair).
+
+    按桶整体重算（覆盖而不是累加），应在 ingest 暂停时运行，否则与并发写入的
+    增量相互覆盖。
+
+    Args:
+        since: Only rebuild buckets from this date/datetime on; None rebuilds everything
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            ensure_play_rollup_tables(cur)
+            where = "WHERE start_time IS NOT NULL" + (" AND start_time >= %(since)s" if since is not None else "")
+            params = {'since': since}
+            for dim in PLAY_ROLLUP_DIMENSIONS:
+                key = _ROLLUP_KEY_EXPR[dim].replace('l.', '')
+                cur.execute(_rollup_hourly_sql(
+                    dim,
+                    f"SELECT DISTINCT date_trunc('hour', start_time) AS bucket_start, {key} AS key FROM ad_logs {where}",
+                ), params)
+                cur.execute(_rollup_daily_sql(
+                    dim,
+                    f"SELECT DISTINCT start_time::date AS bucket_date, {key} AS key FROM ad_logs {where}",
+                ), params)
+            conn.commit()
+        finally:
+            cur.close()
+
+
+# API 排序键 -> 聚合结果列；ad 维度的 "plays" 指有效播放（is_valid != false）。
+_AGG_SORT_COLUMNS = {
+    'device': {'plays': 'plays', 'valid_plays': 'valid_plays', 'avg_completion_rate': 'avg_completion_rate', 'device_id': 'key'},
+    'ad': {'plays': 'valid_plays', 'total_plays': 'plays', 'avg_completion_rate': 'avg_completion_rate', 'ad_file_name': 'key'},
+}
+
+
+def _agg_order_sql(dimension: str, sort: str, order: str) -> str:
+    columns = _AGG_SORT_COLUMNS[dimension]
+    if sort not in columns:
+        raise ValueError(f"unsupported sort key {sort!r}, expected one of {sorted(columns)}")
+    direction = 'ASC' if str(order).lower() == 'asc' else 'DESC'
+    return f"ORDER BY {columns[sort]} {direction} NULLS LAST, key ASC"
+
+
+def _agg_page_sql(limit, offset) -> tuple:
+    sql = ""
+    params = []
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(int(limit))
+    if offset:
+        sql += " OFFSET %s"
+        params.append(int(offset))
+    return sql, params
+
+
+def _with_advertiser(dimension: str, sql: str, order_sql: str) -> str:
+    # 广告主只为当前页的分组补查，避免对全部日志做 materials 连接。
+    if dimension != 'ad':
+        return sql
+    return f"""
+        SELECT g.*, adv.advertiser
+        FROM ({sql}) g
+        LEFT JOIN LATERAL (
+            SELECT m.advertiser FROM materials m
+            WHERE m.file_name = g.key AND COALESCE(m.advertiser, '') <> ''
+            LIMIT 1
+        ) adv ON true
+        {order_sql}
+    """
+
+
+def _agg_result(dimension: str, rows: list) -> tuple:
+    key = PLAY_ROLLUP_DIMENSIONS[dimension][0]
+    total = int(rows[0]['total_groups']) if rows else 0
+    out = []
+    for r in rows:
+        r = dict(r)
+        r[key] = r.pop('key')
+        r.pop('total_groups', None)
+        if r.get('avg_completion_rate') is not None:
+            r['avg_completion_rate'] = float(r['avg_completion_rate'])
+        out.append(r)
+    return out, total
+
+
+def aggregate_ad_logs(dimension: str, from_ts=None, to_ts=None, sort: str = 'plays', order: str = 'desc',
+                      limit=None, offset: int = 0) -> tuple:
+    """
+    Aggregate raw ad_logs per device or per ad file inside Postgres.
+
+    分组、完播率计算以及 is_valid / duration_ms 过滤都在 SQL 中完成，只返回
+    一页分组结果，不再把原始日志拉到 Python 里，也不会被 LIMIT 截断总数。
+
+    Args:
+        dimension: 'device' or 'ad'
+        from_ts / to_ts: Window ``[from_ts, to_ts)`` on start_time (naive, same clock as ad_logs)
+        sort: 'plays' | 'avg_completion_rate' | key column (ad also 'total_plays', device 'valid_plays')
+        order: 'asc' or 'desc'
+        limit / offset: Page over the groups; limit None returns every group
+
+    Returns:
+        (rows, total_groups); each row has the key column, plays, valid_plays,
+        completion_sum, completion_count, avg_completion_rate (and material_id /
+        advertiser for the ad dimension)
+    """
+    order_sql = _agg_order_sql(dimension, sort, order)
+    page_sql, page_params = _agg_page_sql(limit, offset)
+    where = []
+    params = []
+    if from_ts is not None:
+        where.append("l.start_time >= %s")
+        params.append(from_ts)
+    if to_ts is not None:
+        where.append("l.start_time < %s")
+        params.append(to_ts)
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    completion = _COMPLETION_FILTER_SQL[dimension]
+    material = ", MAX(l.material_id) AS material_id" if dimension == 'ad' else ""
+    sql = f"""
+        WITH md AS ({_MATERIAL_DURATION_SQL}), groups AS (
+            SELECT {_ROLLUP_KEY_EXPR[dimension]} AS key,
+                   COUNT(*) AS plays,
+                   COUNT(*) FILTER (WHERE l.is_valid IS DISTINCT FROM false) AS valid_plays,
+                   COALESCE(SUM({_COMPLETION_RATE_SQL}) FILTER (WHERE {completion}), 0) AS completion_sum,
+                   COUNT(*) FILTER (WHERE {completion}) AS completion_count{material}
+            FROM ad_logs l
+            LEFT JOIN md ON md.file_name = l.ad_file_name{where_sql}
+            GROUP BY 1
+        )
+        SELECT groups.*,
+               ROUND((completion_sum / NULLIF(completion_count, 0))::numeric, 4) AS avg_completion_rate,
+               COUNT(*) OVER () AS total_groups
+        FROM groups
+        {order_sql}{page_sql}
+    """
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(_with_advertiser(dimension, sql, order_sql), params + page_params)
+        return _agg_result(dimension, cur.fetchall())
+
+
+def summarize_play_rollups(dimension: str, day_from=None, day_to=None, sort: str = 'plays', order: str = 'desc',
+                           limit=None, offset: int = 0) -> tuple:
+    """
+    Sum daily rollups per key over ``[day_from, day_to]`` (dates, inclusive; None = unbounded).
+
+    Sorting and paging work like :func:`aggregate_ad_logs`; returns ``(rows, total_groups)``
+    with the same row shape.
+    """
+    key, prefix = PLAY_ROLLUP_DIMENSIONS[dimension]
+    order_sql = _agg_order_sql(dimension, sort, order)
+    page_sql, page_params = _agg_page_sql(limit, offset)
+    where = []
+    params = []
+    if day_from is not None:
+        where.append("bucket_date >= %s")
+        params.append(day_from)
+    if day_to is not None:
+        where.append("bucket_date <= %s")
+        params.append(day_to)
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    material = ", MAX(material_id) AS material_id" if dimension == 'ad' else ""
+    sql = f"""
+        WITH groups AS (
+            SELECT {key} AS key, SUM(plays) AS plays, SUM(valid_plays) AS valid_plays,
+                   SUM(completion_sum) AS completion_sum, SUM(completion_count) AS completion_count{material}
+            FROM {prefix}_daily{where_sql}
+            GROUP BY {key}
+            HAVING SUM(plays) > 0
+        )
+        SELECT groups.*,
+               ROUND((completion_sum / NULLIF(completion_count, 0))::numeric, 4) AS avg_completion_rate,
+               COUNT(*) OVER () AS total_groups
+        FROM groups
+        {order_sql}{page_sql}
+    """
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if not _PLAY_ROLLUPS_READY:
+            ensure_play_rollup_tables(cur)
+            conn.commit()
+        cur.execute(_with_advertiser(dimension, sql, order_sql), params + page_params)
+        return _agg_result(dimension, cur.fetchall())
@@ -0,0 +1,340 @@
+"""
+Dead-letter queue for play-log ingestion.
+
+解析失败、缺少必填字段或写库失败（数据错误）的播放日志不再只打一行日志
+就丢弃，而是隔离到死信队列，修复后可以重放：
+
+- 配置了 Kafka broker 时写入死信 topic（默认 ``play_logs_dlq``）；
+- 未配置 broker、或投递 Kafka 失败时，追加写入本地 JSONL 文件
+  （默认 ``data/dlq/play_logs.jsonl``）。
+
+每条死信记录包含：阶段（decode / normalize / insert）、错误信息、来源
+topic / partition / offset、原始字节（base64）或规范化后的记录。
+
+重放（重新解析并写入 ad_logs）::
+
+    python -m app.services.dead_letter replay --source file
+    python -m app.services.dead_letter replay --source kafka --limit 1000
+    python -m app.services.dead_letter replay --dry-run
+
+文件来源重放成功的条目会从文件中移除，仍失败的保留；Kafka 来源按独立
+consumer group 读取并提交 offset，仍失败的条目重新投递到死信 topic。
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DLQ_TOPIC = 'play_logs_dlq'
+DEFAULT_DLQ_FILE = 'data/dlq/play_logs.jsonl'
+
+
+def build_entry(
+    stage: str,
+    error: Any,
+    source: Optional[Tuple[Optional[str], Optional[int], Optional[int]]] = None,
+    raw: Optional[bytes] = None,
+    record: Optional[Dict] = None,
+) -> Dict[str, Any]:
+    """Build one dead-letter entry (JSON-serializable)."""
+    topic, partition, offset = source or (None, None, None)
+    entry: Dict[str, Any] = {
+        'stage': stage,
+        'error': f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error),
+        'topic': topic,
+        'partition': partition,
+        'offset': offset,
+        'failed_at': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+    }
+    if raw is not None:
+        entry['raw_b64'] = base64.b64encode(bytes(raw)).decode('ascii')
+    if record is not None:
+        entry['record'] = record
+        entry['log_id'] = record.get('log_id')
+    return entry
+
+
+def _dumps(entry: Dict[str, Any]) -> bytes:
+    return json.dumps(entry, ensure_ascii=False, default=str).encode('utf-8')
+
+
+class FileDeadLetterSink:
+    """Append-only JSONL file; one entry per line."""
+
+    kind = 'file'
+
+    def __init__(self, path: str = DEFAULT_DLQ_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def publish(self, entry: Dict[str, Any]) -> None:
+        line = _dumps(entry) + b'\n'
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(line)
+                f.flush()
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def read(self) -> List[Dict[str, Any]]:
+        if not self.path.exists():
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Skipping unreadable dead-letter line {self.path}:{n}")
+        return entries
+
+    def rewrite(self, entries: List[Dict[str, Any]]) -> None:
+        """Atomically replace the file with ``entries`` (used after a replay)."""
+        with self._lock:
+            tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+            with open(tmp, 'wb') as f:
+                for entry in entries:
+                    f.write(_dumps(entry) + b'\n')
+            os.replace(tmp, self.path)
+
+
+class KafkaDeadLetterSink:
+    """Publishes entries to a Kafka topic; falls back to a local file if the broker is unavailable."""
+
+    kind = 'kafka'
+
+    def __init__(self, brokers: list, topic: str = DEFAULT_DLQ_TOPIC, fallback: Optional[FileDeadLetterSink] = None):
+        self.brokers = brokers
+        self.topic = topic
+        self.fallback = fallback or FileDeadLetterSink()
+        self._producer = None
+        self._lock = threading.Lock()
+        self._seq = 0
+        # token -> (future, entry)：已 send 但还没有确认结果的死信
+        self._inflight: Dict[int, Tuple[Any, Dict[str, Any]]] = {}
+
+    def _get_producer(self):
+        if self._producer is None:
+            with self._lock:
+                if self._producer is None:
+                    from kafka import KafkaProducer
+
+                    self._producer = KafkaProducer(
+                        bootstrap_servers=self.brokers,
+                        acks='all',
+                        linger_ms=20,
+                    )
+        return self._producer
+
+    def publish(self, entry: Dict[str, Any]) -> None:
+        try:
+            key = entry.get('log_id')
+            future = self._get_producer().send(
+                self.topic,
+                key=key.encode('utf-8') if isinstance(key, str) else None,
+                value=_dumps(entry),
+            )
+        except Exception as e:
+            logger.warning(f"Dead-letter publish to Kafka failed, writing to {self.fallback.path}: {e}")
+            self.fallback.publish(entry)
+            return
+        # send() 只是放进发送缓冲区；重试耗尽、broker 不可用等异步失败在回调里转写本地文件。
+        with self._lock:
+            self._seq += 1
+            token = self._seq
+            self._inflight[token] = (future, entry)
+        future.add_callback(lambda _meta: self._settle(token))
+        future.add_errback(lambda exc: self._settle(token, exc))
+
+    def _settle(self, token: int, error: Optional[BaseException] = None) -> None:
+        # 回调和 flush() 都可能处理同一条死信，只有先取走的一方负责转写。
+        with self._lock:
+            item = self._inflight.pop(token, None)
+        if item is None or error is None:
+            return
+        logger.warning(f"Dead-letter delivery to Kafka failed, writing to {self.fallback.path}: {error}")
+        self.fallback.publish(item[1])
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Wait until every published entry is acknowledged by Kafka or written to the fallback file."""
+        # manual-commit 模式在提交 offset 前调用：返回后所有死信都已经落地。
+        if self._producer is None:
+            return
+        try:
+            self._producer.flush(timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Dead-letter producer flush failed: {e}")
+        with self._lock:
+            pending = list(self._inflight.items())
+        for token, (future, _entry) in pending:
+            try:
+                future.get(timeout=timeout)
+            except Exception as e:
+                self._settle(token, e)
+            else:
+                self._settle(token)
+
+    def close(self) -> None:
+        if self._producer is not None:
+            try:
+                self.flush()
+                self._producer.close()
+            except Exception as e:
+                logger.warning(f"Error closing dead-letter producer: {e}")
+            self._producer = None
+
+
+def create_dead_letter_sink(brokers: Optional[list] = None):
+    """
+    Build the sink selected by ``PLAYLOG_DLQ_MODE`` (auto | kafka | file | off).
+
+    auto 模式下有 broker 时写 Kafka topic，否则写本地文件；off 返回 None。
+    """
+    mode = os.getenv('PLAYLOG_DLQ_MODE', 'auto').strip().lower()
+    if mode == 'off':
+        return None
+    file_sink = FileDeadLetterSink(os.getenv('PLAYLOG_DLQ_FILE', DEFAULT_DLQ_FILE))
+    brokers = [b for b in (brokers or []) if b]
+    if mode == 'file' or not brokers:
+        return file_sink
+    return KafkaDeadLetterSink(
+        brokers,
+        topic=os.getenv('PLAYLOG_DLQ_TOPIC', DEFAULT_DLQ_TOPIC),
+        fallback=file_sink,
+    )
+
+
+# -- replay ------------------------------------------------------------------
+
+
+def entry_records(entry: Dict[str, Any], decoder=None) -> list:
+    """Rebuild normalized records from a dead-letter entry."""
+    from app.services.playlog_codec import get_decoder, normalize_log_record
+
+    if entry.get('record') is not None:
+        record = normalize_log_record(entry['record'])
+        return [record] if record is not None else []
+    if entry.get('raw_b64'):
+        decoder = decoder or get_decoder()
+        return decoder.decode(base64.b64decode(entry['raw_b64']))
+    return []
+
+
+def replay_entries(entries: List[Dict[str, Any]], dry_run: bool = False) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Re-decode and upsert each entry. Returns ``(records_written, still_failing_entries)``.
+
+    每条死信单独一个事务，坏数据不会拖累其他条目；dry_run 只解析不写库。
+    """
+    from app.services.db_service import connection, upsert_ad_logs_batch
+
+    written = 0
+    failed: List[Dict[str, Any]] = []
+    with (nullcontext() if dry_run else connection()) as conn:
+        for entry in entries:
+            try:
+                records = entry_records(entry)
+                if not records:
+                    raise ValueError('entry still yields no valid records')
+                written += len(records) if dry_run else upsert_ad_logs_batch(conn, records)
+            except Exception as e:
+                logger.warning(
+                    f"Replay failed for {entry.get('topic')}[{entry.get('partition')}]@{entry.get('offset')}: {e}"
+                )
+                failed.append({**entry, 'replay_error': f"{type(e).__name__}: {e}"})
+    return written, failed
+
+
+def _read_kafka_entries(brokers: list, topic: str, limit: Optional[int]):
+    from kafka import KafkaConsumer
+
+    consumer = KafkaConsumer(
+        topic,
+        bootstrap_servers=brokers,
+        group_id=os.getenv('PLAYLOG_DLQ_REPLAY_GROUP', 'control-plane-play-logs-dlq-replay'),
+        auto_offset_reset='earliest',
+        enable_auto_commit=False,
+        consumer_timeout_ms=5000,  # 读到末尾 5 秒无新消息即结束
+    )
+    entries = []
+    for message in consumer:
+        try:
+            entries.append(json.loads(message.value))
+        except ValueError:
+            logger.warning(f"Skipping unreadable dead-letter message at offset {message.offset}")
+        if limit is not None and len(entries) >= limit:
+            break
+    return consumer, entries
+
+
+def replay(source: str = 'file', path: Optional[str] = None, limit: Optional[int] = None,
+           stage: Optional[str] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """Replay dead letters from the file or the Kafka DLQ topic back into ad_logs."""
+    if source == 'file':
+        sink = FileDeadLetterSink(path or os.getenv('PLAYLOG_DLQ_FILE', DEFAULT_DLQ_FILE))
+        entries = sink.read()
+        selected = [e for e in entries if stage is None or e.get('stage') == stage]
+        if limit is not None:
+            selected = selected[:limit]
+        written, failed = replay_entries(selected, dry_run=dry_run)
+        if not dry_run:
+            selected_ids = {id(e) for e in selected}
+            sink.rewrite([e for e in entries if id(e) not in selected_ids] + failed)
+        return {'source': 'file', 'entries': len(selected), 'written': written, 'failed': len(failed)}
+
+    brokers = [b.strip() for b in os.getenv('KAFKA_BROKERS', '10.12.58.42:9092').split(',')]
+    topic = os.getenv('PLAYLOG_DLQ_TOPIC', DEFAULT_DLQ_TOPIC)
+    consumer, entries = _read_kafka_entries(brokers, topic, limit)
+    try:
+        selected = [e for e in entries if stage is None or e.get('stage') == stage]
+        written, failed = replay_entries(selected, dry_run=dry_run)
+        if not dry_run:
+            # 未选中的和仍失败的重新投递，然后提交 offset，避免下次重复处理。
+            selected_ids = {id(e) for e in selected}
+            requeue = [e for e in entries if id(e) not in selected_ids] + failed
+            if requeue:
+                sink = KafkaDeadLetterSink(brokers, topic=topic)
+                for entry in requeue:
+                    sink.publish(entry)
+                sink.close()
+            consumer.commit()
+    finally:
+        consumer.close()
+    return {'source': 'kafka', 'entries': len(selected), 'written': written, 'failed': len(failed)}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Play-log dead-letter queue tools.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rp = sub.add_parser('replay', help="re-decode dead letters and upsert them into ad_logs")
+    rp.add_argument('--source', choices=('file', 'kafka'), default='file')
+    rp.add_argument('--file', default=None, help=f"DLQ file (default: PLAYLOG_DLQ_FILE or {DEFAULT_DLQ_FILE})")
+    rp.add_argument('--stage', choices=('decode', 'normalize', 'insert'), default=None)
+    rp.add_argument('--limit', type=int, default=None)
+    rp.add_argument('--dry-run', action='store_true', help="decode only, do not write or remove entries")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    result = replay(source=args.source, path=args.file, limit=args.limit, stage=args.stage, dry_run=args.dry_run)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
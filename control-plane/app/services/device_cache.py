@@ -0,0 +1,120 @@
+"""
+In-process cache of device_ids confirmed to exist in the ``devices`` table.
+
+ad_logs.device_id 有外键约束，Kafka 消费者每条日志都要确认设备存在。
+设备集合变化很少，因此这里维护一个有界 LRU + TTL 缓存：
+
+- 启动时从 devices 表预热；
+- 批量写入成功后把本批 device_id 标记为已知；
+- ``/devices/register`` upsert 设备后使对应条目失效，下次写日志时重新确认。
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class KnownDeviceCache:
+    """Thread-safe bounded LRU set with per-entry TTL."""
+
+    def __init__(self, max_size: int = 100000, ttl_sec: float = 3600.0):
+        self.max_size = max(1, int(max_size))
+        self.ttl_sec = ttl_sec
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __contains__(self, device_id: Any) -> bool:
+        if not isinstance(device_id, str):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._entries.get(device_id)
+            if expires_at is None:
+                self._misses += 1
+                return False
+            if expires_at <= now:
+                del self._entries[device_id]
+                self._misses += 1
+                return False
+            self._entries.move_to_end(device_id)
+            self._hits += 1
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def add(self, device_id: str) -> None:
+        self.add_many([device_id])
+
+    def add_many(self, device_ids: Iterable[str]) -> None:
+        expires_at = time.monotonic() + self.ttl_sec
+        with self._lock:
+            for device_id in device_ids:
+                if not isinstance(device_id, str) or not device_id:
+                    continue
+                self._entries[device_id] = expires_at
+                self._entries.move_to_end(device_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def missing(self, device_ids: Iterable[str]) -> List[str]:
+        """Return the distinct device_ids that are not (or no longer) cached, in sorted order."""
+        return sorted({d for d in device_ids if d not in self})
+
+    def invalidate(self, device_id: Optional[str] = None) -> None:
+        """Drop one device_id, or the whole cache when ``device_id`` is None."""
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device_id, None)
+
+    def warm(self, conn) -> int:
+        """Load up to ``max_size`` device_ids from the devices table. Returns how many were loaded."""
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT device_id FROM devices LIMIT %s", [self.max_size])
+            ids = [r[0] for r in cur.fetchall()]
+        finally:
+            cur.close()
+        self.add_many(ids)
+        return len(ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_sec': self.ttl_sec,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+
+_KNOWN_DEVICES: Optional[KnownDeviceCache] = None
+_KNOWN_DEVICES_LOCK = threading.Lock()
+
+
+def get_known_device_cache() -> KnownDeviceCache:
+    """Process-wide cache shared by the Kafka consumer and the device registration endpoint."""
+    global _KNOWN_DEVICES
+    if _KNOWN_DEVICES is None:
+        with _KNOWN_DEVICES_LOCK:
+            if _KNOWN_DEVICES is None:
+                _KNOWN_DEVICES = KnownDeviceCache(
+                    max_size=settings.device_cache_max_size,
+                    ttl_sec=settings.device_cache_ttl_sec,
+                )
+    return _KNOWN_DEVICES
@@ -0,0 +1,261 @@
+"""
+Device groups: city / building / tag / group_id selectors resolved to compact device sets.
+
+活动的 ``target_device_groups`` 除了具体 device_id，还可以写设备组选择器：
+
+- ``group:<group_id>``  devices.group_id 相等
+- ``city:<city>``       devices.city 相等
+- ``building:<name>``   devices.building 相等
+- ``tag:<tag>``         devices.tags 包含该标签
+
+选择器按需从 devices 表解析为排好序的 device_id 集合（:class:`DeviceSet`，
+二分查找判断成员），进程内缓存；设备注册时按其属性增量加入 / 移出已缓存
+的组，TTL 兜底其它进程的注册。发布校验只检查组是否为空，网关按设备查找
+活动时只做成员判断，不再把成千上万个 device_id 展开进活动的 JSON 数组。
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 选择器前缀 -> devices 表列名
+SELECTOR_FIELDS = {
+    'group': 'group_id',
+    'city': 'city',
+    'building': 'building',
+    'tag': 'tags',
+}
+
+Loader = Callable[[str, str], Iterable[str]]
+
+
+def parse_selector(target: Any) -> Optional[Tuple[str, str]]:
+    """Return ``(field, value)`` for a group selector string, None for a plain device_id."""
+    if not isinstance(target, str):
+        return None
+    field, sep, value = target.partition(':')
+    if not sep:
+        return None
+    field = field.strip().lower()
+    value = value.strip()
+    if field not in SELECTOR_FIELDS or not value:
+        return None
+    return field, value
+
+
+def selector_key(field: str, value: str) -> str:
+    return f"{field}:{value}"
+
+
+def split_targets(targets: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """Split normalized campaign targets into (device_ids, canonical group keys), keeping order."""
+    device_ids: List[str] = []
+    group_keys: List[str] = []
+    for target in targets:
+        parsed = parse_selector(target)
+        if parsed is None:
+            device_ids.append(target)
+        else:
+            key = selector_key(*parsed)
+            if key not in group_keys:
+                group_keys.append(key)
+    return device_ids, group_keys
+
+
+def _normalize_tags(raw: Any) -> List[str]:
+    # tags 在 DB / 注册请求中可能是 JSON 数组、JSON 字符串或逗号分隔字符串。
+    if raw is None:
+        return []
+    if isinstance(raw, str):
+        text = raw.strip()
+        if text.startswith('['):
+            try:
+                raw = json.loads(text)
+            except ValueError:
+                raw = text.strip('[]').split(',')
+        else:
+            raw = text.split(',')
+    if not isinstance(raw, (list, tuple, set)):
+        return []
+    return [str(t).strip() for t in raw if t is not None and str(t).strip()]
+
+
+def device_group_keys(attrs: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Group keys a device belongs to, per selector field present in ``attrs``.
+
+    缺失（None）的字段不出现在结果里：注册请求只更新传入的列，未传的字段
+    保持原值，增量更新时不能据此把设备移出对应的组。
+    """
+    keys: Dict[str, List[str]] = {}
+    for field, column in SELECTOR_FIELDS.items():
+        if attrs.get(column) is None:
+            continue
+        if field == 'tag':
+            keys[field] = [selector_key(field, t) for t in _normalize_tags(attrs.get(column))]
+        else:
+            value = str(attrs.get(column)).strip()
+            keys[field] = [selector_key(field, value)] if value else []
+    return keys
+
+
+class DeviceSet:
+    """Sorted, de-duplicated device_id list with O(log n) membership."""
+
+    __slots__ = ('_ids',)
+
+    def __init__(self, device_ids: Iterable[str] = ()):
+        self._ids = sorted({d for d in device_ids if isinstance(d, str) and d})
+
+    def __contains__(self, device_id: object) -> bool:
+        i = bisect.bisect_left(self._ids, device_id)
+        return i < len(self._ids) and self._ids[i] == device_id
+
+    def add(self, device_id: str) -> None:
+        i = bisect.bisect_left(self._ids, device_id)
+        if i == len(self._ids) or self._ids[i] != device_id:
+            self._ids.insert(i, device_id)
+
+    def discard(self, device_id: str) -> None:
+        i = bisect.bisect_left(self._ids, device_id)
+        if i < len(self._ids) and self._ids[i] == device_id:
+            del self._ids[i]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+
+def _load_from_db(field: str, value: str) -> List[str]:
+    from app.services import db_service
+
+    return db_service.list_device_ids_in_group(SELECTOR_FIELDS[field], value)
+
+
+class DeviceGroupRegistry:
+    """Thread-safe cache of resolved device groups, updated as devices register."""
+
+    def __init__(self, loader: Optional[Loader] = None, ttl_sec: float = 600.0, max_groups: int = 1024):
+        self.loader = loader or _load_from_db
+        self.ttl_sec = ttl_sec
+        self.max_groups = max(1, int(max_groups))
+        self._groups: "OrderedDict[str, Tuple[float, DeviceSet]]" = OrderedDict()
+        # 本进程注册过的设备 -> 所属组；DB 不可用时（内存兜底模式）据此判断成员。
+        self._devices: Dict[str, Dict[str, List[str]]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+
+    def resolve(self, key: str) -> DeviceSet:
+        """Device set of a group key; loads from the devices table on a miss (may raise)."""
+        parsed = parse_selector(key)
+        if parsed is None:
+            raise ValueError(f"invalid device group selector: {key}")
+        key = selector_key(*parsed)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._groups.get(key)
+            if entry is not None and entry[0] > now:
+                self._groups.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+        members = DeviceSet(self.loader(*parsed))
+        with self._lock:
+            self._loads += 1
+            self._groups[key] = (time.monotonic() + self.ttl_sec, members)
+            self._groups.move_to_end(key)
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+        return members
+
+    def contains(self, key: str, device_id: str) -> bool:
+        try:
+            return device_id in self.resolve(key)
+        except Exception:
+            with self._lock:
+                known = self._devices.get(device_id) or {}
+                return any(key in keys for keys in known.values())
+
+    def memberships(self, device_id: str, keys: Iterable[str]) -> List[str]:
+        """Subset of ``keys`` whose group contains ``device_id``."""
+        return [k for k in keys if self.contains(k, device_id)]
+
+    def observe_device(self, device_id: str, attrs: Dict[str, Any]) -> None:
+        """Apply a device registration / metadata update to the cached groups."""
+        if not device_id:
+            return
+        keys = device_group_keys(attrs)
+        with self._lock:
+            known = self._devices.setdefault(device_id, {})
+            known.update(keys)
+            for key, (_, members) in self._groups.items():
+                field = key.partition(':')[0]
+                if field not in keys:
+                    continue
+                if key in keys[field]:
+                    members.add(device_id)
+                else:
+                    members.discard(device_id)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._groups.clear()
+            else:
+                self._groups.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._groups.clear()
+            self._devices.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'groups': len(self._groups),
+                'members': sum(len(members) for _, members in self._groups.values()),
+                'max_groups': self.max_groups,
+                'ttl_sec': self.ttl_sec,
+                'hits': self._hits,
+                'loads': self._loads,
+            }
+
+
+def count_targets(targets: Iterable[str], registry: Optional["DeviceGroupRegistry"] = None) -> int:
+    """Distinct devices covered by plain device_ids plus group selectors (unresolvable groups count 0)."""
+    registry = registry or get_device_group_registry()
+    device_ids, group_keys = split_targets(targets)
+    seen = set(device_ids)
+    for key in group_keys:
+        try:
+            seen.update(registry.resolve(key))
+        except Exception as e:
+            logger.warning(f"Device group {key} could not be resolved: {e}")
+    return len(seen)
+
+
+_REGISTRY: Optional[DeviceGroupRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_device_group_registry() -> DeviceGroupRegistry:
+    """Process-wide device group cache shared by the campaign, gateway and device endpoints."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                _REGISTRY = DeviceGroupRegistry(
+                    ttl_sec=settings.device_group_cache_ttl_sec,
+                    max_groups=settings.device_group_cache_max_groups,
+                )
+    return _REGISTRY
@@ -0,0 +1,335 @@
+"""
+Shared client for the cloud gateway's ``/api/send``.
+
+原来每次下发命令都 ``requests.post`` 新建一条连接（5 秒超时），而且是在
+``send_command`` / ``request_device_snapshot`` 这些 async 接口里同步调用的，
+网关一慢整个事件循环跟着卡住。control-plane 所有到网关的调用都走这里：
+
+- keep-alive 连接池（httpx），连接数上限 / 空闲连接数可配置；同步接口
+  （``send_command``，给同步接口和脚本用）共用一个线程安全的 ``httpx.Client``；
+  异步接口（``asend_command``）每个事件循环一个 ``httpx.AsyncClient``——
+  AsyncClient 的连接绑定创建它的事件循环（测试里的 TestClient、后台线程里的
+  ``asyncio.run`` 都各自有独立的循环）；
+- ``GATEWAY_HTTP2=true`` 时启用 HTTP/2（需要安装 h2；https 网关通过 ALPN
+  协商，http 网关仍是 HTTP/1.1 keep-alive）；
+- 熔断：连续 ``failure_threshold`` 次网络错误 / 网关 5xx 后打开，
+  ``reset_timeout_sec`` 内的调用直接抛 GatewayUnavailableError，不再每次等超时；
+  之后放行一个探测请求（半开），成功即恢复。设备离线等 4xx 说明网关是好的，
+  不计入失败；
+- 按命令类型（REBOOT / SNAPSHOT / ...）记录延迟直方图和结果计数，
+  ``GET /debug/gateway`` 查看。
+"""
+
+import asyncio
+import bisect
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayUnavailableError(RuntimeError):
+    """Raised without a network call while the circuit breaker is open."""
+
+
+def build_command_payload(device_id: str, command: str, data: Any = "", cmd_id: Optional[str] = None) -> Dict[str, Any]:
+    # data 同时兼容字符串和 JSON 结构，后续可复用到截图、策略下发等命令。
+    payload = {"device_id": device_id, "command": command, "data": data}
+    if cmd_id:
+        payload["cmd_id"] = cmd_id
+    return payload
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one probe) -> closed."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_sec: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_sec = reset_timeout_sec
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        # 调用方持有 _lock
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at >= self.reset_timeout_sec:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """True if a request may go out; in half-open state only one probe at a time."""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Gateway circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def abandon(self) -> None:
+        """A probe ended without an outcome (cancelled); let the next call probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def reset(self) -> None:
+        self.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._state(time.monotonic()),
+                "consecutive_failures": self._failures,
+                "rejected": self._rejected,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout_sec": self.reset_timeout_sec,
+            }
+
+
+# 毫秒，最后一个桶是 +Inf
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (cumulative counts in :meth:`snapshot`, like Prometheus)."""
+
+    def __init__(self, buckets_ms: Tuple[float, ...] = LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.outcomes: Dict[str, int] = {}
+
+    def observe(self, latency_ms: float, outcome: str) -> None:
+        self.counts[bisect.bisect_left(self.buckets_ms, latency_ms)] += 1
+        self.count += 1
+        self.sum_ms += latency_ms
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, n in zip(list(self.buckets_ms) + ["+Inf"], self.counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum_ms, 3),
+            "avg_ms": round(self.sum_ms / self.count, 3) if self.count else None,
+            "buckets_ms": buckets,
+            "outcomes": dict(self.outcomes),
+        }
+
+
+def _http2_enabled(requested: bool) -> bool:
+    if not requested:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("GATEWAY_HTTP2 is set but the h2 package is not installed; using HTTP/1.1 keep-alive")
+        return False
+    return True
+
+
+class GatewayClient:
+    """Pooled sync/async client to ``settings.gateway_url`` with circuit breaking and latency metrics."""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        http2: bool = False,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.BaseTransport] = None,
+        async_transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.http2 = _http2_enabled(http2)
+        self.breaker = breaker or CircuitBreaker()
+        self._transport = transport
+        self._async_transport = async_transport
+        self._client: Optional[httpx.Client] = None
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._metrics_lock = threading.Lock()
+
+    # -- pools -----------------------------------------------------------------
+
+    def _client_options(self) -> Dict[str, Any]:
+        return {"base_url": self.base_url, "timeout": self.timeout, "limits": self.limits, "http2": self.http2}
+
+    def _sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None or self._client.is_closed:
+                self._client = httpx.Client(transport=self._transport, **self._client_options())
+            return self._client
+
+    def _async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(transport=self._async_transport, **self._client_options())
+                self._clients[loop] = client
+            return client
+
+    # -- bookkeeping -----------------------------------------------------------
+
+    def _before(self, command: str) -> None:
+        if not self.breaker.allow():
+            self._observe(command, 0.0, "rejected")
+            raise GatewayUnavailableError(f"gateway {self.base_url} unavailable (circuit open)")
+
+    def _after(self, command: str, started: float, resp: Optional[httpx.Response], error: Optional[Exception]) -> None:
+        latency_ms = (time.perf_counter() - started) * 1000
+        if error is not None:
+            # 网络错误 / 超时：网关不可达
+            self.breaker.record_failure()
+            self._observe(command, latency_ms, "error")
+            return
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._observe(command, latency_ms, str(resp.status_code))
+
+    def _observe(self, command: str, latency_ms: float, outcome: str) -> None:
+        with self._metrics_lock:
+            histogram = self._histograms.get(command)
+            if histogram is None:
+                histogram = self._histograms[command] = LatencyHistogram()
+            histogram.observe(latency_ms, outcome)
+
+    # -- commands --------------------------------------------------------------
+
+    def send_command(self, device_id: str, command: str, data: Any = "", cmd_id: Optional[str] = None) -> Dict[str, Any]:
+        """Blocking send for sync handlers / scripts; raises on transport errors and non-2xx responses."""
+        self._before(command)
+        started = time.perf_counter()
+        try:
+            resp = self._sync_client().post("/api/send", json=build_command_payload(device_id, command, data, cmd_id))
+        except Exception as e:
+            self._after(command, started, None, e)
+            raise
+        except BaseException:
+            # 请求被取消：不算网关故障，但要让出半开状态的探测名额。
+            self.breaker.abandon()
+            raise
+        self._after(command, started, resp, None)
+        resp.raise_for_status()
+        return {"status": "ok"}
+
+    async def asend_command(
+        self, device_id: str, command: str, data: Any = "", cmd_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Non-blocking send for async handlers; same errors as :meth:`send_command`."""
+        self._before(command)
+        started = time.perf_counter()
+        try:
+            resp = await self._async_client().post("/api/send", json=build_command_payload(device_id, command, data, cmd_id))
+        except Exception as e:
+            self._after(command, started, None, e)
+            raise
+        except BaseException:
+            # 请求被取消：不算网关故障，但要让出半开状态的探测名额。
+            self.breaker.abandon()
+            raise
+        self._after(command, started, resp, None)
+        resp.raise_for_status()
+        return {"status": "ok"}
+
+    # -- lifecycle / introspection ---------------------------------------------
+
+    def close(self) -> None:
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    async def aclose(self) -> None:
+        """Close the async pool of the running loop and the sync pool (application shutdown)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+        self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            commands = {name: h.snapshot() for name, h in sorted(self._histograms.items())}
+        return {
+            "base_url": self.base_url,
+            "http2": self.http2,
+            "timeout_sec": self.timeout,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "circuit": self.breaker.stats(),
+            "commands": commands,
+        }
+
+
+_CLIENT: Optional[GatewayClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_gateway_client() -> GatewayClient:
+    """Process-wide gateway client configured from settings."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = GatewayClient(
+                    settings.gateway_url,
+                    timeout=settings.gateway_timeout_sec,
+                    max_connections=settings.gateway_max_connections,
+                    max_keepalive_connections=settings.gateway_max_keepalive,
+                    http2=settings.gateway_http2,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.gateway_breaker_failures,
+                        reset_timeout_sec=settings.gateway_breaker_reset_sec,
+                    ),
+                )
+    return _CLIENT
@@ -0,0 +1,280 @@
+"""
+Standalone multi-worker play-log ingestion runner.
+
+API 进程里的单线程消费者受 GIL 和 uvicorn 生命周期限制，吞吐上不去；
+这里把消费拆成独立进程组，每个 worker 是同一 consumer group 下的一个
+KafkaPlayLogConsumer（manual-commit 模式），由 Kafka 按分区分配负载：
+
+- worker 数量建议不超过 topic 分区数，多出的 worker 会处于空闲状态；
+- 分区 rebalance 时 worker 先落库并提交 offset 再交出分区；
+- 父进程汇总各 worker 的指标，定期打印，并可写入 JSON 文件；
+- worker 异常退出时按退避时间重启（连续崩溃时退避时间翻倍，worker 稳定运行
+  ``healthy_after_sec`` 后退避时间复位），SIGINT/SIGTERM 会转发给所有 worker。
+
+Usage::
+
+    python -m app.services.ingest_runner --workers 4 --metrics-file data/ingest_metrics.json
+
+同时运行该 runner 时，建议在 API 进程设置 ``PLAYLOG_INGEST_IN_API=false``，
+避免 API 内置消费者也加入同一个 consumer group。
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 计数类指标在汇总时直接求和。
+_SUMMED_METRICS = (
+    'messages',
+    'records',
+    'written',
+    'flushes',
+    'commits',
+    'flush_errors',
+    'commit_errors',
+    'rebalances',
+    'dead_lettered',
+    'buffered_records',
+)
+
+
+def aggregate_metrics(per_worker: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine per-worker ``metrics_snapshot()`` dicts into one summary."""
+    totals: Dict[str, Any] = {name: 0 for name in _SUMMED_METRICS}
+    partitions = []
+    flush_ms = []
+    for snap in per_worker.values():
+        for name in _SUMMED_METRICS:
+            totals[name] += int(snap.get(name) or 0)
+        partitions.extend(snap.get('assigned_partitions') or [])
+        if snap.get('last_flush_ms') is not None:
+            flush_ms.append(float(snap['last_flush_ms']))
+    totals['workers'] = len(per_worker)
+    totals['assigned_partitions'] = sorted(partitions)
+    totals['last_flush_ms_max'] = max(flush_ms) if flush_ms else None
+    return totals
+
+
+def _worker_main(worker_id: int, metrics_queue, report_interval: float) -> None:
+    """Entry point of one worker process."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - worker-{worker_id} - %(name)s - %(levelname)s - %(message)s',
+    )
+    # 多 worker 依赖 rebalance 回调里的 flush + commit，强制 manual 模式。
+    os.environ['KAFKA_PLAYLOG_COMMIT_MODE'] = 'manual'
+
+    from app.db.session import close_pool
+    from app.services.kafka_consumer import create_consumer
+
+    consumer = create_consumer()
+    stopped = threading.Event()
+
+    def _handle_signal(signum, frame):
+        logger.info(f"Worker {worker_id} received signal {signum}, stopping")
+        consumer.running = False
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    def _report():
+        while not stopped.wait(report_interval):
+            try:
+                metrics_queue.put_nowait((worker_id, consumer.metrics_snapshot()))
+            except Exception:
+                pass
+
+    reporter = threading.Thread(target=_report, daemon=True, name=f"IngestMetrics-{worker_id}")
+    reporter.start()
+    try:
+        consumer.start_consuming()
+    finally:
+        stopped.set()
+        try:
+            metrics_queue.put_nowait((worker_id, consumer.metrics_snapshot()))
+        except Exception:
+            pass
+        close_pool()
+
+
+class IngestRunner:
+    """Supervises a pool of play-log consumer worker processes."""
+
+    def __init__(
+        self,
+        workers: int = 2,
+        report_interval: float = 10.0,
+        metrics_file: Optional[str] = None,
+        restart_backoff_sec: float = 1.0,
+        max_restart_backoff_sec: float = 60.0,
+        healthy_after_sec: float = 300.0,
+    ):
+        self.workers = max(1, int(workers))
+        self.report_interval = report_interval
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self.restart_backoff_sec = restart_backoff_sec
+        self.max_restart_backoff_sec = max_restart_backoff_sec
+        self.healthy_after_sec = healthy_after_sec
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._queue = self._ctx.Queue()
+        self._procs: Dict[int, Any] = {}
+        self._backoff: Dict[int, float] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._started_at: Dict[int, float] = {}
+        self._restarts: Dict[int, int] = {}
+        self._metrics: Dict[int, Dict[str, Any]] = {}
+        self._stopping = False
+
+    def _spawn(self, worker_id: int) -> None:
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self._queue, self.report_interval),
+            name=f"playlog-ingest-{worker_id}",
+            daemon=False,
+        )
+        proc.start()
+        self._procs[worker_id] = proc
+        self._started_at[worker_id] = time.monotonic()
+        logger.info(f"Started ingest worker {worker_id} (pid={proc.pid})")
+
+    def stop(self, *_args) -> None:
+        if self._stopping:
+            return
+        self._stopping = True
+        logger.info("Stopping ingest workers...")
+        for proc in self._procs.values():
+            if proc.is_alive():
+                proc.terminate()  # SIGTERM -> worker 完成最后一次 flush 后退出
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'total': aggregate_metrics(self._metrics),
+            'workers': {
+                str(wid): {
+                    **snap,
+                    'pid': self._procs[wid].pid if wid in self._procs else None,
+                    'alive': self._procs[wid].is_alive() if wid in self._procs else False,
+                    'restarts': self._restarts.get(wid, 0),
+                }
+                for wid, snap in sorted(self._metrics.items())
+            },
+        }
+
+    def _drain_metrics(self, timeout: float) -> None:
+        try:
+            worker_id, snap = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self._metrics[worker_id] = snap
+        while True:
+            try:
+                worker_id, snap = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._metrics[worker_id] = snap
+
+    def _report(self) -> None:
+        snap = self.snapshot()
+        logger.info(f"Ingest metrics: {json.dumps(snap['total'], ensure_ascii=False)}")
+        if self.metrics_file is None:
+            return
+        try:
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.metrics_file.with_suffix(self.metrics_file.suffix + '.tmp')
+            tmp.write_text(json.dumps(snap, ensure_ascii=False, indent=2), encoding='utf-8')
+            os.replace(tmp, self.metrics_file)
+        except Exception as e:
+            logger.warning(f"Failed to write ingest metrics file: {e}")
+
+    def _check_workers(self) -> None:
+        now = time.monotonic()
+        for worker_id, proc in list(self._procs.items()):
+            if proc.is_alive():
+                continue
+            if worker_id not in self._restart_at:
+                # 稳定运行过一段时间后再退出，视为新的故障，不沿用以前累积的退避时间。
+                if now - self._started_at.get(worker_id, now) >= self.healthy_after_sec:
+                    self._backoff.pop(worker_id, None)
+                delay = self._backoff.get(worker_id, self.restart_backoff_sec)
+                logger.warning(
+                    f"Ingest worker {worker_id} exited with code {proc.exitcode}; restarting in {delay:.1f}s"
+                )
+                self._restart_at[worker_id] = now + delay
+                self._backoff[worker_id] = min(delay * 2, self.max_restart_backoff_sec)
+            elif now >= self._restart_at[worker_id]:
+                del self._restart_at[worker_id]
+                self._restarts[worker_id] = self._restarts.get(worker_id, 0) + 1
+                self._spawn(worker_id)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+        next_report = time.monotonic() + self.report_interval
+        try:
+            while not self._stopping:
+                self._drain_metrics(timeout=0.5)
+                self._check_workers()
+                if time.monotonic() >= next_report:
+                    self._report()
+                    next_report = time.monotonic() + self.report_interval
+        finally:
+            self.stop()
+            deadline = time.monotonic() + 30
+            for proc in self._procs.values():
+                proc.join(timeout=max(0.0, deadline - time.monotonic()))
+                if proc.is_alive():
+                    logger.warning(f"Ingest worker pid={proc.pid} did not exit in time; killing")
+                    proc.kill()
+                    proc.join(timeout=5)
+            self._drain_metrics(timeout=0.1)
+            self._report()
+            logger.info("Ingest runner stopped")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run partition-parallel play-log ingestion workers.")
+    parser.add_argument(
+        '--workers', type=int,
+        default=int(os.getenv('PLAYLOG_INGEST_WORKERS', '2')),
+        help="number of consumer processes (<= topic partition count)",
+    )
+    parser.add_argument(
+        '--report-interval', type=float,
+        default=float(os.getenv('PLAYLOG_INGEST_REPORT_INTERVAL_SEC', '10')),
+        help="seconds between metrics reports",
+    )
+    parser.add_argument(
+        '--metrics-file',
+        default=os.getenv('PLAYLOG_INGEST_METRICS_FILE') or None,
+        help="optional JSON file updated with aggregated metrics",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    IngestRunner(
+        workers=args.workers,
+        report_interval=args.report_interval,
+        metrics_file=args.metrics_file,
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,21 +9,45 @@ This service:
 5. Handles data type conversions and timestamp normalization
 """
 
-import json
 import logging
 import os
 import time
 from typing import Dict, Optional
 from datetime import datetime
-from app.services.db_service import get_conn
+
+import psycopg2
+
+from app.db.session import PoolTimeout, get_pool
+from app.services.db_service import connection, upsert_ad_logs_batch
+from app.services.dead_letter import build_entry, create_dead_letter_sink
+from app.services.device_cache import KnownDeviceCache, get_known_device_cache
+from app.services.playlog_codec import (
+    PlayLogRecord,
+    get_decoder,
+    normalize_log_record,
+    parse_timestamp,
+)
 
 logger = logging.getLogger(__name__)
 
+# 连接级故障：逐条重试或隔离单条记录都没有意义，交给调用方重连 / 回退 offset。
+_TRANSIENT_DB_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+
 
 class KafkaPlayLogConsumer:
     """Kafka consumer for play log messages from edge devices."""
     
-    def __init__(self, brokers: list, topic: str = "play_logs", group_id: str = "control-plane-play-logs"):
+    def __init__(
+        self,
+        brokers: list,
+        topic: str = "play_logs",
+        group_id: str = "control-plane-play-logs",
+        device_cache: Optional[KnownDeviceCache] = None,
+        manual_commit: bool = False,
+        flush_records: int = 5000,
+        flush_interval_ms: int = 500,
+        dead_letters=None,
+    ):
         """
         Initialize Kafka consumer.
         
@@ -31,23 +55,55 @@ class KafkaPlayLogConsumer:
             brokers: List of Kafka broker addresses (e.g., ["10.12.58.42:9092"])
             topic: Kafka topic to consume from (default: "play_logs")
             group_id: Consumer group ID (default: "control-plane-play-logs")
+            device_cache: Known-device cache for the ad_logs FK check
+                (default: the process-wide cache shared with /devices/register)
+            manual_commit: Commit offsets only after the DB transaction for the
+                records up to that offset has committed (at-least-once)
+            flush_records: Manual-commit mode flushes once this many records are buffered
+            flush_interval_ms: ...or once the oldest buffered record is this old
+            dead_letters: Dead-letter sink for poison messages / rows
+                (default: created from PLAYLOG_DLQ_* on first use, see dead_letter.py)
         """
         self.brokers = brokers
         self.topic = topic
         self.group_id = group_id
         self.consumer = None
         self.running = False
+        self.device_cache = device_cache if device_cache is not None else get_known_device_cache()
+        self.manual_commit = manual_commit
+        self.flush_records = max(1, int(flush_records))
+        self.flush_interval_ms = max(1, int(flush_interval_ms))
+        self._loop_active = False
+        self._conn = None
+        self._buffer: list = []
+        self._pending: Dict = {}
+        self._first_buffered_at: Optional[float] = None
+        # log_id -> (topic, partition, offset)，写库失败隔离时记录来源位置
+        self._sources: Dict = {}
+        self._dead_letters = dead_letters
+        self.decoder = get_decoder()
+        self.metrics: Dict = {
+            'messages': 0,
+            'records': 0,
+            'written': 0,
+            'flushes': 0,
+            'commits': 0,
+            'flush_errors': 0,
+            'commit_errors': 0,
+            'rebalances': 0,
+            'dead_lettered': 0,
+            'last_flush_ms': None,
+            'assigned_partitions': [],
+        }
         
     def _get_db_connection(self):
-        """Create and return a PostgreSQL connection."""
-        try:
-            # 复用 db_service 的连接逻辑（含 .env 加载和默认值），
-            # 避免消费者与 API 使用不同默认连接参数。
-            conn = get_conn()
-            return conn
-        except Exception as e:
-            logger.error(f"Failed to connect to PostgreSQL: {e}")
-            raise
+        """
+        Return a context manager that checks out a pooled PostgreSQL connection.
+
+        复用 db_service 的进程级连接池，避免每次 poll 都新建连接，
+        也保证消费者与 API 使用相同的连接参数。
+        """
+        return connection()
 
     @staticmethod
     def _deserialize_message(raw: bytes):
@@ -55,225 +111,40 @@ class KafkaPlayLogConsumer:
         Deserialize Kafka payload with encoding fallbacks.
 
         正常情况是 UTF-8 JSON；若历史数据或错误生产者写入了其他编码，
-        这里回退到 gb18030 / latin1，尽量让消费不中断。
+        会回退到 gb18030 / latin1，尽量让消费不中断（见 playlog_codec）。
         """
-        if raw is None:
-            return {}
+        return get_decoder().loads(raw)
 
-        last_exc = None
-        for enc in ('utf-8', 'gb18030', 'latin1'):
-            try:
-                text = raw.decode(enc)
-                return json.loads(text)
-            except Exception as e:
-                last_exc = e
-                continue
-
-        raise ValueError(f"Unable to deserialize kafka message, last error: {last_exc}")
-    
     def _parse_timestamp(self, ts_value) -> Optional[datetime]:
-        """
-        Parse timestamp from various formats.
-        
-        Args:
-            ts_value: Can be Unix timestamp (int), ISO string, or None
-            
-        Returns:
-            datetime object or None
-        """
-        if ts_value is None:
-            return None
-            
-        try:
-            # If it's already a timestamp string in ISO format
-            if isinstance(ts_value, str):
-                # Try parsing ISO format first
-                if 'T' in ts_value or ' ' in ts_value:
-                    return datetime.fromisoformat(ts_value.replace('+08:00', '').replace('Z', ''))
-                # If not, might be a numeric string
-                return None
-            
-            # If it's a Unix timestamp (seconds or milliseconds)
-            if isinstance(ts_value, (int, float)):
-                if ts_value > 1e12:  # Likely milliseconds
-                    ts_value = ts_value / 1000
-                return datetime.fromtimestamp(ts_value)
-                
-        except Exception as e:
-            logger.warning(f"Failed to parse timestamp {ts_value}: {e}")
-        
-        return None
-    
-    def _normalize_log_record(self, log_data: Dict) -> Dict:
+        """Parse a Unix timestamp (s/ms) or ISO string; see ``playlog_codec.parse_timestamp``."""
+        return parse_timestamp(ts_value)
+
+    def _normalize_log_record(self, log_data: Dict) -> Optional[PlayLogRecord]:
         """
         Normalize and validate log record from Kafka message.
-        
-        Args:
-            log_data: Raw log data from Kafka message
-            
+
         Returns:
-            Normalized log record ready for database insertion
+            PlayLogRecord ready for database insertion, or None if required fields are missing
         """
-        normalized = {}
-        
-        # Required fields
-        normalized['log_id'] = log_data.get('log_id')
-        normalized['device_id'] = log_data.get('device_id')
-        
-        if not normalized['log_id'] or not normalized['device_id']:
-            logger.warning(f"Missing required fields in log record: {log_data}")
-            return None
-        
-        # Standard fields
-        normalized['material_id'] = log_data.get('material_id') or log_data.get('ad_id')  # Support both names
-        normalized['ad_file_name'] = log_data.get('ad_file_name')
-        normalized['status_code'] = log_data.get('status_code')
-        normalized['status_msg'] = log_data.get('status_msg')
-        device_ip = log_data.get('device_ip')
-        # PostgreSQL INET 字段不接受空字符串，统一转成 NULL。
-        if isinstance(device_ip, str):
-            device_ip = device_ip.strip()
-            if not device_ip:
-                device_ip = None
-        normalized['device_ip'] = device_ip
-        normalized['firmware_version'] = log_data.get('firmware_version')
-        
-        # Duration is typically in milliseconds from edge (store as INT)
-        normalized['duration_ms'] = log_data.get('duration_ms')
-        
-        # Timestamp parsing for start/end times
-        normalized['start_time'] = self._parse_timestamp(log_data.get('start_time'))
-        normalized['end_time'] = self._parse_timestamp(log_data.get('end_time'))
-        
-        # Device-reported creation timestamp (keep as-is, should be BIGINT Unix timestamp)
-        normalized['created_at'] = log_data.get('created_at')
-        
-        # MD5 verification fields (get from message, don't hardcode)
-        normalized['expected_md5'] = log_data.get('expected_md5')
-        normalized['actual_md5'] = log_data.get('actual_md5')
-        normalized['is_valid'] = log_data.get('is_valid')
-        billing_status = log_data.get('billing_status') or 'pending'
-        if billing_status not in {'unbilled', 'billed', 'failed', 'pending'}:
-            billing_status = 'pending'
-        normalized['billing_status'] = billing_status
-        
-        return normalized
-    
-    def _ensure_device_exists(self, conn, device_id: str) -> bool:
-        """
-        Ensure device exists to satisfy ad_logs.device_id FK constraint.
+        return normalize_log_record(log_data)
 
-        尝试最小插入 device_id；若表上还有其他非空约束导致失败，返回 False。
-        """
+    def _warm_device_cache(self) -> None:
+        """Preload known device_ids from the devices table (best-effort)."""
         try:
-            cur = conn.cursor()
-            cur.execute("SELECT 1 FROM devices WHERE device_id = %s LIMIT 1", (device_id,))
-            if cur.fetchone():
-                return True
-
-            cur.execute(
-                "INSERT INTO devices (device_id) VALUES (%s) ON CONFLICT (device_id) DO NOTHING",
-                (device_id,),
-            )
-            conn.commit()
-            return True
+            with self._get_db_connection() as conn:
+                loaded = self.device_cache.warm(conn)
+            logger.info(f"Known-device cache warmed with {loaded} devices")
         except Exception as e:
-            conn.rollback()
-            logger.error("Failed to ensure device exists device_id=%s err=%s", device_id, e)
-            return False
-        finally:
-            try:
-                cur.close()
-            except Exception:
-                pass
+            logger.warning(f"Failed to warm known-device cache: {e}")
 
-    def _insert_log_record(self, conn, log_record: Dict) -> bool:
-        """
-        Insert or update a log record in the database using UPSERT.
-        
-        Args:
-            conn: PostgreSQL connection
-            log_record: Normalized log record
-            
-        Returns:
-            True if successful, False otherwise
-        """
-        try:
-            cur = conn.cursor()
-
-            # ad_logs.device_id 有外键约束，先确保设备存在。
-            if not self._ensure_device_exists(conn, log_record.get('device_id')):
-                logger.error("Skip log due to missing device FK log_id=%s device_id=%s", log_record.get('log_id'), log_record.get('device_id'))
-                return False
-            
-            # UPSERT query (INSERT ... ON CONFLICT)
-            sql = """
-            INSERT INTO ad_logs (
-                log_id, device_id, material_id, ad_file_name, start_time, end_time,
-                duration_ms, status_code, status_msg, device_ip, firmware_version,
-                created_at, expected_md5, actual_md5, is_valid, billing_status
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-            )
-            ON CONFLICT (log_id) DO UPDATE SET
-                device_id = EXCLUDED.device_id,
-                material_id = EXCLUDED.material_id,
-                ad_file_name = EXCLUDED.ad_file_name,
-                start_time = EXCLUDED.start_time,
-                end_time = EXCLUDED.end_time,
-                duration_ms = EXCLUDED.duration_ms,
-                status_code = EXCLUDED.status_code,
-                status_msg = EXCLUDED.status_msg,
-                device_ip = EXCLUDED.device_ip,
-                firmware_version = EXCLUDED.firmware_version,
-                created_at = EXCLUDED.created_at,
-                expected_md5 = EXCLUDED.expected_md5,
-                actual_md5 = EXCLUDED.actual_md5,
-                is_valid = EXCLUDED.is_valid,
-                billing_status = EXCLUDED.billing_status;
-            """
-            
-            cur.execute(sql, (
-                log_record.get('log_id'),
-                log_record.get('device_id'),
-                log_record.get('material_id'),
-                log_record.get('ad_file_name'),
-                log_record.get('start_time'),
-                log_record.get('end_time'),
-                log_record.get('duration_ms'),
-                log_record.get('status_code'),
-                log_record.get('status_msg'),
-                log_record.get('device_ip'),
-                log_record.get('firmware_version'),
-                log_record.get('created_at'),
-                log_record.get('expected_md5'),
-                log_record.get('actual_md5'),
-                log_record.get('is_valid'),
-                log_record.get('billing_status')
-            ))
-            
-            conn.commit()
-            return True
-            
-        except Exception as e:
-            pgcode = getattr(e, 'pgcode', None)
-            pgerror = getattr(e, 'pgerror', None)
-            logger.error(
-                "Failed to insert log record log_id=%s device_id=%s pgcode=%s err=%s pgerror=%s",
-                log_record.get('log_id'),
-                log_record.get('device_id'),
-                pgcode,
-                e,
-                pgerror,
-            )
-            conn.rollback()
-            return False
-        finally:
-            cur.close()
-    
     def _insert_batch(self, conn, log_records: list) -> int:
         """
         Insert a batch of log records efficiently.
+
+        整批走 db_service.upsert_ad_logs_batch（一条集合式 devices 补齐 +
+        一条多行 UPSERT，单事务提交），健康流量只有这一次往返。整批因数据
+        错误失败时二分重试：每次把失败的一半再拆开，直到定位到单条坏记录
+        并隔离到死信队列，k 条坏记录只需 O(k·log n) 次写入。
         
         Args:
             conn: PostgreSQL connection
@@ -284,27 +155,171 @@ class KafkaPlayLogConsumer:
         """
         if not log_records:
             return 0
-        
-        success_count = 0
-        for record in log_records:
-            if self._insert_log_record(conn, record):
-                success_count += 1
-        
+
+        try:
+            success_count = self._upsert(conn, log_records)
+            logger.info(f"Batch insert: {success_count}/{len(log_records)} records inserted (bulk)")
+            return success_count
+        except _TRANSIENT_DB_ERRORS:
+            raise
+        except Exception as e:
+            logger.warning(f"Bulk insert of {len(log_records)} records failed, bisecting: {e}")
+            success_count = self._bisect_insert(conn, log_records, e)
+
         logger.info(f"Batch insert: {success_count}/{len(log_records)} records inserted")
         return success_count
-    
+
+    def _upsert(self, conn, log_records: list) -> int:
+        # 只为缓存里没有的设备补插 devices，已知设备跳过外键检查。
+        batch_devices = [r.get('device_id') for r in log_records if r and r.get('device_id')]
+        unknown = self.device_cache.missing(batch_devices)
+        written = upsert_ad_logs_batch(conn, log_records, device_ids=unknown)
+        self.device_cache.add_many(unknown)
+        return written
+
+    def _bisect_insert(self, conn, log_records: list, error: Exception) -> int:
+        if len(log_records) == 1:
+            record = log_records[0]
+            self._dead_letter('insert', error, source=self._sources.get(record.get('log_id')),
+                              record=record.as_dict() if hasattr(record, 'as_dict') else dict(record))
+            return 0
+        mid = len(log_records) // 2
+        written = 0
+        for half in (log_records[:mid], log_records[mid:]):
+            try:
+                written += self._upsert(conn, half)
+            except _TRANSIENT_DB_ERRORS:
+                raise
+            except Exception as e:
+                written += self._bisect_insert(conn, half, e)
+        return written
+
+    @property
+    def dead_letters(self):
+        if self._dead_letters is None:
+            self._dead_letters = create_dead_letter_sink(self.brokers)
+        return self._dead_letters
+
+    def _dead_letter(self, stage: str, error, source=None, raw=None, record=None) -> None:
+        """Quarantine one poison message / record instead of dropping it."""
+        self.metrics['dead_lettered'] += 1
+        logger.error(f"Dead-lettering play log ({stage}) at {source}: {error}")
+        sink = self.dead_letters
+        if sink is None:
+            return
+        sink.publish(build_entry(stage, error, source=source, raw=raw, record=record))
+
+    def _message_records(self, topic_partition, message) -> list:
+        """Decode one Kafka message into records; undecodable payloads go to the DLQ."""
+        source = (getattr(topic_partition, 'topic', None), getattr(topic_partition, 'partition', None), message.offset)
+        value = message.value
+        if value is None or isinstance(value, (bytes, bytearray)):
+            try:
+                value = self.decoder.loads(value)
+            except Exception as e:
+                self._dead_letter('decode', e, source=source, raw=value)
+                return []
+        return self._records_from_message(value, source=source, timestamp=getattr(message, 'timestamp', None))
+
+    def _records_from_message(self, log_data, source=None, timestamp=None) -> list:
+        """Normalize one Kafka message (single log or ``{"payload": [...]}`` wrapper) into records."""
+        if not isinstance(log_data, dict):
+            self._dead_letter('normalize', 'message is not a JSON object', source=source,
+                              record={'value': log_data})
+            return []
+        if 'payload' in log_data:
+            # Wrapped format with payload array
+            items = log_data.get('payload') or []
+        else:
+            # Direct log format
+            items = [log_data]
+        records = []
+        for item in items:
+            record = normalize_log_record(item) if isinstance(item, dict) else None
+            if record is None:
+                self._dead_letter('normalize', 'missing log_id/device_id or not an object',
+                                  source=source, record=item if isinstance(item, dict) else {'value': item})
+                continue
+            if record.start_time is None and record.created_at is None and timestamp is not None and timestamp > 0:
+                # 分区键只能由消息本身推导：用 Kafka 消息时间戳（重复投递时不变），不用入库时间。
+                record = record._replace(start_time=parse_timestamp(timestamp))
+            records.append(record)
+            if source is not None:
+                self._sources[record.log_id] = source
+        self.metrics['records'] += len(records)
+        return records
+
+    def _build_kafka_consumer(self, enable_auto_commit: bool, max_poll_records: int):
+        from kafka import KafkaConsumer
+
+        consumer = KafkaConsumer(
+            bootstrap_servers=self.brokers,
+            group_id=self.group_id,
+            auto_offset_reset='earliest',
+            enable_auto_commit=enable_auto_commit,
+            max_poll_records=max_poll_records,
+            session_timeout_ms=30000,
+            request_timeout_ms=40000,
+        )
+        # 不设置 value_deserializer：解析放到消费循环里，坏消息进死信队列，
+        # 而不是在 poll() 内抛错卡住整个分区。
+        # 通过 rebalance 回调在分区被收回前落库并提交 offset，多 worker
+        # 同组消费时避免分区迁移造成重复或丢失。
+        consumer.subscribe([self.topic], listener=self._rebalance_listener())
+        return consumer
+
+    def _rebalance_listener(self):
+        from kafka import ConsumerRebalanceListener
+
+        owner = self
+
+        class _Listener(ConsumerRebalanceListener):
+            def on_partitions_revoked(self, revoked):
+                owner._on_partitions_revoked(revoked)
+
+            def on_partitions_assigned(self, assigned):
+                owner._on_partitions_assigned(assigned)
+
+        return _Listener()
+
+    def _on_partitions_revoked(self, revoked) -> None:
+        self.metrics['rebalances'] += 1
+        logger.info(f"Partitions revoked: {sorted(str(tp) for tp in revoked)}")
+        if self.manual_commit and self._pending:
+            try:
+                self._flush_pending()
+            except Exception as e:
+                # 分区即将交给其他 worker：未提交部分由新 owner 重新消费。
+                logger.error(f"Flush on partition revoke failed; records will be redelivered: {e}")
+            self._reset_pending()
+
+    def _on_partitions_assigned(self, assigned) -> None:
+        self.metrics['assigned_partitions'] = sorted(
+            f"{tp.topic}-{tp.partition}" for tp in assigned
+        )
+        logger.info(f"Partitions assigned: {self.metrics['assigned_partitions']}")
+
+    def metrics_snapshot(self) -> Dict:
+        """Return a copy of this consumer's ingest counters."""
+        snap = dict(self.metrics)
+        snap['assigned_partitions'] = list(self.metrics['assigned_partitions'])
+        snap['buffered_records'] = len(self._buffer)
+        snap['device_cache'] = self.device_cache.stats()
+        return snap
+
     def start_consuming(self, batch_size: int = 50):
         """
         Start consuming messages from Kafka topic and persist to database.
         
         This method sets up a Kafka consumer and continuously processes messages.
         In a production environment, this would typically run as a background service.
+        When the consumer was created with ``manual_commit=True`` this delegates
+        to :meth:`_consume_manual_commit`.
         
         Args:
             batch_size: Number of messages to process before committing (default: 50)
         """
         try:
-            from kafka import KafkaConsumer
             from kafka.errors import KafkaError
         except ImportError:
             logger.error("kafka-python package not installed. Install with: pip install kafka-python")
@@ -312,22 +327,17 @@ class KafkaPlayLogConsumer:
         
         logger.info(f"Starting Kafka consumer for topic '{self.topic}' with group '{self.group_id}'")
         logger.info(f"Brokers: {self.brokers}")
+
+        if self.manual_commit:
+            return self._consume_manual_commit()
         
         try:
-            self.consumer = KafkaConsumer(
-                self.topic,
-                bootstrap_servers=self.brokers,
-                group_id=self.group_id,
-                auto_offset_reset='earliest',
-                enable_auto_commit=True,
-                max_poll_records=batch_size,
-                value_deserializer=self._deserialize_message,
-                session_timeout_ms=30000,
-                request_timeout_ms=40000,
-            )
+            self.consumer = self._build_kafka_consumer(enable_auto_commit=True, max_poll_records=batch_size)
             
             self.running = True
+            self._loop_active = True
             batch = []
+            self._warm_device_cache()
             
             logger.info("Kafka consumer started successfully, waiting for messages...")
             
@@ -338,34 +348,18 @@ class KafkaPlayLogConsumer:
                     if not messages:
                         continue
                     
-                    conn = self._get_db_connection()
-                    try:
+                    with self._get_db_connection() as conn:
                         for topic_partition, records in messages.items():
                             for message in records:
                                 try:
-                                    log_data = message.value
-                                    logger.debug(f"Received log message: {log_data.get('log_id')}")
-                                    
-                                    # Check if it's a single message or batch
-                                    if isinstance(log_data, dict):
-                                        # Single message format or wrapped message
-                                        if 'payload' in log_data:
-                                            # Wrapped format with payload array
-                                            payload = log_data.get('payload', [])
-                                            for log_item in payload:
-                                                normalized = self._normalize_log_record(log_item)
-                                                if normalized:
-                                                    batch.append(normalized)
-                                        else:
-                                            # Direct log format
-                                            normalized = self._normalize_log_record(log_data)
-                                            if normalized:
-                                                batch.append(normalized)
+                                    self.metrics['messages'] += 1
+                                    batch.extend(self._message_records(topic_partition, message))
                                     
                                     # Process batch when size reached
                                     if len(batch) >= batch_size:
-                                        self._insert_batch(conn, batch)
+                                        self.metrics['written'] += self._insert_batch(conn, batch)
                                         batch = []
+                                        self._sources.clear()
                                         
                                 except Exception as e:
                                     logger.error(f"Error processing message: {e}")
@@ -373,15 +367,15 @@ class KafkaPlayLogConsumer:
                         
                         # Process remaining messages in batch
                         if batch:
-                            self._insert_batch(conn, batch)
+                            self.metrics['written'] += self._insert_batch(conn, batch)
                             batch = []
-                            
-                    finally:
-                        conn.close()
+                        self._sources.clear()
                         
                 except KafkaError as e:
                     logger.error(f"Kafka error: {e}")
                 except Exception as e:
+                    batch = []
+                    self._sources.clear()
                     logger.error(f"Error in message processing loop: {e}")
                     time.sleep(5)  # Backoff before retry
         
@@ -389,17 +383,166 @@ class KafkaPlayLogConsumer:
             logger.error(f"Failed to start Kafka consumer: {e}")
             raise
         finally:
+            self._loop_active = False
+            self.stop()
+
+    def _consume_manual_commit(self):
+        """
+        At-least-once consume loop with manual offset commits.
+
+        - enable_auto_commit=False：offset 只在对应记录所在的数据库事务提交之后才提交；
+        - 按条数（flush_records）或时间（flush_interval_ms）触发批量落库；
+        - 整个循环持有一条池化连接，连接故障时丢弃并重新获取；
+        - 落库失败时不提交 offset，并把各分区 seek 回最早未提交的位置重新消费；
+        - 分区被 rebalance 收回前先 flush 并提交（见 _on_partitions_revoked）。
+        """
+        from kafka.errors import KafkaError
+
+        self.consumer = self._build_kafka_consumer(
+            enable_auto_commit=False,
+            max_poll_records=min(self.flush_records, 1000),
+        )
+        self.running = True
+        self._loop_active = True
+        self._reset_pending()
+        self._warm_device_cache()
+        logger.info(
+            "Kafka consumer started in manual-commit mode (flush_records=%s, flush_interval_ms=%s)",
+            self.flush_records,
+            self.flush_interval_ms,
+        )
+
+        interval = self.flush_interval_ms / 1000.0
+        try:
+            while self.running:
+                try:
+                    if self._first_buffered_at is None:
+                        poll_ms = self.flush_interval_ms
+                    else:
+                        remaining = interval - (time.monotonic() - self._first_buffered_at)
+                        poll_ms = max(0, int(remaining * 1000))
+                    messages = self.consumer.poll(
+                        timeout_ms=poll_ms,
+                        max_records=max(1, self.flush_records - len(self._buffer)),
+                    )
+                    for topic_partition, records in (messages or {}).items():
+                        for message in records:
+                            self.metrics['messages'] += 1
+                            if self._first_buffered_at is None:
+                                self._first_buffered_at = time.monotonic()
+                            first, _ = self._pending.get(topic_partition, (message.offset, None))
+                            self._pending[topic_partition] = (first, message.offset + 1)
+                            try:
+                                self._buffer.extend(self._message_records(topic_partition, message))
+                            except Exception as e:
+                                logger.error(f"Error processing message: {e}")
+
+                    due = (
+                        self._first_buffered_at is not None
+                        and time.monotonic() - self._first_buffered_at >= interval
+                    )
+                    if self._pending and (len(self._buffer) >= self.flush_records or due):
+                        try:
+                            self._flush_pending()
+                        except KafkaError as e:
+                            # 记录已落库，只是 offset 提交失败（如 rebalance）：
+                            # 丢弃本批状态，未提交的消息会被重新投递，UPSERT 保证幂等。
+                            self.metrics['commit_errors'] += 1
+                            logger.error(f"Offset commit failed after DB flush: {e}")
+                        self._reset_pending()
+                except KafkaError as e:
+                    logger.error(f"Kafka error: {e}")
+                except Exception as e:
+                    self.metrics['flush_errors'] += 1
+                    logger.error(f"Flush failed, rewinding uncommitted offsets: {e}")
+                    self._rewind(self._pending)
+                    self._reset_pending()
+                    time.sleep(5)  # Backoff before retry
+
+            if self._pending:
+                try:
+                    self._flush_pending()
+                except Exception as e:
+                    logger.error(f"Final flush failed; uncommitted records will be redelivered: {e}")
+                self._reset_pending()
+        finally:
+            self._release_persistent_conn()
+            self._loop_active = False
             self.stop()
+
+    def _reset_pending(self) -> None:
+        self._buffer = []
+        # TopicPartition -> (first offset in buffer, next offset to commit)
+        self._pending = {}
+        self._first_buffered_at = None
+        self._sources = {}
+
+    def _persistent_conn(self):
+        conn = self._conn
+        if conn is None or conn.closed:
+            if conn is not None:
+                self._release_persistent_conn(discard=True)
+            self._conn = conn = get_pool().getconn()
+        return conn
+
+    def _release_persistent_conn(self, discard: bool = False) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                get_pool().putconn(conn, discard=discard or bool(conn.closed))
+            except Exception:
+                pass
+
+    def _flush_pending(self) -> None:
+        """Persist the buffered records in one transaction, then commit their offsets."""
+        started = time.monotonic()
+        if self._buffer:
+            try:
+                self.metrics['written'] += self._insert_batch(self._persistent_conn(), self._buffer)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self._release_persistent_conn(discard=True)
+                raise
+        if self._dead_letters is not None:
+            # 死信先落地再提交 offset，隔离的消息不会因为崩溃而丢失。
+            self._dead_letters.flush()
+        self.consumer.commit(
+            offsets={tp: _offset_and_metadata(nxt) for tp, (_, nxt) in self._pending.items()}
+        )
+        self.metrics['flushes'] += 1
+        self.metrics['commits'] += 1
+        self.metrics['last_flush_ms'] = round((time.monotonic() - started) * 1000.0, 3)
+
+    def _rewind(self, pending: dict) -> None:
+        for tp, (first, _) in pending.items():
+            try:
+                self.consumer.seek(tp, first)
+            except Exception as e:
+                logger.error(f"Failed to seek {tp} back to offset {first}: {e}")
     
     def stop(self):
         """Stop the Kafka consumer."""
         self.running = False
+        if self._loop_active:
+            # 消费循环仍在运行：由循环自身完成最后一次 flush / commit 后关闭。
+            return
         if self.consumer:
             try:
                 self.consumer.close()
                 logger.info("Kafka consumer stopped")
             except Exception as e:
                 logger.error(f"Error closing Kafka consumer: {e}")
+        if self._dead_letters is not None:
+            self._dead_letters.close()
+
+
+def _offset_and_metadata(offset: int):
+    from kafka.structs import OffsetAndMetadata
+
+    # kafka-python >= 2.1 added leader_epoch to OffsetAndMetadata.
+    try:
+        return OffsetAndMetadata(offset, None, -1)
+    except TypeError:
+        return OffsetAndMetadata(offset, None)
 
 
 def create_consumer() -> KafkaPlayLogConsumer:
@@ -415,8 +558,19 @@ def create_consumer() -> KafkaPlayLogConsumer:
     brokers = [b.strip() for b in brokers_str.split(',')]
     
     topic = os.getenv('KAFKA_PLAYLOG_TOPIC', 'play_logs')
+
+    # auto（默认，兼容旧行为）或 manual（落库成功后才提交 offset）。
+    manual_commit = os.getenv('KAFKA_PLAYLOG_COMMIT_MODE', 'auto').strip().lower() == 'manual'
+    flush_records = int(os.getenv('KAFKA_PLAYLOG_FLUSH_RECORDS', '5000'))
+    flush_interval_ms = int(os.getenv('KAFKA_PLAYLOG_FLUSH_INTERVAL_MS', '500'))
     
-    return KafkaPlayLogConsumer(brokers=brokers, topic=topic)
+    return KafkaPlayLogConsumer(
+        brokers=brokers,
+        topic=topic,
+        manual_commit=manual_commit,
+        flush_records=flush_records,
+        flush_interval_ms=flush_interval_ms,
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,237 @@
+"""
+In-memory material catalog with hash indexes on material_id, ad_id and file_name.
+
+网关编译 bundle 时要按播放列表的 ad_id 逐条解析素材，原来的路径是：DB 按
+material_id 查一次、读一遍本地 JSON 索引、最后把最多 1 万条素材全部拉出来
+线性匹配 ad_id / material_id / file_name —— 每个播放条目、每个请求都要走一遍。
+
+这里一次性加载 Postgres + 本地索引的素材，建立三张哈希索引：
+
+- 解析顺序与原来一致：先 material_id，再 ad_id，最后 file_name；同一个
+  ad_id / file_name 对应多条素材时取 material_id 最小者（原来按
+  ``ORDER BY material_id`` 扫描取第一条）；
+- 上传 / 状态变化 / 删除由 material_service 增量更新；
+- TTL 到期整体重新加载，兜底其它进程的写入；
+- 索引未命中的标识合并成一次 ``WHERE material_id / ad_id / file_name = ANY(...)``
+  批量查询，仍未命中的记入负缓存，直到下次重新加载或素材变化。
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Row = Dict[str, Any]
+
+
+def _material_id(row: Row) -> Optional[str]:
+    mid = row.get('material_id') or row.get('id')
+    return mid if isinstance(mid, str) and mid else None
+
+
+def _file_name(row: Row) -> Optional[str]:
+    name = row.get('file_name') or row.get('filename')
+    return name if isinstance(name, str) and name else None
+
+
+def _load_all() -> List[Row]:
+    # 本地索引先放，DB 行后放：同一 material_id 以 DB 为准（与原解析顺序一致）。
+    from app.services import material_service
+
+    rows = list(material_service.list_materials(offset=0, limit=None))
+    try:
+        from app.services import db_service
+
+        rows.extend(db_service.list_all_materials())
+    except Exception as e:
+        logger.warning(f"Material catalog DB load failed, using local index only: {e}")
+    return rows
+
+
+def _load_missing(identifiers: List[str]) -> List[Row]:
+    from app.services import db_service
+
+    return db_service.get_materials_by_identifiers(identifiers)
+
+
+class MaterialCatalog:
+    """Thread-safe material lookup by material_id / ad_id / file_name."""
+
+    def __init__(
+        self,
+        loader: Optional[Callable[[], Iterable[Row]]] = None,
+        batch_loader: Optional[Callable[[List[str]], Iterable[Row]]] = None,
+        ttl_sec: float = 300.0,
+    ):
+        self.loader = loader or _load_all
+        self.batch_loader = batch_loader or _load_missing
+        self.ttl_sec = ttl_sec
+        self._by_id: Dict[str, Row] = {}
+        # ad_id / file_name -> {material_id: row}；取 material_id 最小者。
+        self._by_ad: Dict[str, Dict[str, Row]] = {}
+        self._by_file: Dict[str, Dict[str, Row]] = {}
+        self._missing: set = set()
+        self._expires_at = 0.0
+        self._changes = 0
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._misses = 0
+        self._loads = 0
+        self._batch_queries = 0
+
+    # -- index maintenance -----------------------------------------------------
+
+    def _unindex(self, material_id: str) -> None:
+        row = self._by_id.pop(material_id, None)
+        if row is None:
+            return
+        for index, key in ((self._by_ad, row.get('ad_id')), (self._by_file, _file_name(row))):
+            bucket = index.get(key) if isinstance(key, str) else None
+            if bucket is not None:
+                bucket.pop(material_id, None)
+                if not bucket:
+                    del index[key]
+
+    def _index(self, row: Row) -> None:
+        material_id = _material_id(row)
+        if material_id is None:
+            return
+        self._unindex(material_id)
+        self._by_id[material_id] = row
+        ad_id = row.get('ad_id')
+        if isinstance(ad_id, str) and ad_id:
+            self._by_ad.setdefault(ad_id, {})[material_id] = row
+        file_name = _file_name(row)
+        if file_name:
+            self._by_file.setdefault(file_name, {})[material_id] = row
+
+    def _reload(self) -> None:
+        with self._lock:
+            changes = self._changes
+        rows = list(self.loader())
+        with self._lock:
+            self._by_id.clear()
+            self._by_ad.clear()
+            self._by_file.clear()
+            self._missing.clear()
+            for row in rows:
+                self._index(row)
+            self._loads += 1
+            # 加载期间有增量写入时，快照可能不含该写入：保留结果但下次查询再加载一次。
+            self._expires_at = time.monotonic() + self.ttl_sec if changes == self._changes else 0.0
+
+    def _ensure_loaded(self) -> None:
+        if self._expires_at <= time.monotonic():
+            self._reload()
+
+    def upsert(self, row: Row) -> None:
+        """Apply an upload / status change; the row replaces any previous version."""
+        with self._lock:
+            previous = self._by_id.get(_material_id(row) or '')
+            self._index({**previous, **row} if previous else row)
+            self._missing.clear()
+            self._changes += 1
+
+    def remove(self, material_id: str) -> None:
+        with self._lock:
+            self._unindex(material_id)
+            self._changes += 1
+
+    def invalidate(self) -> None:
+        """Force a full reload on the next lookup."""
+        with self._lock:
+            self._expires_at = 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_id.clear()
+            self._by_ad.clear()
+            self._by_file.clear()
+            self._missing.clear()
+            self._expires_at = 0.0
+
+    # -- lookups ---------------------------------------------------------------
+
+    def _find(self, key: str) -> Optional[Row]:
+        # 调用方持有 _lock
+        row = self._by_id.get(key)
+        if row is not None:
+            return row
+        for index in (self._by_ad, self._by_file):
+            bucket = index.get(key)
+            if bucket:
+                return bucket[min(bucket)]
+        return None
+
+    def lookup_many(self, identifiers: Iterable[str]) -> Dict[str, Row]:
+        """Resolve identifiers in one pass; index misses share one batched DB query."""
+        keys = []
+        for identifier in identifiers:
+            if isinstance(identifier, str) and identifier.strip() and identifier.strip() not in keys:
+                keys.append(identifier.strip())
+        self._ensure_loaded()
+        found: Dict[str, Row] = {}
+        pending: List[str] = []
+        with self._lock:
+            for key in keys:
+                row = self._find(key)
+                if row is not None:
+                    found[key] = row
+                    self._hits += 1
+                elif key not in self._missing:
+                    pending.append(key)
+        if pending:
+            try:
+                rows = list(self.batch_loader(pending))
+            except Exception as e:
+                logger.warning(f"Material catalog batch lookup failed: {e}")
+                rows = []
+            with self._lock:
+                self._batch_queries += 1
+                for row in rows:
+                    self._index(row)
+                for key in pending:
+                    row = self._find(key)
+                    if row is not None:
+                        found[key] = row
+                    else:
+                        self._missing.add(key)
+                        self._misses += 1
+        return found
+
+    def lookup(self, identifier: str) -> Optional[Row]:
+        if not isinstance(identifier, str) or not identifier.strip():
+            return None
+        return self.lookup_many([identifier]).get(identifier.strip())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'materials': len(self._by_id),
+                'ad_ids': len(self._by_ad),
+                'file_names': len(self._by_file),
+                'negative': len(self._missing),
+                'ttl_sec': self.ttl_sec,
+                'hits': self._hits,
+                'misses': self._misses,
+                'loads': self._loads,
+                'batch_queries': self._batch_queries,
+            }
+
+
+_CATALOG: Optional[MaterialCatalog] = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def get_material_catalog() -> MaterialCatalog:
+    """Process-wide catalog used by the gateway and kept current by material_service."""
+    global _CATALOG
+    if _CATALOG is None:
+        with _CATALOG_LOCK:
+            if _CATALOG is None:
+                _CATALOG = MaterialCatalog(ttl_sec=settings.material_catalog_ttl_sec)
+    return _CATALOG
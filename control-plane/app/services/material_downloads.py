@@ -0,0 +1,247 @@
+"""
+Material file downloads: pre-resolved paths, strong ETags and partial responses.
+
+两个下载接口（``/gateway/materials/{id}/file`` 与 ``/materials/{id}/file``）原来
+每次请求都要查素材目录 / DB、再读一遍本地索引取文件路径，然后整文件返回；
+电梯 4G 链路断线后设备只能从第 0 字节重新下载 200MB 的视频。这里：
+
+- 标识 -> (material_id, 路径, md5, 文件名) 的解析结果按 LRU 缓存，命中时只做
+  一次 ``os.stat``；素材写入 / 删除时由 material_service 按标识失效，TTL 兜底
+  其它进程的修改；
+- ETag 使用素材记录里的 MD5（强校验，与设备端校验用的是同一个值），而不是
+  Starlette 默认的 mtime-size 摘要；``If-None-Match`` 命中返回 304；
+- ``Range`` / ``If-Range`` / 206 / 416 / 多段 Range 由 Starlette 的
+  ``FileResponse`` 处理，If-Range 与上面的强 ETag 比较，文件变了就回退整文件；
+- 传输：服务器声明 ``http.response.zerocopysend`` 扩展时整文件和单段 Range 都
+  交给服务器 sendfile；声明 ``http.response.pathsend`` 时整文件按路径发送；
+  都没有时退回线程池分块读取，块大小可配置（默认 1MiB，减少 Python 层循环）。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+# 零拷贝依赖 FileResponse 的私有钩子（Starlette 0.39 起随 Range 支持引入）；
+# 钩子不存在时不启用，退回 FileResponse 自己的发送逻辑。
+_ZEROCOPY_HOOKS = all(hasattr(FileResponse, name) for name in ("_handle_simple", "_handle_single_range"))
+
+Download = Dict[str, Any]
+
+
+class DownloadPathCache:
+    """LRU of resolved download targets keyed by ``(mode, identifier)``."""
+
+    def __init__(self, max_entries: int = 4096, ttl_sec: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Download]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[Download]:
+        with self._lock:
+            found = self._entries.get(key)
+            if found is None or found[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return found[1]
+
+    def put(self, key: Tuple[str, str], download: Download) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_sec, download)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self, identifiers: Iterable[Optional[str]]) -> None:
+        """Drop entries requested by, or resolved to, any of ``identifiers``."""
+        keys = {i for i in identifiers if isinstance(i, str) and i}
+        if not keys:
+            return
+        with self._lock:
+            stale = [
+                key
+                for key, (_, download) in self._entries.items()
+                if key[1] in keys or download["material_id"] in keys
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl_sec,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+_CACHE: Optional[DownloadPathCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_download_cache() -> DownloadPathCache:
+    """Process-wide download path cache, invalidated by material_service writes."""
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = DownloadPathCache(
+                    max_entries=settings.material_download_cache_size,
+                    ttl_sec=settings.material_download_cache_ttl_sec,
+                )
+    return _CACHE
+
+
+def _resolve(identifier: str, via_catalog: bool) -> Download:
+    from app.services import material_service
+
+    if via_catalog:
+        # 网关接口：按 material_id / ad_id / 文件名解析（同 bundle 中的素材解析顺序）。
+        from app.services.material_catalog import get_material_catalog
+
+        row = get_material_catalog().lookup(identifier)
+        if not row or not row.get("material_id"):
+            raise HTTPException(status_code=404, detail="material not found")
+        material_id = row["material_id"]
+        path = material_service.get_material_file_path(material_id)
+        download_name = row.get("file_name")
+    else:
+        row = material_service.get_material(identifier)
+        if not row:
+            raise HTTPException(status_code=404, detail="material not found")
+        material_id = identifier
+        path = material_service.get_material_file_path(material_id, item=row)
+        # 下载时展示原始文件名(索引中已保存 filename)
+        download_name = row.get("filename")
+    if not path:
+        raise HTTPException(status_code=404, detail="material file not found")
+    md5 = row.get("md5")
+    return {
+        "material_id": material_id,
+        "path": str(path),
+        "filename": download_name or Path(path).name,
+        "md5": md5 if isinstance(md5, str) and md5 else None,
+    }
+
+
+def resolve_material_download(identifier: str, *, via_catalog: bool) -> Tuple[Download, os.stat_result]:
+    """
+    Resolve ``identifier`` to a servable file; raises HTTPException(404) like the old handlers.
+
+    Returns the (cached) download entry and a fresh ``stat`` of its path.
+    """
+    cache = get_download_cache()
+    key = ("catalog" if via_catalog else "local", identifier)
+    download = cache.get(key)
+    if download is not None:
+        try:
+            return download, os.stat(download["path"])
+        except OSError:
+            # 文件已被其它进程删除 / 替换：丢弃缓存重新解析。
+            cache.discard(key)
+    download = _resolve(identifier, via_catalog)
+    try:
+        stat_result = os.stat(download["path"])
+    except OSError:
+        raise HTTPException(status_code=404, detail="material file not found")
+    cache.put(key, download)
+    return download, stat_result
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match 使用弱比较：忽略 W/ 前缀，支持逗号分隔的列表和 "*"。
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class MaterialFileResponse(FileResponse):
+    """FileResponse that hands whole files and single ranges to the server's sendfile when offered."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.chunk_size = settings.material_download_chunk_bytes
+        self._zerocopy = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._zerocopy = _ZEROCOPY_HOOKS and ZEROCOPY_EXTENSION in (scope.get("extensions") or {})
+        await super().__call__(scope, receive, send)
+
+    async def _send_zerocopy(self, send: Send, offset: int, count: int) -> None:
+        fh = await run_in_threadpool(open, self.path, "rb")
+        try:
+            await send({"type": ZEROCOPY_EXTENSION, "file": fh, "offset": offset, "count": count, "more_body": False})
+        finally:
+            fh.close()
+
+    async def _handle_simple(self, send: Send, send_header_only: bool, *args: Any) -> None:
+        # 较早的 Starlette 没有 send_pathsend 参数，原样透传。
+        if send_header_only or any(args) or not self._zerocopy:
+            await super()._handle_simple(send, send_header_only, *args)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await self._send_zerocopy(send, 0, int(self.headers["content-length"]))
+
+    async def _handle_single_range(
+        self, send: Send, start: int, end: int, file_size: int, send_header_only: bool
+    ) -> None:
+        if send_header_only or not self._zerocopy:
+            await super()._handle_single_range(send, start, end, file_size, send_header_only)
+            return
+        headers = MutableHeaders(raw=list(self.raw_headers))
+        headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": headers.raw})
+        await self._send_zerocopy(send, start, end - start)
+
+
+def material_file_response(request: Request, identifier: str, *, via_catalog: bool, media_type: str) -> Response:
+    """Serve a material file with strong MD5 ETag, conditional GET and Range support."""
+    download, stat_result = resolve_material_download(identifier, via_catalog=via_catalog)
+    headers: Dict[str, str] = {}
+    if download["md5"]:
+        etag = f'"{download["md5"]}"'
+        headers["ETag"] = etag
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={**headers, "Accept-Ranges": "bytes"})
+    return MaterialFileResponse(
+        path=download["path"],
+        filename=download["filename"],
+        media_type=media_type,
+        headers=headers,
+        stat_result=stat_result,
+    )
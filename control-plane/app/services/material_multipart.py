@@ -0,0 +1,353 @@
+"""
+Resumable multipart material uploads.
+
+大尺寸素材经常在上传中途断开，``/materials/upload`` 只能从头再来。这里提供
+分片续传协议：
+
+1. init：声明文件大小（和可选的整体 MD5），服务端按 ``part_size`` 切分，
+   在 ``data/materials/.uploads/{upload_id}/`` 下预分配一个稀疏数据文件；
+2. PUT part：第 n 片直接写到数据文件的 ``(n-1) * part_size`` 偏移处，边写边
+   计算分片 MD5，并与客户端提供的 Content-MD5 比对，不一致则该片不计入；
+   同一分片正在写入时，再次 PUT 该分片返回 409；
+3. status：返回已收到的分片和合并后的字节区间，客户端只补传缺失的分片；
+4. complete：所有分片到齐后把数据文件原子改名为素材文件，不需要再拼接。
+
+整体 MD5（设备端用来校验文件）和 SHA-256（内容寻址存储的键）在分片按顺序
+到达时随写入增量计算；乱序、分片重传或进程重启后才在 complete 时整文件读一遍。会话
+元数据（session.json）落盘，进程重启不丢失已收到的分片；超过 TTL 未完成的
+会话在下一次 init 时清理。
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services.material_service import MATERIAL_DIR
+from app.services.material_upload import iter_chunks
+
+UPLOADS_DIR = MATERIAL_DIR / ".uploads"
+MIN_PART_SIZE = 64 * 1024
+
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_LOCKS: Dict[str, threading.Lock] = {}
+_LOCKS_GUARD = threading.Lock()
+# upload_id -> (下一个期望的分片号, 已按顺序喂入的整体 MD5, SHA-256 或 None)；仅本进程有效。
+_RUNNING_MD5: Dict[str, Tuple[int, Any, Optional[Any]]] = {}
+# upload_id -> 正在写入的分片号；同一分片的并发 PUT 会交错写入同一字节区间，直接 409。
+_IN_FLIGHT: Dict[str, Set[int]] = {}
+
+
+def parse_content_md5(value: Optional[str]) -> Optional[str]:
+    """Accept a Content-MD5 header (base64) or a hex digest; return lowercase hex."""
+    if not value:
+        return None
+    value = value.strip()
+    if re.fullmatch(r"[0-9a-fA-F]{32}", value):
+        return value.lower()
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raw = b""
+    if len(raw) != 16:
+        raise HTTPException(status_code=400, detail="invalid Content-MD5")
+    return raw.hex()
+
+
+def received_ranges(parts: Dict[str, Dict[str, Any]], part_size: int) -> List[List[int]]:
+    """Merge received parts into ``[start, end)`` byte ranges."""
+    ranges: List[List[int]] = []
+    for n in sorted(int(k) for k in parts):
+        start = (n - 1) * part_size
+        end = start + int(parts[str(n)]["size"])
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def _lock_for(upload_id: str) -> threading.Lock:
+    with _LOCKS_GUARD:
+        return _LOCKS.setdefault(upload_id, threading.Lock())
+
+
+def _session_dir(upload_id: str) -> Path:
+    if not isinstance(upload_id, str) or not _UPLOAD_ID_RE.match(upload_id):
+        raise HTTPException(status_code=404, detail="upload not found")
+    return UPLOADS_DIR / upload_id
+
+
+def _read_session(upload_id: str) -> Dict[str, Any]:
+    path = _session_dir(upload_id) / "session.json"
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="upload not found")
+
+
+def _write_session(session: Dict[str, Any]) -> None:
+    path = _session_dir(session["upload_id"]) / "session.json"
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(session, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _expected_part_size(session: Dict[str, Any], part_number: int) -> int:
+    offset = (part_number - 1) * session["part_size"]
+    return min(session["part_size"], session["size_bytes"] - offset)
+
+
+def _forget(upload_id: str) -> None:
+    _RUNNING_MD5.pop(upload_id, None)
+    _IN_FLIGHT.pop(upload_id, None)
+    with _LOCKS_GUARD:
+        _LOCKS.pop(upload_id, None)
+
+
+def sweep_expired_uploads(now: Optional[float] = None) -> List[str]:
+    """Remove sessions idle for longer than ``material_multipart_ttl_sec``."""
+    now = time.time() if now is None else now
+    removed = []
+    if not UPLOADS_DIR.exists():
+        return removed
+    for d in UPLOADS_DIR.iterdir():
+        if not d.is_dir() or not _UPLOAD_ID_RE.match(d.name):
+            continue
+        try:
+            updated = json.loads((d / "session.json").read_text(encoding="utf-8")).get("updated_at", 0)
+        except Exception:
+            updated = d.stat().st_mtime
+        if now - updated > settings.material_multipart_ttl_sec:
+            shutil.rmtree(d, ignore_errors=True)
+            _forget(d.name)
+            removed.append(d.name)
+    return removed
+
+
+def init_upload(meta: Dict[str, Any], size_bytes: int, part_size: Optional[int] = None, md5: Optional[str] = None) -> Dict[str, Any]:
+    """Create a session; ``meta`` holds the material fields applied on complete."""
+    if not isinstance(size_bytes, int) or size_bytes <= 0:
+        raise HTTPException(status_code=400, detail="size_bytes must be positive")
+    max_bytes = settings.material_upload_max_bytes
+    if max_bytes and size_bytes > max_bytes:
+        raise HTTPException(status_code=413, detail=f"file exceeds max upload size ({max_bytes} bytes)")
+    part_size = int(part_size or settings.material_multipart_part_bytes)
+    if part_size < MIN_PART_SIZE:
+        raise HTTPException(status_code=400, detail=f"part_size must be at least {MIN_PART_SIZE} bytes")
+    if md5 is not None and not re.fullmatch(r"[0-9a-fA-F]{32}", md5):
+        raise HTTPException(status_code=400, detail="invalid md5")
+
+    sweep_expired_uploads()
+    upload_id = uuid.uuid4().hex
+    d = _session_dir(upload_id)
+    d.mkdir(parents=True)
+    # 预分配为稀疏文件，各分片按偏移写入，complete 时无需拼接。
+    with open(d / "data", "wb") as fh:
+        fh.truncate(size_bytes)
+    now = time.time()
+    session = {
+        "upload_id": upload_id,
+        "size_bytes": size_bytes,
+        "part_size": part_size,
+        "total_parts": math.ceil(size_bytes / part_size),
+        "md5": md5.lower() if md5 else None,
+        "meta": meta,
+        "parts": {},
+        "created_at": now,
+        "updated_at": now,
+    }
+    _write_session(session)
+    # 内容寻址存储按 SHA-256 去重，顺序到达时一并增量计算，complete 时不必再读文件。
+    want_sha = settings.material_blob_store or settings.material_upload_sha256
+    _RUNNING_MD5[upload_id] = (1, hashlib.md5(), hashlib.sha256() if want_sha else None)
+    return session
+
+
+def _open_at(path: Path, offset: int):
+    fh = open(path, "r+b")
+    fh.seek(offset)
+    return fh
+
+
+def _write_and_hash(fh, chunk: bytes, hashers: List[Any]) -> None:
+    fh.write(chunk)
+    for h in hashers:
+        h.update(chunk)
+
+
+async def upload_part(upload_id: str, part_number: int, source, content_md5: Optional[str] = None) -> Dict[str, Any]:
+    """Stream one part into place; it is recorded only if its length and checksum match."""
+    expected_md5 = parse_content_md5(content_md5)
+    session = await run_in_threadpool(_read_session, upload_id)
+    if not 1 <= part_number <= session["total_parts"]:
+        raise HTTPException(status_code=400, detail=f"part_number must be 1..{session['total_parts']}")
+
+    lock = _lock_for(upload_id)
+    with lock:
+        in_flight = _IN_FLIGHT.setdefault(upload_id, set())
+        if part_number in in_flight:
+            raise HTTPException(status_code=409, detail=f"part {part_number} is already being uploaded")
+        in_flight.add(part_number)
+        running = _RUNNING_MD5.get(upload_id)
+        if running is not None and running[0] == part_number:
+            # 顺序到达：借出整体 MD5 一起更新，成功后再放回。
+            del _RUNNING_MD5[upload_id]
+        else:
+            if running is not None and (part_number < running[0] or str(part_number) in session["parts"]):
+                # 已收到的分片被重传，内容可能不同，整体 MD5 作废（complete 时重新读文件计算）。
+                del _RUNNING_MD5[upload_id]
+            running = None
+
+    def _record(size: int, digest: str) -> Dict[str, Any]:
+        with lock:
+            current = _read_session(upload_id)
+            current["parts"][str(part_number)] = {"size": size, "md5": digest}
+            current["updated_at"] = time.time()
+            _write_session(current)
+            if running is not None:
+                _RUNNING_MD5[upload_id] = (part_number + 1,) + running[1:]
+            # 与落盘在同一把锁内结束 in-flight，complete 不会看到"已记录但仍在写"的分片。
+            _IN_FLIGHT.get(upload_id, set()).discard(part_number)
+            return current
+
+    try:
+        size, digest = await _receive_part(upload_id, session, part_number, source, running, expected_md5)
+        await run_in_threadpool(_record, size, digest)
+    finally:
+        _release(upload_id, part_number)
+    return {"upload_id": upload_id, "part_number": part_number, "size": size, "md5": digest}
+
+
+def _release(upload_id: str, part_number: int) -> None:
+    with _lock_for(upload_id):
+        _IN_FLIGHT.get(upload_id, set()).discard(part_number)
+
+
+async def _receive_part(
+    upload_id: str,
+    session: Dict[str, Any],
+    part_number: int,
+    source,
+    running: Optional[Tuple[int, Any, Optional[Any]]],
+    expected_md5: Optional[str],
+) -> Tuple[int, str]:
+    """Write the part body at its offset; returns ``(size, md5)`` after length / checksum checks."""
+    expected_size = _expected_part_size(session, part_number)
+    md5 = hashlib.md5()
+    hashers = [md5] + ([h for h in running[1:] if h is not None] if running is not None else [])
+    fh = await run_in_threadpool(_open_at, _session_dir(upload_id) / "data", (part_number - 1) * session["part_size"])
+    size = 0
+    try:
+        async for chunk in iter_chunks(source, settings.material_upload_chunk_bytes):
+            size += len(chunk)
+            if size > expected_size:
+                raise HTTPException(status_code=400, detail=f"part {part_number} exceeds {expected_size} bytes")
+            await run_in_threadpool(_write_and_hash, fh, chunk, hashers)
+    finally:
+        fh.close()
+    if size != expected_size:
+        raise HTTPException(status_code=400, detail=f"part {part_number} must be {expected_size} bytes, got {size}")
+    digest = md5.hexdigest()
+    if expected_md5 is not None and digest != expected_md5:
+        raise HTTPException(status_code=400, detail=f"part {part_number} checksum mismatch")
+    return size, digest
+
+
+def get_upload(upload_id: str) -> Dict[str, Any]:
+    """Raw session record (404 if unknown or expired)."""
+    return _read_session(upload_id)
+
+
+def upload_status(upload_id: str) -> Dict[str, Any]:
+    session = _read_session(upload_id)
+    parts = session["parts"]
+    ranges = received_ranges(parts, session["part_size"])
+    return {
+        "upload_id": upload_id,
+        "size_bytes": session["size_bytes"],
+        "part_size": session["part_size"],
+        "total_parts": session["total_parts"],
+        "received_bytes": sum(end - start for start, end in ranges),
+        "received_ranges": ranges,
+        "parts": [{"part_number": int(n), **parts[n]} for n in sorted(parts, key=int)],
+        "missing_parts": [n for n in range(1, session["total_parts"] + 1) if str(n) not in parts],
+    }
+
+
+def _hash_file(path: Path, sha256: bool) -> Tuple[str, Optional[str]]:
+    md5 = hashlib.md5()
+    sha = hashlib.sha256() if sha256 else None
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(settings.material_upload_chunk_bytes), b""):
+            md5.update(chunk)
+            if sha is not None:
+                sha.update(chunk)
+    return md5.hexdigest(), sha.hexdigest() if sha is not None else None
+
+
+def complete_upload(
+    upload_id: str,
+    dest: Path,
+    parts: Optional[Iterable[Dict[str, Any]]] = None,
+    sha256: bool = False,
+) -> Dict[str, Any]:
+    """
+    Move the assembled file to ``dest`` once every part is in.
+
+    ``parts`` (optional ``[{"part_number", "md5"}]``) is cross-checked against the
+    recorded part checksums. Returns ``{"path", "size_bytes", "md5", "sha256", "meta"}``.
+    """
+    lock = _lock_for(upload_id)
+    with lock:
+        session = _read_session(upload_id)
+        if _IN_FLIGHT.get(upload_id):
+            raise HTTPException(status_code=409, detail={"message": "parts still uploading", "parts": sorted(_IN_FLIGHT[upload_id])})
+        missing = [n for n in range(1, session["total_parts"] + 1) if str(n) not in session["parts"]]
+        if missing:
+            raise HTTPException(status_code=409, detail={"message": "upload incomplete", "missing_parts": missing})
+        for p in parts or ():
+            recorded = session["parts"].get(str(p.get("part_number")))
+            if recorded is None or (p.get("md5") and p["md5"].lower() != recorded["md5"]):
+                raise HTTPException(status_code=400, detail=f"part {p.get('part_number')} checksum mismatch")
+
+        data = _session_dir(upload_id) / "data"
+        with open(data, "r+b") as fh:
+            os.fsync(fh.fileno())
+        running = _RUNNING_MD5.get(upload_id)
+        want_sha = sha256 or settings.material_upload_sha256
+        if running is not None and running[0] == session["total_parts"] + 1 and (running[2] is not None or not want_sha):
+            md5 = running[1].hexdigest()
+            sha_hex = running[2].hexdigest() if want_sha else None
+        else:
+            md5, sha_hex = _hash_file(data, want_sha)
+        if session.get("md5") and session["md5"] != md5:
+            raise HTTPException(status_code=400, detail="file checksum mismatch")
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(data, dest)
+        shutil.rmtree(_session_dir(upload_id), ignore_errors=True)
+    _forget(upload_id)
+    return {"path": dest, "size_bytes": session["size_bytes"], "md5": md5, "sha256": sha_hex, "meta": session["meta"]}
+
+
+def abort_upload(upload_id: str) -> None:
+    d = _session_dir(upload_id)
+    if not d.exists():
+        raise HTTPException(status_code=404, detail="upload not found")
+    with _lock_for(upload_id):
+        shutil.rmtree(d, ignore_errors=True)
+    _forget(upload_id)
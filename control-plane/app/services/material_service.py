@@ -1,6 +1,4 @@
 # app/services/material_index.py
-import json
-import os
 import threading
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Literal
@@ -15,20 +13,14 @@ def get_next_material_id(prefix_hint: Optional[str] = None, pad: int = 3) -> str
     - Choose a prefix (either prefix_hint if present, or the most common detected prefix, or 'M').
     - Return prefix + '_' + zero-padded number using detected width or provided pad.
     """
-    # collect ids from local index
-    data = _read_index()
-    items = data.get('items', [])
-    ids = [it.get('material_id') for it in items if it.get('material_id')]
+    # collect ids from local catalog (id column only, no payload decoding)
+    ids = list(_get_store().ids())
 
     # try to get ids from DB if available
     try:
         from app.services import db_service
         try:
-            rows = db_service.list_materials(limit=10000, offset=0)
-            for r in rows:
-                mid = r.get('material_id') or r.get('id')
-                if mid:
-                    ids.append(mid)
+            ids.extend(db_service.list_material_ids())
         except Exception:
             # ignore DB errors
             pass
@@ -87,8 +79,8 @@ MATERIAL_DIR = Path("data/materials")
 INDEX_PATH = MATERIAL_DIR / "index.json"
 
 MaterialStatus = Literal["uploaded", "transcoding", "done", "failed"]
-# 这里使用可重入锁：状态更新会再调用 upsert_material，如果只用普通锁，
-# 很容易在同一线程的嵌套调用里死锁。
+# 写路径（读-改-写）仍然串行：状态更新会再调用 upsert_material，所以用可重入锁。
+# 读路径直接走存储后端，不经过这把锁。
 _LOCK = threading.RLock()
 
 ALLOWED_TRANSITIONS = {
@@ -97,26 +89,47 @@ ALLOWED_TRANSITIONS = {
     "done": set(),
     "failed": set(),
 }
-def _ensure_paths():
-    MATERIAL_DIR.mkdir(parents=True, exist_ok=True)
-    if not INDEX_PATH.exists():
-        # 初始化空索引
-        INDEX_PATH.write_text(json.dumps({"items": []}, ensure_ascii=False, indent=2), encoding="utf-8")
 
+_STORE = None
+_STORE_LOCK = threading.Lock()
 
-def _read_index() -> Dict[str, Any]:
-    _ensure_paths()
-    raw = INDEX_PATH.read_text(encoding="utf-8").strip()
-    if not raw:
-        return {"items": []}
-    return json.loads(raw)
 
+def _get_store():
+    """Local catalog backend (SQLite by default, legacy index.json with MATERIAL_STORE_BACKEND=json)."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                from app.core.config import settings
+                from app.services.material_store import open_material_store
 
-def _atomic_write(data: Dict[str, Any]) -> None:
-    _ensure_paths()
-    tmp = INDEX_PATH.with_suffix(".json.tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    os.replace(tmp, INDEX_PATH)  # 原子替换
+                _STORE = open_material_store(settings.material_store_backend, MATERIAL_DIR)
+    return _STORE
+
+
+def _sync_catalog(upserted: Optional[Dict[str, Any]] = None, removed: Optional[str] = None) -> None:
+    # 网关的素材目录（material_catalog）按 material_id / ad_id / 文件名建了索引，
+    # 本地写入后增量更新，不必等 TTL 重新加载。
+    from app.services.material_catalog import get_material_catalog
+
+    catalog = get_material_catalog()
+    if upserted is not None:
+        catalog.upsert(upserted)
+    if removed:
+        catalog.remove(removed)
+
+
+def _invalidate_bundles(*rows: Dict[str, Any]) -> None:
+    # 网关缓存的设备 bundle 和下载路径缓存都可能按 material_id / ad_id / 文件名
+    # 引用了该素材。
+    from app.services.bundle_cache import get_bundle_cache
+    from app.services.material_downloads import get_download_cache
+
+    identifiers = []
+    for row in rows:
+        identifiers.extend([row.get("material_id"), row.get("ad_id"), row.get("file_name"), row.get("filename")])
+    get_bundle_cache().invalidate_materials(identifiers)
+    get_download_cache().invalidate(identifiers)
 
 
 def upsert_material(meta: Dict[str, Any]) -> None:
@@ -124,33 +137,17 @@ def upsert_material(meta: Dict[str, Any]) -> None:
     meta 至少包含 material_id
     """
     with _LOCK:
-        data = _read_index()
-        items: List[Dict[str, Any]] = data.get("items", [])
-
-        mid = meta["material_id"]
-        found = False
-        for i, it in enumerate(items):
-            if it.get("material_id") == mid:
-                items[i] = {**it, **meta}
-                found = True
-                break
-        if not found:
-            items.insert(0, meta)  # 新的放前面
-
-        data["items"] = items
-        _atomic_write(data)
+        store = _get_store()
+        previous = store.get(meta["material_id"])
+        row = {**previous, **meta} if previous else meta
+        store.put(row)
+    _sync_catalog(upserted=meta)
+    _invalidate_bundles(meta, previous or {})
 
 def update_material_status(material_id: str, new_status: str, patch: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     patch = patch or {}
     with _LOCK:
-        data = _read_index()
-        items = data.get("items", [])
-
-        target = None
-        for it in items:
-            if it.get("material_id") == material_id:
-                target = it
-                break
+        target = _get_store().get(material_id)
         if not target:
             raise KeyError("material not found")
 
@@ -204,33 +201,20 @@ def apply_transcode_callback(material_id: str, payload: Dict[str, Any]) -> Dict[
 
 
 def get_material(material_id: str) -> Optional[Dict[str, Any]]:
-    with _LOCK:
-        data = _read_index()
-        for it in data.get("items", []):
-            if it.get("material_id") == material_id:
-                return it
-    return None
+    return _get_store().get(material_id)
 
 
 def delete_material(material_id: str) -> bool:
     """
     从本地索引删除素材，并尽量清理对应文件。
     """
-    # read item first
-    item = None
     with _LOCK:
-        data = _read_index()
-        items: List[Dict[str, Any]] = data.get("items", [])
-        for it in items:
-            if it.get("material_id") == material_id:
-                item = it
-                break
-        new_items = [it for it in items if it.get("material_id") != material_id]
-        if len(new_items) == len(items):
-            return False
-        # update index
-        data["items"] = new_items
-        _atomic_write(data)
+        item = _get_store().delete(material_id)
+    # 接口层可能已删除 DB 中的同一素材，本地索引没有也要从目录移除。
+    _sync_catalog(removed=material_id)
+    if item is None:
+        return False
+    _invalidate_bundles(item)
 
     # 文件删除采用 best-effort：即使磁盘清理失败，也不回滚已经完成的
     # 元数据删除，避免接口语义变得不稳定。
@@ -238,7 +222,12 @@ def delete_material(material_id: str) -> bool:
         if item:
             extra = item.get('extra') or {}
             path_str = extra.get('path')
-            if path_str:
+            if extra.get('blob'):
+                # 内容寻址存储：多条素材可能共享同一文件，引用计数归零才删除。
+                from app.services.blob_store import get_blob_store
+
+                get_blob_store().release(extra['blob'])
+            elif path_str:
                 p = Path(path_str)
                 if p.exists() and p.is_file():
                     try:
@@ -251,14 +240,12 @@ def delete_material(material_id: str) -> bool:
     return True
 
 
-def list_materials(offset: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
-    with _LOCK:
-        data = _read_index()
-        items = data.get("items", [])
-        return items[offset : offset + limit]
+def list_materials(offset: int = 0, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
+    return _get_store().list(offset=offset, limit=limit)
 
-def get_material_file_path(material_id: str) -> Optional[Path]:
-    item = get_material(material_id)
+def get_material_file_path(material_id: str, item: Optional[Dict[str, Any]] = None) -> Optional[Path]:
+    """Local file of ``material_id``; pass ``item`` when the record was already read."""
+    item = item if item is not None else get_material(material_id)
     if not item:
         return None
 
@@ -271,7 +258,7 @@ def get_material_file_path(material_id: str) -> Optional[Path]:
 
     # 安全校验：必须在MATERIAL_DIR 目录里(防止 ../ 任意文件下载)
     try:
-        if MATERIAL_DIR.resolve() not in p.resolve().parents and p.resolve() != MATERIAL_DIR.resolve:
+        if MATERIAL_DIR.resolve() not in p.resolve().parents and p.resolve() != MATERIAL_DIR.resolve():
             return None
     except Exception:
         return None
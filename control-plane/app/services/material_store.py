@@ -0,0 +1,213 @@
+"""
+Local material catalog backends used by material_service.
+
+原来本地素材目录是一个 ``index.json``：每次 get / list / 取文件路径都在全局
+锁下重新读取并解析整个文件，每次 upsert 都以 ``indent=2`` 重写整个文件。
+这里把存储抽成后端，material_service 的函数签名不变：
+
+- ``SqliteMaterialStore``（默认）：material_id 唯一索引 + ad_id / file_name
+  索引，按主键读写是 O(1)（B-tree）；WAL 模式下读者互不阻塞、也不阻塞写者，
+  每个线程一个连接，读取不再经过进程内全局锁。首次打开时如果存在旧的
+  index.json，会按原顺序导入。
+- ``JsonIndexStore``：原 index.json 实现，``MATERIAL_STORE_BACKEND=json`` 时使用。
+
+两个后端的列表顺序一致：新素材在前，更新不改变位置。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+Row = Dict[str, Any]
+
+
+class JsonIndexStore:
+    """Whole-file JSON index (legacy layout: ``{"items": [...]}``, newest first)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+
+    def _read(self) -> Dict[str, Any]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            return {"items": []}
+        raw = self.path.read_text(encoding="utf-8").strip()
+        if not raw:
+            return {"items": []}
+        return json.loads(raw)
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)  # 原子替换
+
+    def get(self, material_id: str) -> Optional[Row]:
+        with self._lock:
+            for it in self._read().get("items", []):
+                if it.get("material_id") == material_id:
+                    return it
+        return None
+
+    def list(self, offset: int = 0, limit: Optional[int] = None) -> List[Row]:
+        with self._lock:
+            items = self._read().get("items", [])
+        return items[offset:] if limit is None else items[offset : offset + limit]
+
+    def ids(self) -> List[str]:
+        return [it.get("material_id") for it in self.list() if it.get("material_id")]
+
+    def put(self, row: Row) -> Optional[Row]:
+        """Insert or replace ``row`` by material_id; returns the previous row."""
+        with self._lock:
+            data = self._read()
+            items: List[Row] = data.get("items", [])
+            previous = None
+            for i, it in enumerate(items):
+                if it.get("material_id") == row["material_id"]:
+                    previous = it
+                    items[i] = row
+                    break
+            if previous is None:
+                items.insert(0, row)  # 新的放前面
+            data["items"] = items
+            self._write(data)
+            return previous
+
+    def delete(self, material_id: str) -> Optional[Row]:
+        with self._lock:
+            data = self._read()
+            items: List[Row] = data.get("items", [])
+            removed = next((it for it in items if it.get("material_id") == material_id), None)
+            if removed is None:
+                return None
+            data["items"] = [it for it in items if it.get("material_id") != material_id]
+            self._write(data)
+            return removed
+
+
+class SqliteMaterialStore:
+    """SQLite catalog: one row per material, JSON payload plus indexed lookup columns."""
+
+    def __init__(self, path: Path, import_from: Optional[Path] = None):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._init_lock:
+            conn = self._conn()
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS materials (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    material_id TEXT NOT NULL UNIQUE,
+                    ad_id TEXT,
+                    file_name TEXT,
+                    status TEXT,
+                    data TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_materials_ad_id ON materials(ad_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_materials_file_name ON materials(file_name)")
+            if import_from is not None:
+                self._import_json(Path(import_from))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit；写入各自是单条语句，WAL 下读者看到的是已提交快照。
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_json(self, legacy: Path) -> None:
+        conn = self._conn()
+        if not legacy.exists() or conn.execute("SELECT 1 FROM materials LIMIT 1").fetchone():
+            return
+        items = JsonIndexStore(legacy).list()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # index.json 新的在前；倒序插入，保持 seq 越大越新。
+            for row in reversed(items):
+                if row.get("material_id"):
+                    self._upsert(conn, row)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _upsert(conn: sqlite3.Connection, row: Row) -> None:
+        conn.execute(
+            """
+            INSERT INTO materials (material_id, ad_id, file_name, status, data)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(material_id) DO UPDATE SET
+                ad_id = excluded.ad_id,
+                file_name = excluded.file_name,
+                status = excluded.status,
+                data = excluded.data
+            """,
+            (
+                row["material_id"],
+                row.get("ad_id"),
+                row.get("file_name") or row.get("filename"),
+                row.get("status"),
+                json.dumps(row, ensure_ascii=False, default=str),
+            ),
+        )
+
+    def get(self, material_id: str) -> Optional[Row]:
+        found = self._conn().execute("SELECT data FROM materials WHERE material_id = ?", (material_id,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def list(self, offset: int = 0, limit: Optional[int] = None) -> List[Row]:
+        rows = self._conn().execute(
+            "SELECT data FROM materials ORDER BY seq DESC LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def ids(self) -> List[str]:
+        return [r[0] for r in self._conn().execute("SELECT material_id FROM materials ORDER BY seq DESC")]
+
+    def put(self, row: Row) -> Optional[Row]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous = conn.execute("SELECT data FROM materials WHERE material_id = ?", (row["material_id"],)).fetchone()
+            self._upsert(conn, row)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return json.loads(previous[0]) if previous else None
+
+    def delete(self, material_id: str) -> Optional[Row]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            found = conn.execute("SELECT data FROM materials WHERE material_id = ?", (material_id,)).fetchone()
+            if found:
+                conn.execute("DELETE FROM materials WHERE material_id = ?", (material_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return json.loads(found[0]) if found else None
+
+
+def open_material_store(backend: str, directory: Path):
+    """Build the configured backend rooted at ``directory`` (the materials dir)."""
+    directory = Path(directory)
+    legacy = directory / "index.json"
+    if (backend or "sqlite").strip().lower() == "json":
+        return JsonIndexStore(legacy)
+    return SqliteMaterialStore(directory / "catalog.sqlite3", import_from=legacy)
@@ -0,0 +1,165 @@
+"""
+Streaming writes for material uploads.
+
+``upload_material`` 原来 ``await file.read()`` 一次读入整个文件，再在内存里算
+MD5、``write_bytes`` 落盘；几个 500MB 视频并发上传就能把 API Pod 内存打满。
+这里改成分块流式写入：
+
+- 每次只读 ``chunk_size`` 字节，内存占用与文件大小无关；
+- 写入同目录下的临时文件，边写边增量计算 MD5（可选 SHA-256）；
+- 超过 ``max_bytes`` 立即中止并删除临时文件（413）；
+- ``UploadLimitRoute`` 在表单解析之前按 Content-Length（以及实际收到的字节数）
+  拒绝超限请求：FastAPI 会先把整个 multipart 请求体落到临时文件里再调用接口，
+  没有这一步 10GB 的请求要先写满临时盘才会得到 413。注意表单临时文件仍在，
+  ``/upload`` 的数据会写盘两次；分片上传接口直接读请求流，没有这次额外写入；
+- 全部写完 fsync 后 ``os.replace`` 原子改名，读者看不到半个文件；
+- 写盘和哈希都在线程池里执行，不阻塞事件循环。
+"""
+
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+
+async def iter_chunks(source, chunk_size: int) -> AsyncIterator[bytes]:
+    """Yield body chunks from an UploadFile-like ``read(n)`` or an async iterable (``Request.stream()``)."""
+    if hasattr(source, "read"):
+        while True:
+            chunk = await source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in source:
+            if chunk:
+                yield chunk
+
+
+def _open_temp(dest: Path):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex[:8]}.part")
+    return tmp, open(tmp, "wb")
+
+
+def _write_chunk(fh, chunk: bytes, hashers: List[Any]) -> None:
+    fh.write(chunk)
+    for h in hashers:
+        h.update(chunk)
+
+
+def _finish(fh, tmp: Path, dest: Path) -> None:
+    fh.flush()
+    os.fsync(fh.fileno())
+    fh.close()
+    os.replace(tmp, dest)
+
+
+def _discard(fh, tmp: Path) -> None:
+    try:
+        fh.close()
+    finally:
+        try:
+            tmp.unlink()
+        except FileNotFoundError:
+            pass
+
+
+async def save_upload_stream(
+    upload,
+    dest: Path,
+    *,
+    max_bytes: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    sha256: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """
+    Stream ``upload`` (an UploadFile, anything with ``async read(n)`` or an async byte iterable) to ``dest``.
+
+    Returns ``{"path", "size_bytes", "md5", "sha256"}``; ``sha256`` is None unless enabled.
+    Raises HTTPException(413) once more than ``max_bytes`` have been received.
+    """
+    max_bytes = settings.material_upload_max_bytes if max_bytes is None else max_bytes
+    chunk_size = chunk_size or settings.material_upload_chunk_bytes
+    sha256 = settings.material_upload_sha256 if sha256 is None else sha256
+
+    md5 = hashlib.md5()
+    sha = hashlib.sha256() if sha256 else None
+    hashers = [h for h in (md5, sha) if h is not None]
+
+    tmp, fh = await run_in_threadpool(_open_temp, dest)
+    size = 0
+    try:
+        async for chunk in iter_chunks(upload, chunk_size):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"file exceeds max upload size ({max_bytes} bytes)")
+            await run_in_threadpool(_write_chunk, fh, chunk, hashers)
+        await run_in_threadpool(_finish, fh, tmp, dest)
+    except BaseException:
+        # 包括客户端断开导致的取消：不留下半截临时文件。取消后不能再 await，
+        # 这里直接同步关闭并删除（开销很小）。
+        _discard(fh, tmp)
+        raise
+
+    return {
+        "path": dest,
+        "size_bytes": size,
+        "md5": md5.hexdigest(),
+        "sha256": sha.hexdigest() if sha is not None else None,
+    }
+
+
+# multipart 边界、表单字段等在文件内容之外的余量
+_FORM_OVERHEAD_BYTES = 1024 * 1024
+
+
+def upload_body_limit() -> int:
+    """Largest request body accepted by upload routes; 0 disables the check."""
+    max_bytes = settings.material_upload_max_bytes
+    return max_bytes + _FORM_OVERHEAD_BYTES if max_bytes else 0
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"request body exceeds max upload size ({limit} bytes)")
+
+
+def _limited_receive(receive: Callable, limit: int) -> Callable:
+    received = 0
+
+    async def limited():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > limit:
+                raise _too_large(limit)
+        return message
+
+    return limited
+
+
+class UploadLimitRoute(APIRoute):
+    """APIRoute that rejects oversized request bodies before FastAPI parses (and spools) them."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def limited_handler(request: Request) -> Response:
+            limit = upload_body_limit()
+            if limit:
+                length = request.headers.get("content-length")
+                if length and length.isdigit() and int(length) > limit:
+                    raise _too_large(limit)
+                # 没有 Content-Length（chunked）或声明不实时，按实际收到的字节数中止。
+                request = Request(request.scope, _limited_receive(request.receive, limit))
+            return await handler(request)
+
+        return limited_handler
@@ -0,0 +1,235 @@
+"""
+Decoding and normalization of play-log Kafka messages.
+
+消费者热路径上每条消息都要做：字节 -> JSON -> 规范化记录。这里把这一层
+抽成可替换的解码器：
+
+- JSON 后端可插拔：优先 orjson，其次 msgspec，最后标准库 json；
+  可用 ``PLAYLOG_JSON_BACKEND=orjson|msgspec|json|auto`` 指定；
+- 编码只检测一次：字节直接交给 JSON 后端（按 UTF-8 解析），只有在
+  字节不是合法 UTF-8 时才判断 gb18030 / latin1，不再对同一条消息
+  反复 decode + loads；
+- 规范化结果是 :class:`PlayLogRecord`（按 ad_logs 列顺序排列的 NamedTuple），
+  可直接作为 execute_values 的一行，同时保留 ``record['log_id']`` /
+  ``record.get(...)`` 的字典式读取，兼容现有调用方。
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_BILLING_STATUSES = frozenset({'unbilled', 'billed', 'failed', 'pending'})
+
+
+def _load_backend(name: str) -> Optional[Tuple[str, Callable[[Any], Any]]]:
+    if name == 'orjson':
+        try:
+            import orjson
+        except ImportError:
+            return None
+        return 'orjson', orjson.loads
+    if name == 'msgspec':
+        try:
+            import msgspec
+        except ImportError:
+            return None
+        return 'msgspec', msgspec.json.Decoder().decode
+    if name == 'json':
+        return 'json', json.loads
+    return None
+
+
+def select_backend(preferred: Optional[str] = None) -> Tuple[str, Callable[[Any], Any]]:
+    """
+    Return ``(name, loads)`` for the JSON backend to use.
+
+    ``preferred`` (or ``PLAYLOG_JSON_BACKEND``) may name a backend; ``auto``
+    picks the fastest one installed. Unknown or missing backends fall back
+    to the standard library.
+    """
+    preferred = (preferred or os.getenv('PLAYLOG_JSON_BACKEND', 'auto')).strip().lower()
+    candidates = ('orjson', 'msgspec', 'json') if preferred == 'auto' else (preferred, 'json')
+    for name in candidates:
+        backend = _load_backend(name)
+        if backend is not None:
+            return backend
+    logger.warning(f"Unknown PLAYLOG_JSON_BACKEND={preferred!r}, using json")
+    return 'json', json.loads
+
+
+def detect_encoding(raw: bytes) -> str:
+    """Pick the text encoding of a payload: utf-8, then gb18030, then latin1 (never fails)."""
+    for enc in ('utf-8', 'gb18030'):
+        try:
+            raw.decode(enc)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return 'latin1'
+
+
+@lru_cache(maxsize=4096)
+def _parse_time_string(value: str) -> Optional[datetime]:
+    # 同一批日志的时间戳高度重复（秒级），缓存解析结果。
+    if 'T' not in value and ' ' not in value:
+        return None
+    if value.endswith('Z'):
+        value = value[:-1]
+    elif value.endswith('+08:00'):
+        value = value[:-6]
+    return datetime.fromisoformat(value)
+
+
+def parse_timestamp(ts_value) -> Optional[datetime]:
+    """
+    Parse a device timestamp: ISO string (``Z``/``+08:00`` suffix dropped, naive result),
+    or Unix seconds / milliseconds. Returns None when it cannot be parsed.
+    """
+    if ts_value is None:
+        return None
+    try:
+        if isinstance(ts_value, str):
+            return _parse_time_string(ts_value)
+        if isinstance(ts_value, (int, float)) and not isinstance(ts_value, bool):
+            if ts_value > 1e12:  # Likely milliseconds
+                ts_value = ts_value / 1000
+            return datetime.fromtimestamp(ts_value)
+    except Exception as e:
+        logger.warning(f"Failed to parse timestamp {ts_value}: {e}")
+    return None
+
+
+class PlayLogRecord(NamedTuple):
+    """Normalized play log; field order matches ``db_service.AD_LOG_COLUMNS``."""
+
+    log_id: str
+    device_id: str
+    material_id: Optional[str]
+    ad_file_name: Optional[str]
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
+    duration_ms: Optional[int]
+    status_code: Optional[int]
+    status_msg: Optional[str]
+    device_ip: Optional[str]
+    firmware_version: Optional[str]
+    created_at: Optional[int]
+    expected_md5: Optional[str]
+    actual_md5: Optional[str]
+    is_valid: Optional[bool]
+    billing_status: str
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self))
+
+
+def normalize_log_record(log_data: Dict) -> Optional[PlayLogRecord]:
+    """Validate one raw log dict and build a :class:`PlayLogRecord`; None if required fields are missing."""
+    get = log_data.get
+    log_id = get('log_id')
+    device_id = get('device_id')
+    if not log_id or not device_id:
+        logger.warning(f"Missing required fields in log record: {log_data}")
+        return None
+
+    device_ip = get('device_ip')
+    # PostgreSQL INET 字段不接受空字符串，统一转成 NULL。
+    if isinstance(device_ip, str):
+        device_ip = device_ip.strip() or None
+
+    billing_status = get('billing_status') or 'pending'
+    if billing_status not in _BILLING_STATUSES:
+        billing_status = 'pending'
+
+    return PlayLogRecord(
+        log_id,
+        device_id,
+        get('material_id') or get('ad_id'),  # Support both names
+        get('ad_file_name'),
+        parse_timestamp(get('start_time')),
+        parse_timestamp(get('end_time')),
+        get('duration_ms'),
+        get('status_code'),
+        get('status_msg'),
+        device_ip,
+        get('firmware_version'),
+        get('created_at'),
+        get('expected_md5'),
+        get('actual_md5'),
+        get('is_valid'),
+        billing_status,
+    )
+
+
+class PlayLogDecoder:
+    """Bytes -> JSON -> :class:`PlayLogRecord` list, using the selected JSON backend."""
+
+    def __init__(self, backend: Optional[str] = None):
+        self.backend, self._loads = select_backend(backend)
+
+    def loads(self, raw: Optional[bytes]):
+        if raw is None:
+            return {}
+        try:
+            # 三个后端都直接接受 UTF-8 字节，绝大多数消息只解析一次。
+            return self._loads(raw)
+        except Exception as first_exc:
+            if isinstance(raw, str):
+                raise ValueError(f"Unable to deserialize kafka message: {first_exc}") from first_exc
+            enc = detect_encoding(raw)
+            if enc == 'utf-8':
+                # 编码没问题，是 JSON 本身非法。
+                raise ValueError(f"Unable to deserialize kafka message: {first_exc}") from first_exc
+            try:
+                return self._loads(raw.decode(enc))
+            except Exception as e:
+                raise ValueError(f"Unable to deserialize kafka message ({enc}): {e}") from e
+
+    @staticmethod
+    def records(log_data) -> List[PlayLogRecord]:
+        """Normalize one message (single log or ``{"payload": [...]}`` wrapper)."""
+        if not isinstance(log_data, dict):
+            return []
+        if 'payload' in log_data:
+            items = log_data.get('payload') or []
+        else:
+            items = [log_data]
+        records = []
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            record = normalize_log_record(item)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def decode(self, raw: Optional[bytes]) -> List[PlayLogRecord]:
+        return self.records(self.loads(raw))
+
+
+_DEFAULT_DECODER: Optional[PlayLogDecoder] = None
+
+
+def get_decoder() -> PlayLogDecoder:
+    """Process-wide decoder using the backend selected by ``PLAYLOG_JSON_BACKEND``."""
+    global _DEFAULT_DECODER
+    if _DEFAULT_DECODER is None:
+        _DEFAULT_DECODER = PlayLogDecoder()
+        logger.info(f"Play-log JSON backend: {_DEFAULT_DECODER.backend}")
+    return _DEFAULT_DECODER
@@ -0,0 +1,326 @@
+"""
+Correlation-id keyed registry of pending snapshot requests.
+
+原来 ``device_snapshot_service._waiters`` 以 device_id 为键：同一台电梯的两个
+并发截图请求会互相覆盖，先到的请求永远等不到结果；回调里还直接访问
+``event._loop`` 私有属性。这里：
+
+- 以 cmd_id（网关 / 设备回传的 req_id）为键，每个条目可以挂多个等待方
+  （future），回调到达时一起唤醒；
+- 回调带了已登记的 req_id 时只唤醒该条目；没有 req_id 或 req_id 不认识
+  （旧网关 / 设备不回传）时按 device_id 唤醒该设备所有等待中的条目；
+- future 属于创建它的事件循环，唤醒统一通过 ``loop.call_soon_threadsafe``，
+  回调可以来自任意线程 / 事件循环；
+- 超时由哈希时间轮统一处理：登记 / 取消 O(1)，一个守护线程按 tick 推进，
+  到期条目以 TimeoutError 结束，不再为每个请求各挂一个定时器；
+- 单飞合并（``join``）：同一设备已有进行中的截图时，后来的请求直接挂到该
+  条目上等待同一次设备往返，不再写 command_log、不再下发 SNAPSHOT；条目的
+  截止时间取各等待方中最晚的一个，保证每个等待方至少能等满自己的 timeout；``SnapshotResultCache`` 在短时间窗口内直接复用刚拿到的截图。
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+
+class TimerWheel:
+    """Hashed timing wheel; deadlines are rounded up to ``tick_sec``."""
+
+    def __init__(self, tick_sec: float = 0.25, slots: int = 512, now: Optional[float] = None):
+        self.tick_sec = tick_sec
+        self.slots = slots
+        self._buckets: List[Dict[str, int]] = [{} for _ in range(slots)]  # key -> absolute tick
+        self._where: Dict[str, int] = {}
+        self._tick = int((time.monotonic() if now is None else now) / tick_sec)
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key: str, deadline: float) -> None:
+        self.cancel(key)
+        # 向上取整：绝不提前到期。
+        tick = max(int(-(-deadline // self.tick_sec)), self._tick + 1)
+        slot = tick % self.slots
+        self._buckets[slot][key] = tick
+        self._where[key] = slot
+
+    def cancel(self, key: str) -> None:
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self._buckets[slot].pop(key, None)
+
+    def advance(self, now: float) -> List[str]:
+        """Move the wheel to ``now``; returns the keys whose deadline has passed."""
+        target = int(now / self.tick_sec)
+        expired: List[str] = []
+        # 空转超过一圈时每个槽只需要看一次。
+        start = max(self._tick + 1, target - self.slots + 1)
+        for tick in range(start, target + 1):
+            bucket = self._buckets[tick % self.slots]
+            if not bucket:
+                continue
+            for key, due in list(bucket.items()):
+                if due <= target:
+                    del bucket[key]
+                    del self._where[key]
+                    expired.append(key)
+        self._tick = max(self._tick, target)
+        return expired
+
+
+class _Pending:
+    __slots__ = ("cmd_id", "device_id", "futures", "deadline")
+
+    def __init__(self, cmd_id: str, device_id: str):
+        self.cmd_id = cmd_id
+        self.device_id = device_id
+        self.futures: List[asyncio.Future] = []
+        self.deadline = 0.0
+
+
+def _settle(fut: asyncio.Future, result: Any = None, error: Optional[BaseException] = None, cancel: bool = False) -> None:
+    def apply() -> None:
+        if fut.done():
+            return
+        if cancel:
+            fut.cancel()
+        elif error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+    loop = fut.get_loop()
+    if loop.is_closed():
+        return
+    loop.call_soon_threadsafe(apply)
+
+
+class SnapshotWaiterRegistry:
+    """Pending snapshot requests keyed by cmd_id with per-device fan-out and wheel-based expiry."""
+
+    def __init__(self, tick_sec: float = 0.25):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, _Pending] = {}
+        self._by_device: Dict[str, Set[str]] = {}
+        self._wheel = TimerWheel(tick_sec=tick_sec)
+        self._ticker: Optional[threading.Thread] = None
+        self._resolved = 0
+        self._expired = 0
+        self._coalesced = 0
+
+    # -- registration ----------------------------------------------------------
+
+    def register(self, device_id: str, cmd_id: str, timeout: float) -> asyncio.Future:
+        """Add an awaiter for ``cmd_id`` (creating the entry if needed) on the running loop."""
+        fut = asyncio.get_running_loop().create_future()
+        with self._lock:
+            entry = self._pending.get(cmd_id)
+            if entry is None:
+                entry = _Pending(cmd_id, device_id)
+                self._pending[cmd_id] = entry
+                self._by_device.setdefault(device_id, set()).add(cmd_id)
+            self._extend(entry, timeout)
+            entry.futures.append(fut)
+            self._ensure_ticker()
+        return fut
+
+    def join(self, device_id: str, cmd_id: str, timeout: float) -> Tuple[str, asyncio.Future, bool]:
+        """
+        Single-flight: attach to the device's in-flight request, or start ``cmd_id``.
+
+        Returns ``(cmd_id, future, leader)``; only the leader sends the command.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        with self._lock:
+            in_flight = sorted(self._by_device.get(device_id, ()))
+            leader = not in_flight
+            if leader:
+                entry = _Pending(cmd_id, device_id)
+                self._pending[cmd_id] = entry
+                self._by_device.setdefault(device_id, set()).add(cmd_id)
+            else:
+                entry = self._pending[in_flight[0]]
+                self._coalesced += 1
+            self._extend(entry, timeout)
+            entry.futures.append(fut)
+            self._ensure_ticker()
+        return entry.cmd_id, fut, leader
+
+    def _extend(self, entry: _Pending, timeout: float) -> None:
+        # 调用方持有 _lock。截止时间只延后不提前：合并进来的请求 timeout 更长时
+        # 整个条目一起延后；更短的请求由调用方按自己的 timeout 停止等待。
+        deadline = time.monotonic() + timeout
+        if deadline > entry.deadline:
+            entry.deadline = deadline
+            self._wheel.schedule(entry.cmd_id, deadline)
+
+    def fail(self, cmd_id: str, error: BaseException) -> int:
+        """End ``cmd_id`` with ``error`` for every awaiter (e.g. the gateway rejected the command)."""
+        with self._lock:
+            entry = self._drop(cmd_id)
+            futures = list(entry.futures) if entry else []
+        for fut in futures:
+            _settle(fut, error=error)
+        return len(futures)
+
+    def discard(self, cmd_id: str, fut: asyncio.Future) -> None:
+        """Detach one awaiter (finished or cancelled); the entry goes away with its last awaiter."""
+        with self._lock:
+            entry = self._pending.get(cmd_id)
+            if entry is None:
+                return
+            if fut in entry.futures:
+                entry.futures.remove(fut)
+            if not entry.futures:
+                self._drop(cmd_id)
+
+    def _drop(self, cmd_id: str) -> Optional[_Pending]:
+        # 调用方持有 _lock
+        entry = self._pending.pop(cmd_id, None)
+        if entry is None:
+            return None
+        self._wheel.cancel(cmd_id)
+        ids = self._by_device.get(entry.device_id)
+        if ids is not None:
+            ids.discard(cmd_id)
+            if not ids:
+                del self._by_device[entry.device_id]
+        return entry
+
+    # -- completion ------------------------------------------------------------
+
+    def resolve(self, device_id: str, snapshot_url: str, req_id: Optional[str] = None) -> int:
+        """Wake awaiters for ``req_id`` (or every pending request of ``device_id``); returns how many."""
+        with self._lock:
+            if req_id and req_id in self._pending:
+                entries = [self._drop(req_id)]
+            else:
+                entries = [self._drop(cmd_id) for cmd_id in list(self._by_device.get(device_id, ()))]
+            futures = [fut for entry in entries if entry for fut in entry.futures]
+            self._resolved += len(futures)
+        for fut in futures:
+            _settle(fut, result=snapshot_url)
+        return len(futures)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Fail entries past their deadline with TimeoutError; returns the number of awaiters woken."""
+        with self._lock:
+            entries = [self._drop(cmd_id) for cmd_id in self._wheel.advance(time.monotonic() if now is None else now)]
+            woken = [(entry, fut) for entry in entries if entry for fut in entry.futures]
+            self._expired += len(woken)
+        for entry, fut in woken:
+            _settle(fut, error=TimeoutError(f"snapshot {entry.cmd_id} for device {entry.device_id} timed out"))
+        return len(woken)
+
+    def _ensure_ticker(self) -> None:
+        # 调用方持有 _lock；没有等待条目时线程自行退出，下次登记再启动。
+        if self._ticker is not None and self._ticker.is_alive():
+            return
+        self._ticker = threading.Thread(target=self._run_ticker, name="snapshot-waiters", daemon=True)
+        self._ticker.start()
+
+    def _run_ticker(self) -> None:
+        while True:
+            time.sleep(self._wheel.tick_sec)
+            self.expire()
+            with self._lock:
+                if not self._pending:
+                    self._ticker = None
+                    return
+
+    # -- introspection ---------------------------------------------------------
+
+    def pending(self, device_id: Optional[str] = None) -> List[str]:
+        with self._lock:
+            if device_id is None:
+                return list(self._pending)
+            return list(self._by_device.get(device_id, ()))
+
+    def clear(self) -> None:
+        with self._lock:
+            for cmd_id in list(self._pending):
+                for fut in self._drop(cmd_id).futures:
+                    _settle(fut, cancel=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "devices": len(self._by_device),
+                "awaiters": sum(len(e.futures) for e in self._pending.values()),
+                "resolved": self._resolved,
+                "expired": self._expired,
+                "coalesced": self._coalesced,
+            }
+
+
+class SnapshotResultCache:
+    """Most recent snapshot URL per device, served for ``ttl_sec`` after it arrived."""
+
+    def __init__(self, ttl_sec: float = 10.0):
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._results: Dict[str, Tuple[float, str]] = {}
+        self._hits = 0
+
+    def get(self, device_id: str) -> Optional[str]:
+        if self.ttl_sec <= 0:
+            return None
+        with self._lock:
+            found = self._results.get(device_id)
+            if found is None:
+                return None
+            if found[0] <= time.monotonic():
+                del self._results[device_id]
+                return None
+            self._hits += 1
+            return found[1]
+
+    def put(self, device_id: str, snapshot_url: str) -> None:
+        if self.ttl_sec <= 0 or not snapshot_url:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # 顺带清理过期条目，设备数量有限，不单独起线程。
+            for key in [k for k, (expires_at, _) in self._results.items() if expires_at <= now]:
+                del self._results[key]
+            self._results[device_id] = (now + self.ttl_sec, snapshot_url)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"devices": len(self._results), "ttl_sec": self.ttl_sec, "hits": self._hits}
+
+
+_REGISTRY: Optional[SnapshotWaiterRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_snapshot_waiters() -> SnapshotWaiterRegistry:
+    """Process-wide registry shared by request_device_snapshot and the snapshot callback."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                _REGISTRY = SnapshotWaiterRegistry(tick_sec=settings.snapshot_waiter_tick_sec)
+    return _REGISTRY
+
+
+_RESULTS: Optional[SnapshotResultCache] = None
+_RESULTS_LOCK = threading.Lock()
+
+
+def get_snapshot_results() -> SnapshotResultCache:
+    """Process-wide cache of recent snapshot URLs (``SNAPSHOT_RESULT_CACHE_SEC``, 0 disables)."""
+    global _RESULTS
+    if _RESULTS is None:
+        with _RESULTS_LOCK:
+            if _RESULTS is None:
+                _RESULTS = SnapshotResultCache(ttl_sec=settings.snapshot_result_cache_sec)
+    return _RESULTS
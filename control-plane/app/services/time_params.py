@@ -0,0 +1,54 @@
+"""
+Time query parameters shared by the ad_logs / ad_stats endpoints.
+
+请求里的时间（Unix 秒 / 毫秒或 ISO 8601）按 ``tz`` 解读，再换算成
+ad_logs.start_time 使用的无时区本地时间（``settings.ad_log_timezone``）。
+非法的时间或时区统一返回 400。
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+
+try:
+    from zoneinfo import ZoneInfo
+except Exception:
+    ZoneInfo = None
+
+from app.core.config import settings
+
+
+def validate_timezone(tz_name: Optional[str]) -> None:
+    """Raise 400 for an unknown IANA zone name (no-op without zoneinfo)."""
+    if tz_name and ZoneInfo is not None:
+        try:
+            ZoneInfo(tz_name)
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"unknown timezone: {tz_name}")
+
+
+def parse_time_param(value: Optional[str]) -> Optional[datetime]:
+    # 支持 Unix 秒 / 毫秒和 ISO 8601（可带时区，Z 视为 UTC）。
+    if value is None or str(value).strip() == '':
+        return None
+    value = str(value).strip()
+    try:
+        if value.lstrip('-').isdigit():
+            ts = int(value)
+            if ts > 1e12:
+                ts = ts / 1000
+            return datetime.fromtimestamp(ts, tz=timezone.utc)
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, OverflowError, OSError):
+        # 超出平台时间范围的时间戳：fromtimestamp 抛 OverflowError / OSError
+        raise HTTPException(status_code=400, detail=f"invalid time value: {value}")
+
+
+def to_storage_time(dt: Optional[datetime], tz_name: str) -> Optional[datetime]:
+    """Convert a request time into the naive clock used by ad_logs.start_time."""
+    if dt is None or ZoneInfo is None:
+        return dt.replace(tzinfo=None) if dt is not None else None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=ZoneInfo(tz_name))
+    return dt.astimezone(ZoneInfo(settings.ad_log_timezone)).replace(tzinfo=None)
@@ -0,0 +1,35 @@
+-- Indexes backing /ad_logs listing, keyset pagination and substring search.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block; apply with
+-- autocommit, e.g.:
+--   psql "$PG_DSN" -f control-plane/db/ad_logs_indexes.sql
+-- On a partitioned ad_logs CONCURRENTLY is not supported on the parent table;
+-- drop that keyword there, the indexes then cascade to every partition.
+
+-- pg_trgm powers ILIKE '%q%' on log_id / device_id / ad_file_name.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Matches list_ad_logs ORDER BY start_time DESC NULLS LAST, log_id DESC and the
+-- keyset predicate (start_time, log_id) < (cursor_time, cursor_id).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ad_logs_start_time_log_id
+    ON ad_logs (start_time DESC NULLS LAST, log_id DESC);
+
+-- device_id = ? ORDER BY start_time (device detail / filtered listing).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ad_logs_device_start_time
+    ON ad_logs (device_id, start_time DESC NULLS LAST, log_id DESC);
+
+-- ad_file_name lookups per time window (ad detail).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ad_logs_ad_file_start_time
+    ON ad_logs (ad_file_name, start_time DESC NULLS LAST, log_id DESC);
+
+-- Substring search (q=..., ad_file_name=...); one multi-column GIN index serves
+-- each ILIKE branch of the OR through a BitmapOr.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ad_logs_search_trgm
+    ON ad_logs USING gin (log_id gin_trgm_ops, device_id gin_trgm_ops, ad_file_name gin_trgm_ops);
+
+-- ad_logs -> materials lookup by file name (completion rate / advertiser).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_materials_file_name
+    ON materials (file_name);
+
+ANALYZE ad_logs;
+ANALYZE materials;
@@ -0,0 +1,20 @@
+-- Indexes backing device group selectors (group:/city:/building:/tag:) used in
+-- campaign targets; see app/services/device_groups.py.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block; apply with
+-- autocommit, e.g.:
+--   psql "$PG_DSN" -f control-plane/db/devices_group_indexes.sql
+
+-- Group resolution returns device_id in order; covering the sort avoids a heap fetch.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_devices_group_id
+    ON devices (group_id, device_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_devices_city
+    ON devices (city, device_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_devices_building
+    ON devices (building, device_id);
+
+-- tag:<tag> is evaluated as to_jsonb(tags) ? 'tag'.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_devices_tags_gin
+    ON devices USING gin ((to_jsonb(tags)));
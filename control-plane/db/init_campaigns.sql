@@ -77,3 +77,18 @@ CREATE TABLE IF NOT EXISTS campaign_retry_batches (
 
 CREATE INDEX IF NOT EXISTS idx_retry_batches_campaign_time
 ON campaign_retry_batches(campaign_id, created_at DESC);
+
+-- device_id -> published campaign bindings; replaces the JSONB containment scan
+-- over campaigns.target_device_groups for per-device schedule resolution.
+-- Maintained by db_service.sync_campaign_device_bindings on publish / rollback /
+-- strategy update / delete (rows exist only while the campaign is published).
+CREATE TABLE IF NOT EXISTS campaign_device_bindings (
+    device_id TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    version TEXT,
+    published_at TIMESTAMPTZ,
+    PRIMARY KEY (device_id, campaign_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_campaign_device_bindings_campaign
+ON campaign_device_bindings(campaign_id);
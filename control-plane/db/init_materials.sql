@@ -19,3 +19,4 @@ CREATE TABLE IF NOT EXISTS materials (
 
 CREATE INDEX IF NOT EXISTS idx_materials_status ON materials(status);
 CREATE INDEX IF NOT EXISTS idx_materials_ad_id ON materials(ad_id);
+CREATE INDEX IF NOT EXISTS idx_materials_file_name ON materials(file_name);
@@ -0,0 +1,59 @@
+-- Pre-aggregated play statistics for /ad_stats (hourly + daily, by device and by ad file).
+-- Maintained incrementally by the ad_logs ingest path (db_service.upsert_ad_logs_batch);
+-- the API also creates these tables on demand (db_service.ensure_play_rollup_tables).
+--
+-- Buckets follow ad_logs.start_time (device local time).
+-- plays            : all logs in the bucket
+-- valid_plays      : logs with is_valid IS DISTINCT FROM false
+-- completion_sum/count : sum / number of per-log completion rates
+--                    (duration_ms / material duration, clamped to [0, 10]);
+--                    the ad dimension also skips duration_ms = 0
+--
+-- Backfill existing ad_logs after creating the tables:
+--   python -c "from app.services.db_service import rebuild_play_rollups; rebuild_play_rollups()"
+
+CREATE TABLE IF NOT EXISTS ad_play_rollup_device_hourly (
+    bucket_start TIMESTAMP NOT NULL,
+    device_id TEXT NOT NULL,
+    plays BIGINT NOT NULL DEFAULT 0,
+    valid_plays BIGINT NOT NULL DEFAULT 0,
+    completion_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    completion_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (bucket_start, device_id)
+);
+
+CREATE TABLE IF NOT EXISTS ad_play_rollup_device_daily (
+    bucket_date DATE NOT NULL,
+    device_id TEXT NOT NULL,
+    plays BIGINT NOT NULL DEFAULT 0,
+    valid_plays BIGINT NOT NULL DEFAULT 0,
+    completion_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    completion_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (bucket_date, device_id)
+);
+
+CREATE TABLE IF NOT EXISTS ad_play_rollup_ad_hourly (
+    bucket_start TIMESTAMP NOT NULL,
+    ad_file_name TEXT NOT NULL,          -- '' for logs without ad_file_name
+    material_id TEXT,
+    plays BIGINT NOT NULL DEFAULT 0,
+    valid_plays BIGINT NOT NULL DEFAULT 0,
+    completion_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    completion_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (bucket_start, ad_file_name)
+);
+
+CREATE TABLE IF NOT EXISTS ad_play_rollup_ad_daily (
+    bucket_date DATE NOT NULL,
+    ad_file_name TEXT NOT NULL,
+    material_id TEXT,
+    plays BIGINT NOT NULL DEFAULT 0,
+    valid_plays BIGINT NOT NULL DEFAULT 0,
+    completion_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    completion_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (bucket_date, ad_file_name)
+);
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from app.services import db_service
+
+
+def _rows(n, start=0):
+    return [
+        {"log_id": f"log_{i:03d}", "device_id": "ELEV_001", "start_time": datetime(2026, 3, 9, 10, 0, i)}
+        for i in range(start, start + n)
+    ]
+
+
+def test_list_returns_opaque_next_cursor_and_estimated_total(client, monkeypatch):
+    calls = {}
+
+    def fake_list(limit, offset, cursor=None, **_kw):
+        calls["list"] = (limit, cursor)
+        return _rows(limit)
+
+    def fake_count(estimate=False, **_kw):
+        calls.setdefault("count", []).append(estimate)
+        return 2_000_000
+
+    monkeypatch.setattr(db_service, "list_ad_logs", fake_list)
+    monkeypatch.setattr(db_service, "count_ad_logs", fake_count)
+
+    body = client.get("/api/v1/ad_logs/", params={"limit": 2}).json()
+
+    assert calls == {"list": (3, None), "count": [True]}
+    assert [r["log_id"] for r in body["items"]] == ["log_000", "log_001"]
+    assert body["total"] == 2_000_000 and body["total_estimated"] is True
+    assert db_service.decode_ad_log_cursor(body["next_cursor"]) == (datetime(2026, 3, 9, 10, 0, 1), "log_001")
+
+
+def test_small_result_gets_exact_count_and_last_page_has_no_cursor(client, monkeypatch):
+    counts = []
+    monkeypatch.setattr(db_service, "list_ad_logs", lambda limit, offset, **_kw: _rows(1))
+    monkeypatch.setattr(db_service, "count_ad_logs", lambda estimate=False, **_kw: counts.append(estimate) or 1)
+
+    body = client.get("/api/v1/ad_logs/", params={"limit": 5}).json()
+
+    assert counts == [True, False]
+    assert body["total"] == 1 and body["total_estimated"] is False
+    assert body["next_cursor"] is None
+
+
+def test_malformed_cursor_is_a_client_error(client):
+    resp = client.get("/api/v1/ad_logs/", params={"cursor": "not-a-cursor", "count": "none"})
+    assert resp.status_code == 400
+
+
+def test_time_window_is_passed_to_list_and_count(client, monkeypatch):
+    seen = []
+    monkeypatch.setattr(db_service, "list_ad_logs", lambda limit, offset, **kw: seen.append(kw) or [])
+    monkeypatch.setattr(db_service, "count_ad_logs", lambda estimate=False, **kw: seen.append(kw) or 0)
+
+    resp = client.get(
+        "/api/v1/ad_logs/",
+        params={"from_ts": "2026-03-09T00:00:00", "to_ts": "2026-03-09T23:59:59", "tz": "Asia/Shanghai", "count": "exact"},
+    )
+
+    assert resp.status_code == 200
+    assert len(seen) == 2
+    for kw in seen:
+        assert kw["from_ts"] == datetime(2026, 3, 9, 0, 0, 0)
+        assert kw["to_ts"] == datetime(2026, 3, 9, 23, 59, 59)
+
+
+def test_unknown_timezone_is_a_bad_request(client, monkeypatch):
+    monkeypatch.setattr(db_service, "list_ad_logs", lambda *a, **kw: [])
+    monkeypatch.setattr(db_service, "count_ad_logs", lambda *a, **kw: 0)
+
+    resp = client.get("/api/v1/ad_logs/", params={"from_ts": "2026-03-09T00:00:00", "tz": "Mars/Olympus"})
+
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == "unknown timezone: Mars/Olympus"
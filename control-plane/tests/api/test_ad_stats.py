@@ -0,0 +1,95 @@
+from datetime import datetime
+
+from app.services import db_service
+
+
+def test_devices_summary_reads_daily_rollups(client, monkeypatch):
+    calls = []
+
+    def fake_summarize(dimension, day_from=None, day_to=None, **page):
+        calls.append((dimension, day_from is not None, page))
+        return [
+            {"device_id": "ELEV_002", "plays": 5, "avg_completion_rate": None},
+            {"device_id": "ELEV_001", "plays": 3, "avg_completion_rate": 0.75},
+        ], 7
+
+    monkeypatch.setattr(db_service, "summarize_play_rollups", fake_summarize)
+    monkeypatch.setattr(db_service, "aggregate_ad_logs", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("raw scan")))
+
+    resp = client.get("/api/v1/ad_stats/devices", params={"limit": 2})
+
+    assert resp.status_code == 200
+    assert calls == [("device", True, {"sort": "plays", "order": "desc", "limit": 2, "offset": 0})]
+    assert resp.json() == {
+        "total": 7,
+        "items": [
+            {"device_id": "ELEV_002", "plays": 5, "avg_completion_rate": None},
+            {"device_id": "ELEV_001", "plays": 3, "avg_completion_rate": 0.75},
+        ],
+    }
+
+
+def test_ads_summary_falls_back_to_all_days_and_counts_valid_plays(client, monkeypatch):
+    def fake_summarize(dimension, day_from=None, day_to=None, **page):
+        if day_from is not None:
+            return [], 0
+        return [{"ad_file_name": "", "plays": 4, "valid_plays": 3, "avg_completion_rate": 0.9, "advertiser": "acme"}], 1
+
+    monkeypatch.setattr(db_service, "summarize_play_rollups", fake_summarize)
+
+    resp = client.get("/api/v1/ad_stats/ads")
+
+    assert resp.status_code == 200
+    assert resp.json()["items"] == [
+        {"ad_file_name": "unknown", "plays": 3, "avg_completion_rate": 0.9, "advertiser": "acme"}
+    ]
+
+
+def test_explicit_window_is_aggregated_in_sql_in_storage_timezone(client, monkeypatch):
+    seen = {}
+
+    def fake_aggregate(dimension, from_ts=None, to_ts=None, **page):
+        seen.update(dimension=dimension, from_ts=from_ts, to_ts=to_ts, **page)
+        return [], 0
+
+    monkeypatch.setattr(db_service, "aggregate_ad_logs", fake_aggregate)
+
+    resp = client.get(
+        "/api/v1/ad_stats/ads",
+        params={"from_ts": "2026-03-09T00:00:00Z", "to_ts": "2026-03-10T00:00:00", "tz": "UTC",
+                "sort": "avg_completion_rate", "order": "asc"},
+    )
+
+    assert resp.status_code == 200
+    # ad_logs.start_time is stored as naive Asia/Shanghai time
+    assert seen["from_ts"] == datetime(2026, 3, 9, 8, 0)
+    assert seen["to_ts"] == datetime(2026, 3, 10, 8, 0)
+    assert (seen["sort"], seen["order"]) == ("avg_completion_rate", "asc")
+
+
+def test_unknown_sort_key_is_rejected(client):
+    resp = client.get("/api/v1/ad_stats/devices", params={"from_ts": "0", "sort": "bogus"})
+    assert resp.status_code == 400
+
+
+def test_out_of_range_timestamp_is_a_bad_request(client, monkeypatch):
+    monkeypatch.setattr(db_service, "aggregate_ad_logs", lambda *a, **kw: ([], 0))
+
+    for value in ("99999999999999999999", "-99999999999"):
+        resp = client.get("/api/v1/ad_stats/devices", params={"from_ts": value})
+        assert resp.status_code == 400
+        assert "invalid time value" in resp.json()["detail"]
+
+
+def test_default_timezone_follows_ad_log_timezone(monkeypatch):
+    import inspect
+
+    from app.api.v1.endpoints import ad_stats
+    from app.core.config import settings
+
+    # 默认请求的 tz 与存储时区一致，才会走 rollup。
+    for endpoint in (ad_stats.devices_summary, ad_stats.ads_summary):
+        assert inspect.signature(endpoint).parameters["tz"].default == settings.ad_log_timezone
+    monkeypatch.setattr(settings, "ad_log_timezone", "UTC")
+    start, now = ad_stats._today_range_local()
+    assert now.utcoffset().total_seconds() == 0 and start.date() == now.date()
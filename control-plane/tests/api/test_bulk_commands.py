@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.api.v1.endpoints import commands as commands_ep
+from app.services import command_jobs, db_service
+from app.services.device_groups import get_device_group_registry
+
+
+@pytest.fixture()
+def bulk_env(monkeypatch):
+    calls = []
+    attempts = {}
+    request = httpx.Request("POST", "http://gateway/api/send")
+
+    async def sender(device_id, command, data, cmd_id):
+        calls.append((device_id, command, data, cmd_id))
+        attempts[device_id] = attempts.get(device_id, 0) + 1
+        if device_id == "dev-2" and attempts[device_id] == 1:
+            raise httpx.ConnectError("connection reset", request=request)
+        if device_id == "dev-3":
+            raise httpx.HTTPStatusError("offline", request=request, response=httpx.Response(404, text="Device Offline", request=request))
+        return {"status": "ok"}
+
+    runner = command_jobs.CommandJobRunner(concurrency=2, max_retries=2, backoff_sec=0, sender=sender)
+    monkeypatch.setattr(command_jobs, "_RUNNER", runner)
+    inserted, updated = [], []
+    monkeypatch.setattr(db_service, "insert_commands_batch", lambda rows: inserted.append(rows) or len(rows))
+    monkeypatch.setattr(db_service, "update_command_statuses_batch", lambda rows: updated.append(rows) or len(rows))
+    monkeypatch.setattr(get_device_group_registry(), "loader", lambda field, value: ["dev-2", "dev-3", "dev-4"])
+    return calls, attempts, inserted, updated
+
+
+def test_bulk_command_fans_out_to_devices_and_group(client, bulk_env):
+    calls, attempts, inserted, updated = bulk_env
+
+    resp = client.post(
+        "/api/v1/commands/bulk",
+        json={"action": "reboot", "params": {"delay": 5}, "target_device_ids": ["dev-1", "dev-2"], "group": "B1"},
+    )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["total"] == 4
+    assert body["job_url"].endswith(f"/api/v1/commands/jobs/{body['job_id']}")
+
+    job = client.get(f"/api/v1/commands/jobs/{body['job_id']}", params={"include_results": True}).json()
+    assert job["status"] == "done"
+    assert job["targets"] == ["dev-1", "dev-2", "group:B1"]
+    assert (job["sent"], job["failed"], job["pending"]) == (3, 1, 0)
+    assert job["failures"][0]["device_id"] == "dev-3"
+    assert "404" in job["failures"][0]["error"]
+    # 网络错误重试一次成功；设备离线（4xx）不重试。
+    assert attempts == {"dev-1": 1, "dev-2": 2, "dev-3": 1, "dev-4": 1}
+    assert {c[1] for c in calls} == {"REBOOT"}
+
+    # command_logs：一次批量插入 pending，一次批量回写最终状态。
+    assert len(inserted) == 1 and [r["status"] for r in inserted[0]] == ["pending"] * 4
+    assert len(updated) == 1
+    assert sorted(status for _, status, _ in updated[0]) == ["failed", "sent", "sent", "sent"]
+
+
+def test_bulk_command_validation_and_memory_fallback(client, bulk_env, monkeypatch):
+    assert client.post("/api/v1/commands/bulk", json={"action": "reboot"}).status_code == 400
+    assert client.post("/api/v1/commands/bulk", json={"action": "capture", "target_device_ids": ["dev-1"]}).status_code == 400
+    assert client.get("/api/v1/commands/jobs/unknown").status_code == 404
+
+    def db_down(rows):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(db_service, "insert_commands_batch", db_down)
+    monkeypatch.setattr(commands_ep, "mock_command_db", [])
+    resp = client.post("/api/v1/commands/bulk", json={"action": "volume", "params": {"level": 3}, "target_device_ids": ["dev-1", "dev-1"]})
+    assert resp.json()["total"] == 1
+    assert [(r["device_id"], r["status"], r["result"]) for r in commands_ep.mock_command_db] == [("dev-1", "sent", "volume_sent")]
+
+
+def test_job_cancelled_at_shutdown_gets_terminal_status(monkeypatch):
+    monkeypatch.setattr(db_service, "insert_commands_batch", lambda rows: len(rows))
+
+    async def hang(device_id, command, data, cmd_id):
+        await asyncio.Event().wait()
+
+    runner = command_jobs.CommandJobRunner(concurrency=1, max_retries=0, backoff_sec=0, sender=hang)
+    job = command_jobs.CommandJob("reboot", {}, ["dev-1"], ["dev-1"])
+
+    async def scenario():
+        task = asyncio.create_task(runner.run(job))
+        await asyncio.sleep(0.05)
+        assert job.status == "running"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert job.status == "cancelled" and job.finished_at is not None
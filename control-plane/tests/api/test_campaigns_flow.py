@@ -320,8 +320,8 @@ def test_gateway_device_bundle_returns_schedule_and_assets(client, monkeypatch):
     )
     monkeypatch.setattr(
         gateway_ep.db_service,
-        "list_materials",
-        lambda **_kwargs: [
+        "list_all_materials",
+        lambda: [
             {
                 "material_id": "mat_001",
                 "ad_id": "ad_101",
@@ -351,8 +351,8 @@ def test_gateway_device_bundle_returns_schedule_and_assets(client, monkeypatch):
 def test_gateway_material_metadata_by_ad_id_returns_download_url(client, monkeypatch):
     monkeypatch.setattr(
         gateway_ep.db_service,
-        "list_materials",
-        lambda **_kwargs: [
+        "list_all_materials",
+        lambda: [
             {
                 "material_id": "mat_001",
                 "ad_id": "ad_101",
@@ -373,3 +373,123 @@ def test_gateway_material_metadata_by_ad_id_returns_download_url(client, monkeyp
     assert body["material_id"] == "mat_001"
     assert body["ad_id"] == "ad_101"
     assert body["download_url"].endswith("/api/v1/gateway/materials/mat_001/file")
+
+
+def test_gateway_bundle_is_cached_until_campaign_changes(client, monkeypatch):
+    campaign_id = _create_campaign(client)
+    assert _publish_campaign(client, monkeypatch, campaign_id).status_code == 200
+
+    lookups = []
+
+    def fake_latest(device_id):
+        lookups.append(device_id)
+        return None
+
+    monkeypatch.setattr(gateway_ep.db_service, "get_latest_published_campaign_for_device", fake_latest, raising=False)
+    builds = []
+    real_build = gateway_ep._build_device_schedule_bundle
+    monkeypatch.setattr(
+        gateway_ep,
+        "_build_device_schedule_bundle",
+        lambda *args: builds.append(args[1]) or real_build(*args),
+    )
+
+    first = client.get("/api/v1/gateway/devices/dev_001/bundle").json()
+    assert client.get("/api/v1/gateway/devices/dev_001/bundle").json() == first
+    assert client.get("/api/v1/gateway/devices/dev_001/schedule").json() == first["schedule"]
+    assert lookups == ["dev_001"] and builds == ["dev_001"]
+
+    resp = client.post(f"/api/v1/campaigns/{campaign_id}/rollback", json={"version": first["version"], "publish_now": False})
+    assert resp.status_code == 200
+    assert client.get("/api/v1/gateway/devices/dev_001/bundle").status_code == 404
+
+
+def test_gateway_schedule_conditional_requests(client, monkeypatch):
+    campaign_id = _create_campaign(client)
+    assert _publish_campaign(client, monkeypatch, campaign_id).status_code == 200
+    monkeypatch.setattr(
+        gateway_ep.db_service,
+        "get_latest_published_campaign_for_device",
+        lambda *_args, **_kwargs: None,
+        raising=False,
+    )
+
+    for path in ("/api/v1/gateway/devices/dev_001/schedule", "/api/v1/gateway/devices/dev_001/bundle"):
+        resp = client.get(path)
+        assert resp.status_code == 200
+        etag = resp.headers["etag"]
+        assert etag.startswith('"') and resp.headers["last-modified"].endswith("GMT")
+        version = resp.headers["x-schedule-version"]
+
+        not_modified = client.get(path, headers={"If-None-Match": f'W/"other", {etag}'})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+
+        assert client.get(path, headers={"If-None-Match": '"stale"'}).status_code == 200
+        assert client.get(path, params={"since_version": version}).status_code == 304
+        assert client.get(path, params={"since_version": "19700101_v1"}).status_code == 200
+
+    edge = client.get("/api/v1/gateway/devices/dev_001/schedule", params={"format": "edge-schedule"})
+    assert edge.headers["etag"] != client.get("/api/v1/gateway/devices/dev_001/schedule").headers["etag"]
+
+
+def test_gateway_memory_fallback_follows_publish_and_delete(client, monkeypatch):
+    monkeypatch.setattr(
+        gateway_ep.db_service,
+        "get_latest_published_campaign_for_device",
+        lambda *_args, **_kwargs: None,
+        raising=False,
+    )
+    monkeypatch.setattr(campaigns_ep.db_service, "delete_campaign", lambda *_args, **_kwargs: 0)
+    first = _create_campaign(client)
+    second = _create_campaign(client)
+    assert _publish_campaign(client, monkeypatch, first).status_code == 200
+    assert client.get("/api/v1/gateway/devices/dev_001/bundle").json()["campaign_id"] == first
+
+    assert _publish_campaign(client, monkeypatch, second).status_code == 200
+    assert client.get("/api/v1/gateway/devices/dev_001/bundle").json()["campaign_id"] == second
+
+    assert client.delete(f"/api/v1/campaigns/{second}").status_code == 200
+    assert client.get("/api/v1/gateway/devices/dev_001/bundle").json()["campaign_id"] == first
+    assert client.get("/api/v1/gateway/devices/dev_404/bundle").status_code == 404
+
+
+def test_campaign_targets_device_groups(client, monkeypatch):
+    from app.services.device_groups import get_device_group_registry
+
+    groups = {("city", "Shanghai"): ["dev_sh_2", "dev_sh_1"], ("group_id", "G_EMPTY"): []}
+    monkeypatch.setattr(
+        campaigns_ep.db_service,
+        "list_device_ids_in_group",
+        lambda column, value: list(groups.get((column, value), [])),
+        raising=False,
+    )
+    monkeypatch.setattr(
+        gateway_ep.db_service,
+        "get_latest_published_campaign_for_device",
+        lambda *_args, **_kwargs: None,
+        raising=False,
+    )
+    payload = _strategy_payload()
+    payload["devices_list"] = ["City: Shanghai", "group:G_EMPTY"]
+    campaign_id = client.post("/api/v1/campaigns/strategy", json=payload).json()["campaign_id"]
+    assert campaigns_ep._CAMPAIGN_STORE[campaign_id]["target_device_groups"] == ["city:Shanghai", "group:G_EMPTY"]
+
+    resp = _publish_campaign(client, monkeypatch, campaign_id)
+    assert resp.status_code == 400
+    assert resp.json()["detail"]["errors"] == ["empty device groups: ['group:G_EMPTY']"]
+
+    groups[("group_id", "G_EMPTY")] = ["dev_sh_1"]
+    get_device_group_registry().invalidate()
+    resp = _publish_campaign(client, monkeypatch, campaign_id)
+    assert resp.status_code == 200
+    assert resp.json()["device_count"] == 2
+
+    assert client.get("/api/v1/gateway/devices/dev_sh_2/bundle").json()["campaign_id"] == campaign_id
+    assert client.get("/api/v1/gateway/devices/dev_bj_1/bundle").status_code == 404
+
+    # 新注册的设备增量加入已解析的组，网关随即能解析到活动。
+    get_device_group_registry().observe_device("dev_bj_1", {"city": "Shanghai"})
+    gateway_ep.get_bundle_cache().forget_device("dev_bj_1")
+    assert client.get("/api/v1/gateway/devices/dev_bj_1/bundle").json()["campaign_id"] == campaign_id
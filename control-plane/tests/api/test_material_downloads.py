@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from app.services import db_service, material_downloads, material_service
+from app.services.material_downloads import MaterialFileResponse, get_download_cache
+from app.services.material_store import SqliteMaterialStore
+
+
+@pytest.fixture()
+def stored_material(tmp_path, monkeypatch):
+    monkeypatch.setattr(material_service, "MATERIAL_DIR", tmp_path)
+    monkeypatch.setattr(material_service, "_STORE", SqliteMaterialStore(tmp_path / "catalog.sqlite3"))
+    monkeypatch.setattr(db_service, "list_all_materials", lambda: [])
+    data = bytes(range(256)) * 64
+    path = tmp_path / "M_001_promo.mp4"
+    path.write_bytes(data)
+    md5 = hashlib.md5(data).hexdigest()
+    material_service.upsert_material(
+        {
+            "material_id": "M_001",
+            "ad_id": "ad_1",
+            "filename": "promo.mp4",
+            "file_name": "promo.mp4",
+            "md5": md5,
+            "status": "done",
+            "extra": {"path": str(path)},
+        }
+    )
+    return data, f'"{md5}"'
+
+
+def test_download_supports_range_and_strong_etag(client, stored_material):
+    data, etag = stored_material
+    url = "/api/v1/materials/M_001/file"
+
+    full = client.get(url)
+    assert full.status_code == 200
+    assert full.content == data
+    assert full.headers["etag"] == etag
+    assert full.headers["accept-ranges"] == "bytes"
+    assert 'filename="promo.mp4"' in full.headers["content-disposition"]
+
+    # 断点续传：从已收到的字节处继续。
+    part = client.get(url, headers={"Range": "bytes=1000-"})
+    assert part.status_code == 206
+    assert part.content == data[1000:]
+    assert part.headers["content-range"] == f"bytes 1000-{len(data) - 1}/{len(data)}"
+
+    assert client.get(url, headers={"Range": "bytes=0-9", "If-Range": etag}).status_code == 206
+    # 文件已变化（ETag 不符）时 If-Range 回退整文件。
+    stale = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"0000"'})
+    assert stale.status_code == 200
+    assert stale.content == data
+
+    assert client.get(url, headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_gateway_download_uses_cached_path_until_material_changes(client, stored_material):
+    data, etag = stored_material
+    url = "/api/v1/gateway/materials/ad_1/file"
+
+    assert client.get(url).content == data
+    resp = client.get(url, headers={"Range": "bytes=0-99"})
+    assert resp.status_code == 206
+    assert resp.content == data[:100]
+    assert resp.headers["etag"] == etag
+    assert get_download_cache().stats()["hits"] >= 1
+
+    material_service.delete_material("M_001")
+    assert get_download_cache().stats()["entries"] == 0
+    assert client.get(url).status_code == 404
+
+
+def test_file_response_uses_zerocopy_extension_when_offered(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b"0123456789")
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            fh = message["file"]
+            fh.seek(message["offset"])
+            message = {**message, "body": fh.read(message["count"])}
+        sent.append(message)
+
+    async def receive():
+        await asyncio.Event().wait()  # 客户端一直保持连接
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "headers": [(b"range", b"bytes=2-5")],
+        "extensions": {"http.response.zerocopysend": {}},
+    }
+    asyncio.run(MaterialFileResponse(str(path), stat_result=path.stat())(scope, receive, send))
+
+    assert sent[0]["status"] == 206
+    assert sent[1]["type"] == "http.response.zerocopysend"
+    assert sent[1]["body"] == b"2345"
+
+
+def test_file_response_serves_range_without_zerocopy_hooks(tmp_path, monkeypatch):
+    # 没有私有钩子的 Starlette：即使服务器声明了扩展，也按普通 206 分块返回。
+    monkeypatch.setattr(material_downloads, "_ZEROCOPY_HOOKS", False)
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b"0123456789")
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "headers": [(b"range", b"bytes=2-5")],
+        "extensions": {"http.response.zerocopysend": {}},
+    }
+    asyncio.run(MaterialFileResponse(str(path), stat_result=path.stat())(scope, receive, send))
+
+    assert sent[0]["status"] == 206
+    assert b"".join(m.get("body", b"") for m in sent[1:] if m["type"] == "http.response.body") == b"2345"
@@ -0,0 +1,186 @@
+import asyncio
+import base64
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.endpoints import materials as materials_ep
+from app.core.config import settings
+from app.services import blob_store, material_multipart
+
+
+@pytest.fixture()
+def upload_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(material_multipart, "UPLOADS_DIR", tmp_path / ".uploads")
+    monkeypatch.setattr(materials_ep, "MATERIAL_DIR", tmp_path)
+    monkeypatch.setattr(blob_store, "_BLOB_STORE", blob_store.BlobStore(tmp_path / "blobs"))
+    monkeypatch.setattr(settings, "material_blob_store", False)
+    monkeypatch.setattr(materials_ep, "_new_material_id", lambda: "M_900")
+    persisted = []
+    monkeypatch.setattr(materials_ep, "_persist_material", persisted.append)
+    return tmp_path, persisted
+
+
+def test_multipart_upload_resumes_and_completes(client, upload_dirs):
+    tmp_path, persisted = upload_dirs
+    part_size = material_multipart.MIN_PART_SIZE
+    data = bytes(range(256)) * (part_size * 3 // 256) + b"tail"
+    parts = [data[i:i + part_size] for i in range(0, len(data), part_size)]
+
+    resp = client.post(
+        "/api/v1/materials/uploads",
+        json={"file_name": "promo.mp4", "size_bytes": len(data), "part_size": part_size, "ad_id": "ad_9", "md5": hashlib.md5(data).hexdigest()},
+    )
+    assert resp.status_code == 200
+    upload_id = resp.json()["upload_id"]
+    assert resp.json()["total_parts"] == 4
+    base = f"/api/v1/materials/uploads/{upload_id}"
+
+    # 乱序上传第 1、3 片；第 2 片校验和不符被拒绝。
+    assert client.put(f"{base}/parts/1", content=parts[0], headers={"Content-MD5": hashlib.md5(parts[0]).hexdigest()}).status_code == 200
+    assert client.put(f"{base}/parts/3", content=parts[2]).status_code == 200
+    bad = client.put(f"{base}/parts/2", content=parts[1], headers={"Content-MD5": hashlib.md5(b"x").hexdigest()})
+    assert bad.status_code == 400
+    assert client.put(f"{base}/parts/4", content=parts[3] + b"!").status_code == 400
+
+    status = client.get(base).json()
+    assert status["missing_parts"] == [2, 4]
+    assert status["received_ranges"] == [[0, part_size], [2 * part_size, 3 * part_size]]
+    assert client.post(f"{base}/complete").status_code == 409
+
+    assert client.put(f"{base}/parts/2", content=parts[1]).status_code == 200
+    assert client.put(f"{base}/parts/4", content=parts[3]).status_code == 200
+    assert client.get(base).json()["received_ranges"] == [[0, len(data)]]
+
+    resp = client.post(f"{base}/complete", json={"parts": [{"part_number": 3, "md5": hashlib.md5(parts[2]).hexdigest()}]})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["material_id"] == "M_900"
+    assert body["md5"] == hashlib.md5(data).hexdigest()
+    assert (tmp_path / "M_900_promo.mp4").read_bytes() == data
+    assert persisted[0]["ad_id"] == "ad_9" and persisted[0]["size_bytes"] == len(data)
+    assert client.get(base).status_code == 404
+
+
+def test_in_order_parts_keep_running_md5(upload_dirs):
+    session = material_multipart.init_upload({"file_name": "a.bin"}, 10, part_size=material_multipart.MIN_PART_SIZE)
+    assert material_multipart._RUNNING_MD5[session["upload_id"]][0] == 1
+    material_multipart.abort_upload(session["upload_id"])
+    assert session["upload_id"] not in material_multipart._RUNNING_MD5
+
+
+def test_concurrent_put_of_same_part_is_rejected_and_reput_drops_running_md5(upload_dirs):
+    part_size = material_multipart.MIN_PART_SIZE
+    session = material_multipart.init_upload({"file_name": "a.bin"}, part_size * 2, part_size=part_size)
+    upload_id = session["upload_id"]
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def slow_body():
+            yield b"a" * (part_size // 2)
+            await gate.wait()
+            yield b"a" * (part_size // 2)
+
+        first = asyncio.ensure_future(material_multipart.upload_part(upload_id, 1, slow_body()))
+        await asyncio.sleep(0.05)
+        # 第一个 PUT 还在写：同一分片的第二个 PUT 直接 409，不会与之交错写入。
+        with pytest.raises(HTTPException) as exc:
+            await material_multipart.upload_part(upload_id, 1, _body(b"b" * part_size))
+        assert exc.value.status_code == 409
+        with pytest.raises(HTTPException) as exc:
+            material_multipart.complete_upload(upload_id, upload_dirs[0] / "a.bin")
+        assert exc.value.status_code == 409
+        gate.set()
+        await first
+        assert material_multipart._RUNNING_MD5[upload_id][0] == 2
+
+        await material_multipart.upload_part(upload_id, 1, _body(b"c" * part_size))
+        assert upload_id not in material_multipart._RUNNING_MD5
+        await material_multipart.upload_part(upload_id, 2, _body(b"d" * part_size))
+
+    asyncio.run(scenario())
+    result = material_multipart.complete_upload(upload_id, upload_dirs[0] / "a.bin")
+    assert result["md5"] == hashlib.md5(b"c" * part_size + b"d" * part_size).hexdigest()
+
+
+async def _body(data):
+    yield data
+
+
+def test_content_md5_accepts_base64_and_hex():
+    digest = hashlib.md5(b"abc")
+    assert material_multipart.parse_content_md5(base64.b64encode(digest.digest()).decode()) == digest.hexdigest()
+    assert material_multipart.parse_content_md5(digest.hexdigest().upper()) == digest.hexdigest()
+    with pytest.raises(HTTPException):
+        material_multipart.parse_content_md5("not-a-digest")
+
+
+def test_multipart_upload_into_blob_store_deduplicates(client, upload_dirs, monkeypatch):
+    monkeypatch.setattr(settings, "material_blob_store", True)
+    data = b"creative" * 20000
+
+    def upload_once():
+        upload_id = client.post("/api/v1/materials/uploads", json={"file_name": "c.mp4", "size_bytes": len(data)}).json()["upload_id"]
+        base = f"/api/v1/materials/uploads/{upload_id}"
+        assert client.put(f"{base}/parts/1", content=data).status_code == 200
+        return client.post(f"{base}/complete").json()
+
+    first, second = upload_once(), upload_once()
+    sha = hashlib.sha256(data).hexdigest()
+    store = blob_store.get_blob_store()
+    assert first["extra"]["path"] == second["extra"]["path"] == str(store.blob_path(sha))
+    assert (first["extra"]["deduplicated"], second["extra"]["deduplicated"]) == (False, True)
+    assert store.get(sha)["refcount"] == 2
+
+
+def test_blob_reference_is_released_when_material_record_fails(client, upload_dirs, monkeypatch):
+    monkeypatch.setattr(settings, "material_blob_store", True)
+
+    def broken_persist(meta):
+        raise RuntimeError("catalog unavailable")
+
+    monkeypatch.setattr(materials_ep, "_persist_material", broken_persist)
+    data = b"orphan" * 20000
+    sha = hashlib.sha256(data).hexdigest()
+    store = blob_store.get_blob_store()
+
+    resp = client.post("/api/v1/materials/upload", files={"file": ("o.mp4", data)})
+    assert resp.status_code == 500
+    assert store.get(sha) is None and not store.blob_path(sha).exists()
+
+    upload_id = client.post("/api/v1/materials/uploads", json={"file_name": "o.mp4", "size_bytes": len(data)}).json()["upload_id"]
+    base = f"/api/v1/materials/uploads/{upload_id}"
+    assert client.put(f"{base}/parts/1", content=data).status_code == 200
+    with pytest.raises(RuntimeError):
+        client.post(f"{base}/complete")
+    assert store.get(sha) is None and not store.blob_path(sha).exists()
+
+
+def test_declared_sha256_short_circuits_duplicate_uploads(client, upload_dirs, monkeypatch):
+    tmp_path, persisted = upload_dirs
+    monkeypatch.setattr(settings, "material_blob_store", True)
+    data = b"known-creative" * 10000
+    sha = hashlib.sha256(data).hexdigest()
+    store = blob_store.get_blob_store()
+    first = client.post("/api/v1/materials/upload", files={"file": ("k.mp4", data)}, data={"sha256": sha}).json()
+    assert first["extra"]["deduplicated"] is False
+
+    # 分片上传：init 时就命中已有 blob，不用传任何分片。
+    init = client.post("/api/v1/materials/uploads", json={"file_name": "k2.mp4", "size_bytes": len(data), "sha256": sha.upper()})
+    body = init.json()
+    assert init.status_code == 200 and body["upload_id"] is None and body["deduplicated"] is True
+    assert body["material"]["md5"] == hashlib.md5(data).hexdigest()
+    assert body["material"]["extra"]["path"] == str(store.blob_path(sha))
+
+    # 表单上传：命中后不再写 incoming 临时文件。
+    monkeypatch.setattr(materials_ep, "save_upload_stream", None)
+    again = client.post("/api/v1/materials/upload", files={"file": ("k3.mp4", data)}, data={"sha256": sha}).json()
+    assert again["extra"]["deduplicated"] is True and again["md5"] == first["md5"]
+    assert store.get(sha)["refcount"] == 3 and len(persisted) == 3
+
+    # 大小不符时不引用，按正常分片上传处理；非法哈希直接 400。
+    miss = client.post("/api/v1/materials/uploads", json={"file_name": "k4.mp4", "size_bytes": len(data) + 1, "sha256": sha}).json()
+    assert miss["upload_id"] and miss["deduplicated"] is False
+    assert client.post("/api/v1/materials/uploads", json={"file_name": "x", "size_bytes": 10, "sha256": "zz"}).status_code == 400
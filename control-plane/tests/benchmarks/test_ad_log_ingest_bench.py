@@ -0,0 +1,154 @@
+"""
+Ingest throughput benchmark: per-row upsert path vs. bulk upsert path.
+
+Needs a scratch Postgres; it is skipped unless ``BENCH_PG_DSN`` is set::
+
+    BENCH_PG_DSN="host=localhost user=postgres password=... dbname=elevator_ad" \
+        python -m pytest -c pytest.ini tests/benchmarks -s
+
+Everything runs inside a throwaway schema that is dropped afterwards.
+Tune the batch count with ``BENCH_AD_LOG_RECORDS`` (default 2000).
+"""
+
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services import db_service
+
+DSN = os.getenv("BENCH_PG_DSN")
+N_RECORDS = int(os.getenv("BENCH_AD_LOG_RECORDS", "2000"))
+
+pytestmark = pytest.mark.skipif(not DSN, reason="BENCH_PG_DSN not set")
+
+
+@pytest.fixture()
+def bench_conn():
+    import psycopg2
+
+    schema = f"bench_{uuid.uuid4().hex[:8]}"
+    conn = psycopg2.connect(DSN)
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path TO {schema}")
+    cur.execute("CREATE TABLE devices (device_id TEXT PRIMARY KEY)")
+    cur.execute("CREATE TABLE materials (file_name TEXT, duration_sec INT, advertiser TEXT, updated_at TIMESTAMP)")
+    cur.execute(
+        """
+        CREATE TABLE ad_logs (
+            log_id TEXT PRIMARY KEY,
+            device_id TEXT NOT NULL REFERENCES devices(device_id),
+            material_id TEXT,
+            ad_file_name TEXT,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            duration_ms INT,
+            status_code SMALLINT,
+            status_msg TEXT,
+            device_ip INET,
+            firmware_version TEXT,
+            created_at BIGINT,
+            expected_md5 TEXT,
+            actual_md5 TEXT,
+            is_valid BOOLEAN,
+            billing_status TEXT
+        )
+        """
+    )
+    conn.commit()
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def _records(n: int, prefix: str) -> list:
+    base = datetime(2026, 3, 19, 10, 0, 0)
+    out = []
+    for i in range(n):
+        start = base + timedelta(seconds=15 * i)
+        out.append({
+            "log_id": f"{prefix}_{i:08d}",
+            "device_id": f"ELEV_{i % 200:04d}",
+            "material_id": f"AD_{i % 30:03d}",
+            "ad_file_name": f"ads/ad_{i % 30:03d}.mp4",
+            "start_time": start,
+            "end_time": start + timedelta(seconds=15),
+            "duration_ms": 15000,
+            "status_code": 200,
+            "status_msg": "Play Success",
+            "device_ip": "192.168.1.105",
+            "firmware_version": "1.0.0",
+            "created_at": 1709815005 + i,
+            "expected_md5": None,
+            "actual_md5": None,
+            "is_valid": True,
+            "billing_status": "pending",
+        })
+    return out
+
+
+def _per_row_upsert(conn, rec) -> None:
+    # 基线：原来逐条写入的路径（补齐 devices + 单行 UPSERT + COMMIT）。
+    cur = conn.cursor()
+    cur.execute("INSERT INTO devices (device_id) VALUES (%s) ON CONFLICT (device_id) DO NOTHING", [rec["device_id"]])
+    cur.execute(
+        db_service._ad_log_upsert_sql(
+            db_service.ad_logs_partitioned(cur), "(" + ", ".join(["%s"] * len(db_service.AD_LOG_COLUMNS)) + ")"
+        ),
+        [rec.get(c) for c in db_service.AD_LOG_COLUMNS],
+    )
+    conn.commit()
+    cur.close()
+
+
+def _count(conn) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(1) FROM ad_logs")
+    n = cur.fetchone()[0]
+    conn.commit()
+    return n
+
+
+def test_bulk_upsert_outperforms_per_row(bench_conn):
+    per_row = _records(N_RECORDS, "row")
+    t0 = time.perf_counter()
+    for rec in per_row:
+        _per_row_upsert(bench_conn, rec)
+    per_row_sec = time.perf_counter() - t0
+
+    bulk = _records(N_RECORDS, "bulk")
+    t0 = time.perf_counter()
+    written = db_service.upsert_ad_logs_batch(bench_conn, bulk)
+    bulk_sec = time.perf_counter() - t0
+
+    assert written == N_RECORDS
+    assert _count(bench_conn) == 2 * N_RECORDS
+
+    per_row_rps = N_RECORDS / per_row_sec
+    bulk_rps = N_RECORDS / bulk_sec
+    print(
+        f"\nad_logs ingest, {N_RECORDS} records: "
+        f"per-row {per_row_rps:,.0f} rec/s, bulk {bulk_rps:,.0f} rec/s "
+        f"({bulk_rps / per_row_rps:.1f}x)"
+    )
+    assert bulk_rps > per_row_rps
+
+
+def test_bulk_upsert_dedupes_log_ids_within_batch(bench_conn):
+    recs = _records(3, "dup")
+    recs.append({**recs[0], "duration_ms": 1})
+
+    written = db_service.upsert_ad_logs_batch(bench_conn, recs)
+
+    assert written == 3
+    cur = bench_conn.cursor()
+    cur.execute("SELECT duration_ms FROM ad_logs WHERE log_id = %s", [recs[0]["log_id"]])
+    assert cur.fetchone()[0] == 1
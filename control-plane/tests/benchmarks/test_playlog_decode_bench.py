@@ -0,0 +1,109 @@
+"""
+Play-log decode micro-benchmark: legacy try-each-encoding + dict path vs. PlayLogDecoder.
+
+The corpus is built from the ``logs`` payloads in ``tools/mock_device.py``
+(wrapped as ``{"type": "log", "payload": [...]}`` like the device sends
+them), plus a share of gb18030-encoded messages. Run with output::
+
+    python -m pytest -c pytest.ini tests/benchmarks/test_playlog_decode_bench.py -s
+
+Tune the corpus size with ``BENCH_DECODE_MESSAGES`` (default 2000).
+"""
+
+import ast
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from app.services.playlog_codec import PlayLogDecoder, _load_backend
+
+N_MESSAGES = int(os.getenv("BENCH_DECODE_MESSAGES", "2000"))
+MOCK_DEVICE = Path(__file__).resolve().parents[3] / "tools" / "mock_device.py"
+
+
+def _mock_device_logs() -> list:
+    # 只取 mock_device.py 里的 logs 赋值语句求值，不导入整个脚本（依赖 websocket）。
+    tree = ast.parse(MOCK_DEVICE.read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "logs" for t in node.targets):
+            expr = ast.Expression(node.value)
+            return eval(compile(expr, str(MOCK_DEVICE), "eval"), {"uuid": uuid, "time": time})
+    raise AssertionError("logs not found in tools/mock_device.py")
+
+
+def _corpus(n: int) -> list:
+    logs = _mock_device_logs()
+    out = []
+    for i in range(n):
+        payload = [{**log, "log_id": f"{log['log_id']}_{i}"} for log in logs]
+        text = json.dumps({"type": "log", "payload": payload}, ensure_ascii=False)
+        out.append(text.encode("gb18030" if i % 20 == 0 else "utf-8"))
+    return out
+
+
+def _legacy_decode(raw: bytes) -> list:
+    # 旧实现：逐个编码 decode + json.loads，再逐字段构造 dict。
+    data = None
+    for enc in ("utf-8", "gb18030", "latin1"):
+        try:
+            data = json.loads(raw.decode(enc))
+            break
+        except Exception:
+            continue
+
+    def ts(v):
+        if isinstance(v, str) and ("T" in v or " " in v):
+            return datetime.fromisoformat(v.replace("+08:00", "").replace("Z", ""))
+        if isinstance(v, (int, float)):
+            return datetime.fromtimestamp(v / 1000 if v > 1e12 else v)
+        return None
+
+    out = []
+    for item in data.get("payload", []):
+        rec = {}
+        rec["log_id"] = item.get("log_id")
+        rec["device_id"] = item.get("device_id")
+        rec["material_id"] = item.get("material_id") or item.get("ad_id")
+        rec["ad_file_name"] = item.get("ad_file_name")
+        rec["start_time"] = ts(item.get("start_time"))
+        rec["end_time"] = ts(item.get("end_time"))
+        rec["duration_ms"] = item.get("duration_ms")
+        rec["status_code"] = item.get("status_code")
+        rec["status_msg"] = item.get("status_msg")
+        rec["device_ip"] = (item.get("device_ip") or "").strip() or None
+        rec["firmware_version"] = item.get("firmware_version")
+        rec["created_at"] = item.get("created_at")
+        rec["expected_md5"] = item.get("expected_md5")
+        rec["actual_md5"] = item.get("actual_md5")
+        rec["is_valid"] = item.get("is_valid")
+        rec["billing_status"] = item.get("billing_status") or "pending"
+        out.append(rec)
+    return out
+
+
+def _run(decode, corpus) -> tuple:
+    t0 = time.perf_counter()
+    records = [decode(raw) for raw in corpus]
+    return records, time.perf_counter() - t0
+
+
+def test_decoder_backends_match_legacy_and_report_throughput():
+    corpus = _corpus(N_MESSAGES)
+    n_records = N_MESSAGES * len(_mock_device_logs())
+
+    legacy, legacy_sec = _run(_legacy_decode, corpus)
+    lines = [f"legacy   {n_records / legacy_sec:>12,.0f} rec/s"]
+
+    for name in ("json", "orjson", "msgspec"):
+        if _load_backend(name) is None:
+            lines.append(f"{name:<8} not installed")
+            continue
+        decoder = PlayLogDecoder(name)
+        records, sec = _run(decoder.decode, corpus)
+        assert [[r.as_dict() for r in msg] for msg in records] == legacy
+        lines.append(f"{name:<8} {n_records / sec:>12,.0f} rec/s ({legacy_sec / sec:.1f}x)")
+
+    print(f"\nplay-log decode, {N_MESSAGES} messages / {n_records} records:\n  " + "\n  ".join(lines))
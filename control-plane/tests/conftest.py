@@ -6,6 +6,13 @@ from fastapi.testclient import TestClient
 from app.main import app
 from app.api.v1.endpoints import campaigns as campaigns_ep
 from app.core.config import settings
+from app.services.bundle_cache import get_bundle_cache
+from app.services.campaign_bindings import get_campaign_device_index
+from app.services.device_groups import get_device_group_registry
+from app.services import material_service
+from app.services.material_catalog import get_material_catalog
+from app.services.material_downloads import get_download_cache
+from app.services.material_store import SqliteMaterialStore
 
 
 @pytest.fixture(autouse=True)
@@ -14,12 +21,30 @@ def reset_campaign_state() -> Generator[None, None, None]:
     settings.enable_memory_fallback = True
     campaigns_ep._CAMPAIGN_STORE.clear()
     campaigns_ep._CAMPAIGN_VERSION_STORE.clear()
+    get_bundle_cache().clear()
+    get_campaign_device_index().clear()
+    get_device_group_registry().clear()
+    get_material_catalog().clear()
+    get_download_cache().clear()
     yield
     campaigns_ep._CAMPAIGN_STORE.clear()
     campaigns_ep._CAMPAIGN_VERSION_STORE.clear()
+    get_bundle_cache().clear()
+    get_campaign_device_index().clear()
+    get_device_group_registry().clear()
+    get_material_catalog().clear()
+    get_download_cache().clear()
     settings.enable_memory_fallback = prev
 
 
+@pytest.fixture(autouse=True)
+def isolated_material_store(tmp_path_factory, monkeypatch):
+    # 素材目录库默认落在 data/materials/catalog.sqlite3，测试一律改到独立的临时目录
+    # （不占用 tmp_path，避免干扰断言目录内容的用例）。
+    store_dir = tmp_path_factory.mktemp("materials")
+    monkeypatch.setattr(material_service, "_STORE", SqliteMaterialStore(store_dir / "catalog.sqlite3"))
+
+
 @pytest.fixture()
 def client() -> TestClient:
     return TestClient(app)
@@ -0,0 +1,71 @@
+from datetime import date, datetime
+
+import pytest
+
+from app.services import ad_log_partitions as parts
+
+
+class _FakeCursor:
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.statements = []
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+        if "FROM pg_inherits" in sql:
+            self._result = [(name, None, 0) for name in self.partitions]
+
+    def fetchall(self):
+        return self._result
+
+
+def test_bounds_and_names():
+    assert parts.partition_bounds("day", date(2026, 3, 31)) == (date(2026, 3, 31), date(2026, 4, 1))
+    assert parts.partition_bounds("month", datetime(2026, 12, 15, 8)) == (date(2026, 12, 1), date(2027, 1, 1))
+    assert parts.partition_name("day", date(2026, 3, 9)) == "ad_logs_p20260309"
+    assert parts.partition_name("month", date(2026, 3, 1)) == "ad_logs_p202603"
+    assert parts.parse_partition_name("ad_logs_p202602") == (date(2026, 2, 1), date(2026, 3, 1))
+    assert parts.parse_partition_name("ad_logs_default") is None
+    with pytest.raises(ValueError):
+        parts.partition_bounds("week", date(2026, 3, 9))
+
+
+def test_planned_partitions_cover_today_and_premake():
+    planned = parts.planned_partitions("day", date(2026, 3, 30), premake=2)
+    assert [p[0] for p in planned] == ["ad_logs_p20260330", "ad_logs_p20260331", "ad_logs_p20260401"]
+
+    backfill = parts.planned_partitions("month", date(2026, 3, 9), premake=1, since=date(2025, 12, 20))
+    assert [p[0] for p in backfill] == ["ad_logs_p202512", "ad_logs_p202601", "ad_logs_p202602", "ad_logs_p202603", "ad_logs_p202604"]
+
+
+def test_expired_partitions_only_whole_ranges_past_retention():
+    names = ["ad_logs_p20260301", "ad_logs_p20260302", "ad_logs_p20260303", "ad_logs_default", "ad_logs_p202601"]
+    assert parts.expired_partitions(names, date(2026, 3, 10), retention_days=7) == ["ad_logs_p202601", "ad_logs_p20260301", "ad_logs_p20260302"]
+    assert parts.expired_partitions(names, date(2026, 3, 10), retention_days=0) == []
+
+
+def test_ensure_creates_missing_and_drop_detaches_expired():
+    cur = _FakeCursor(["ad_logs_p20260309", "ad_logs_p20260101"])
+
+    created = parts.ensure_partitions(cur, "day", date(2026, 3, 9), premake=1)
+    assert created == ["ad_logs_p20260310", "ad_logs_default"]
+    ddl = [sql for sql, _ in cur.statements if sql.startswith("CREATE TABLE")]
+    assert ddl[0] == "CREATE TABLE IF NOT EXISTS ad_logs_p20260310 PARTITION OF ad_logs FOR VALUES FROM (%s) TO (%s)"
+    assert ddl[1].endswith("PARTITION OF ad_logs DEFAULT")
+
+    cur.statements.clear()
+    assert parts.drop_expired_partitions(cur, date(2026, 3, 9), retention_days=30) == ["ad_logs_p20260101"]
+    assert [sql for sql, _ in cur.statements[1:]] == [
+        "ALTER TABLE ad_logs DETACH PARTITION ad_logs_p20260101",
+        "DROP TABLE ad_logs_p20260101",
+    ]
+
+
+def test_partition_key_fallback_is_derived_from_the_message_only():
+    from app.services import db_service
+
+    record = {"log_id": "log_1", "device_id": "dev_001", "created_at": 1773050400}
+    assert db_service._fallback_start_time(record) == db_service._fallback_start_time(dict(record))
+    with pytest.raises(ValueError):
+        db_service._fallback_start_time({"log_id": "log_2", "device_id": "dev_001"})
@@ -0,0 +1,60 @@
+import hashlib
+
+from app.services import material_service
+from app.services.blob_store import BlobStore
+from app.services.material_store import SqliteMaterialStore
+
+
+def _incoming(store: BlobStore, data: bytes):
+    path = store.incoming_path()
+    path.write_bytes(data)
+    return path, hashlib.sha256(data).hexdigest(), hashlib.md5(data).hexdigest()
+
+
+def test_identical_content_is_stored_once_and_refcounted(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    path, sha, md5 = _incoming(store, b"same bytes")
+    first = store.ingest(path, sha, md5, 10)
+    path2, _, _ = _incoming(store, b"same bytes")
+    second = store.ingest(path2, sha, md5, 10)
+
+    assert first["deduplicated"] is False and second["deduplicated"] is True
+    assert first["path"] == second["path"] == store.blob_path(sha)
+    assert not path2.exists()
+    assert store.stats() == {"blobs": 1, "references": 2, "stored_bytes": 10}
+
+    assert store.release(sha) == 1
+    assert store.blob_path(sha).exists()
+    assert store.release(sha) == 0
+    assert not store.blob_path(sha).exists()
+    assert store.get(sha) is None
+    assert store.release(sha) == 0
+
+
+def test_missing_blob_file_is_restored_by_next_upload(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    path, sha, md5 = _incoming(store, b"abc")
+    store.ingest(path, sha, md5, 3)
+    store.blob_path(sha).unlink()
+
+    path, _, _ = _incoming(store, b"abc")
+    assert store.ingest(path, sha, md5, 3)["deduplicated"] is False
+    assert store.blob_path(sha).read_bytes() == b"abc"
+    assert store.get(sha)["refcount"] == 2
+
+
+def test_delete_material_releases_blob_reference(tmp_path, monkeypatch):
+    store = BlobStore(tmp_path / "blobs")
+    monkeypatch.setattr("app.services.blob_store._BLOB_STORE", store)
+    monkeypatch.setattr(material_service, "_STORE", SqliteMaterialStore(tmp_path / "catalog.sqlite3"))
+    path, sha, md5 = _incoming(store, b"shared")
+    store.ingest(path, sha, md5, 6)
+    path, _, _ = _incoming(store, b"shared")
+    store.ingest(path, sha, md5, 6)
+    for mid in ("M_001", "M_002"):
+        material_service.upsert_material({"material_id": mid, "extra": {"path": str(store.blob_path(sha)), "blob": sha}})
+
+    assert material_service.delete_material("M_001")
+    assert store.blob_path(sha).exists()
+    assert material_service.delete_material("M_002")
+    assert not store.blob_path(sha).exists()
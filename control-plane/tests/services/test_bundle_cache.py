@@ -0,0 +1,38 @@
+from app.services.bundle_cache import BundleCache, bundle_key
+
+
+def test_bundle_cache_invalidates_by_campaign_and_material():
+    cache = BundleCache(max_size=10, ttl_sec=60)
+    k1 = bundle_key("cmp_1", "20260309_v1", "dev_001", "http://cp/")
+    k2 = bundle_key("cmp_2", "20260309_v1", "dev_002", "http://cp/")
+    cache.put(k1, {"n": 1}, ["mat_001", "ad_101"])
+    cache.put(k2, {"n": 2}, ["mat_002"])
+    cache.put_device_campaign("dev_001", {"campaign_id": "cmp_1"})
+
+    assert cache.get(k1) == {"n": 1}
+    cache.invalidate_materials(["ad_101"])
+    assert cache.get(k1) is None
+    assert cache.get(k2) == {"n": 2}
+    assert cache.get_device_campaign("dev_001") == {"campaign_id": "cmp_1"}
+
+    cache.invalidate_campaign("cmp_2")
+    assert cache.get(k2) is None
+    assert cache.get_device_campaign("dev_001") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_bundle_cache_is_bounded_and_skips_stale_puts():
+    cache = BundleCache(max_size=2, ttl_sec=60)
+    keys = [bundle_key("cmp_1", "v1", f"dev_{i}") for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, {"n": i}, [f"mat_{i}"])
+    assert cache.get(keys[0]) is None
+    assert cache.stats()["evictions"] == 1
+
+    generation = cache.generation
+    cache.invalidate_materials()
+    cache.put(keys[0], {"n": 0}, generation=generation)
+    cache.put_device_campaign("dev_0", {"campaign_id": "cmp_1"}, generation)
+    assert cache.get(keys[0]) is None
+    assert cache.get_device_campaign("dev_0") is None
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,23 @@
+from app.services.campaign_bindings import CampaignDeviceIndex
+
+
+def _campaign(campaign_id, updated_at, status="published"):
+    return {"campaign_id": campaign_id, "status": status, "updated_at": updated_at}
+
+
+def test_index_tracks_latest_published_campaign_per_device():
+    index = CampaignDeviceIndex()
+    index.bind(_campaign("cmp_a", "2026-03-01T00:00:00Z"), ["dev_1", "dev_2"])
+    index.bind(_campaign("cmp_b", "2026-03-02T00:00:00Z"), ["dev_2"])
+
+    assert index.latest("dev_1") == "cmp_a"
+    assert index.latest("dev_2") == "cmp_b"
+
+    # rollback to draft / retarget / delete
+    index.bind(_campaign("cmp_b", "2026-03-03T00:00:00Z", status="draft"), ["dev_2"])
+    assert index.latest("dev_2") == "cmp_a"
+    index.bind(_campaign("cmp_a", "2026-03-04T00:00:00Z"), ["dev_2"])
+    assert index.latest("dev_1") is None
+    index.unbind("cmp_a")
+    assert index.latest("dev_2") is None
+    assert len(index) == 0
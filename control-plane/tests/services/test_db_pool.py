@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+from psycopg2 import extensions
+
+from app.db.session import ConnectionPool, PoolTimeout
+
+
+class _FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.encoding = "UTF8"
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def set_client_encoding(self, enc):
+        self.encoding = enc
+
+    def close(self):
+        self.closed = 1
+
+
+class _FakePool(ConnectionPool):
+    def __init__(self, **kwargs):
+        super().__init__("fake", **kwargs)
+        self.opened = []
+
+    def _open(self):
+        conn = _FakeConn()
+        self.opened.append(conn)
+        return conn
+
+
+def test_pool_reuses_connections_and_resets_state():
+    pool = _FakePool(min_size=1, max_size=2)
+    assert pool.warmup() == 1
+
+    with pool.connection() as conn:
+        conn.status = extensions.TRANSACTION_STATUS_INTRANS
+        conn.encoding = "LATIN1"
+    with pool.connection() as again:
+        assert again is conn
+
+    assert len(pool.opened) == 1
+    assert conn.rollbacks == 1
+    assert conn.encoding == "UTF8"
+    stats = pool.stats()
+    assert stats["checkouts"] == 2
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+
+
+def test_pool_times_out_when_exhausted():
+    pool = _FakePool(min_size=0, max_size=1, timeout=0.05)
+    held = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(held)
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_pool_waiter_gets_released_connection():
+    pool = _FakePool(min_size=0, max_size=1, timeout=2)
+    held = pool.getconn()
+    got = []
+
+    t = threading.Thread(target=lambda: got.append(pool.getconn()))
+    t.start()
+    pool.putconn(held)
+    t.join(timeout=2)
+
+    assert got == [held]
+
+
+def test_pool_discards_closed_connections():
+    pool = _FakePool(min_size=0, max_size=1)
+    with pool.connection() as conn:
+        conn.closed = 1
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert pool.stats()["discarded"] == 1
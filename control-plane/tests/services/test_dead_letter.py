@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+
+from app.services import dead_letter, db_service
+from app.services.dead_letter import FileDeadLetterSink, build_entry
+
+
+def test_file_replay_removes_replayed_entries_and_keeps_failures(monkeypatch, tmp_path):
+    sink = FileDeadLetterSink(str(tmp_path / "dlq.jsonl"))
+    sink.publish(build_entry("insert", ValueError("bad"), source=("play_logs", 0, 5),
+                             record={"log_id": "ok", "device_id": "ELEV_001"}))
+    sink.publish(build_entry("decode", ValueError("bad"), source=("play_logs", 0, 6), raw=b'{"log_id": '))
+    written = []
+
+    @contextmanager
+    def fake_connection(timeout=None):
+        yield object()
+
+    def fake_upsert(conn, records, **_kw):
+        written.extend(r.log_id for r in records)
+        return len(records)
+
+    monkeypatch.setattr(db_service, "connection", fake_connection)
+    monkeypatch.setattr(db_service, "upsert_ad_logs_batch", fake_upsert)
+
+    result = dead_letter.replay(source="file", path=str(sink.path))
+
+    assert result == {"source": "file", "entries": 2, "written": 1, "failed": 1}
+    assert written == ["ok"]
+    [left] = sink.read()
+    assert left["stage"] == "decode" and "replay_error" in left
+
+
+class _FakeFuture:
+    def __init__(self):
+        self.callbacks, self.errbacks = [], []
+        self.exception = None
+        self.done = False
+
+    def add_callback(self, fn):
+        self.callbacks.append(fn)
+
+    def add_errback(self, fn):
+        self.errbacks.append(fn)
+
+    def fail(self, exc, run_errbacks=True):
+        self.done, self.exception = True, exc
+        if run_errbacks:
+            for fn in self.errbacks:
+                fn(exc)
+
+    def succeed(self):
+        self.done = True
+        for fn in self.callbacks:
+            fn("meta")
+
+    def get(self, timeout=None):
+        if self.exception is not None:
+            raise self.exception
+        return "meta"
+
+
+class _FakeProducer:
+    def __init__(self):
+        self.futures = []
+
+    def send(self, topic, key=None, value=None):
+        future = _FakeFuture()
+        self.futures.append(future)
+        return future
+
+    def flush(self, timeout=None):
+        pass
+
+
+def test_kafka_sink_writes_asynchronously_failed_deliveries_to_fallback(tmp_path):
+    fallback = FileDeadLetterSink(str(tmp_path / "dlq.jsonl"))
+    sink = dead_letter.KafkaDeadLetterSink(["broker:9092"], fallback=fallback)
+    producer = sink._producer = _FakeProducer()
+    for log_id in ("a", "b", "c"):
+        sink.publish(build_entry("insert", "bad", record={"log_id": log_id}))
+    first, second, third = producer.futures
+
+    # 投递结果在 send() 之后才确定：失败的走 errback，flush() 还会兜底检查未回调的结果。
+    first.succeed()
+    second.fail(RuntimeError("retries exhausted"))
+    third.fail(RuntimeError("broker unavailable"), run_errbacks=False)
+    sink.flush()
+
+    assert sorted(e["log_id"] for e in fallback.read()) == ["b", "c"]
+    assert sink._inflight == {}
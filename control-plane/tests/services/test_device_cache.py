@@ -0,0 +1,26 @@
+from app.services.device_cache import KnownDeviceCache
+
+
+def test_known_device_cache_is_bounded_lru():
+    cache = KnownDeviceCache(max_size=2, ttl_sec=60)
+    cache.add_many(["dev_a", "dev_b"])
+    assert "dev_a" in cache  # refresh dev_a, dev_b becomes LRU
+    cache.add("dev_c")
+
+    assert "dev_b" not in cache
+    assert cache.missing(["dev_a", "dev_b", "dev_c", "dev_b"]) == ["dev_b"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_known_device_cache_expires_and_invalidates():
+    cache = KnownDeviceCache(max_size=10, ttl_sec=0)
+    cache.add("dev_a")
+    assert "dev_a" not in cache
+
+    cache.ttl_sec = 60
+    cache.add_many(["dev_a", "dev_b"])
+    cache.invalidate("dev_a")
+    assert "dev_a" not in cache
+    assert "dev_b" in cache
+    cache.invalidate()
+    assert len(cache) == 0
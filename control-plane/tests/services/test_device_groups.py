@@ -0,0 +1,77 @@
+from app.services.campaign_bindings import CampaignDeviceIndex
+from app.services.device_groups import (
+    DeviceGroupRegistry,
+    DeviceSet,
+    count_targets,
+    device_group_keys,
+    parse_selector,
+    split_targets,
+)
+
+
+def test_selectors_and_device_keys():
+    assert parse_selector(" City : Shanghai ") == ("city", "Shanghai")
+    assert parse_selector("tag:lobby") == ("tag", "lobby")
+    assert parse_selector("ELEVATOR_ABC123") is None
+    assert parse_selector("zone:1") is None
+    assert parse_selector("group:") is None
+    assert split_targets(["dev_1", "group:G1", "GROUP:G1", "dev_2"]) == (["dev_1", "dev_2"], ["group:G1"])
+
+    keys = device_group_keys({"city": "Shanghai", "group_id": "G1", "tags": '["lobby", "vip"]', "building": None})
+    assert keys == {"group": ["group:G1"], "city": ["city:Shanghai"], "tag": ["tag:lobby", "tag:vip"]}
+    assert device_group_keys({"tags": "a, b"})["tag"] == ["tag:a", "tag:b"]
+
+
+def test_device_set_is_sorted_and_supports_membership():
+    members = DeviceSet(["d3", "d1", "d2", "d1", None, ""])
+    assert list(members) == ["d1", "d2", "d3"]
+    assert "d2" in members and "d4" not in members
+    members.add("d0")
+    members.add("d2")
+    members.discard("d3")
+    members.discard("d9")
+    assert list(members) == ["d0", "d1", "d2"]
+
+
+def test_registry_caches_and_updates_incrementally():
+    calls = []
+
+    def loader(field, value):
+        calls.append((field, value))
+        return {"Shanghai": ["d2", "d1"]}.get(value, [])
+
+    registry = DeviceGroupRegistry(loader=loader, ttl_sec=60)
+    assert list(registry.resolve("city:Shanghai")) == ["d1", "d2"]
+    assert registry.contains("City:Shanghai", "d1")
+    assert calls == [("city", "Shanghai")]
+
+    registry.observe_device("d3", {"city": "Shanghai", "tags": ["vip"]})
+    registry.observe_device("d1", {"city": "Beijing"})
+    registry.observe_device("d2", {"tags": ["vip"]})  # city 未传：保持原组
+    assert list(registry.resolve("city:Shanghai")) == ["d2", "d3"]
+    assert registry.memberships("d3", ["city:Shanghai", "city:Beijing"]) == ["city:Shanghai"]
+    assert calls == [("city", "Shanghai"), ("city", "Beijing")]
+    assert count_targets(["d9", "d2", "city:Shanghai"], registry) == 3
+
+
+def test_registry_falls_back_to_registered_devices_when_loader_fails():
+    def loader(field, value):
+        raise RuntimeError("db down")
+
+    registry = DeviceGroupRegistry(loader=loader)
+    registry.observe_device("d1", {"group_id": "G1"})
+    assert registry.contains("group:G1", "d1")
+    assert not registry.contains("group:G1", "d2")
+    assert count_targets(["group:G1"], registry) == 0
+
+
+def test_index_picks_latest_across_device_and_group_targets():
+    index = CampaignDeviceIndex()
+    index.bind({"campaign_id": "c1", "status": "published", "updated_at": "2026-01-01"}, ["d1"])
+    index.bind({"campaign_id": "c2", "status": "published", "updated_at": "2026-02-01"}, ["city:Shanghai", "d2"])
+    assert index.group_targets() == ["city:Shanghai"]
+    assert index.latest("d1") == "c1"
+    assert index.latest("d1", ["city:Shanghai"]) == "c2"
+    index.unbind("c2")
+    assert index.group_targets() == []
+    assert index.latest("d1", ["city:Shanghai"]) == "c1"
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services.gateway_client import CircuitBreaker, GatewayClient, GatewayUnavailableError
+
+
+def _client(handler, breaker=None):
+    return GatewayClient(
+        "http://gateway:8080/",
+        breaker=breaker or CircuitBreaker(failure_threshold=2, reset_timeout_sec=0.05),
+        transport=httpx.MockTransport(handler),
+        async_transport=httpx.MockTransport(handler),
+    )
+
+
+def test_sync_and_async_send_share_payload_and_metrics():
+    seen = []
+
+    def handler(request):
+        seen.append((request.url.path, json.loads(request.content)))
+        return httpx.Response(200)
+
+    client = _client(handler)
+    assert client.send_command("dev-1", "REBOOT", {"delay": 5}, cmd_id="c1") == {"status": "ok"}
+    assert asyncio.run(client.asend_command("dev-1", "SNAPSHOT", "")) == {"status": "ok"}
+    # 同步连接池在调用之间复用
+    assert client._sync_client() is client._sync_client()
+
+    assert seen == [
+        ("/api/send", {"device_id": "dev-1", "command": "REBOOT", "data": {"delay": 5}, "cmd_id": "c1"}),
+        ("/api/send", {"device_id": "dev-1", "command": "SNAPSHOT", "data": ""}),
+    ]
+    stats = client.stats()
+    assert set(stats["commands"]) == {"REBOOT", "SNAPSHOT"}
+    reboot = stats["commands"]["REBOOT"]
+    assert reboot["count"] == 1 and reboot["outcomes"] == {"200": 1}
+    assert reboot["buckets_ms"]["+Inf"] == 1
+
+
+def test_circuit_opens_on_gateway_failures_and_recovers_after_probe():
+    state = {"status": 502, "calls": 0}
+
+    def handler(request):
+        state["calls"] += 1
+        return httpx.Response(state["status"], text="Device Offline" if state["status"] == 404 else "")
+
+    client = _client(handler)
+    # 设备离线（4xx）说明网关正常，不计入熔断。
+    state["status"] = 404
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            client.send_command("dev-1", "REBOOT")
+    assert client.breaker.state == "closed"
+
+    state["status"] = 502
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            client.send_command("dev-1", "REBOOT")
+    assert client.breaker.state == "open"
+
+    calls = state["calls"]
+    with pytest.raises(GatewayUnavailableError):
+        asyncio.run(client.asend_command("dev-1", "REBOOT"))
+    assert state["calls"] == calls
+    assert client.stats()["commands"]["REBOOT"]["outcomes"]["rejected"] == 1
+
+    asyncio.run(asyncio.sleep(0.06))
+    state["status"] = 200
+    assert client.send_command("dev-1", "REBOOT") == {"status": "ok"}
+    assert client.breaker.state == "closed"
+
+
+def test_transport_errors_count_as_failures():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    client = _client(handler, breaker=CircuitBreaker(failure_threshold=1, reset_timeout_sec=60))
+    with pytest.raises(httpx.ConnectError):
+        client.send_command("dev-1", "VOLUME")
+    with pytest.raises(GatewayUnavailableError):
+        client.send_command("dev-1", "VOLUME")
+    assert client.stats()["commands"]["VOLUME"]["outcomes"] == {"error": 1, "rejected": 1}
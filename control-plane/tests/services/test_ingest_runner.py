@@ -0,0 +1,70 @@
+from app.services import ingest_runner
+from app.services.ingest_runner import IngestRunner, aggregate_metrics
+
+
+def test_aggregate_metrics_sums_counters_across_workers():
+    total = aggregate_metrics({
+        0: {"messages": 10, "written": 8, "flushes": 2, "assigned_partitions": ["play_logs-0"], "last_flush_ms": 4.5},
+        1: {"messages": 5, "written": 5, "flushes": 1, "assigned_partitions": ["play_logs-1"], "last_flush_ms": None},
+    })
+
+    assert total["workers"] == 2
+    assert total["messages"] == 15
+    assert total["written"] == 13
+    assert total["flushes"] == 3
+    assert total["assigned_partitions"] == ["play_logs-0", "play_logs-1"]
+    assert total["last_flush_ms_max"] == 4.5
+
+
+class _FakeProc:
+    def __init__(self):
+        self.alive = True
+        self.exitcode = None
+        self.pid = 4242
+
+    def is_alive(self):
+        return self.alive
+
+    def crash(self):
+        self.alive = False
+        self.exitcode = 1
+
+
+def test_crashed_worker_restarts_with_backoff_that_resets_after_healthy_run(monkeypatch):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(ingest_runner.time, "monotonic", lambda: clock["now"])
+    runner = IngestRunner(workers=1, restart_backoff_sec=1.0, max_restart_backoff_sec=8.0, healthy_after_sec=60.0)
+    spawned = []
+
+    def fake_spawn(worker_id):
+        proc = _FakeProc()
+        spawned.append(proc)
+        runner._procs[worker_id] = proc
+        runner._started_at[worker_id] = clock["now"]
+
+    monkeypatch.setattr(runner, "_spawn", fake_spawn)
+    runner._spawn(0)
+
+    def crash_and_restart():
+        before = len(spawned)
+        spawned[-1].crash()
+        runner._check_workers()
+        delay = runner._restart_at[0] - clock["now"]
+        clock["now"] += delay - 0.01
+        runner._check_workers()
+        assert len(spawned) == before  # 退避时间未到，不重启
+        clock["now"] += 0.01
+        runner._check_workers()
+        assert len(spawned) == before + 1
+        return delay
+
+    # 连续快速崩溃：退避时间翻倍，封顶 max_restart_backoff_sec。
+    delays = []
+    for _ in range(5):
+        delays.append(crash_and_restart())
+    assert delays == [1.0, 2.0, 4.0, 8.0, 8.0]
+    assert runner._restarts[0] == 5
+
+    # 稳定运行超过 healthy_after_sec 后再崩溃：从初始退避时间重新开始。
+    clock["now"] += 61.0
+    assert crash_and_restart() == 1.0
@@ -0,0 +1,187 @@
+from collections import namedtuple
+
+import psycopg2
+
+from app.services import kafka_consumer as kc
+from app.services.dead_letter import FileDeadLetterSink
+from app.services.device_cache import KnownDeviceCache
+
+_TP = namedtuple("TP", "topic partition")
+_Msg = namedtuple("Msg", "offset value")
+
+
+class _FakeKafka:
+    def __init__(self, owner, batches):
+        self.owner = owner
+        self.batches = list(batches)
+        self.commits = []
+        self.seeks = []
+        self.closed = False
+
+    def poll(self, timeout_ms=0, max_records=None):
+        if not self.batches:
+            self.owner.running = False
+            return {}
+        return self.batches.pop(0)
+
+    def commit(self, offsets=None):
+        self.commits.append({tp: om.offset for tp, om in offsets.items()})
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp, offset))
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeConn:
+    closed = 0
+
+
+class _FakePool:
+    def getconn(self):
+        return _FakeConn()
+
+    def putconn(self, conn, discard=False):
+        pass
+
+
+def _log(i):
+    return {"log_id": f"log_{i}", "device_id": "dev_001", "duration_ms": 1000}
+
+
+def _manual_consumer(monkeypatch, batches, insert, dead_letters=None):
+    consumer = kc.KafkaPlayLogConsumer(
+        brokers=[],
+        device_cache=KnownDeviceCache(),
+        dead_letters=dead_letters,
+        manual_commit=True,
+        flush_records=2,
+        flush_interval_ms=10_000,
+    )
+    fake = _FakeKafka(consumer, batches)
+    monkeypatch.setattr(consumer, "_build_kafka_consumer", lambda **_kw: fake)
+    monkeypatch.setattr(consumer, "_warm_device_cache", lambda: None)
+    if insert is not None:
+        monkeypatch.setattr(consumer, "_insert_batch", insert)
+    monkeypatch.setattr(kc, "get_pool", lambda: _FakePool())
+    monkeypatch.setattr(kc.time, "sleep", lambda _s: None)
+    return consumer, fake
+
+
+def test_manual_commit_advances_offsets_only_after_flush(monkeypatch):
+    tp = _TP("play_logs", 0)
+    written = []
+
+    def insert(conn, records):
+        written.append([r["log_id"] for r in records])
+        return len(records)
+
+    consumer, fake = _manual_consumer(
+        monkeypatch,
+        [{tp: [_Msg(10, _log(1)), _Msg(11, _log(2))]}, {tp: [_Msg(12, _log(3))]}],
+        insert,
+    )
+    consumer.start_consuming()
+
+    # size-triggered flush for the first two, final flush on shutdown for the third
+    assert written == [["log_1", "log_2"], ["log_3"]]
+    assert fake.commits == [{tp: 12}, {tp: 13}]
+    assert fake.closed is True
+
+
+def test_manual_commit_rewinds_when_db_write_fails(monkeypatch):
+    tp = _TP("play_logs", 0)
+
+    def insert(conn, records):
+        raise psycopg2.OperationalError("db down")
+
+    consumer, fake = _manual_consumer(
+        monkeypatch,
+        [{tp: [_Msg(10, _log(1)), _Msg(11, _log(2))]}],
+        insert,
+    )
+    consumer.start_consuming()
+
+    assert fake.commits == []
+    assert fake.seeks == [(tp, 10)]
+
+
+def test_partition_revoke_flushes_and_commits_buffer(monkeypatch):
+    tp = _TP("play_logs", 0)
+    written = []
+
+    def insert(conn, records):
+        written.append([r["log_id"] for r in records])
+        return len(records)
+
+    consumer, fake = _manual_consumer(monkeypatch, [], insert)
+    consumer.consumer = fake
+    consumer._reset_pending()
+    consumer._buffer = consumer._records_from_message(_log(1))
+    consumer._pending = {tp: (10, 11)}
+
+    consumer._on_partitions_revoked([tp])
+
+    assert written == [["log_1"]]
+    assert fake.commits == [{tp: 11}]
+    assert consumer._pending == {} and consumer._buffer == []
+    metrics = consumer.metrics_snapshot()
+    assert metrics["rebalances"] == 1
+    assert metrics["written"] == 1
+
+
+def test_poison_row_is_bisected_into_dead_letter_queue(monkeypatch, tmp_path):
+    tp = _TP("play_logs", 0)
+    sink = FileDeadLetterSink(str(tmp_path / "dlq.jsonl"))
+    written = []
+
+    def upsert(conn, records, device_ids=None):
+        if any(r.log_id == "log_3" for r in records):
+            raise psycopg2.DataError("invalid input syntax for type inet")
+        written.extend(r.log_id for r in records)
+        return len(records)
+
+    monkeypatch.setattr(kc, "upsert_ad_logs_batch", upsert)
+    consumer, fake = _manual_consumer(
+        monkeypatch,
+        [{tp: [_Msg(9 + i, _log(i)) for i in range(1, 5)]}],
+        None,
+        dead_letters=sink,
+    )
+    consumer.flush_records = 4
+    consumer.start_consuming()
+
+    assert sorted(written) == ["log_1", "log_2", "log_4"]
+    assert fake.commits == [{tp: 14}]
+    [entry] = sink.read()
+    assert entry["stage"] == "insert"
+    assert entry["log_id"] == "log_3"
+    assert (entry["topic"], entry["partition"], entry["offset"]) == ("play_logs", 0, 12)
+    assert "DataError" in entry["error"]
+
+
+def test_undecodable_message_is_dead_lettered_with_raw_bytes(tmp_path):
+    sink = FileDeadLetterSink(str(tmp_path / "dlq.jsonl"))
+    consumer = kc.KafkaPlayLogConsumer(brokers=[], device_cache=KnownDeviceCache(), dead_letters=sink)
+
+    records = consumer._message_records(_TP("play_logs", 3), _Msg(7, b'{"log_id": '))
+
+    assert records == []
+    [entry] = sink.read()
+    assert entry["stage"] == "decode"
+    assert entry["partition"] == 3 and entry["offset"] == 7
+    assert entry["raw_b64"]
+    assert consumer.metrics["dead_lettered"] == 1
+
+
+def test_missing_start_time_uses_kafka_message_timestamp():
+    consumer = kc.KafkaPlayLogConsumer(brokers=[], device_cache=KnownDeviceCache())
+    msg = namedtuple("Msg", "offset value timestamp")
+
+    [derived] = consumer._message_records(_TP("play_logs", 0), msg(1, b'{"log_id": "a", "device_id": "d"}', 1773050400000))
+    [redelivered] = consumer._message_records(_TP("play_logs", 0), msg(1, b'{"log_id": "a", "device_id": "d"}', 1773050400000))
+    [kept] = consumer._message_records(_TP("play_logs", 0), msg(2, b'{"log_id": "b", "device_id": "d", "created_at": 5}', 1773050400000))
+
+    assert derived.start_time == redelivered.start_time == kc.parse_timestamp(1773050400000)
+    assert kept.start_time is None  # created_at 仍优先，由写入路径推导
@@ -0,0 +1,60 @@
+from app.services.material_catalog import MaterialCatalog
+
+
+def _rows():
+    return [
+        {"material_id": "M_002", "ad_id": "ad_1", "file_name": "b.mp4", "source": "db"},
+        {"material_id": "M_001", "ad_id": "ad_1", "file_name": "a.mp4", "source": "local"},
+        {"material_id": "M_001", "ad_id": "ad_1", "file_name": "a.mp4", "source": "db"},
+    ]
+
+
+def test_lookup_prefers_material_id_then_smallest_id_per_ad_or_file():
+    catalog = MaterialCatalog(loader=_rows, batch_loader=lambda ids: [])
+    assert catalog.lookup("M_002")["file_name"] == "b.mp4"
+    # 同一 material_id 以后加载的 DB 行为准；同一 ad_id 取 material_id 最小者。
+    assert catalog.lookup("ad_1") == {"material_id": "M_001", "ad_id": "ad_1", "file_name": "a.mp4", "source": "db"}
+    assert catalog.lookup(" b.mp4 ")["material_id"] == "M_002"
+    assert catalog.lookup("") is None
+    assert catalog.stats()["loads"] == 1
+
+
+def test_misses_share_one_batch_query_and_are_negatively_cached():
+    batches = []
+
+    def batch_loader(ids):
+        batches.append(list(ids))
+        return [{"material_id": "M_009", "ad_id": "ad_9", "file_name": "z.mp4"}]
+
+    catalog = MaterialCatalog(loader=_rows, batch_loader=batch_loader)
+    found = catalog.lookup_many(["ad_1", "ad_9", "ad_x", "ad_9"])
+    assert sorted(found) == ["ad_1", "ad_9"]
+    assert batches == [["ad_9", "ad_x"]]
+
+    assert catalog.lookup("ad_x") is None
+    assert catalog.lookup("z.mp4")["material_id"] == "M_009"
+    assert batches == [["ad_9", "ad_x"]]
+
+
+def test_incremental_upsert_remove_and_ttl_reload():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return _rows()
+
+    catalog = MaterialCatalog(loader=loader, batch_loader=lambda ids: [], ttl_sec=3600)
+    assert catalog.lookup("ad_1")["material_id"] == "M_001"
+
+    catalog.upsert({"material_id": "M_001", "ad_id": "ad_7", "status": "done"})
+    assert catalog.lookup("ad_1")["material_id"] == "M_002"
+    assert catalog.lookup("ad_7")["status"] == "done"
+    assert catalog.lookup("a.mp4")["material_id"] == "M_001"
+
+    catalog.remove("M_002")
+    assert catalog.lookup("ad_1") is None
+    assert len(loads) == 1
+
+    catalog.invalidate()
+    assert catalog.lookup("ad_1")["material_id"] == "M_001"
+    assert len(loads) == 2
@@ -0,0 +1,62 @@
+import json
+import threading
+
+import pytest
+
+from app.services.material_store import JsonIndexStore, SqliteMaterialStore, open_material_store
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def store(request, tmp_path):
+    return open_material_store(request.param, tmp_path)
+
+
+def test_put_get_list_delete_keep_newest_first(store):
+    assert store.put({"material_id": "M_001", "ad_id": "ad_1", "status": "uploaded"}) is None
+    store.put({"material_id": "M_002", "file_name": "b.mp4"})
+    previous = store.put({"material_id": "M_001", "ad_id": "ad_1", "status": "done"})
+
+    assert previous["status"] == "uploaded"
+    assert store.get("M_001")["status"] == "done"
+    assert store.get("M_404") is None
+    assert [r["material_id"] for r in store.list()] == ["M_002", "M_001"]
+    assert [r["material_id"] for r in store.list(offset=1, limit=5)] == ["M_001"]
+    assert store.ids() == ["M_002", "M_001"]
+
+    assert store.delete("M_002")["file_name"] == "b.mp4"
+    assert store.delete("M_002") is None
+    assert store.ids() == ["M_001"]
+
+
+def test_sqlite_imports_legacy_index_once(tmp_path):
+    legacy = tmp_path / "index.json"
+    legacy.write_text(json.dumps({"items": [{"material_id": "M_002"}, {"material_id": "M_001"}]}), encoding="utf-8")
+
+    store = open_material_store("sqlite", tmp_path)
+    assert isinstance(store, SqliteMaterialStore)
+    assert store.ids() == ["M_002", "M_001"]
+
+    store.delete("M_001")
+    assert SqliteMaterialStore(tmp_path / "catalog.sqlite3", import_from=legacy).ids() == ["M_002"]
+    assert isinstance(open_material_store("json", tmp_path), JsonIndexStore)
+
+
+def test_sqlite_concurrent_writers_and_readers(tmp_path):
+    store = SqliteMaterialStore(tmp_path / "catalog.sqlite3")
+    errors = []
+
+    def writer(n):
+        try:
+            for i in range(20):
+                store.put({"material_id": f"M_{n}_{i}", "status": "uploaded"})
+                assert store.get(f"M_{n}_{i}") is not None
+        except Exception as e:  # pragma: no cover - surfaced below
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(store.ids()) == 80
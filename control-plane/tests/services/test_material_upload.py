@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.material_upload import save_upload_stream
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.reads = []
+
+    async def read(self, n: int) -> bytes:
+        self.reads.append(n)
+        chunk, self.data = self.data[:n], self.data[n:]
+        return chunk
+
+
+def test_streams_in_chunks_with_incremental_hashes(tmp_path):
+    data = b"0123456789" * 1000
+    reader = _Reader(data)
+    dest = tmp_path / "mat" / "M_001_a.mp4"
+
+    saved = asyncio.run(save_upload_stream(reader, dest, max_bytes=0, chunk_size=4096, sha256=True))
+
+    assert saved["size_bytes"] == len(data)
+    assert saved["md5"] == hashlib.md5(data).hexdigest()
+    assert saved["sha256"] == hashlib.sha256(data).hexdigest()
+    assert dest.read_bytes() == data
+    assert set(reader.reads) == {4096}
+    assert [p.name for p in dest.parent.iterdir()] == ["M_001_a.mp4"]
+
+
+def test_oversized_upload_is_rejected_and_temp_file_removed(tmp_path):
+    dest = tmp_path / "M_002_big.mp4"
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(save_upload_stream(_Reader(b"x" * 10000), dest, max_bytes=5000, chunk_size=1024, sha256=False))
+    assert exc.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_route_rejects_oversized_body_before_parsing_the_form(client, monkeypatch):
+    from app.api.v1.endpoints import materials as materials_ep
+    from app.core.config import settings
+    from app.services import material_upload
+
+    monkeypatch.setattr(settings, "material_upload_max_bytes", 1000)
+    monkeypatch.setattr(material_upload, "_FORM_OVERHEAD_BYTES", 100)
+
+    async def never(*_a, **_kw):
+        raise AssertionError("handler must not run")
+
+    monkeypatch.setattr(materials_ep, "save_upload_stream", never)
+
+    # Content-Length 超限：不读请求体直接 413
+    resp = client.post("/api/v1/materials/upload", files={"file": ("big.mp4", b"x" * 5000, "video/mp4")})
+    assert resp.status_code == 413
+
+    # chunked（无 Content-Length）：按实际收到的字节数中止
+    def body():
+        for _ in range(10):
+            yield b"x" * 500
+
+    resp = client.post(
+        "/api/v1/materials/upload",
+        content=body(),
+        headers={"content-type": "multipart/form-data; boundary=abc"},
+    )
+    assert resp.status_code == 413
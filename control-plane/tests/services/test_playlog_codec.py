@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+
+from app.services.playlog_codec import PlayLogDecoder, PlayLogRecord, normalize_log_record
+
+
+@pytest.mark.parametrize("backend", ["json", "auto"])
+def test_decoder_falls_back_to_gb18030_once(backend):
+    raw = '{"payload": [{"log_id": "l1", "device_id": "ELEV_001", "ad_id": "AD_公益_01"}]}'.encode("gb18030")
+
+    records = PlayLogDecoder(backend).decode(raw)
+
+    assert [r.material_id for r in records] == ["AD_公益_01"]
+
+
+def test_decoder_rejects_invalid_utf8_json():
+    with pytest.raises(ValueError):
+        PlayLogDecoder("json").loads(b'{"log_id": ')
+
+
+def test_record_is_a_row_and_supports_dict_access():
+    record = normalize_log_record({
+        "log_id": "l1",
+        "device_id": "ELEV_001",
+        "start_time": "2026-03-09T10:53:20+08:00",
+        "device_ip": "  ",
+        "billing_status": "bogus",
+    })
+
+    assert isinstance(record, PlayLogRecord)
+    assert record["log_id"] == "l1" and record.get("missing") is None
+    assert record[0] == "l1"
+    assert record.start_time == datetime(2026, 3, 9, 10, 53, 20)
+    assert record.device_ip is None
+    assert record.billing_status == "pending"
+    assert normalize_log_record({"device_id": "ELEV_001"}) is None
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services import device_snapshot_service, snapshot_waiters
+from app.services.snapshot_waiters import SnapshotResultCache, SnapshotWaiterRegistry, TimerWheel
+
+
+def test_timer_wheel_expires_after_deadline_only():
+    wheel = TimerWheel(tick_sec=1.0, slots=8, now=100.0)
+    wheel.schedule("a", 102.5)
+    wheel.schedule("b", 120.0)  # 超过一圈
+    wheel.schedule("c", 103.0)
+    wheel.cancel("c")
+
+    assert wheel.advance(102.0) == []
+    assert wheel.advance(103.0) == ["a"]
+    assert wheel.advance(119.0) == []
+    assert wheel.advance(500.0) == ["b"]
+    assert len(wheel) == 0
+
+
+def test_concurrent_requests_for_same_device_do_not_overwrite_each_other():
+    registry = SnapshotWaiterRegistry(tick_sec=0.05)
+
+    async def scenario():
+        first = registry.register("dev-1", "cmd-1", timeout=5)
+        second = registry.register("dev-1", "cmd-2", timeout=5)
+        shared = registry.register("dev-1", "cmd-2", timeout=5)
+        assert sorted(registry.pending("dev-1")) == ["cmd-1", "cmd-2"]
+
+        # req_id 命中：只唤醒该条目的所有等待方。
+        assert registry.resolve("dev-1", "https://oss/2.jpg", req_id="cmd-2") == 2
+        assert await second == await shared == "https://oss/2.jpg"
+        assert not first.done()
+
+        # 不带 req_id（旧网关）：按设备唤醒剩下的请求。
+        assert registry.resolve("dev-1", "https://oss/1.jpg") == 1
+        assert await first == "https://oss/1.jpg"
+        assert registry.stats()["pending"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_callback_from_another_thread_and_wheel_expiry():
+    registry = SnapshotWaiterRegistry(tick_sec=0.05)
+
+    async def scenario():
+        fut = registry.register("dev-2", "cmd-a", timeout=5)
+        threading.Thread(target=registry.resolve, args=("dev-2", "https://oss/a.jpg", "cmd-a")).start()
+        assert await asyncio.wait_for(fut, 2) == "https://oss/a.jpg"
+
+        late = registry.register("dev-2", "cmd-b", timeout=0.1)
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(late, 2)
+        assert registry.stats()["expired"] == 1
+        assert registry.pending() == []
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture()
+def snapshot_env(monkeypatch):
+    registry = SnapshotWaiterRegistry(tick_sec=0.05)
+    results = SnapshotResultCache(ttl_sec=30)
+    monkeypatch.setattr(snapshot_waiters, "_REGISTRY", registry)
+    monkeypatch.setattr(snapshot_waiters, "_RESULTS", results)
+    inserted = []
+    monkeypatch.setattr(device_snapshot_service.db_service, "insert_command", inserted.append)
+    monkeypatch.setattr(device_snapshot_service.db_service, "update_command_status", lambda **kw: 1)
+    sent = []
+
+    class FakeClient:
+        release = None
+        error = None
+
+        async def asend_command(self, device_id, command, data="", cmd_id=None):
+            sent.append(cmd_id)
+            if self.release is not None:
+                await self.release.wait()
+            if self.error is not None:
+                raise self.error
+            return {"status": "ok"}
+
+    client = FakeClient()
+    monkeypatch.setattr(device_snapshot_service, "get_gateway_client", lambda: client)
+    return registry, results, client, sent, inserted
+
+
+def test_concurrent_snapshots_share_one_device_round_trip(snapshot_env):
+    registry, results, client, sent, inserted = snapshot_env
+
+    async def scenario():
+        client.release = asyncio.Event()
+        tasks = [asyncio.create_task(device_snapshot_service.request_device_snapshot("dev-3", timeout=2)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert registry.stats()["awaiters"] == 3
+        client.release.set()
+        await asyncio.sleep(0)
+        await device_snapshot_service.receive_snapshot_callback("dev-3", "https://oss/3.jpg", sent[0])
+        urls = await asyncio.gather(*tasks)
+        # 窗口内再次请求直接命中结果缓存。
+        urls.append(await device_snapshot_service.request_device_snapshot("dev-3", timeout=2))
+        return urls
+
+    assert asyncio.run(scenario()) == ["https://oss/3.jpg"] * 4
+    assert len(sent) == 1 and len(inserted) == 1
+    assert registry.stats()["coalesced"] == 2
+    assert results.stats()["hits"] == 1
+
+
+def test_gateway_failure_is_shared_by_coalesced_requests(snapshot_env):
+    registry, results, client, sent, inserted = snapshot_env
+    client.error = RuntimeError("Device Offline")
+
+    async def scenario():
+        client.release = asyncio.Event()
+        tasks = [asyncio.create_task(device_snapshot_service.request_device_snapshot("dev-4", timeout=2)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        client.release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert len(sent) == 1
+    assert registry.stats()["pending"] == 0
+    assert results.get("dev-4") is None
+
+
+def test_command_log_writes_run_off_the_event_loop(snapshot_env, monkeypatch):
+    registry, results, client, sent, inserted = snapshot_env
+    db_threads = []
+    monkeypatch.setattr(device_snapshot_service.db_service, "insert_command",
+                        lambda meta: db_threads.append(threading.get_ident()))
+    monkeypatch.setattr(device_snapshot_service.db_service, "update_command_status",
+                        lambda **kw: db_threads.append(threading.get_ident()) or 1)
+
+    async def scenario():
+        task = asyncio.create_task(device_snapshot_service.request_device_snapshot("dev-5", timeout=2))
+        await asyncio.sleep(0.05)
+        await device_snapshot_service.receive_snapshot_callback("dev-5", "https://oss/5.jpg", sent[0])
+        return await task
+
+    assert asyncio.run(scenario()) == "https://oss/5.jpg"
+    # 同步的 psycopg2 调用（insert + update）都在线程池里执行，不阻塞事件循环。
+    assert len(db_threads) == 2 and threading.get_ident() not in db_threads
+
+
+def test_coalesced_requests_each_wait_their_own_timeout(snapshot_env):
+    registry, results, client, sent, inserted = snapshot_env
+
+    async def scenario():
+        short_leader = asyncio.create_task(device_snapshot_service.request_device_snapshot("dev-6", timeout=0.2))
+        await asyncio.sleep(0.02)
+        long_follower = asyncio.create_task(device_snapshot_service.request_device_snapshot("dev-6", timeout=1.5))
+        short_follower = asyncio.create_task(device_snapshot_service.request_device_snapshot("dev-6", timeout=0.1))
+        await asyncio.sleep(0.4)
+        # 两个短请求按各自的 timeout 结束，报错里是各自的秒数；长请求仍在等同一次往返。
+        errors = [str(t.exception()) for t in (short_leader, short_follower)]
+        assert not long_follower.done() and registry.stats()["pending"] == 1
+        await device_snapshot_service.receive_snapshot_callback("dev-6", "https://oss/6.jpg", sent[0])
+        return errors, await long_follower
+
+    errors, url = asyncio.run(scenario())
+    assert "(0.2s)" in errors[0] and "(0.1s)" in errors[1]
+    assert url == "https://oss/6.jpg" and len(sent) == 1